@@ -0,0 +1,255 @@
+"""
+Admission control and load shedding
+
+Requests are sorted into route classes, each with its own concurrency limit
+and a bounded wait queue:
+
+    interactive  cheap reads (daily sets, exercises, progress)   priority 0
+    write        performance submissions and other writes        priority 1
+    analytics    expensive reads (stats, searches, similarity)   priority 2
+    batch        uploads, MusicXML parsing, recording analysis   priority 3
+
+All classes also share one overall limit. When it is reached, freed slots
+go to waiting requests of the highest priority class first. The lower
+classes' own limits add up to well under the overall one, so an upload storm
+can queue and be shed but never take the slots interactive reads need.
+
+A request that finds its class's queue full, or waits longer than the
+class allows, gets a 503 with a Retry-After header right away, before its
+body is read. Limits apply per worker process.
+"""
+
+import asyncio
+import math
+import os
+import re
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from fastapi.responses import JSONResponse
+
+from metrics import ADMISSION_QUEUED, ADMISSION_SHED
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "1") != "0"
+ADMISSION_MAX_CONCURRENT = int(os.getenv("ADMISSION_MAX_CONCURRENT", "64"))
+
+# name: (priority, max concurrent, max queued, max wait in seconds)
+ROUTE_CLASSES: Dict[str, Tuple[int, int, int, float]] = {
+    "interactive": (0, 64, 256, 2.0),
+    "write": (1, 16, 64, 5.0),
+    "analytics": (2, 8, 16, 5.0),
+    "batch": (3, 4, 8, 10.0),
+}
+
+# First match wins; other requests are interactive if reads, writes otherwise
+ROUTE_RULES: List[Tuple[Tuple[str, ...], "re.Pattern[str]", str]] = [
+    (("POST",), re.compile(r"^/upload/upload/"), "batch"),
+    (("POST",), re.compile(r"^/users/users/submit_recording$"), "batch"),
+    (("GET",), re.compile(
+        r"^/exercises/exercises/(stats/summary|pattern-search|search/|similar-to-mistakes/"
+        r"|\d+/(similar|transpositions|audio))"), "analytics"),
+    (("GET",), re.compile(r"^/users/users/(leaderboard|[^/]+/stats)$"), "analytics"),
+]
+READ_METHODS = ("GET", "HEAD")
+
+# Never limited: probes, docs and monitoring must answer under load
+EXEMPT_PATHS = ("/health", "/metrics", "/docs", "/redoc", "/openapi.json", "/api/admission", "/admin/profile")
+
+
+class Overloaded(Exception):
+    """A request was shed; `retry_after` is a suggested wait in seconds"""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class Limiter:
+    """Concurrency limit and wait queue for one route class"""
+
+    def __init__(self, name: str, priority: int, max_concurrent: int, max_queue: int, max_wait: float):
+        self.name = name
+        self.priority = priority
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.in_flight = 0
+        self.waiters: Deque[asyncio.Future] = deque()
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.completed = 0
+        self.wait_seconds = 0.0
+        self.service_seconds = 0.0
+        self.max_queued = 0
+        self.queued_gauge = ADMISSION_QUEUED.labels(name)
+        self.shed_full = ADMISSION_SHED.labels(name, "queue_full")
+        self.shed_timeout = ADMISSION_SHED.labels(name, "timeout")
+
+    def mean_service_seconds(self) -> float:
+        return self.service_seconds / self.completed if self.completed else 1.0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "priority": self.priority,
+            "in_flight": self.in_flight,
+            "queued": len(self.waiters),
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "max_wait_seconds": self.max_wait,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "completed": self.completed,
+            "peak_queued": self.max_queued,
+            "mean_wait_ms": round(1000 * self.wait_seconds / self.admitted, 2) if self.admitted else 0.0,
+            "mean_service_ms": round(1000 * self.service_seconds / self.completed, 2) if self.completed else 0.0,
+        }
+
+
+class AdmissionController:
+    """Route classes, their limiters and the overall limit"""
+
+    def __init__(self, classes: Dict[str, Tuple[int, int, int, float]] = ROUTE_CLASSES,
+                 max_concurrent: int = ADMISSION_MAX_CONCURRENT):
+        self.max_concurrent = max_concurrent
+        self.in_flight = 0
+        self.limiters = {name: Limiter(name, *settings) for name, settings in classes.items()}
+        self._by_priority = sorted(self.limiters.values(), key=lambda limiter: limiter.priority)
+
+    def classify(self, method: str, path: str) -> Optional[Limiter]:
+        """The limiter for a request, or None if it isn't limited"""
+        if method == "OPTIONS" or path in EXEMPT_PATHS or path.startswith("/docs"):
+            return None
+        for methods, pattern, name in ROUTE_RULES:
+            if method in methods and pattern.match(path):
+                return self.limiters[name]
+        return self.limiters["interactive" if method in READ_METHODS else "write"]
+
+    def retry_after(self, limiter: Limiter) -> int:
+        """Seconds until the queue ahead of a new request has likely drained"""
+        backlog = limiter.in_flight + len(limiter.waiters)
+        drain = backlog * limiter.mean_service_seconds() / max(limiter.max_concurrent, 1)
+        return min(max(math.ceil(drain), 1), 60)
+
+    async def acquire(self, limiter: Limiter):
+        """Wait for a slot in `limiter`; raises Overloaded if the request is shed"""
+        if (not limiter.waiters and limiter.in_flight < limiter.max_concurrent
+                and self.in_flight < self.max_concurrent):
+            self._admit(limiter)
+            return
+        if len(limiter.waiters) >= limiter.max_queue:
+            limiter.rejected += 1
+            limiter.shed_full.inc()
+            raise Overloaded(f"{limiter.name} queue is full", self.retry_after(limiter))
+
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        limiter.waiters.append(waiter)
+        limiter.queued_gauge.inc()
+        limiter.max_queued = max(limiter.max_queued, len(limiter.waiters))
+        queued_at = time.perf_counter()
+        timer = loop.call_later(limiter.max_wait, self._expire, limiter, waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            # Client went away; give back a slot granted in the meantime
+            if waiter.done() and not waiter.cancelled() and waiter.exception() is None:
+                self.release(limiter)
+            else:
+                self._forget(limiter, waiter)
+            raise
+        finally:
+            timer.cancel()
+        limiter.wait_seconds += time.perf_counter() - queued_at
+
+    def _admit(self, limiter: Limiter):
+        limiter.in_flight += 1
+        limiter.admitted += 1
+        self.in_flight += 1
+
+    def _expire(self, limiter: Limiter, waiter: asyncio.Future):
+        if not waiter.done():
+            self._forget(limiter, waiter)
+            limiter.timed_out += 1
+            limiter.shed_timeout.inc()
+            waiter.set_exception(Overloaded(f"{limiter.name} queue wait exceeded {limiter.max_wait}s",
+                                            self.retry_after(limiter)))
+
+    def _forget(self, limiter: Limiter, waiter: asyncio.Future):
+        try:
+            limiter.waiters.remove(waiter)
+            limiter.queued_gauge.dec()
+        except ValueError:
+            pass
+
+    def release(self, limiter: Limiter, service_seconds: Optional[float] = None):
+        """Free a slot and hand free slots to waiters, highest priority first"""
+        limiter.in_flight -= 1
+        self.in_flight -= 1
+        if service_seconds is not None:
+            limiter.completed += 1
+            limiter.service_seconds += service_seconds
+        for candidate in self._by_priority:
+            while (candidate.waiters and candidate.in_flight < candidate.max_concurrent
+                   and self.in_flight < self.max_concurrent):
+                waiter = candidate.waiters.popleft()
+                candidate.queued_gauge.dec()
+                if not waiter.done():
+                    self._admit(candidate)
+                    waiter.set_result(None)
+            if self.in_flight >= self.max_concurrent:
+                break
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": ADMISSION_ENABLED,
+            "in_flight": self.in_flight,
+            "max_concurrent": self.max_concurrent,
+            "classes": {name: limiter.stats() for name, limiter in self.limiters.items()},
+        }
+
+
+admission = AdmissionController()
+
+
+def overloaded_response(path: str, error: Overloaded) -> JSONResponse:
+    return JSONResponse(
+        status_code=503,
+        headers={"Retry-After": str(error.retry_after)},
+        content={
+            "error": "Service Unavailable",
+            "message": f"Server is busy ({error.reason}), retry later",
+            "timestamp": datetime.now().isoformat(),
+            "path": path
+        }
+    )
+
+
+class AdmissionMiddleware:
+    """ASGI middleware admitting HTTP requests through `controller`"""
+
+    def __init__(self, app, controller: AdmissionController = admission):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not ADMISSION_ENABLED:
+            return await self.app(scope, receive, send)
+        limiter = self.controller.classify(scope["method"], scope["path"])
+        if limiter is None:
+            return await self.app(scope, receive, send)
+
+        try:
+            await self.controller.acquire(limiter)
+        except Overloaded as e:
+            return await overloaded_response(scope["path"], e)(scope, receive, send)
+
+        began = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(limiter, time.perf_counter() - began)
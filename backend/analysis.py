@@ -0,0 +1,304 @@
+"""
+Audio analysis for SightReadPro recordings
+
+Decodes a PCM WAV take block by block (never holding more than one block of
+samples), frames each block into a matrix and runs YIN pitch detection and
+spectral-flux onset detection over all frames of the block at once. The
+per-frame results are small, so note segmentation runs once at the end.
+"""
+
+import wave
+from functools import lru_cache
+from typing import List, Optional, Dict, Any, BinaryIO, Iterator, Tuple
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+FMIN = 50.0
+FMAX = 2000.0
+YIN_THRESHOLD = 0.15
+HOP_SECONDS = 0.01
+BLOCK_SECONDS = 2.0
+
+# Frames quieter than this RMS (about -40 dBFS) are treated as silence
+SILENCE_RMS = 0.01
+# Minimum gap between onsets, and the shortest pitch run counted as a new note
+MIN_ONSET_GAP_SECONDS = 0.05
+MIN_NOTE_SECONDS = 0.04
+
+PITCH_CLASS_NAMES = ['C', 'C#', 'D', 'E-', 'E', 'F', 'F#', 'G', 'A-', 'A', 'B-', 'B']
+
+
+class AnalysisError(ValueError):
+    """Raised for recordings that cannot be decoded or analysed"""
+
+
+def midi_name(midi: int) -> str:
+    """Note name for a MIDI number, spelled like music21 ('C#4', 'B-3')"""
+    return f"{PITCH_CLASS_NAMES[midi % 12]}{midi // 12 - 1}"
+
+
+def _pcm_to_float(data: bytes, sample_width: int, channels: int) -> np.ndarray:
+    if sample_width == 1:
+        samples = (np.frombuffer(data, dtype=np.uint8).astype(np.float32) - 128.0) / 128.0
+    elif sample_width == 2:
+        samples = np.frombuffer(data, dtype='<i2').astype(np.float32) / 32768.0
+    elif sample_width == 3:
+        raw = np.frombuffer(data, dtype=np.uint8).reshape(-1, 3)
+        padded = np.zeros((raw.shape[0], 4), dtype=np.uint8)
+        padded[:, 1:] = raw
+        samples = padded.view('<i4').ravel().astype(np.float32) / 2147483648.0
+    elif sample_width == 4:
+        samples = np.frombuffer(data, dtype='<i4').astype(np.float32) / 2147483648.0
+    else:
+        raise AnalysisError(f"Unsupported sample width: {sample_width} bytes")
+
+    if channels > 1:
+        samples = samples.reshape(-1, channels).mean(axis=1)
+    return samples
+
+
+def iter_wav_blocks(stream: BinaryIO, block_seconds: float = BLOCK_SECONDS) -> Iterator[Tuple[int, np.ndarray]]:
+    """Decode a PCM WAV stream into (sample_rate, mono float32 block) pairs"""
+    try:
+        reader = wave.open(stream, 'rb')
+    except (wave.Error, EOFError):
+        raise AnalysisError("Recording is not a PCM WAV file")
+
+    with reader:
+        sample_rate = reader.getframerate()
+        sample_width = reader.getsampwidth()
+        channels = reader.getnchannels()
+        block_frames = max(int(sample_rate * block_seconds), 1)
+        while True:
+            data = reader.readframes(block_frames)
+            if not data:
+                break
+            yield sample_rate, _pcm_to_float(data, sample_width, channels)
+
+
+@lru_cache(maxsize=None)
+def _hann(size: int) -> np.ndarray:
+    # Shared between analyzers; only ever read
+    window = np.hanning(size)
+    window.flags.writeable = False
+    return window
+
+
+class FrameAnalyzer:
+    """
+    Streaming YIN pitch and spectral-flux analysis
+
+    Feed blocks of samples with `push`; leftover samples that don't fill a
+    whole hop are carried into the next block. `finish` returns per-frame
+    f0 (NaN when unvoiced), onset strength and RMS level.
+    """
+
+    def __init__(self, sample_rate: int):
+        self.sample_rate = sample_rate
+        self.hop = max(int(round(sample_rate * HOP_SECONDS)), 1)
+        self.tau_min = max(int(sample_rate / FMAX), 2)
+        self.tau_max = int(sample_rate / FMIN)
+        # Window holds the integration window plus the largest lag
+        self.window = 1 << int(np.ceil(np.log2(2 * self.tau_max)))
+        self.integration = self.window - self.tau_max
+        self.fft_size = 1 << int(np.ceil(np.log2(self.window + self.integration)))
+        self.hann = _hann(self.window)
+
+        self._pending = np.zeros(0, dtype=np.float32)
+        self._previous_spectrum: Optional[np.ndarray] = None
+        self._f0: List[np.ndarray] = []
+        self._flux: List[np.ndarray] = []
+        self._rms: List[np.ndarray] = []
+        self.samples_seen = 0
+
+    def push(self, samples: np.ndarray):
+        self.samples_seen += samples.size
+        buffer = np.concatenate((self._pending, samples)) if self._pending.size else samples
+        if buffer.size < self.window:
+            self._pending = buffer
+            return
+        count = (buffer.size - self.window) // self.hop + 1
+        frames = sliding_window_view(buffer, self.window)[::self.hop][:count]
+        self._analyse(frames)
+        self._pending = buffer[count * self.hop:]
+
+    def finish(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # Zero-pad the tail so the last note is framed too
+        if self._pending.size > self.hop:
+            tail = np.zeros(self.window, dtype=np.float32)
+            tail[:self._pending.size] = self._pending
+            self._analyse(tail[None, :])
+            self._pending = np.zeros(0, dtype=np.float32)
+        if not self._f0:
+            return np.zeros(0), np.zeros(0), np.zeros(0)
+        return np.concatenate(self._f0), np.concatenate(self._flux), np.concatenate(self._rms)
+
+    def _analyse(self, frames: np.ndarray):
+        frames = frames.astype(np.float64)
+        self._rms.append(np.sqrt(np.mean(frames ** 2, axis=1)))
+        self._f0.append(self._yin(frames))
+        self._flux.append(self._spectral_flux(frames))
+
+    def _yin(self, frames: np.ndarray) -> np.ndarray:
+        """YIN f0 estimate for every row of a frame matrix"""
+        count = frames.shape[0]
+        w, tau_max = self.integration, self.tau_max
+
+        # Difference function d(tau) = a + b(tau) - 2 c(tau), via FFT cross-correlation
+        squares = np.concatenate((np.zeros((count, 1)), np.cumsum(frames ** 2, axis=1)), axis=1)
+        a = squares[:, w][:, None]
+        lags = np.arange(tau_max + 1)
+        b = squares[:, lags + w] - squares[:, lags]
+        spectrum = np.fft.rfft(frames, self.fft_size)
+        head = np.fft.rfft(frames[:, :w], self.fft_size)
+        c = np.fft.irfft(spectrum * np.conj(head), self.fft_size)[:, :tau_max + 1]
+        diff = np.maximum(a + b - 2.0 * c, 0.0)
+
+        # Cumulative mean normalized difference
+        cumulative = np.cumsum(diff[:, 1:], axis=1)
+        cmnd = np.ones_like(diff)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cmnd[:, 1:] = np.where(cumulative > 0, diff[:, 1:] * lags[1:] / cumulative, 1.0)
+
+        # First local minimum under the threshold, within the pitch range
+        inner = cmnd[:, 1:-1]
+        minima = (inner < cmnd[:, :-2]) & (inner <= cmnd[:, 2:]) & (inner < YIN_THRESHOLD)
+        minima[:, :self.tau_min - 1] = False
+        voiced = minima.any(axis=1)
+        tau = minima.argmax(axis=1) + 1
+
+        # Parabolic interpolation around the chosen lag
+        rows = np.arange(count)
+        left, mid, right = cmnd[rows, tau - 1], cmnd[rows, tau], cmnd[rows, np.minimum(tau + 1, tau_max)]
+        denominator = left - 2.0 * mid + right
+        with np.errstate(divide='ignore', invalid='ignore'):
+            shift = np.where(np.abs(denominator) > 1e-12, 0.5 * (left - right) / denominator, 0.0)
+        refined = tau + np.clip(shift, -1.0, 1.0)
+
+        rms = np.sqrt(a[:, 0] / w)
+        voiced &= rms >= SILENCE_RMS
+        return np.where(voiced, self.sample_rate / refined, np.nan)
+
+    def _spectral_flux(self, frames: np.ndarray) -> np.ndarray:
+        """Half-wave rectified log-magnitude flux between consecutive frames"""
+        magnitude = np.log1p(10.0 * np.abs(np.fft.rfft(frames * self.hann, axis=1)))
+        previous = self._previous_spectrum if self._previous_spectrum is not None else np.zeros_like(magnitude[0])
+        stacked = np.vstack((previous[None, :], magnitude))
+        self._previous_spectrum = magnitude[-1].astype(np.float32)  # a copy, not a view of the block
+        return np.maximum(np.diff(stacked, axis=0), 0.0).sum(axis=1)
+
+
+def pick_onsets(flux: np.ndarray, rms: np.ndarray, frame_rate: float) -> np.ndarray:
+    """
+    Frame indexes of onset peaks, using an adaptive moving-average threshold
+
+    Peaks where the level doesn't rise above the preceding dip are dropped;
+    those come from notes being released, not attacked.
+    """
+    if flux.size < 3:
+        return np.zeros(0, dtype=np.int64)
+    normalized = flux / (flux.max() or 1.0)
+    width = max(int(frame_rate * 0.1), 1)
+    kernel = np.ones(2 * width + 1) / (2 * width + 1)
+    threshold = np.convolve(normalized, kernel, mode='same') + 0.1
+
+    peaks = np.flatnonzero(
+        (normalized[1:-1] > normalized[:-2]) & (normalized[1:-1] >= normalized[2:]) & (normalized[1:-1] > threshold[1:-1])
+    ) + 1
+    if peaks.size:
+        offsets = np.arange(-3, 6)
+        around = rms[np.clip(peaks[:, None] + offsets, 0, rms.size - 1)]
+        peaks = peaks[around[:, 5:].mean(axis=1) > 1.1 * around[:, :4].min(axis=1)]
+
+    min_gap = max(int(frame_rate * MIN_ONSET_GAP_SECONDS), 1)
+    kept = []
+    for peak in peaks:
+        if not kept or peak - kept[-1] >= min_gap:
+            kept.append(peak)
+    return np.array(kept, dtype=np.int64)
+
+
+def segment_notes(f0: np.ndarray, onsets: np.ndarray, frame_rate: float,
+                  frame_offset: float = 0.0) -> List[Dict[str, Any]]:
+    """
+    Turn per-frame pitch and onset frames into note events
+
+    Besides flux onsets, a note starts wherever the detected pitch changes
+    to a new stable value (legato playing has no energy onset). Times are
+    frame starts plus `frame_offset` seconds.
+    """
+    if f0.size == 0:
+        return []
+
+    with np.errstate(invalid='ignore'):
+        midi = np.where(np.isnan(f0), -1, np.round(69 + 12 * np.log2(f0 / 440.0))).astype(np.int64)
+
+    # Runs of identical rounded pitch
+    change = np.flatnonzero(np.diff(midi)) + 1
+    run_starts = np.concatenate(([0], change))
+    run_lengths = np.diff(np.concatenate((run_starts, [midi.size])))
+    run_pitch = midi[run_starts]
+    min_frames = max(int(frame_rate * MIN_NOTE_SECONDS), 1)
+    stable = (run_pitch >= 0) & (run_lengths >= min_frames)
+
+    boundaries = set(int(i) for i in onsets)
+    last_pitch = None
+    for start, pitch, is_stable in zip(run_starts, run_pitch, stable):
+        if not is_stable:
+            continue
+        if pitch != last_pitch:
+            boundaries.add(int(start))
+        last_pitch = pitch
+
+    # Drop boundaries that sit right after another one
+    min_gap = max(int(frame_rate * MIN_ONSET_GAP_SECONDS), 1)
+    ordered = []
+    for boundary in sorted(boundaries):
+        if not ordered or boundary - ordered[-1] >= min_gap:
+            ordered.append(boundary)
+    edges = np.array(ordered + [midi.size])
+
+    notes = []
+    for start, end in zip(edges[:-1], edges[1:]):
+        segment = midi[start:end]
+        voiced = segment[segment >= 0]
+        if voiced.size < min_frames or voiced.size < 0.3 * segment.size:
+            continue
+        last_voiced = start + np.flatnonzero(segment >= 0)[-1]
+        pitch = int(np.median(voiced))
+        notes.append({
+            'onset': start / frame_rate + frame_offset,
+            'duration': (last_voiced + 1 - start) / frame_rate,
+            'midi': pitch,
+            'name': midi_name(pitch),
+        })
+    return notes
+
+
+def analyze_recording(stream: BinaryIO) -> Dict[str, Any]:
+    """
+    Detect the notes played in a WAV recording
+
+    Returns the sample rate, duration in seconds and a list of notes with
+    onset and duration (seconds), MIDI number and name.
+    """
+    analyzer = None
+    for sample_rate, block in iter_wav_blocks(stream):
+        if analyzer is None:
+            analyzer = FrameAnalyzer(sample_rate)
+        analyzer.push(block)
+
+    if analyzer is None:
+        raise AnalysisError("Recording contains no audio")
+
+    f0, flux, rms = analyzer.finish()
+    frame_rate = analyzer.sample_rate / analyzer.hop
+    onsets = pick_onsets(flux, rms, frame_rate)
+    # Report times at the centre of each frame
+    frame_offset = analyzer.window / 2 / analyzer.sample_rate
+    return {
+        'sample_rate': analyzer.sample_rate,
+        'duration': analyzer.samples_seen / analyzer.sample_rate,
+        'notes': segment_notes(f0, onsets, frame_rate, frame_offset),
+    }
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Benchmark the recording analysis pipeline on synthetic takes
+
+Renders random exercises with the reference synthesizer (optionally with
+added noise), runs the full decode + pitch/onset + scoring pipeline on one
+core and reports the real-time factor and how many notes were recovered.
+
+Usage:
+    python benchmarks/bench_analysis.py [--seconds 60] [--takes 5] [--sample-rate 44100]
+
+Exits non-zero if any take is analysed slower than real time.
+"""
+
+import argparse
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from analysis import analyze_recording, midi_name
+from scoring import score_performance
+from synth import render_samples, wav_bytes, INSTRUMENT_VOICES
+
+RHYTHMS = ['quarter', 'quarter', 'eighth', 'half', 'dotted quarter', '16th']
+
+
+def synthetic_take(rng: np.random.Generator, seconds: float, tempo: int, sample_rate: int, noise: float):
+    """Random stepwise melody of about `seconds` length, rendered to WAV bytes"""
+    notes, rhythm = [], []
+    midi = 60
+    beats = 0.0
+    beat_lengths = {'quarter': 1.0, 'eighth': 0.5, 'half': 2.0, 'dotted quarter': 1.5, '16th': 0.25}
+    while beats * 60.0 / tempo < seconds:
+        midi = int(np.clip(midi + rng.integers(-4, 5), 48, 84))
+        name = rng.choice(RHYTHMS)
+        notes.append(midi_name(midi))
+        rhythm.append(str(name))
+        beats += beat_lengths[str(name)]
+
+    instrument = str(rng.choice(list(INSTRUMENT_VOICES)))
+    samples = render_samples(notes, rhythm, tempo, instrument, sample_rate)
+    if noise:
+        samples = samples + rng.normal(0.0, noise, samples.size).astype(np.float32)
+    return notes, rhythm, instrument, wav_bytes(samples, sample_rate)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--seconds", type=float, default=60.0, help="Length of each take")
+    parser.add_argument("--takes", type=int, default=5, help="Number of takes")
+    parser.add_argument("--sample-rate", type=int, default=44100)
+    parser.add_argument("--noise", type=float, default=0.005, help="Gaussian noise level (0 to disable)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(args.seed)
+    print(f"{'take':>4} {'instrument':<10} {'audio s':>8} {'cpu s':>7} {'x realtime':>10} {'accuracy':>8} {'rhythm':>7}")
+
+    slowest = float('inf')
+    for take in range(args.takes):
+        tempo = int(rng.integers(60, 140))
+        notes, rhythm, instrument, data = synthetic_take(rng, args.seconds, tempo, args.sample_rate, args.noise)
+
+        started = time.process_time()
+        analysis = analyze_recording(io.BytesIO(data))
+        detected = analysis['notes']
+        metrics = score_performance(notes, rhythm, [n['midi'] for n in detected], [n['onset'] for n in detected])
+        cpu = time.process_time() - started
+
+        factor = analysis['duration'] / cpu if cpu else float('inf')
+        slowest = min(slowest, factor)
+        print(f"{take:>4} {instrument:<10} {analysis['duration']:>8.1f} {cpu:>7.2f} {factor:>10.1f} "
+              f"{metrics['accuracy']:>8.1f} {metrics['rhythm_score'] or 0:>7.1f}")
+
+    print(f"slowest take: {slowest:.1f}x real time")
+    return 0 if slowest >= 1.0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
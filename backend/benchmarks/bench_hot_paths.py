@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks of the parsing, exercise generation and database hot paths
+
+Runs each hot path against deterministic fixtures at several scales:
+
+- parse: parse_musicxml_with_music21 (music21 parse, persisting the parsed
+  score and chunking) on synthetic MusicXML scores of 16, 128 and 1024
+  measures (small, medium, large)
+- chunk: generate_exercises on the stored parsed score of each size
+- get_exercises, get_user_progress, save_performance, update_user_progress
+  on databases of 1k, 10k and 100k exercises with 10, 100 and 1000 users
+  and 10k, 100k and 1M performances
+
+Fixtures come from a seeded generator, so every run (and every commit) sees
+the same scores and rows. Each benchmark is timed over repeated calls (min,
+median, p95) and run once more under tracemalloc for its peak Python
+memory (numpy buffers included; SQLite's own allocations are not).
+
+Results are saved as JSON with the commit they were measured at. Compare
+two runs with --compare: a benchmark whose median is more than --tolerance
+(50%; commits make the write paths noisy) slower, or whose peak memory is
+more than --tolerance larger, fails the run (exit status 1). Timings are
+machine specific; compare runs from the same machine.
+
+Usage:
+    python benchmarks/bench_hot_paths.py [--scales small,medium,large] [--filter parse]
+    python benchmarks/bench_hot_paths.py --output before.json
+    python benchmarks/bench_hot_paths.py --compare before.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+SCALES = ("small", "medium", "large")
+SCORE_BENCHMARKS = ("parse", "chunk")
+DB_BENCHMARKS = ("get_exercises", "get_user_progress", "save_performance", "update_user_progress")
+SCORE_MEASURES = {"small": 16, "medium": 128, "large": 1024}
+# exercises, users, performances per user
+DB_FIXTURES = {"small": (1_000, 10, 1_000), "medium": (10_000, 100, 1_000), "large": (100_000, 1_000, 1_000)}
+
+# Median differences below this are noise, whatever the ratio
+MIN_REGRESSION_US = 5.0
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+STEPS = ("C", "D", "E", "F", "G", "A", "B")
+# (type, divisions at 4 per quarter) of the durations measures are filled with
+DURATIONS = (("half", 8), ("quarter", 4), ("quarter", 4), ("eighth", 2), ("eighth", 2), ("16th", 1))
+
+
+def synthetic_musicxml(measures: int, seed: int) -> str:
+    """A one-part 4/4 score of stepwise notes and rests, the same for the same arguments"""
+    rng = random.Random(seed)
+    position = 7 * 4  # diatonic steps above C0
+    body = []
+    for number in range(1, measures + 1):
+        body.append(f'<measure number="{number}">')
+        if number == 1:
+            body.append('<attributes><divisions>4</divisions><key><fifths>0</fifths></key>'
+                        '<time><beats>4</beats><beat-type>4</beat-type></time>'
+                        '<clef><sign>G</sign><line>2</line></clef></attributes>')
+        remaining = 16
+        while remaining:
+            kind, duration = rng.choice([d for d in DURATIONS if d[1] <= remaining])
+            remaining -= duration
+            if rng.random() < 0.08:
+                body.append(f'<note><rest/><duration>{duration}</duration><type>{kind}</type></note>')
+                continue
+            position = min(max(position + rng.choice((-2, -1, -1, 0, 1, 1, 2)), 7 * 3 + 5), 7 * 5 + 4)
+            octave, step = divmod(position, 7)
+            alter = '<alter>1</alter>' if rng.random() < 0.05 and STEPS[step] not in "EB" else ''
+            body.append(f'<note><pitch><step>{STEPS[step]}</step>{alter}<octave>{octave}</octave></pitch>'
+                        f'<duration>{duration}</duration><type>{kind}</type></note>')
+        body.append('</measure>')
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n<score-partwise version="3.1">'
+        '<part-list><score-part id="P1"><part-name>Benchmark</part-name></score-part></part-list>'
+        f'<part id="P1">{"".join(body)}</part></score-partwise>\n'
+    )
+
+
+def build_database(db_module, path: str, scale: str, seed: int):
+    """A database filled with the fixture rows for `scale`"""
+    from analysis import midi_name
+
+    exercise_count, user_count, per_user = DB_FIXTURES[scale]
+    database = db_module.Database(path)
+    rng = np.random.default_rng(seed)
+    exercise_ids, _ = database.save_exercises(
+        {'measures': '1-4', 'difficulty': ('easy', 'medium', 'hard')[i % 3], 'title': f'Exercise {i}',
+         'key_signature': 'C', 'time_signature': '4/4',
+         'notes': [midi_name(int(m)) for m in 60 + np.cumsum(rng.integers(-3, 4, int(rng.integers(8, 33))))],
+         'rhythm_pattern': ['quarter', 'eighth', 'eighth']}
+        for i in range(exercise_count)
+    )
+
+    started = datetime(2024, 1, 1)
+    conn = database.get_connection()
+    conn.executemany(
+        'INSERT INTO users (user_id, xp, streak, last_active_date, created_at, level) VALUES (?, ?, ?, ?, ?, ?)',
+        ((f'bench_user_{u}', 0, 0, '2024-01-01', started.isoformat(), 1) for u in range(user_count)))
+    scores = rng.integers(40, 101, user_count * per_user)
+    picks = rng.integers(0, len(exercise_ids), user_count * per_user)
+    conn.executemany(
+        '''INSERT INTO performances (user_id, exercise_id, score, accuracy, practice_time_seconds,
+                                     mistakes_count, submitted_at)
+           VALUES (?, ?, ?, ?, ?, ?, ?)''',
+        ((f'bench_user_{i // per_user}', exercise_ids[picks[i]], int(scores[i]), float(scores[i]), 60,
+          int(100 - scores[i]) // 10, (started + timedelta(minutes=i % per_user * 30)).isoformat())
+         for i in range(user_count * per_user)))
+    conn.commit()
+    conn.close()
+    return database, user_count
+
+
+def measure(function: Callable[[], Any], repeats: int, budget: float) -> Dict[str, Any]:
+    """Time `function` (at least 3 and at most `repeats` calls, about `budget` seconds), then its peak memory"""
+    function()  # warm up
+    timings: List[float] = []
+    deadline = time.perf_counter() + budget
+    while len(timings) < repeats and (len(timings) < 3 or time.perf_counter() < deadline):
+        began = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - began)
+
+    tracemalloc.start()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    microseconds = np.array(timings) * 1e6
+    return {
+        "runs": len(timings),
+        "min_us": round(float(microseconds.min()), 1),
+        "median_us": round(float(np.median(microseconds)), 1),
+        "p95_us": round(float(np.percentile(microseconds, 95)), 1),
+        "peak_kib": round(peak / 1024, 1),
+    }
+
+
+def benchmarks(directory: str, scales: List[str], seed: int,
+               wanted: Callable[[str], bool]) -> List[Tuple[str, Callable[[], Any]]]:
+    """(name, function) of the wanted benchmarks at `scales`, building only the fixtures they need"""
+    import db as db_module
+    from models import Performance
+    from routers.upload import parse_musicxml_with_music21
+    from score_store import generate_exercises, load_parsed_score, parsed_path_for
+
+    cases = []
+    for scale in scales:
+        if not any(wanted(f"{name}[{scale}]") for name in SCORE_BENCHMARKS):
+            continue
+        path = os.path.join(directory, f"score_{scale}.musicxml")
+        with open(path, "w") as f:
+            f.write(synthetic_musicxml(SCORE_MEASURES[scale], seed))
+        cases.append((f"parse[{scale}]", lambda path=path: parse_musicxml_with_music21(path)))
+
+        parse_musicxml_with_music21(path)
+        parsed = load_parsed_score(parsed_path_for(path))
+        cases.append((f"chunk[{scale}]", lambda parsed=parsed: generate_exercises(parsed, chunk_size=4)))
+
+    for scale in scales:
+        if not any(wanted(f"{name}[{scale}]") for name in DB_BENCHMARKS):
+            continue
+        began = time.perf_counter()
+        database, users = build_database(db_module, os.path.join(directory, f"{scale}.db"), scale, seed)
+        exercises, _, per_user = DB_FIXTURES[scale]
+        print(f"fixture {scale}: {exercises} exercises, {users} users, {users * per_user} performances "
+              f"({time.perf_counter() - began:.1f}s)")
+
+        rng = random.Random(seed)
+        user_ids = [f"bench_user_{u}" for u in range(users)]
+        performance = Performance(user_id=user_ids[0], exercise_id=1, score=80, accuracy=80.0,
+                                  practice_time_seconds=60, mistakes_count=2,
+                                  notes_played=["C4", "D4", "E4", "F4", "G4"])
+
+        cases += [
+            (f"get_exercises[{scale}]", lambda database=database: database.get_exercises(limit=10)),
+            (f"get_user_progress[{scale}]",
+             lambda database=database, rng=rng, user_ids=user_ids: database.get_user_progress(rng.choice(user_ids))),
+            (f"save_performance[{scale}]",
+             lambda database=database, performance=performance: database.save_performance(performance)),
+            (f"update_user_progress[{scale}]",
+             lambda database=database, rng=rng, user_ids=user_ids:
+                 database.update_user_progress(rng.choice(user_ids), 15)),
+        ]
+    return [(name, function) for name, function in cases if wanted(name)]
+
+
+def git_commit() -> Optional[str]:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True,
+                               text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ("-dirty" if dirty else "")
+
+
+def compare(results: Dict[str, Dict[str, Any]], previous: Dict[str, Dict[str, Any]],
+            tolerance: float) -> List[str]:
+    """Print each benchmark against `previous` and return the regressions"""
+    regressions = []
+    print(f"{'benchmark':<30} {'median us':>11} {'was':>11} {'ratio':>6} {'peak KiB':>10} {'was':>10}")
+    for name, stats in results.items():
+        before = previous.get(name)
+        if before is None:
+            print(f"{name:<30} {stats['median_us']:>11.1f} {'-':>11}")
+            continue
+        ratio = stats["median_us"] / before["median_us"] if before["median_us"] else float("inf")
+        print(f"{name:<30} {stats['median_us']:>11.1f} {before['median_us']:>11.1f} {ratio:>6.2f} "
+              f"{stats['peak_kib']:>10.1f} {before['peak_kib']:>10.1f}")
+        if ratio > 1 + tolerance and stats["median_us"] - before["median_us"] > MIN_REGRESSION_US:
+            regressions.append(f"{name}: median {stats['median_us']:.1f} us, was {before['median_us']:.1f} us")
+        if stats["peak_kib"] > before["peak_kib"] * (1 + tolerance) and stats["peak_kib"] - before["peak_kib"] > 64:
+            regressions.append(f"{name}: peak {stats['peak_kib']:.1f} KiB, was {before['peak_kib']:.1f} KiB")
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--scales", default=",".join(SCALES), help="Comma-separated subset of small,medium,large")
+    parser.add_argument("--filter", help="Only run benchmarks whose name matches this regex")
+    parser.add_argument("--repeats", type=int, default=200, help="Most timed calls per benchmark")
+    parser.add_argument("--budget", type=float, default=2.0, help="Seconds of timed calls per benchmark")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Results file (default benchmarks/results/hot_paths-<commit>.json)")
+    parser.add_argument("--compare", help="Fail on regressions against this results file")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="Allowed relative slowdown or growth")
+    args = parser.parse_args(argv)
+
+    scales = [scale.strip() for scale in args.scales.split(",") if scale.strip()]
+    unknown = set(scales) - set(SCALES)
+    if unknown:
+        parser.error(f"unknown scales {sorted(unknown)}")
+    pattern = re.compile(args.filter) if args.filter else None
+
+    commit = git_commit()
+    output = args.output or os.path.join(RESULTS_DIR, f"hot_paths-{(commit or 'unknown')[:12]}.json")
+    output = os.path.abspath(output)
+
+    results: Dict[str, Dict[str, Any]] = {}
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        wanted = (lambda name: bool(pattern.search(name))) if pattern else (lambda name: True)
+        for name, function in benchmarks(directory, scales, args.seed, wanted):
+            results[name] = stats = measure(function, args.repeats, args.budget)
+            print(f"{name:<30} median {stats['median_us']:>11.1f} us  p95 {stats['p95_us']:>11.1f} us  "
+                  f"peak {stats['peak_kib']:>9.1f} KiB  ({stats['runs']} runs)")
+
+    report = {
+        "commit": commit,
+        "recorded_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": f"{platform.system()} {platform.machine()}, {os.cpu_count()} CPUs",
+        "config": {"scales": scales, "seed": args.seed, "repeats": args.repeats, "budget": args.budget},
+        "results": results,
+    }
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+        f.write("\n")
+    print(f"results saved to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        print(f"\ncompared with {previous.get('commit')} ({previous.get('recorded_at')}, {previous.get('machine')})")
+        regressions = compare(results, previous["results"], args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+        print(f"no regressions (tolerance {args.tolerance:.0%})")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
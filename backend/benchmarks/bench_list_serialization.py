@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Benchmark exercise list serialization: pydantic models vs SQLite JSON
+
+Compares, for pages of --limit exercises, the model path (one Exercise per
+row, validated again against response_model and encoded by FastAPI) with
+the fast path (rows serialized by SQLite's json_object and joined). Reports
+the cost of producing one page outside HTTP, then requests per second on
+one core through the ASGI app, for GET /exercises/ against an equivalent
+route returning models.
+
+Usage:
+    python benchmarks/bench_list_serialization.py [--exercises 10000] [--limit 100] [--seconds 5]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+
+def page_cost(produce, repeats: int) -> float:
+    """Median milliseconds per call"""
+    timings = []
+    for _ in range(repeats):
+        began = time.perf_counter()
+        produce()
+        timings.append((time.perf_counter() - began) * 1000)
+    return float(np.median(timings))
+
+
+async def requests_per_second(app, path: str, seconds: float) -> float:
+    import httpx
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        (await client.get(path)).raise_for_status()
+        count = 0
+        began = time.perf_counter()
+        while time.perf_counter() - began < seconds:
+            (await client.get(path)).raise_for_status()
+            count += 1
+        return count / (time.perf_counter() - began)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--exercises", type=int, default=10_000)
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--seconds", type=float, default=5.0, help="Duration of each request-rate run")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        from fastapi.responses import JSONResponse
+        from pydantic import TypeAdapter
+        from analysis import midi_name
+        import db as db_module
+        from models import Exercise
+        import main as app_module
+
+        db_module.db.db_path = os.path.join(directory, "bench.db")
+        db_module.db.init_database()
+        rng = np.random.default_rng(0)
+        db_module.db.save_exercises(
+            {'measures': '1-4', 'difficulty': ('easy', 'medium', 'hard')[i % 3], 'title': f'Exercise {i}',
+             'key_signature': 'C', 'time_signature': '4/4',
+             'notes': [midi_name(int(m)) for m in 60 + np.cumsum(rng.integers(-3, 4, int(rng.integers(8, 33))))],
+             'rhythm_pattern': ['quarter', 'eighth', 'eighth']}
+            for i in range(args.exercises)
+        )
+        database = db_module.db
+        print(f"library:   {args.exercises} exercises, pages of {args.limit}")
+
+        # What FastAPI does with a response_model: validate, dump to JSON types, encode
+        adapter = TypeAdapter(List[Exercise])
+
+        def model_page() -> bytes:
+            exercises = adapter.validate_python(database.get_exercises(limit=args.limit), from_attributes=True)
+            return JSONResponse(content=adapter.dump_python(exercises, mode="json")).body
+
+        def fast_page() -> bytes:
+            return ('[' + ','.join(database.get_exercises_json(limit=args.limit)) + ']').encode('utf-8')
+
+        repeats = 200
+        model_ms, fast_ms = page_cost(model_page, repeats), page_cost(fast_page, repeats)
+        print(f"page, models:      {model_ms:6.2f} ms")
+        print(f"page, SQLite JSON: {fast_ms:6.2f} ms  ({model_ms / fast_ms:.1f}x)")
+
+        app = app_module.app
+
+        @app.get("/bench/model-path", response_model=List[Exercise])
+        async def model_path(limit: int = 20):
+            return database.get_exercises(limit=limit)
+
+        for label, path in (("models", f"/bench/model-path?limit={args.limit}"),
+                            ("SQLite JSON", f"/exercises/exercises/?limit={args.limit}")):
+            rate = asyncio.run(requests_per_second(app, path, args.seconds))
+            print(f"GET, {label + ':':<13} {rate:7.0f} requests/s on one core")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Benchmark melodic pattern search on a large synthetic exercise library
+
+Stores random-walk melodies through Database.save_exercises (which keeps the
+trigram index up to date), then times pattern queries of different
+selectivity (top --limit results, plus the total) and checks the full
+result sets against a scan of every melody.
+
+Usage:
+    python benchmarks/bench_pattern_search.py [--exercises 100000] [--queries 50]
+
+Exits non-zero if a query result differs from the scan.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from analysis import midi_name
+from pattern_index import parse_pattern, query_windows, MAX_INTERVAL
+
+PATTERNS = ['+8,-s,-s,-s', '+2,+2,+1,+2', '-1,-1', '+4,+3,-7', '+s,-s,+s,-s,+s,-s', '+5']
+
+
+def synthetic_melodies(rng: np.random.Generator, count: int):
+    """Random-walk melodies, mostly steps with the occasional leap"""
+    for _ in range(count):
+        length = int(rng.integers(8, 33))
+        steps = np.where(rng.random(length - 1) < 0.8, rng.integers(-2, 3, length - 1), rng.integers(-9, 10, length - 1))
+        midi = np.clip(60 + np.concatenate(([0], np.cumsum(steps))), 36, 96)
+        yield midi
+
+
+def scan(melodies, steps):
+    """Exercises containing the pattern, found by checking every melody"""
+    allowed = [np.clip(np.array(alternatives), -MAX_INTERVAL, MAX_INTERVAL) for alternatives in steps]
+    found = set()
+    for index, midi in enumerate(melodies):
+        intervals = np.clip(np.diff(midi), -MAX_INTERVAL, MAX_INTERVAL)
+        starts = len(intervals) - len(steps) + 1
+        if starts <= 0:
+            continue
+        hits = np.ones(starts, dtype=bool)
+        for j, values in enumerate(allowed):
+            hits &= np.isin(intervals[j:j + starts], values)
+        if hits.any():
+            found.add(index)
+    return found
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--exercises", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=50, help="Timed runs per pattern")
+    parser.add_argument("--limit", type=int, default=20, help="Results returned per query")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(args.seed)
+    melodies = list(synthetic_melodies(rng, args.exercises))
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        from db import Database
+        database = Database(os.path.join(directory, "bench.db"))
+
+        started = time.perf_counter()
+        ids, _ = database.save_exercises(
+            {'measures': '1-8', 'difficulty': 'medium', 'key_signature': 'C', 'time_signature': '4/4',
+             'notes': [midi_name(m) for m in midi], 'rhythm_pattern': ['quarter', 'eighth', 'eighth'],
+             'title': f'Melody {i}'}
+            for i, midi in enumerate(melodies)
+        )
+        elapsed = time.perf_counter() - started
+        postings = sum(len(m) - 1 for m in melodies)
+        print(f"library:   {args.exercises} exercises, {postings} postings, "
+              f"stored and indexed in {elapsed:.1f}s ({args.exercises / elapsed:.0f}/s)")
+
+        exact = True
+        for pattern in PATTERNS:
+            steps = parse_pattern(pattern)
+            windows = query_windows(steps)
+            latencies = []
+            for _ in range(args.queries):
+                began = time.perf_counter()
+                _, total = database.search_patterns(windows, limit=args.limit)
+                latencies.append((time.perf_counter() - began) * 1000)
+            matches, _ = database.search_patterns(windows, limit=args.exercises + 10)
+            expected = {ids[i] for i in scan(melodies, steps)}
+            # The database's own sample exercises are not part of the scan
+            same = {exercise_id for exercise_id, _, _ in matches} & set(ids) == expected
+            exact &= same
+            print(f"{pattern:<22} {total:>7} exercises  p50 {np.percentile(latencies, 50):7.1f} ms  "
+                  f"p99 {np.percentile(latencies, 99):7.1f} ms  {'exact' if same else 'MISMATCH'}")
+
+    return 0 if exact else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
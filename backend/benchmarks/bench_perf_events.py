@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Compare stored size and decode time of performance events: JSON vs perf_events
+
+Generates realistic takes (a steady tempo with human timing jitter, stepwise
+pitches, varying velocity) and stores each as the JSON a client would send
+and in the packed binary format with and without delta onsets and zlib.
+Decode time includes computing the rhythm and tempo scores from the onsets,
+since that is what reading a performance back is for.
+
+Usage:
+    python benchmarks/bench_perf_events.py [--notes 2000] [--takes 200]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from perf_events import EVENT_DTYPE, encode_events, decode_events, events_to_records, onset_seconds
+from scoring import timing_scores
+
+
+def synthetic_events(rng: np.random.Generator, notes: int) -> np.ndarray:
+    beat_ms = 60000.0 / rng.integers(60, 160)
+    beats = np.cumsum(rng.choice([0.5, 1.0, 1.0, 2.0], size=notes)) - 0.5
+    events = np.empty(notes, dtype=EVENT_DTYPE)
+    events['onset_ms'] = np.maximum(beats * beat_ms + rng.normal(0, 15, notes), 0).round()
+    events['onset_ms'] = np.maximum.accumulate(events['onset_ms'])
+    events['pitch'] = np.clip(60 + np.cumsum(rng.integers(-3, 4, notes)), 36, 96)
+    events['velocity'] = np.clip(rng.normal(80, 12, notes), 1, 127)
+    events['duration_ms'] = np.clip(beat_ms * 0.9 + rng.normal(0, 20, notes), 10, 4000)
+    return events
+
+
+def time_per_take(function, payloads) -> float:
+    started = time.perf_counter()
+    for payload in payloads:
+        function(payload)
+    return (time.perf_counter() - started) / len(payloads) * 1e6
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--notes", type=int, default=2000, help="Notes per take")
+    parser.add_argument("--takes", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(args.seed)
+    takes = [synthetic_events(rng, args.notes) for _ in range(args.takes)]
+    names = EVENT_DTYPE.names
+
+    def json_decode(payload):
+        records = json.loads(payload)
+        onsets = np.array([record['onset_ms'] for record in records], dtype=np.float64) / 1000.0
+        timing_scores(np.arange(len(onsets), dtype=np.float64), onsets)
+
+    def binary_decode(payload):
+        events = decode_events(payload)
+        timing_scores(np.arange(len(events), dtype=np.float64), onset_seconds(events))
+
+    formats = [
+        ("json objects", lambda e: json.dumps([dict(zip(names, r)) for r in events_to_records(e)]).encode(), json_decode),
+        ("binary", lambda e: encode_events(e, delta=False, compress=False), binary_decode),
+        ("binary+delta", lambda e: encode_events(e, delta=True, compress=False), binary_decode),
+        ("binary+delta+zlib", lambda e: encode_events(e, delta=True, compress=True), binary_decode),
+    ]
+
+    print(f"{args.takes} takes of {args.notes} notes")
+    print(f"{'format':<18} {'bytes/take':>11} {'bytes/note':>10} {'vs json':>8} {'decode+score us':>16}")
+    baseline = None
+    for name, encode, decode in formats:
+        payloads = [encode(events) for events in takes]
+        size = sum(len(p) for p in payloads) / len(payloads)
+        baseline = baseline or size
+        decode_us = time_per_take(decode, payloads)
+        print(f"{name:<18} {size:>11.0f} {size / args.notes:>10.2f} {baseline / size:>7.1f}x {decode_us:>16.0f}")
+
+    # Round trip check on the stored format
+    assert all((decode_events(encode_events(events)) == events).all() for events in takes[:10])
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
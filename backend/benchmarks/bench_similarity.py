@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Benchmark similarity queries on a large synthetic exercise library
+
+Builds feature vectors for random melodies, spreads them to the requested
+library size with small perturbations, saves the index, then measures
+startup (memory-mapped load) and top-k query latency, checking results
+against a full sort.
+
+Usage:
+    python benchmarks/bench_similarity.py [--exercises 1000000] [--queries 200] [--k 10]
+
+Exits non-zero if the p99 query latency exceeds --max-ms.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from similarity import SimilarityIndex, exercise_features, DIFFICULTY_CODES
+from analysis import midi_name
+
+RHYTHMS = ['quarter', 'eighth', 'half', 'dotted quarter', '16th']
+KEYS = ['C', 'G', 'D', 'F', 'B-', 'A minor', 'E minor']
+METERS = ['4/4', '3/4', '2/4', '6/8']
+
+
+def synthetic_vectors(rng: np.random.Generator, count: int, distinct: int = 5000):
+    """`count` unit feature vectors derived from `distinct` random exercises"""
+    seeds = []
+    for _ in range(distinct):
+        length = int(rng.integers(4, 33))
+        midi = np.clip(60 + np.cumsum(rng.integers(-5, 6, length)), 36, 96)
+        seeds.append(exercise_features(
+            [midi_name(m) for m in midi], list(rng.choice(RHYTHMS, size=int(rng.integers(1, 5)))),
+            str(rng.choice(KEYS)), str(rng.choice(METERS)), str(rng.choice(list(DIFFICULTY_CODES)))
+        ))
+    seeds = np.stack(seeds)
+    vectors = seeds[rng.integers(0, distinct, count)]
+    vectors += rng.normal(0, 0.02, vectors.shape).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors.astype(np.float32), rng.integers(0, 3, count).astype(np.int8)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--exercises", type=int, default=1_000_000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--max-ms", type=float, default=25.0, help="p99 latency budget (ms)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(args.seed)
+    started = time.perf_counter()
+    vectors, difficulty = synthetic_vectors(rng, args.exercises)
+    ids = np.arange(1, args.exercises + 1)
+    print(f"library:   {args.exercises} exercises x {vectors.shape[1]} features "
+          f"({vectors.nbytes / 1e6:.0f} MB) generated in {time.perf_counter() - started:.1f}s")
+
+    with tempfile.TemporaryDirectory() as directory:
+        index = SimilarityIndex(directory, load=False)
+        started = time.perf_counter()
+        index.add(ids, vectors, difficulty)
+        index.save()
+        print(f"save:      {time.perf_counter() - started:.2f}s")
+
+        started = time.perf_counter()
+        index = SimilarityIndex(directory)
+        print(f"startup:   {(time.perf_counter() - started) * 1000:.1f} ms (memory-mapped)")
+
+        # Fault the matrix in once, as a warm server would have it
+        index.query(vectors[0], args.k)
+
+        for label, kwargs in (("top-k", {}), ("top-k, one difficulty", {"difficulty": "medium"})):
+            latencies = []
+            for target in rng.integers(0, args.exercises, args.queries):
+                began = time.perf_counter()
+                index.query(vectors[target], args.k, exclude=[int(ids[target])], **kwargs)
+                latencies.append((time.perf_counter() - began) * 1000)
+            latencies = np.array(latencies)
+            print(f"{label + ':':<26} p50 {np.percentile(latencies, 50):.1f} ms  "
+                  f"p99 {np.percentile(latencies, 99):.1f} ms")
+
+        # Exactness against a full sort
+        target = int(rng.integers(0, args.exercises))
+        scores = vectors @ vectors[target]
+        scores[target] = -np.inf
+        expected = set((np.argsort(-scores)[:args.k] + 1).tolist())
+        found = {exercise_id for exercise_id, _ in index.query(vectors[target], args.k, exclude=[target + 1])}
+        print(f"exact:     {len(expected & found)}/{args.k} neighbours match a full sort")
+
+    return 0 if np.percentile(latencies, 99) <= args.max_ms else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
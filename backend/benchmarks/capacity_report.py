@@ -0,0 +1,513 @@
+#!/usr/bin/env python3
+"""
+Capacity report: time every Database method and API endpoint on a dataset
+
+Runs against a database made by benchmarks/gen_dataset.py (or a copy of
+production). Every public Database method and every HTTP route is called
+repeatedly with arguments drawn from the data, and per-user operations are
+timed separately for a median user, a heavy user (top 1% by XP) and the
+very top users, since the power-law tail is where per-user queries break
+first. Endpoints go through the whole app in-process (httpx's ASGI
+transport) with the response cache cleared before each call, so they
+measure the database work rather than cache hits; daily sets are
+deleted before they are requested, so each one is chosen afresh.
+
+The report lists operations slowest first, with median, p95 and max, and
+is saved as JSON with the dataset's row counts. Run it on datasets of
+several sizes and pass the reports to --trend to see how each operation
+grows with the data: a growth exponent near 0 is an index lookup, near 1
+a scan of the table (the cliff), in between a scan of a user's rows.
+
+Writes (performances, uploads, users) go to the dataset being measured;
+run it on a copy you don't mind growing a little.
+
+Usage:
+    python benchmarks/capacity_report.py --db /data/capacity.db [--calls 30] [--output report.json]
+    python benchmarks/capacity_report.py --trend small.json medium.json large.json
+"""
+
+import argparse
+import asyncio
+import inspect
+import json
+import math
+import os
+import platform
+import random
+import re
+import sqlite3
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+from datetime import date, datetime
+from typing import Any, Callable, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+TIERS = ("median", "heavy", "top")
+# Users drawn from for each tier
+TIER_POOL = 200
+# Growth exponents at or above these are flagged in --trend
+GROWS_WITH_DATA = 0.3
+SCANS_TABLE = 0.8
+
+
+@dataclass
+class Case:
+    """One timed operation: `prepare` (untimed) returns the arguments for `run`"""
+    name: str
+    run: Callable[..., Any]
+    prepare: Callable[[], Any] = lambda: ()
+    is_async: bool = False
+
+    async def call(self) -> float:
+        """Prepare (which may be a coroutine) and run once; returns the seconds `run` took"""
+        arguments = self.prepare()
+        if inspect.isawaitable(arguments):
+            arguments = await arguments
+        began = time.perf_counter()
+        result = self.run(*arguments)
+        if self.is_async:
+            await result
+        return time.perf_counter() - began
+
+
+class Samples:
+    """Argument pools drawn from the dataset"""
+
+    def __init__(self, path: str, rng: random.Random):
+        self.rng = rng
+        conn = sqlite3.connect(path)
+        active = [row[0] for row in conn.execute('SELECT user_id FROM users WHERE xp > 0 ORDER BY xp')]
+        if not active:
+            raise SystemExit("the dataset has no active users; generate one with benchmarks/gen_dataset.py")
+        middle = len(active) // 2
+        self.users = {
+            "median": active[max(middle - TIER_POOL // 2, 0):middle + TIER_POOL // 2],
+            "heavy": active[-max(len(active) // 100, 1):][:TIER_POOL],
+            "top": active[-10:],
+        }
+        self.exercise_ids = [row[0] for row in conn.execute(
+            'SELECT id FROM exercises ORDER BY random() LIMIT 1000')]
+        self.exercises = conn.execute('SELECT COUNT(*) FROM exercises').fetchone()[0]
+        self.max_performance_id = conn.execute('SELECT MAX(id) FROM performances').fetchone()[0] or 0
+        self.uploads = [row[0] for row in conn.execute(
+            "SELECT filename FROM uploads ORDER BY random() LIMIT 1000")] or ["missing.musicxml"]
+        self.notes = [json.loads(row[0]) for row in conn.execute(
+            'SELECT notes FROM exercises WHERE notes IS NOT NULL ORDER BY random() LIMIT 200')]
+        conn.close()
+
+    def user(self, tier: str) -> str:
+        return self.rng.choice(self.users[tier])
+
+    def exercise_id(self) -> int:
+        return self.rng.choice(self.exercise_ids)
+
+    def user_performance(self, tier: str) -> tuple:
+        """(user_id, performance_id) of the latest performance with note events of a user in `tier`"""
+        from db import db
+
+        user_id = self.user(tier)
+        conn = db.get_connection()
+        row = conn.execute('''
+            SELECT id FROM performances WHERE user_id = ? AND events IS NOT NULL ORDER BY submitted_at DESC LIMIT 1
+        ''', (user_id,)).fetchone()
+        conn.close()
+        return user_id, row['id'] if row else 0
+
+    def pattern(self) -> str:
+        notes = self.rng.choice(self.notes)
+        start = self.rng.randrange(max(len(notes) - 4, 1))
+        return ",".join(notes[start:start + 4])
+
+
+def row_counts(path: str) -> Dict[str, int]:
+    conn = sqlite3.connect(path)
+    tables = [row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name")]
+    counts = {table: conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0] for table in tables}
+    conn.close()
+    return counts
+
+
+def database_cases(samples: Samples, directory: str) -> List[Case]:
+    """A case for every public Database method (per tier where it takes a user)"""
+    from gen_dataset import synthetic_exercise
+    from db import db, Database
+    from models import Performance, FileType, ParseStatus
+    from pattern_index import parse_pattern, query_windows
+    from routers.upload import classify_upload
+
+    rng = samples.rng
+    created: List[str] = []
+    counter = iter(range(10 ** 9))
+
+    def new_upload() -> tuple:
+        filename = f"capacity_{os.getpid()}_{next(counter)}.musicxml"
+        created.append(filename)
+        return filename, FileType.MUSICXML, 10_000
+
+    def deletable_upload() -> tuple:
+        if not created:
+            db.create_upload(*new_upload())
+        return created.pop(), os.path.join(directory, "missing")
+
+    def performance(tier: str) -> tuple:
+        score = rng.randint(40, 100)
+        return (Performance(user_id=samples.user(tier), exercise_id=samples.exercise_id(), score=score,
+                            accuracy=float(score), practice_time_seconds=rng.randint(20, 120)),)
+
+    def unchanged_scores() -> tuple:
+        conn = db.get_connection()
+        row = conn.execute('SELECT score, accuracy, mistakes_count, scoring_version, id FROM performances WHERE id = ?',
+                           (rng.randint(1, max(samples.max_performance_id, 1)),)).fetchone()
+        conn.close()
+        return ([tuple(row)] if row else [],)
+
+    def forget_daily_set(user_id: str) -> tuple:
+        conn = db.get_connection()
+        conn.execute('DELETE FROM daily_sets WHERE user_id = ? AND date = ?', (user_id, date.today().isoformat()))
+        conn.commit()
+        conn.close()
+        return (user_id,)
+
+    cases = [
+        Case("get_connection", lambda: db.get_connection().close()),
+        Case("init_database", db.init_database),
+        Case("backfill_exercise_fingerprints", db.backfill_exercise_fingerprints),
+        Case("backfill_pattern_index", db.backfill_pattern_index),
+        Case("backfill_xp_ledger", db.backfill_xp_ledger),
+        Case("insert_sample_data", db.insert_sample_data),
+        Case("create_user", db.create_user, lambda: (f"capacity_user_{next(counter)}",)),
+        Case("get_exercises", db.get_exercises),
+        Case("get_exercises_json", db.get_exercises_json),
+        Case("get_max_exercise_id", db.get_max_exercise_id),
+        Case("iter_exercises_after", lambda after: next(db.iter_exercises_after(after), None),
+             lambda: (rng.randint(0, samples.exercises),)),
+        Case("search_patterns", db.search_patterns, lambda: (query_windows(parse_pattern(samples.pattern())),)),
+        Case("get_exercise", db.get_exercise, lambda: (samples.exercise_id(),)),
+        Case("get_exercises_by_ids", db.get_exercises_by_ids,
+             lambda: ([samples.exercise_id() for _ in range(20)],)),
+        Case("save_exercises", db.save_exercises,
+             lambda: ([synthetic_exercise(random.Random(rng.random()), rng.randrange(3))],)),
+        Case("get_upload_exercise_links", db.get_upload_exercise_links, lambda: (rng.randint(1, len(samples.uploads)),)),
+        Case("iter_review_histories", lambda: next(db.iter_review_histories(), None)),
+        Case("replace_review_state", db.replace_review_state, lambda: (
+            ["capacity_user"],
+            [("capacity_user", samples.exercise_id(), 2.5, 1.0, 1, 0, datetime.now().isoformat(timespec="seconds"),
+              datetime.now().isoformat(timespec="seconds"))])),
+        Case("get_performance_events", db.get_performance_events,
+             lambda: (rng.randint(1, max(samples.max_performance_id, 1)),)),
+        Case("iter_performances_for_rescore", lambda: next(db.iter_performances_for_rescore(), None)),
+        Case("snapshot_xp", db.snapshot_xp),
+        Case("iter_xp_events", lambda: next(db.iter_xp_events(), None)),
+        # A zero adjustment: the write without changing anyone's XP
+        Case("append_xp_adjustments", db.append_xp_adjustments, lambda: ([(samples.user("median"), 0)],)),
+        Case("update_performance_scores", db.update_performance_scores, unchanged_scores),
+        Case("create_upload", db.create_upload, new_upload),
+        Case("update_upload_status", db.update_upload_status,
+             lambda: (rng.choice(samples.uploads), ParseStatus.PARSED)),
+        Case("get_upload", db.get_upload, lambda: (rng.choice(samples.uploads),)),
+        Case("count_uploads", db.count_uploads),
+        Case("list_uploads", db.list_uploads),
+        Case("delete_upload", db.delete_upload, deletable_upload),
+        Case("reconcile_uploads", db.reconcile_uploads,
+             lambda: (os.path.join(directory, "uploads"), classify_upload, True)),
+    ]
+    for tier in TIERS:
+        cases += [
+            Case(f"get_user [{tier}]", db.get_user, lambda tier=tier: (samples.user(tier),)),
+            Case(f"update_user_progress [{tier}]", db.update_user_progress,
+                 lambda tier=tier: (samples.user(tier), 15)),
+            Case(f"save_performance [{tier}]", db.save_performance, lambda tier=tier: performance(tier)),
+            Case(f"get_due_reviews [{tier}]", db.get_due_reviews, lambda tier=tier: (samples.user(tier),)),
+            Case(f"get_struggled_exercise_ids [{tier}]", db.get_struggled_exercise_ids,
+                 lambda tier=tier: (samples.user(tier),)),
+            Case(f"list_user_performances [{tier}]", db.list_user_performances,
+                 lambda tier=tier: (samples.user(tier),)),
+            Case(f"get_user_progress [{tier}]", db.get_user_progress, lambda tier=tier: (samples.user(tier),)),
+            Case(f"get_daily_exercises_for_user [{tier}]", db.get_daily_exercises_for_user,
+                 lambda tier=tier: forget_daily_set(samples.user(tier))),
+        ]
+
+    public = {name for name in vars(Database) if not name.startswith("_") and callable(getattr(Database, name))}
+    missing = public - {case.name.split(" ")[0] for case in cases}
+    if missing:
+        print(f"⚠️  Database methods without a capacity case: {', '.join(sorted(missing))}")
+    return [Case(f"Database.{case.name}", case.run, case.prepare) for case in cases]
+
+
+def endpoint_cases(client, app, samples: Samples) -> List[Case]:
+    """A case for every HTTP route (per tier where it takes a user)"""
+    from fastapi.routing import APIRoute
+    from bench_hot_paths import synthetic_musicxml
+    from synth import render_samples, wav_bytes
+
+    rng = samples.rng
+    uploaded: List[str] = []
+
+    def request(method: str, url: str, **kwargs):
+        async def call():
+            response = await client.request(method, url, **kwargs)
+            if response.status_code >= 400:
+                raise RuntimeError(f"{method} {url}: {response.status_code} {response.text[:200]}")
+            return response
+        return call
+
+    def score_file() -> tuple:
+        return ("capacity.musicxml", synthetic_musicxml(16, rng.randrange(10 ** 9)).encode(), "application/xml")
+
+    def upload_score():
+        async def call():
+            response = await request("POST", "/upload/upload/score", files={"file": score_file()})()
+            uploaded.append(response.json()["filename"])
+        return call
+
+    async def fresh_upload() -> tuple:
+        await upload_score()()
+        return (request("DELETE", f"/upload/upload/files/{uploaded.pop()}"),)
+
+    def uploaded_file() -> str:
+        return rng.choice(uploaded) if uploaded else "missing.musicxml"
+
+    def recording() -> tuple:
+        exercise = samples.rng.choice(samples.notes)
+        return ("take.wav", wav_bytes(render_samples(exercise, None)), "audio/wav")
+
+    routes: Dict[str, Callable[[Optional[str]], Callable]] = {
+        "POST /upload/upload/score": lambda tier: upload_score(),
+        "POST /upload/upload/batch": lambda tier: request(
+            "POST", "/upload/upload/batch", files=[("files", score_file()), ("files", score_file())]),
+        "POST /upload/upload/files/{filename}/revisions": lambda tier: request(
+            "POST", f"/upload/upload/files/{uploaded_file()}/revisions", files={"file": score_file()}),
+        "GET /upload/upload/files": lambda tier: request("GET", "/upload/upload/files"),
+        "GET /upload/upload/files/{filename}/measures": lambda tier: request(
+            "GET", f"/upload/upload/files/{uploaded_file()}/measures"),
+        "POST /upload/upload/files/{filename}/exercises": lambda tier: request(
+            "POST", f"/upload/upload/files/{uploaded_file()}/exercises?chunk_size={rng.choice((2, 4, 8))}"),
+        "GET /exercises/exercises/daily/{user_id}": lambda tier: request(
+            "GET", f"/exercises/exercises/daily/{samples.user(tier)}"),
+        "GET /exercises/exercises/reviews/{user_id}": lambda tier: request(
+            "GET", f"/exercises/exercises/reviews/{samples.user(tier)}"),
+        "GET /exercises/exercises/similar-to-mistakes/{user_id}": lambda tier: request(
+            "GET", f"/exercises/exercises/similar-to-mistakes/{samples.user(tier)}"),
+        "GET /exercises/exercises/pattern-search": lambda tier: request(
+            "GET", "/exercises/exercises/pattern-search", params={"pattern": samples.pattern()}),
+        "GET /exercises/exercises/": lambda tier: request("GET", "/exercises/exercises/"),
+        "GET /exercises/exercises/{exercise_id}": lambda tier: request(
+            "GET", f"/exercises/exercises/{samples.exercise_id()}"),
+        "GET /exercises/exercises/{exercise_id}/similar": lambda tier: request(
+            "GET", f"/exercises/exercises/{samples.exercise_id()}/similar"),
+        "GET /exercises/exercises/{exercise_id}/transpose/{key}": lambda tier: request(
+            "GET", f"/exercises/exercises/{samples.exercise_id()}/transpose/{rng.choice(('G', 'F', 'D', 'B-'))}"),
+        "GET /exercises/exercises/{exercise_id}/transpositions": lambda tier: request(
+            "GET", f"/exercises/exercises/{samples.exercise_id()}/transpositions"),
+        "GET /exercises/exercises/{exercise_id}/audio": lambda tier: request(
+            "GET", f"/exercises/exercises/{samples.exercise_id()}/audio", params={"tempo": rng.randint(60, 160)}),
+        "GET /exercises/exercises/difficulty/{difficulty}": lambda tier: request(
+            "GET", f"/exercises/exercises/difficulty/{rng.choice(('easy', 'medium', 'hard'))}"),
+        "GET /exercises/exercises/random/{count}": lambda tier: request("GET", "/exercises/exercises/random/5"),
+        "GET /exercises/exercises/stats/summary": lambda tier: request("GET", "/exercises/exercises/stats/summary"),
+        "GET /exercises/exercises/search/{query}": lambda tier: request(
+            "GET", f"/exercises/exercises/search/{rng.choice(('Measures 1', 'hard', 'B-', 'G'))}"),
+        "POST /users/users/submit_performance": lambda tier: request(
+            "POST", "/users/users/submit_performance", json={
+                "user_id": samples.user(tier), "exercise_id": samples.exercise_id(), "score": 0,
+                "notes_played": rng.choice(samples.notes), "practice_time_seconds": rng.randint(20, 120)}),
+        "POST /users/users/submit_recording": lambda tier: request(
+            "POST", "/users/users/submit_recording", files={"file": recording()},
+            data={"user_id": samples.user(tier), "exercise_id": str(samples.exercise_id())}),
+        "GET /users/users/{user_id}/progress": lambda tier: request(
+            "GET", f"/users/users/{samples.user(tier)}/progress"),
+        "GET /users/users/{user_id}/profile": lambda tier: request(
+            "GET", f"/users/users/{samples.user(tier)}/profile"),
+        "GET /users/users/{user_id}/performances": lambda tier: request(
+            "GET", f"/users/users/{samples.user(tier)}/performances"),
+        "GET /users/users/{user_id}/performances/{performance_id}/events": lambda tier: request(
+            "GET", "/users/users/{}/performances/{}/events".format(*samples.user_performance(tier))),
+        "GET /users/users/{user_id}/stats": lambda tier: request("GET", f"/users/users/{samples.user(tier)}/stats"),
+        "POST /users/users/{user_id}/reset": lambda tier: request("POST", f"/users/users/{samples.user(tier)}/reset"),
+        "GET /users/users/leaderboard": lambda tier: request("GET", "/users/users/leaderboard"),
+        "GET /": lambda tier: request("GET", "/"),
+        "GET /health": lambda tier: request("GET", "/health"),
+        "GET /metrics": lambda tier: request("GET", "/metrics"),
+        "GET /api/info": lambda tier: request("GET", "/api/info"),
+        "GET /api/admission": lambda tier: request("GET", "/api/admission"),
+    }
+    # Only served with a profiling token, or documentation
+    skipped = {"POST /admin/profile", "GET /openapi.json", "GET /docs", "GET /docs/oauth2-redirect", "GET /redoc"}
+
+    cases = []
+    for route in app.routes:
+        if not isinstance(route, APIRoute):
+            continue
+        for method in sorted(route.methods - {"HEAD"}):
+            name = f"{method} {route.path}"
+            if name in skipped:
+                continue
+            if name == "DELETE /upload/upload/files/{filename}":
+                # Each call deletes a file uploaded (untimed) just before
+                cases.append(Case(name, lambda call: call(), fresh_upload, is_async=True))
+                continue
+            if name not in routes:
+                print(f"⚠️  No capacity case for {name}")
+                continue
+            tiers = TIERS if "{user_id}" in route.path or name.startswith("POST /users/") else (None,)
+            for tier in tiers:
+                label = f"{name} [{tier}]" if tier else name
+                cases.append(Case(label, lambda call: call(),
+                                  lambda make=routes[name], tier=tier: (make(tier),), is_async=True))
+    return cases
+
+
+async def measure(case: Case, calls: int, budget: float, before: Callable[[], None]) -> Dict[str, Any]:
+    timings: List[float] = []
+    errors = 0
+    deadline = None
+    # One untimed call first, to start pools and load code
+    while len(timings) < calls and (len(timings) < 3 or deadline is None or time.perf_counter() < deadline):
+        before()
+        began = time.perf_counter()
+        try:
+            seconds = await case.call()
+        except Exception as e:
+            seconds = time.perf_counter() - began
+            if deadline is not None:
+                errors += 1
+                if errors == 1:
+                    print(f"   {case.name}: {type(e).__name__}: {str(e)[:200]}")
+        if deadline is None:
+            deadline = time.perf_counter() + budget
+        else:
+            timings.append(seconds)
+    milliseconds = np.array(timings) * 1000
+    return {
+        "calls": len(timings),
+        "errors": errors,
+        "median_ms": round(float(np.median(milliseconds)), 3),
+        "p95_ms": round(float(np.percentile(milliseconds, 95)), 3),
+        "max_ms": round(float(milliseconds.max()), 3),
+    }
+
+
+async def run_report(path: str, calls: int, budget: float, seed: int, pattern) -> Dict[str, Any]:
+    import httpx
+    import db as db_module
+    import main as app_module
+    from http_cache import response_cache
+    from similarity import similarity_index
+
+    db_module.db.db_path = path
+    app_module.prepare_shared_state()
+    samples = Samples(path, random.Random(seed))
+
+    results: Dict[str, Dict[str, Any]] = {}
+    began = time.perf_counter()
+    similarity_index.sync(db_module.db)
+    results["startup: similarity_index.sync"] = {
+        "calls": 1, "errors": 0, "median_ms": round((time.perf_counter() - began) * 1000, 3),
+        "p95_ms": None, "max_ms": None}
+
+    directory = os.getcwd()
+    transport = httpx.ASGITransport(app=app_module.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://capacity", timeout=600) as client:
+        cases = database_cases(samples, directory) + endpoint_cases(client, app_module.app, samples)
+        for case in cases:
+            if pattern and not pattern.search(case.name):
+                continue
+            results[case.name] = stats = await measure(case, calls, budget, response_cache.clear)
+            print(f"{case.name:<70} median {stats['median_ms']:>10.2f} ms  p95 {stats['p95_ms']:>10.2f} ms"
+                  + (f"  ({stats['errors']} errors)" if stats["errors"] else ""))
+    return results
+
+
+def print_report(report: Dict[str, Any]):
+    counts = report["rows"]
+    print(f"\ndataset: {counts.get('users', 0)} users, {counts.get('exercises', 0)} exercises, "
+          f"{counts.get('performances', 0)} performances, {report['size_bytes'] / 2**30:.2f} GiB")
+    print(f"{'operation (slowest first)':<70} {'median ms':>10} {'p95 ms':>10} {'max ms':>10}")
+    for name, stats in sorted(report["results"].items(), key=lambda item: -item[1]["median_ms"]):
+        p95 = f"{stats['p95_ms']:>10.2f}" if stats["p95_ms"] is not None else f"{'-':>10}"
+        top = f"{stats['max_ms']:>10.2f}" if stats["max_ms"] is not None else f"{'-':>10}"
+        errors = f"  {stats['errors']}/{stats['calls']} failed" if stats["errors"] else ""
+        print(f"{name:<70} {stats['median_ms']:>10.2f} {p95} {top}{errors}")
+
+
+def print_trend(reports: List[Dict[str, Any]]):
+    """Median of each operation across datasets, with its growth exponent in performances"""
+    reports = sorted(reports, key=lambda report: report["rows"].get("performances", 0))
+    sizes = [max(report["rows"].get("performances", 0), 1) for report in reports]
+    print(f"{'operation':<70} " + " ".join(f"{size:>12,}" for size in sizes) + f" {'growth':>7}")
+    names = sorted(set().union(*(report["results"] for report in reports)))
+    rows = []
+    for name in names:
+        medians = [report["results"].get(name, {}).get("median_ms") for report in reports]
+        growth = None
+        if medians[0] and medians[-1] and sizes[-1] > sizes[0]:
+            growth = math.log(medians[-1] / medians[0]) / math.log(sizes[-1] / sizes[0])
+        rows.append((growth if growth is not None else -1, name, medians, growth))
+    for _, name, medians, growth in sorted(rows, reverse=True):
+        cells = " ".join(f"{median:>12.2f}" if median is not None else f"{'-':>12}" for median in medians)
+        flag = ""
+        if growth is not None and growth >= SCANS_TABLE:
+            flag = "  ⚠️  scans"
+        elif growth is not None and growth >= GROWS_WITH_DATA:
+            flag = "  grows"
+        print(f"{name:<70} {cells} {growth if growth is not None else float('nan'):>7.2f}{flag}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--db", help="Dataset to measure (see benchmarks/gen_dataset.py)")
+    parser.add_argument("--calls", type=int, default=30, help="Most calls per operation")
+    parser.add_argument("--budget", type=float, default=5.0, help="Seconds of calls per operation")
+    parser.add_argument("--filter", help="Only time operations whose name matches this regex")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Report file (default: <db>.capacity.json)")
+    parser.add_argument("--trend", nargs="+", metavar="REPORT", help="Compare reports of different dataset sizes")
+    args = parser.parse_args(argv)
+
+    if args.trend:
+        reports = []
+        for path in args.trend:
+            with open(path) as f:
+                reports.append(json.load(f))
+        print_trend(reports)
+        return 0
+    if not args.db:
+        parser.error("--db is required unless --trend is given")
+
+    path = os.path.abspath(args.db)
+    if not os.path.exists(path):
+        parser.error(f"{path} does not exist")
+    output = os.path.abspath(args.output or path + ".capacity.json")
+    pattern = re.compile(args.filter) if args.filter else None
+
+    with tempfile.TemporaryDirectory() as directory:
+        # Uploads, parsed scores and audio go to a scratch directory
+        os.chdir(directory)
+        rows = row_counts(path)
+        results = asyncio.run(run_report(path, args.calls, args.budget, args.seed, pattern))
+
+    report = {
+        "recorded_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": f"{platform.system()} {platform.machine()}, {os.cpu_count()} CPUs",
+        "database": path,
+        "size_bytes": os.path.getsize(path),
+        "rows": rows,
+        "results": results,
+    }
+    print_report(report)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+        f.write("\n")
+    print(f"report saved to {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
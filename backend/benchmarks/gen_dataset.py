@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+"""
+Generate a large synthetic SightReadPro database for capacity testing
+
+Fills a new database file with users, exercises, performances, review
+schedules and an uploads catalog whose shapes resemble production rather
+than the three sample exercises in sightreadpro.db:
+
+- Exercises are melodies in weighted keys and meters (mostly C/G/F major
+  and 4/4), a random walk over the scale with wider leaps, accidentals and
+  shorter notes as difficulty rises, each measure filled to its meter.
+  They are stored with Database.save_exercises (fingerprints and pattern
+  index included).
+- Users sign up over the whole period, more of them recently, and practice
+  at a rate drawn from a power law (a few users submit most performances),
+  until they drop out after an exponentially distributed lifetime.
+- Performances arrive day by day in time order (so rows interleave users
+  the way production inserts do), more on weekends and in the evenings,
+  on exercises drawn from a Zipf popularity curve. Scores follow the
+  user's skill minus the exercise difficulty; accuracy, rhythm and tempo
+  scores, mistakes and practice time follow the score. A share of them
+  (--notes-fraction) carry played notes and note events, as server-scored
+  submissions do.
+- Each performance gets its XP ledger event, users get the XP, level,
+  streak and last active date the API would have given them (as snapshots
+  of the whole ledger), and review schedules are rebuilt from the
+  performance history as `manage.py schedule-reviews` does.
+
+Rows go in with executemany inside large transactions, with the journal
+off and the performances indexes dropped until the end, so the run is
+bounded by SQLite's insert rate: about 80,000 performances (with their
+XP ledger events) a second on one core, so 100 million take about 20
+minutes (and rebuilding review schedules about as long again; skip it
+with --skip-reviews). Output is
+deterministic for a given --seed and sizes, except that dates are
+relative to the day it runs.
+
+Usage:
+    python benchmarks/gen_dataset.py --db /data/capacity.db [--users 100000] [--exercises 100000]
+                                     [--performances 10000000] [--days 730] [--force]
+"""
+
+import argparse
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterator, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+# key -> relative frequency (tonic names as score_store reads them from scores)
+KEYS = {"C": 20, "G": 15, "F": 12, "D": 11, "B-": 8, "A": 8, "E-": 7, "E": 5,
+        "A-": 4, "B": 3, "D-": 3, "F#": 2, "C#": 1, "G-": 1}
+TONIC_PITCH_CLASSES = {"C": 0, "C#": 1, "D-": 1, "D": 2, "E-": 3, "E": 4, "F": 5, "F#": 6, "G-": 6,
+                       "G": 7, "A-": 8, "A": 9, "B-": 10, "B": 11}
+# meter -> (quarter notes per measure, relative frequency)
+METERS = {"4/4": (4.0, 50), "3/4": (3.0, 20), "6/8": (3.0, 12), "2/4": (2.0, 9), "2/2": (4.0, 5),
+          "12/8": (6.0, 3), "9/8": (4.5, 1)}
+DIFFICULTIES = ("easy", "medium", "hard")
+DIFFICULTY_WEIGHTS = (0.4, 0.35, 0.25)
+XP_REWARDS = (10, 15, 20)
+# Score points lost to each difficulty
+DIFFICULTY_PENALTY = np.array([0.0, 8.0, 16.0])
+# (quarter length, rhythm name) each difficulty fills measures with; repeats weight the draw
+RHYTHMS = (
+    ((4.0, "whole"), (2.0, "half"), (2.0, "half"), (1.0, "quarter"), (1.0, "quarter"), (1.0, "quarter")),
+    ((2.0, "half"), (1.5, "dotted quarter"), (1.0, "quarter"), (1.0, "quarter"), (0.5, "eighth"), (0.5, "eighth")),
+    ((1.0, "quarter"), (0.75, "dotted eighth"), (0.5, "eighth"), (0.5, "eighth"), (0.25, "16th"), (0.25, "16th")),
+)
+# Scale-degree steps of the melody for each difficulty
+STEPS = ((-1, -1, 0, 1, 1, 2, -2), (-2, -1, -1, 1, 1, 2, -3, 3), (-4, -2, -1, 1, 2, 4, -5, 5, 3, -3))
+MAJOR_SCALE = (0, 2, 4, 5, 7, 9, 11)
+
+# Pareto shape of per-user practice rates (smaller is more skewed), capped
+# at this multiple of the least active rate: nobody practices all day
+ACTIVITY_SHAPE = 1.2
+MAX_RATE = 100.0
+# Zipf exponent of exercise popularity
+POPULARITY_EXPONENT = 1.05
+# Relative number of performances in each hour of the day
+HOURLY = np.array([1, 0.5, 0.3, 0.2, 0.2, 0.4, 1, 2, 3, 3, 3, 3, 4, 4, 4, 5, 7, 9, 10, 10, 9, 7, 4, 2])
+WEEKEND_FACTOR = 1.3
+
+PERFORMANCE_INDEXES = ("idx_performances_user_id", "idx_performances_exercise_id",
+                       "idx_performances_submitted_at", "idx_performances_user_submitted", "idx_xp_events_user")
+COMMIT_ROWS = 1_000_000
+
+
+def synthetic_exercise(rng: random.Random, difficulty: int) -> Dict[str, Any]:
+    """One exercise in a weighted key and meter, filled measure by measure"""
+    from analysis import midi_name
+
+    key = rng.choices(list(KEYS), weights=list(KEYS.values()))[0]
+    meter = rng.choices(list(METERS), weights=[weight for _, weight in METERS.values()])[0]
+    measure_length = METERS[meter][0]
+    measure_count = rng.choice((4, 4, 4, 2, 8))
+    first = rng.randrange(0, 32) * measure_count + 1
+
+    tonic = 60 + TONIC_PITCH_CLASSES[key]
+    if tonic > 66:
+        tonic -= 12
+    degree = 0
+    notes, rhythm = [], []
+    for _ in range(measure_count):
+        remaining = measure_length
+        while remaining > 0:
+            length, name = rng.choice([r for r in RHYTHMS[difficulty] if r[0] <= remaining] or [(remaining, "quarter")])
+            remaining -= length
+            degree = min(max(degree + rng.choice(STEPS[difficulty]), -5), 11)
+            octave, step = divmod(degree, 7)
+            midi = tonic + 12 * octave + MAJOR_SCALE[step]
+            if difficulty == 2 and rng.random() < 0.1:
+                midi += 1
+            notes.append(midi_name(midi))
+            rhythm.append(name)
+
+    measures = f"{first}-{first + measure_count - 1}"
+    return {
+        "measures": measures,
+        "difficulty": DIFFICULTIES[difficulty],
+        "title": f"Measures {measures}",
+        "key_signature": key,
+        "time_signature": meter,
+        "notes": notes,
+        "rhythm_pattern": rhythm,
+        "xp_reward": XP_REWARDS[difficulty],
+    }
+
+
+def played_events(exercise: Dict[str, Any], tempo: int) -> bytes:
+    """Encoded note events of the exercise played as written at `tempo`"""
+    from perf_events import EVENT_DTYPE, encode_events
+    from score_store import quarter_lengths
+    from transpose import notes_to_arrays
+
+    beats = quarter_lengths(exercise["rhythm_pattern"], len(exercise["notes"])) * 60000.0 / tempo
+    events = np.zeros(len(beats), dtype=EVENT_DTYPE)
+    events["onset_ms"] = np.concatenate([[0.0], np.cumsum(beats)[:-1]]).round()
+    events["pitch"] = notes_to_arrays(exercise["notes"])[2]
+    events["velocity"] = 72
+    events["duration_ms"] = (beats * 0.9).round()
+    return encode_events(events)
+
+
+def generate_exercises(database, count: int, seed: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Store `count` exercises; returns their IDs, difficulty indexes, notes as JSON and played events"""
+    rng = random.Random(seed)
+    difficulties = np.random.default_rng(seed).choice(3, size=count, p=DIFFICULTY_WEIGHTS)
+    exercises = [synthetic_exercise(rng, int(level)) for level in difficulties]
+    exercise_ids, inserted = database.save_exercises(exercises)
+
+    # Duplicates map to one row; keep the first of each
+    ids, first = np.unique(np.array(exercise_ids, dtype=np.int64), return_index=True)
+    notes_json = np.array([json.dumps(exercises[i]["notes"]) for i in first.tolist()], dtype=object)
+    events = np.array([played_events(exercises[i], rng.randrange(60, 140)) for i in first.tolist()], dtype=object)
+    return ids, difficulties[first], notes_json, events
+
+
+class Population:
+    """Users (in sign-up order) with their active period and practice rate"""
+
+    def __init__(self, rng: np.random.Generator, users: int, days: int):
+        # More sign-ups as the period goes on
+        self.signup = np.sort((days * np.sqrt(rng.random(users))).astype(np.int64))
+        lifetime = rng.exponential(days / 3, users) * (1 + (rng.random(users) < 0.2) * 10)
+        self.last_day = np.minimum(self.signup + lifetime.astype(np.int64), days - 1)
+        self.rate = np.minimum(rng.pareto(ACTIVITY_SHAPE, users) + 1, MAX_RATE)
+        self.skill = 100 * rng.beta(5, 2, users)
+        self.signup_cdf = np.cumsum(self.rate)
+        self.signed_up = np.searchsorted(self.signup, np.arange(days), side="right")
+
+        # Daily volume follows the rate of users active that day
+        churned = np.argsort(self.last_day, kind="stable")
+        churned_rate = np.concatenate([[0.0], np.cumsum(self.rate[churned])])
+        gone = np.searchsorted(self.last_day[churned], np.arange(days), side="left")
+        self.daily_rate = np.concatenate([[0.0], self.signup_cdf])[self.signed_up] - churned_rate[gone]
+        self.daily_rate[self.signed_up - gone <= 0] = 0
+        self.daily_rate = np.maximum(self.daily_rate, 0)
+
+    def sample(self, rng: np.random.Generator, day: int, count: int) -> np.ndarray:
+        """`count` users active on `day`, weighted by practice rate"""
+        signed_up = self.signed_up[day]
+        if not signed_up or not count:
+            return np.zeros(0, dtype=np.int64)
+        chosen: List[np.ndarray] = []
+        needed = count
+        while needed > 0:
+            candidates = np.searchsorted(self.signup_cdf[:signed_up],
+                                         rng.random(needed * 2 + 16) * self.signup_cdf[signed_up - 1])
+            candidates = candidates[self.last_day[candidates] >= day][:needed]
+            chosen.append(candidates)
+            needed -= len(candidates)
+        return np.concatenate(chosen)
+
+
+def performance_days(rng: np.random.Generator, population: Population, total: int, days: int,
+                     exercise_ids: np.ndarray, difficulties: np.ndarray, note_counts: np.ndarray,
+                     notes_json: np.ndarray, events: np.ndarray, notes_fraction: float, user_ids: np.ndarray,
+                     first_day: date) -> Iterator[Tuple[int, np.ndarray, np.ndarray, List[tuple]]]:
+    """Yield (day, users, xp earned, performance rows) for each day, in time order"""
+    from scoring import SCORING_VERSION
+    from xp import performance_xp
+
+    weekday = np.array([(first_day + timedelta(days=d)).weekday() for d in range(days)])
+    weights = population.daily_rate * np.where(weekday >= 5, WEEKEND_FACTOR, 1.0)
+    per_day = rng.multinomial(total, weights / weights.sum()) if weights.sum() else np.zeros(days, dtype=np.int64)
+
+    popularity = rng.permutation(len(exercise_ids))
+    popularity_cdf = np.cumsum(1.0 / np.arange(1, len(exercise_ids) + 1) ** POPULARITY_EXPONENT)
+    popularity_cdf /= popularity_cdf[-1]
+    hourly_cdf = np.cumsum(HOURLY) / HOURLY.sum()
+    epoch = np.datetime64(first_day.isoformat(), "s")
+
+    for day in range(days):
+        count = int(per_day[day])
+        if not count:
+            continue
+        users = population.sample(rng, day, count)
+        count = len(users)
+        seconds = np.searchsorted(hourly_cdf, rng.random(count)) * 3600 + rng.integers(0, 3600, count)
+        order = np.argsort(seconds, kind="stable")
+        users, seconds = users[order], seconds[order]
+        submitted_at = np.datetime_as_string(epoch + np.timedelta64(day * 86400, "s") + seconds, unit="s")
+
+        picks = popularity[np.minimum(np.searchsorted(popularity_cdf, rng.random(count)), len(popularity) - 1)]
+        level = difficulties[picks]
+        score = np.clip(rng.normal(population.skill[users] - DIFFICULTY_PENALTY[level], 12), 0, 100).round()
+        accuracy = np.clip(score + rng.normal(0, 3, count), 0, 100).round(1)
+        rhythm_score = np.clip(rng.normal(score, 8), 0, 100).round(1)
+        tempo_score = np.clip(rng.normal(score + 5, 8), 0, 100).round(1)
+        mistakes = rng.binomial(note_counts[picks], (100 - accuracy) / 100)
+        practice = np.maximum(rng.lognormal(np.log(45) + 0.3 * level, 0.5), 5).astype(np.int64)
+        with_notes = rng.random(count) < notes_fraction
+
+        rows = list(zip(
+            user_ids[users].tolist(), exercise_ids[picks].tolist(), score.astype(np.int64).tolist(),
+            accuracy.tolist(), rhythm_score.tolist(), tempo_score.tolist(), practice.tolist(), mistakes.tolist(),
+            np.where(with_notes, notes_json[picks], None).tolist(),
+            np.where(with_notes, SCORING_VERSION, None).tolist(), np.where(with_notes, events[picks], None).tolist(),
+            submitted_at.tolist()
+        ))
+        yield day, users, performance_xp(score.astype(np.int64)), rows
+
+
+def generate_uploads(conn, rng: np.random.Generator, count: int, population: Population, user_ids: np.ndarray,
+                     exercise_ids: np.ndarray, first_day: date) -> int:
+    """Catalog rows for `count` uploads (the files themselves don't exist), each linked to a run of exercises"""
+    days = len(population.signed_up)
+    owners = np.searchsorted(population.signup_cdf, rng.random(count) * population.signup_cdf[-1])
+    created_days = population.signup[owners] + (rng.random(count) * (days - population.signup[owners])).astype(np.int64)
+    chunks = rng.integers(4, 41, count)
+    starts = rng.integers(0, max(len(exercise_ids) - 41, 1), count)
+    uploads, links = [], []
+    for i in range(count):
+        created = datetime.combine(first_day + timedelta(days=int(created_days[i])), datetime.min.time()) + \
+            timedelta(seconds=int(rng.integers(0, 86400)))
+        uploads.append((f"{created:%Y%m%d_%H%M%S}_{i:08x}.musicxml", f"score_{i}.musicxml",
+                        user_ids[int(owners[i])],
+                        f"{int(rng.integers(0, 2**63)):064x}", int(rng.integers(5_000, 500_000)), "musicxml",
+                        "parsed", created.isoformat()))
+    conn.executemany('''
+        INSERT INTO uploads (filename, original_filename, owner_id, content_hash, size_bytes, file_type,
+                             parse_status, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', uploads)
+    first_id = conn.execute('SELECT MAX(id) FROM uploads').fetchone()[0] - count + 1
+    for i in range(count):
+        for chunk in range(int(chunks[i])):
+            links.append((first_id + i, 0, 4, chunk, int(exercise_ids[(starts[i] + chunk) % len(exercise_ids)])))
+    conn.executemany('''
+        INSERT OR REPLACE INTO upload_exercises (upload_id, part, chunk_size, chunk_index, exercise_id)
+        VALUES (?, ?, ?, ?, ?)
+    ''', links)
+    return count
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--db", required=True, help="Database file to create")
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--exercises", type=int, default=100_000)
+    parser.add_argument("--performances", type=int, default=10_000_000)
+    parser.add_argument("--uploads", type=int, default=10_000)
+    parser.add_argument("--days", type=int, default=730, help="Length of the history, ending yesterday")
+    parser.add_argument("--notes-fraction", type=float, default=0.1,
+                        help="Share of performances with played notes and note events (server-scored)")
+    parser.add_argument("--skip-reviews", action="store_true", help="Don't rebuild review schedules")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--force", action="store_true", help="Replace an existing file")
+    args = parser.parse_args(argv)
+
+    path = os.path.abspath(args.db)
+    if os.path.exists(path):
+        if not args.force:
+            parser.error(f"{path} exists (use --force to replace it)")
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+    began = time.perf_counter()
+    rng = np.random.default_rng(args.seed)
+    first_day = date.today() - timedelta(days=args.days)
+
+    with tempfile.TemporaryDirectory() as directory:
+        # Importing db opens sightreadpro.db in the working directory
+        os.chdir(directory)
+        import db as db_module
+        from xp import level_for, PERFORMANCE
+
+        database = db_module.Database(path)
+
+        step = time.perf_counter()
+        exercise_ids, difficulties, notes_json, events = generate_exercises(database, args.exercises, args.seed)
+        note_counts = np.array([notes.count(",") + 1 for notes in notes_json], dtype=np.int64)
+        print(f"🎼 {len(exercise_ids)} exercises in {time.perf_counter() - step:.1f}s")
+
+        population = Population(rng, args.users, args.days)
+        user_ids = np.array([f"user_{i:07d}" for i in range(args.users)], dtype=object)
+        xp = np.zeros(args.users, dtype=np.int64)
+        active_days = np.zeros(args.users, dtype=np.int64)
+        last_active = np.full(args.users, -1, dtype=np.int64)
+
+        conn = database.get_connection()
+        conn.execute('PRAGMA journal_mode=OFF')
+        conn.execute('PRAGMA synchronous=OFF')
+        conn.execute('PRAGMA cache_size=-262144')
+        for index in PERFORMANCE_INDEXES:
+            conn.execute(f'DROP INDEX IF EXISTS {index}')
+
+        step = time.perf_counter()
+        inserted = uncommitted = 0
+        first_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM performances').fetchone()[0] + 1
+        for day, users, earned, rows in performance_days(
+                rng, population, args.performances, args.days, exercise_ids, difficulties, note_counts,
+                notes_json, events, args.notes_fraction, user_ids, first_day):
+            conn.executemany('''
+                INSERT INTO performances (
+                    user_id, exercise_id, score, accuracy, rhythm_score, tempo_score,
+                    practice_time_seconds, mistakes_count, notes_played, scoring_version, events, submitted_at
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', rows)
+            # Ledger events for the performances just inserted (IDs are consecutive in a new file)
+            conn.executemany('INSERT INTO xp_events (user_id, reason, performance_id, xp, day) VALUES (?, ?, ?, ?, ?)',
+                             zip(user_ids[users].tolist(), itertools.repeat(PERFORMANCE),
+                                 range(first_id + inserted, first_id + inserted + len(rows)), earned.tolist(),
+                                 itertools.repeat(first_day.toordinal() + day)))
+            xp += np.bincount(users, weights=earned, minlength=args.users).astype(np.int64)
+            practiced = np.unique(users)
+            active_days[practiced] += 1
+            last_active[practiced] = day
+
+            inserted += len(rows)
+            uncommitted += len(rows)
+            if uncommitted >= COMMIT_ROWS:
+                conn.commit()
+                uncommitted = 0
+                elapsed = time.perf_counter() - step
+                print(f"   {inserted} performances ({inserted / elapsed:,.0f}/s)")
+        conn.commit()
+        print(f"🎯 {inserted} performances in {time.perf_counter() - step:.1f}s")
+
+        # Snapshots of the whole ledger, as update_user_progress leaves them: the streak only
+        # grows, on each new active day
+        day_names = [(first_day + timedelta(days=d)).isoformat() for d in range(args.days)]
+        last_event_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM xp_events').fetchone()[0]
+        conn.executemany('''
+            INSERT INTO users (user_id, xp, streak, last_active_date, created_at, level, snapshot_event_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', ((user_ids[u], int(xp[u]), max(int(active_days[u]) - 1, 0),
+               day_names[last_active[u] if last_active[u] >= 0 else population.signup[u]],
+               f"{day_names[population.signup[u]]}T08:00:00", level_for(int(xp[u])), last_event_id)
+              for u in range(args.users)))
+        generate_uploads(conn, rng, args.uploads, population, user_ids, exercise_ids, first_day)
+        conn.commit()
+        conn.close()
+        print(f"👥 {args.users} users ({int((active_days > 0).sum())} active), {args.uploads} uploads")
+
+        step = time.perf_counter()
+        database.init_database()
+        print(f"🗂️  Indexes rebuilt in {time.perf_counter() - step:.1f}s")
+
+        if not args.skip_reviews:
+            import manage
+
+            db_module.db.db_path = path
+            manage.schedule_reviews(argparse.Namespace(batch_users=1000, dry_run=False))
+
+    size = sum(os.path.getsize(path + suffix) for suffix in ("", "-wal") if os.path.exists(path + suffix))
+    print(f"✅ {path}: {size / 2**30:.2f} GiB in {time.perf_counter() - began:.0f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
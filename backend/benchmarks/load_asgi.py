@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+In-process load test of the API over ASGI, with latency baselines
+
+Virtual users drive the FastAPI app directly (httpx's ASGI transport, no
+network or server) in a temporary directory with a seeded library. Each
+user repeats the practice flow: fetch the daily set, fetch one of its
+exercises, submit a performance of it (notes played, scored on the server)
+and read their progress. Reports throughput and, per route, p50/p95/p99
+latency and error rate.
+
+With --baseline, the run is compared with a stored report and fails (exit
+status 1) if a route's p95 is more than --tolerance (50%) slower, throughput
+is more than --tolerance lower, or a route's error rate rises. Baselines are
+machine specific: record one with --save-baseline on the machine that
+compares against it.
+
+Usage:
+    python benchmarks/load_asgi.py [--users 32] [--seconds 10] [--exercises 5000]
+    python benchmarks/load_asgi.py --save-baseline benchmarks/baselines/load_asgi.json
+    python benchmarks/load_asgi.py --baseline benchmarks/baselines/load_asgi.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+# p95 differences below this are noise, whatever the ratio
+MIN_REGRESSION_MS = 1.0
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines", "load_asgi.json")
+
+
+class Recorder:
+    """Latencies and errors per route"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+
+    async def call(self, client, route: str, method: str, url: str, **kwargs) -> Optional[Any]:
+        began = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+            ok = response.status_code < 400
+        except Exception:
+            response, ok = None, False
+        self.latencies[route].append((time.perf_counter() - began) * 1000)
+        if not ok:
+            self.errors[route] += 1
+            return None
+        return response.json()
+
+    def report(self, elapsed: float, flows: int) -> Dict[str, Any]:
+        routes = {}
+        for route, values in sorted(self.latencies.items()):
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            routes[route] = {
+                "requests": len(values),
+                "error_rate": round(self.errors[route] / len(values), 4),
+                "p50_ms": round(float(p50), 2), "p95_ms": round(float(p95), 2), "p99_ms": round(float(p99), 2),
+            }
+        requests = sum(len(values) for values in self.latencies.values())
+        return {
+            "requests_per_second": round(requests / elapsed, 1),
+            "flows_per_second": round(flows / elapsed, 1),
+            "routes": routes,
+        }
+
+
+def played_notes(notes: List[str], rng: random.Random) -> List[str]:
+    """The exercise as a student might play it: mostly right, a slip now and then"""
+    played = list(notes)
+    for _ in range(rng.choice((0, 0, 1, 2))):
+        if played:
+            played.pop(rng.randrange(len(played)))
+    return played
+
+
+async def virtual_user(client, user_id: str, deadline: float, think: float, recorder: Recorder,
+                       rng: random.Random) -> int:
+    flows = 0
+    while time.perf_counter() < deadline:
+        daily = await recorder.call(client, "GET /exercises/daily/{user_id}", "GET",
+                                    f"/exercises/exercises/daily/{user_id}")
+        if daily and daily["exercises"]:
+            exercise_id = rng.choice(daily["exercises"])["id"]
+            exercise = await recorder.call(client, "GET /exercises/{exercise_id}", "GET",
+                                           f"/exercises/exercises/{exercise_id}")
+            if exercise:
+                await recorder.call(client, "POST /users/submit_performance", "POST",
+                                    "/users/users/submit_performance", json={
+                                        "user_id": user_id, "exercise_id": exercise_id, "score": 0,
+                                        "notes_played": played_notes(exercise["notes"] or [], rng),
+                                        "practice_time_seconds": rng.randint(20, 120),
+                                    })
+        await recorder.call(client, "GET /users/{user_id}/progress", "GET", f"/users/users/{user_id}/progress")
+        flows += 1
+        if think:
+            await asyncio.sleep(rng.expovariate(1 / think))
+    return flows
+
+
+async def drive(app, users: int, seconds: float, think: float, seed: int) -> Dict[str, Any]:
+    import httpx
+
+    recorder = Recorder()
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://load") as client:
+        # Warm up caches and code paths once before timing
+        await virtual_user(client, "warmup", time.perf_counter(), 0, Recorder(), random.Random(seed))
+        began = time.perf_counter()
+        deadline = began + seconds
+        flows = await asyncio.gather(*(
+            virtual_user(client, f"load_user_{i}", deadline, think, recorder, random.Random(seed + i))
+            for i in range(users)
+        ))
+        elapsed = time.perf_counter() - began
+    return recorder.report(elapsed, sum(flows))
+
+
+def print_report(report: Dict[str, Any]):
+    print(f"throughput: {report['requests_per_second']:.0f} requests/s, {report['flows_per_second']:.0f} flows/s")
+    print(f"{'route':<36} {'requests':>8} {'errors':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for route, stats in report["routes"].items():
+        print(f"{route:<36} {stats['requests']:>8} {stats['error_rate']:>7.1%} "
+              f"{stats['p50_ms']:>8.2f} {stats['p95_ms']:>8.2f} {stats['p99_ms']:>8.2f}")
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Regressions of `report` against `baseline`"""
+    regressions = []
+    if report["requests_per_second"] < baseline["requests_per_second"] * (1 - tolerance):
+        regressions.append(f"throughput {report['requests_per_second']:.0f} requests/s, "
+                           f"baseline {baseline['requests_per_second']:.0f}")
+    for route, expected in baseline["routes"].items():
+        stats = report["routes"].get(route)
+        if stats is None:
+            regressions.append(f"{route}: no requests")
+            continue
+        if (stats["p95_ms"] > expected["p95_ms"] * (1 + tolerance)
+                and stats["p95_ms"] - expected["p95_ms"] > MIN_REGRESSION_MS):
+            regressions.append(f"{route}: p95 {stats['p95_ms']:.2f} ms, baseline {expected['p95_ms']:.2f} ms")
+        if stats["error_rate"] > expected["error_rate"] + 0.001:
+            regressions.append(f"{route}: error rate {stats['error_rate']:.2%}, "
+                               f"baseline {expected['error_rate']:.2%}")
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=32, help="Concurrent virtual users")
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--think-ms", type=float, default=0.0, help="Mean pause between flows")
+    parser.add_argument("--exercises", type=int, default=5000, help="Exercises in the seeded library")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--baseline", nargs="?", const=DEFAULT_BASELINE, help="Fail on regressions against this report")
+    parser.add_argument("--save-baseline", nargs="?", const=DEFAULT_BASELINE, help="Store this run's report")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="Allowed relative slowdown")
+    args = parser.parse_args(argv)
+
+    config = {"users": args.users, "seconds": args.seconds, "think_ms": args.think_ms,
+              "exercises": args.exercises}
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        from analysis import midi_name
+        import db as db_module
+        import main as app_module
+
+        db_module.db.db_path = os.path.join(directory, "load.db")
+        app_module.prepare_shared_state()
+        rng = np.random.default_rng(args.seed)
+        db_module.db.save_exercises(
+            {'measures': '1-4', 'difficulty': ('easy', 'medium', 'hard')[i % 3], 'title': f'Exercise {i}',
+             'key_signature': 'C', 'time_signature': '4/4',
+             'notes': [midi_name(int(m)) for m in 60 + np.cumsum(rng.integers(-3, 4, int(rng.integers(8, 33))))],
+             'rhythm_pattern': ['quarter', 'eighth', 'eighth']}
+            for i in range(args.exercises)
+        )
+        print(f"config: {args.users} users, {args.seconds:g}s, {args.exercises} exercises, "
+              f"think {args.think_ms:g} ms")
+
+        report = asyncio.run(drive(app_module.app, args.users, args.seconds, args.think_ms / 1000, args.seed))
+        report["config"] = config
+
+    print_report(report)
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save_baseline)), exist_ok=True)
+        with open(args.save_baseline, "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+        print(f"baseline saved to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("config") != config:
+            print(f"warning: baseline was recorded with {baseline.get('config')}")
+        regressions = compare(report, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+        print(f"no regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+
+        return 0
+
+    # Without a baseline, any failed request fails the run
+    return 1 if any(stats["error_rate"] for stats in report["routes"].values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
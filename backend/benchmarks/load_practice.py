@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Load harness for live practice WebSocket sessions
+
+Opens many concurrent practice sessions against one API worker, has each
+play an exercise note by note at a steady tempo, and reports the round-trip
+latency of feedback messages and the worker's memory per session.
+
+Usage:
+    python benchmarks/load_practice.py [--sessions 1000] [--notes 16] [--tempo 120]
+    python benchmarks/load_practice.py --url ws://localhost:8000 --sessions 200
+
+Without --url a single uvicorn worker is started in a temporary directory.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+import numpy as np
+from websockets.asyncio.client import connect
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PRACTICE_PATH = "/exercises/exercises/{exercise_id}/practice"
+
+
+def rss_kb(pid: int) -> int:
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(workdir: str):
+    port = free_port()
+    env = dict(os.environ, PYTHONPATH=BACKEND_DIR, MAX_PRACTICE_SESSIONS="1000000")
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning",
+         "--ws-max-queue", "64"],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL,
+    )
+    for _ in range(100):
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1)
+            return process, f"ws://127.0.0.1:{port}"
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("API server did not start")
+
+
+async def session(url: str, notes: int, tempo: float, connected: asyncio.Event, go: asyncio.Event,
+                  ready: list, latencies: list, failures: list):
+    try:
+        async with connect(url, max_queue=64) as ws:
+            await ws.recv()  # ready
+            ready.append(1)
+            if len(ready) == ready_target[0]:
+                connected.set()
+            await go.wait()
+
+            # Spread session start times over one beat
+            beat = 60.0 / tempo
+            await asyncio.sleep(np.random.uniform(0, beat))
+            for i in range(notes):
+                sent = time.perf_counter()
+                await ws.send(json.dumps({"type": "note", "midi": 60 + (i % 8), "time": i * beat}))
+                await ws.recv()
+                latencies.append((time.perf_counter() - sent) * 1000.0)
+                await asyncio.sleep(max(beat - (time.perf_counter() - sent), 0))
+            await ws.send(json.dumps({"type": "end"}))
+            await ws.recv()
+    except Exception as e:
+        failures.append(type(e).__name__)
+        ready.append(1)
+        if len(ready) == ready_target[0]:
+            connected.set()
+
+
+ready_target = [0]
+
+
+async def run(url: str, sessions: int, notes: int, tempo: float, server_pid=None):
+    connected, go = asyncio.Event(), asyncio.Event()
+    ready, latencies, failures = [], [], []
+    ready_target[0] = sessions
+
+    base_rss = rss_kb(server_pid) if server_pid else None
+    tasks = [asyncio.create_task(session(url, notes, tempo, connected, go, ready, latencies, failures))
+             for _ in range(sessions)]
+    await connected.wait()
+    held_rss = rss_kb(server_pid) if server_pid else None
+
+    started = time.perf_counter()
+    go.set()
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+
+    values = np.array(latencies) if latencies else np.zeros(1)
+    print(f"sessions:        {sessions} ({len(failures)} failed)")
+    print(f"feedback events: {len(latencies)} in {elapsed:.1f}s ({len(latencies) / elapsed:.0f}/s)")
+    print(f"latency ms:      p50 {np.percentile(values, 50):.1f}  p95 {np.percentile(values, 95):.1f}  "
+          f"p99 {np.percentile(values, 99):.1f}  max {values.max():.1f}")
+    if base_rss is not None:
+        print(f"worker memory:   {(held_rss - base_rss) / max(sessions, 1):.1f} KB per open session")
+    if failures:
+        print(f"failures:        {sorted(set(failures))}")
+    return 0 if not failures else 1
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--url", help="Server base URL (ws://host:port); starts a local worker if omitted")
+    parser.add_argument("--sessions", type=int, default=1000)
+    parser.add_argument("--notes", type=int, default=16, help="Notes played per session")
+    parser.add_argument("--tempo", type=float, default=120.0)
+    parser.add_argument("--exercise-id", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    # Each session needs a socket on both ends when the server is local
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (min(hard, max(soft, args.sessions * 2 + 256)), hard))
+
+    path = PRACTICE_PATH.format(exercise_id=args.exercise_id) + f"?tempo={args.tempo}"
+    if args.url:
+        return asyncio.run(run(args.url + path, args.sessions, args.notes, args.tempo))
+
+    with tempfile.TemporaryDirectory() as workdir:
+        process, base_url = start_server(workdir)
+        try:
+            return asyncio.run(run(base_url + path, args.sessions, args.notes, args.tempo, process.pid))
+        finally:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,32 @@
+"""
+Shared fixtures for the backend tests
+"""
+
+import os
+import sys
+from typing import Any, Dict, Iterable
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def make_database(tmp_path, monkeypatch):
+    """Factory for a fresh database in tmp_path, seeded with generated exercise rows (as for save_exercises)"""
+    # Importing db opens sightreadpro.db in the working directory
+    monkeypatch.chdir(tmp_path)
+    from db import Database
+
+    def make(exercises: Iterable[Dict[str, Any]] = ()) -> Database:
+        database = Database(str(tmp_path / "test.db"))
+        database.save_exercises(exercises)
+        return database
+
+    return make
+
+
+@pytest.fixture
+def database(make_database):
+    """An empty database; test modules override this to seed their own rows"""
+    return make_database()
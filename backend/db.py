@@ -1,9 +1,79 @@
 import sqlite3
 import json
-from typing import List, Optional, Dict, Any
-from datetime import datetime
+import base64
+import hashlib
+import itertools
+from typing import List, Optional, Dict, Any, Tuple, Callable, Iterable, Iterator
+from datetime import datetime, date, timedelta
 import os
-from models import User, Exercise, Performance, UserProgress, UserTable, ExerciseTable, PerformanceTable
+import numpy as np
+from models import (
+    User, Exercise, Performance, PerformanceSummary, UserProgress, UploadRecord, FileType, ParseStatus,
+    UserTable, ExerciseTable, PerformanceTable
+)
+from recommend import (
+    RecentExercises, target_difficulty, difficulty_quotas, daily_seed, prefer_fresh,
+    DIFFICULTIES, RECENT_PERFORMANCES, CANDIDATE_OVERSAMPLE
+)
+from review import schedule, grade_from_score, DEFAULT_EASE, REVIEW_SHARE
+from pattern_index import exercise_postings, Window, INDEX_VERSION as PATTERN_INDEX_VERSION
+from xp import performance_xp, level_for, PERFORMANCE, ADJUSTMENT, SNAPSHOT_EVERY
+from versions import data_versions, LIBRARY
+from metrics import time_methods, DB_QUERY_SECONDS
+
+# Suffixes of in-flight files that never belong in the upload catalog
+TEMPORARY_SUFFIXES = ('.tmp', '.deleting')
+
+def file_sha256(file_path: str, chunk_size: int = 1024 * 1024) -> str:
+    """Hash a file in chunks"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def exercise_fingerprint(notes: Optional[List[str]], rhythm_pattern: Optional[List[str]],
+                         key_signature: Optional[str], time_signature: Optional[str]) -> str:
+    """Content fingerprint used to store identical exercises only once"""
+    content = json.dumps([notes or [], rhythm_pattern or [], key_signature, time_signature], separators=(',', ':'))
+    return hashlib.blake2b(content.encode('utf-8'), digest_size=16).hexdigest()
+
+# Journal mode set on startup (WAL unless the filesystem can't share memory maps)
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+
+# Exercises are written and looked up in batches of this many rows
+EXERCISE_BATCH_SIZE = 500
+# One exercise as JSON text, built by SQLite, byte-identical to FastAPI's
+# serialization of the Exercise model (created_at is stored by isoformat())
+EXERCISE_JSON_SQL = '''
+    json_object(
+        'id', id,
+        'measures', measures,
+        'difficulty', difficulty,
+        'title', title,
+        'key_signature', key_signature,
+        'time_signature', time_signature,
+        'notes', CASE WHEN notes IS NULL OR notes = '' THEN NULL ELSE json(notes) END,
+        'rhythm_pattern', CASE WHEN rhythm_pattern IS NULL OR rhythm_pattern = '' THEN NULL ELSE json(rhythm_pattern) END,
+        'xp_reward', xp_reward,
+        'created_at', replace(created_at, ' ', 'T')
+    )
+'''
+# Pattern matches are keyed as exercise_id * PATTERN_POSITION_SPAN + start note
+PATTERN_POSITION_SPAN = 1 << 20
+# Most candidate exercises a later pattern window is narrowed to (bound parameters per query)
+PATTERN_CANDIDATE_LIMIT = 10000
+# Performances turned into XP ledger events per pass when the ledger is first filled
+XP_BACKFILL_BATCH_SIZE = 50000
+
+def encode_cursor(created_at: str, row_id: int) -> str:
+    """Encode a keyset pagination cursor"""
+    return base64.urlsafe_b64encode(f"{created_at}|{row_id}".encode()).decode()
+
+def decode_cursor(cursor: str) -> Tuple[str, int]:
+    """Decode a keyset pagination cursor"""
+    created_at, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().rsplit('|', 1)
+    return created_at, int(row_id)
 
 class Database:
     def __init__(self, db_path: str = "sightreadpro.db"):
@@ -21,6 +91,12 @@ class Database:
         conn = self.get_connection()
         cursor = conn.cursor()
         
+        # Several worker processes share the file: with WAL, readers don't wait
+        # for a writer, and the schema check-and-migrate below runs under one
+        # write lock so workers starting together don't race on it
+        cursor.execute(f'PRAGMA journal_mode={SQLITE_JOURNAL_MODE}')
+        cursor.execute('BEGIN IMMEDIATE')
+        
         # Create users table
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS users (
@@ -32,6 +108,20 @@ class Database:
                 level INTEGER DEFAULT 1
             )
         ''')
+        # The XP columns are a snapshot up to this xp_events row (see xp.py)
+        self._ensure_column(cursor, 'users', 'snapshot_event_id', 'INTEGER NOT NULL DEFAULT 0')
+        
+        # Append-only XP ledger: one row per award (day is a date ordinal, NULL for adjustments)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS xp_events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id TEXT NOT NULL,
+                reason INTEGER NOT NULL,
+                performance_id INTEGER,
+                xp INTEGER NOT NULL,
+                day INTEGER
+            )
+        ''')
         
         # Create exercises table
         cursor.execute('''
@@ -49,6 +139,26 @@ class Database:
             )
         ''')
         
+        self._ensure_column(cursor, 'exercises', 'fingerprint', 'TEXT')
+        
+        # Link generated exercises to the upload and chunk they came from
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS upload_exercises (
+                upload_id INTEGER NOT NULL,
+                part INTEGER NOT NULL DEFAULT 0,
+                chunk_size INTEGER NOT NULL,
+                chunk_index INTEGER NOT NULL,
+                exercise_id INTEGER NOT NULL,
+                PRIMARY KEY (upload_id, part, chunk_size, chunk_index),
+                FOREIGN KEY (upload_id) REFERENCES uploads (id),
+                FOREIGN KEY (exercise_id) REFERENCES exercises (id)
+            )
+        ''')
+        # Measures a chunk covers (end exclusive); NULL in rows from before
+        # revisions could move chunks, which cover chunk_index * chunk_size on
+        self._ensure_column(cursor, 'upload_exercises', 'start_measure', 'INTEGER')
+        self._ensure_column(cursor, 'upload_exercises', 'end_measure', 'INTEGER')
+        
         # Create performances table
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS performances (
@@ -69,16 +179,238 @@ class Database:
             )
         ''')
         
+        # Create uploads catalog table
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS uploads (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                filename TEXT NOT NULL UNIQUE,
+                original_filename TEXT,
+                owner_id TEXT,
+                content_hash TEXT,
+                size_bytes INTEGER NOT NULL DEFAULT 0,
+                file_type TEXT NOT NULL,
+                parse_status TEXT NOT NULL DEFAULT 'pending',
+                created_at TEXT NOT NULL
+            )
+        ''')
+        self._ensure_column(cursor, 'uploads', 'parent_upload_id', 'INTEGER REFERENCES uploads (id)')
+        self._ensure_column(cursor, 'uploads', 'revision', 'INTEGER NOT NULL DEFAULT 1')
+        self._ensure_column(cursor, 'performances', 'scoring_version', 'INTEGER')
+        self._ensure_column(cursor, 'performances', 'events', 'BLOB')
+        
+        # Per-user Bloom filter of recently practiced exercises (see recommend.py)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS recent_exercises (
+                user_id TEXT PRIMARY KEY,
+                generation INTEGER NOT NULL,
+                bits BLOB NOT NULL
+            )
+        ''')
+        
+        # Spaced-repetition memory state per user and exercise (see review.py)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS review_state (
+                user_id TEXT NOT NULL,
+                exercise_id INTEGER NOT NULL,
+                ease REAL NOT NULL,
+                interval_days REAL NOT NULL,
+                repetitions INTEGER NOT NULL,
+                lapses INTEGER NOT NULL DEFAULT 0,
+                last_reviewed_at TEXT NOT NULL,
+                due_at TEXT NOT NULL,
+                PRIMARY KEY (user_id, exercise_id)
+            )
+        ''')
+        
+        # Daily exercise sets, chosen once per user and day
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS daily_sets (
+                user_id TEXT NOT NULL,
+                date TEXT NOT NULL,
+                difficulty TEXT NOT NULL DEFAULT '',
+                exercise_ids TEXT NOT NULL,
+                PRIMARY KEY (user_id, date, difficulty)
+            )
+        ''')
+        self._ensure_column(cursor, 'daily_sets', 'review_count', 'INTEGER NOT NULL DEFAULT 0')
+        # The limit the set was chosen for; a shorter set is all the library had
+        self._ensure_column(cursor, 'daily_sets', 'set_limit', 'INTEGER NOT NULL DEFAULT 0')
+        
+        # Inverted index of melodic interval trigrams (see pattern_index.py)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS pattern_postings (
+                gram INTEGER NOT NULL,
+                exercise_id INTEGER NOT NULL,
+                position INTEGER NOT NULL,
+                rhythm INTEGER NOT NULL,
+                measure INTEGER NOT NULL,
+                PRIMARY KEY (gram, exercise_id, position)
+            ) WITHOUT ROWID
+        ''')
+        self._ensure_column(cursor, 'exercises', 'pattern_index_version', 'INTEGER')
+        
         # Create indexes for better performance
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_performances_user_id ON performances (user_id)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_performances_exercise_id ON performances (exercise_id)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_performances_submitted_at ON performances (submitted_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_performances_user_submitted ON performances (user_id, submitted_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_exercises_difficulty ON exercises (difficulty, id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_review_state_due ON review_state (user_id, due_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_xp_events_user ON xp_events (user_id, id)')
+        
+        # Keyset pagination indexes for the uploads catalog (newest first)
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_uploads_created ON uploads (created_at, id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_uploads_owner_created ON uploads (owner_id, created_at, id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_uploads_content_hash ON uploads (content_hash)')
+        
+        # Deduplicate exercises by content
+        cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_exercises_fingerprint ON exercises (fingerprint)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_upload_exercises_exercise_id ON upload_exercises (exercise_id)')
         
         conn.commit()
         conn.close()
         
         # Insert sample data if tables are empty
         self.insert_sample_data()
+        self.backfill_exercise_fingerprints()
+        self.backfill_pattern_index()
+        self.backfill_xp_ledger()
+    
+    def _ensure_column(self, cursor: sqlite3.Cursor, table: str, column: str, definition: str):
+        """Add a column to an existing table if it is missing"""
+        cursor.execute(f'PRAGMA table_info({table})')
+        if column not in [row['name'] for row in cursor.fetchall()]:
+            cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+    
+    def backfill_exercise_fingerprints(self):
+        """Fingerprint exercises stored before deduplication existed"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            SELECT id, notes, rhythm_pattern, key_signature, time_signature
+            FROM exercises WHERE fingerprint IS NULL
+        ''')
+        updates = [
+            (
+                exercise_fingerprint(
+                    json.loads(row['notes']) if row['notes'] else None,
+                    json.loads(row['rhythm_pattern']) if row['rhythm_pattern'] else None,
+                    row['key_signature'],
+                    row['time_signature']
+                ),
+                row['id']
+            )
+            for row in cursor.fetchall()
+        ]
+        
+        # Existing duplicates keep a NULL fingerprint rather than failing the unique index
+        cursor.executemany('UPDATE OR IGNORE exercises SET fingerprint = ? WHERE id = ?', updates)
+        conn.commit()
+        conn.close()
+    
+    def _index_patterns(self, cursor: sqlite3.Cursor, exercises: Iterable[Tuple[int, Dict[str, Any]]]):
+        """Write the pattern postings of (exercise_id, exercise dict) pairs"""
+        cursor.executemany('''
+            INSERT OR IGNORE INTO pattern_postings (gram, rhythm, position, measure, exercise_id)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (
+            posting + (exercise_id,)
+            for exercise_id, ex in exercises
+            for posting in exercise_postings(ex.get('notes'), ex.get('rhythm_pattern'),
+                                             ex.get('time_signature'), ex.get('measures'))
+        ))
+    
+    def backfill_pattern_index(self, rebuild: bool = False) -> int:
+        """Index the melodies of exercises not yet in the pattern index; returns how many"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        if rebuild:
+            cursor.execute('DELETE FROM pattern_postings')
+            cursor.execute('UPDATE exercises SET pattern_index_version = NULL')
+        
+        indexed = 0
+        after_id = 0
+        while True:
+            cursor.execute('''
+                SELECT id, measures, time_signature, notes, rhythm_pattern FROM exercises
+                WHERE id > ? AND pattern_index_version IS NOT ? ORDER BY id LIMIT ?
+            ''', (after_id, PATTERN_INDEX_VERSION, EXERCISE_BATCH_SIZE))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            after_id = rows[-1]['id']
+            ids = [row['id'] for row in rows]
+            placeholders = ','.join('?' * len(ids))
+            cursor.execute(f'DELETE FROM pattern_postings WHERE exercise_id IN ({placeholders})', ids)
+            self._index_patterns(cursor, (
+                (row['id'], {
+                    'notes': json.loads(row['notes']) if row['notes'] else None,
+                    'rhythm_pattern': json.loads(row['rhythm_pattern']) if row['rhythm_pattern'] else None,
+                    'time_signature': row['time_signature'],
+                    'measures': row['measures'],
+                })
+                for row in rows
+            ))
+            cursor.execute(f'UPDATE exercises SET pattern_index_version = ? WHERE id IN ({placeholders})',
+                           [PATTERN_INDEX_VERSION] + ids)
+            indexed += len(rows)
+        
+        conn.commit()
+        conn.close()
+        return indexed
+    
+    def backfill_xp_ledger(self) -> int:
+        """
+        Start the XP ledger from the performance history; returns how many events were added
+        
+        Runs once, on a database from before the ledger: every performance
+        becomes an award of what the current formula gives it, and users'
+        XP columns become their snapshot up to the last of those, so nothing
+        is counted twice.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT EXISTS (SELECT 1 FROM xp_events), EXISTS (SELECT 1 FROM performances)')
+        started, history = cursor.fetchone()
+        if started or not history:
+            conn.close()
+            return 0
+        
+        # Workers starting together: the first one fills the ledger, the others find it filled
+        cursor.execute('BEGIN IMMEDIATE')
+        cursor.execute('SELECT EXISTS (SELECT 1 FROM xp_events)')
+        if cursor.fetchone()[0]:
+            conn.rollback()
+            conn.close()
+            return 0
+        
+        added = 0
+        after_id = 0
+        while True:
+            cursor.execute('''
+                SELECT id, user_id, score, submitted_at FROM performances WHERE id > ? ORDER BY id LIMIT ?
+            ''', (after_id, XP_BACKFILL_BATCH_SIZE))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            after_id = rows[-1]['id']
+            earned = performance_xp(np.array([row['score'] for row in rows], dtype=np.int64)).tolist()
+            cursor.executemany('''
+                INSERT INTO xp_events (user_id, reason, performance_id, xp, day) VALUES (?, ?, ?, ?, ?)
+            ''', (
+                (row['user_id'], PERFORMANCE, row['id'], xp_earned,
+                 date.fromisoformat(row['submitted_at'][:10]).toordinal() if row['submitted_at'] else None)
+                for row, xp_earned in zip(rows, earned)
+            ))
+            added += len(rows)
+        cursor.execute('UPDATE users SET snapshot_event_id = (SELECT MAX(id) FROM xp_events)')
+        
+        conn.commit()
+        conn.close()
+        return added
     
     def insert_sample_data(self):
         """Insert sample exercises for testing"""
@@ -141,6 +473,7 @@ class Database:
                 ))
             
             conn.commit()
+            data_versions.bump(LIBRARY)
         
         conn.close()
     
@@ -152,9 +485,10 @@ class Database:
         current_date = datetime.now().strftime('%Y-%m-%d')
         created_at = datetime.now().isoformat()
         
+        # The new user's snapshot starts at the end of the ledger, so it begins at zero XP
         cursor.execute('''
-            INSERT OR REPLACE INTO users (user_id, xp, streak, last_active_date, created_at, level)
-            VALUES (?, ?, ?, ?, ?, ?)
+            INSERT OR REPLACE INTO users (user_id, xp, streak, last_active_date, created_at, level, snapshot_event_id)
+            VALUES (?, ?, ?, ?, ?, ?, (SELECT COALESCE(MAX(id), 0) FROM xp_events))
         ''', (user_id, 0, 0, current_date, created_at, 1))
         
         conn.commit()
@@ -170,138 +504,714 @@ class Database:
         )
     
     def get_user(self, user_id: str) -> Optional[User]:
-        """Get user by ID"""
+        """Get user by ID (with XP, level and streak from the ledger)"""
         conn = self.get_connection()
         cursor = conn.cursor()
         
-        cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
-        row = cursor.fetchone()
+        found = self._ledger_user(cursor, user_id)
         
         conn.close()
         
-        if row:
-            return User(
-                user_id=row['user_id'],
-                xp=row['xp'],
-                streak=row['streak'],
-                last_active_date=row['last_active_date'],
-                created_at=datetime.fromisoformat(row['created_at']),
-                level=row['level']
-            )
-        return None
+        return found[0] if found else None
     
-    def update_user_progress(self, user_id: str, xp_earned: int, streak_updated: bool) -> User:
-        """Update user XP and streak"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+    def _ledger_user(self, cursor: sqlite3.Cursor, user_id: str) -> Optional[Tuple[User, int, int]]:
+        """
+        A user's snapshot plus their XP events after it (see xp.py)
         
-        # Get current user data
+        Returns (user with current totals, events after the snapshot, ID of
+        the user's last event), or None for an unknown user. The streak
+        grows by one for each active day after the snapshot's last one.
+        """
         cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
         row = cursor.fetchone()
-        
         if not row:
+            return None
+        
+        last_active = date.fromisoformat(row['last_active_date']).toordinal() if row['last_active_date'] else 0
+        cursor.execute('''
+            SELECT COUNT(*) AS events, MAX(id) AS last_id, COALESCE(SUM(xp), 0) AS xp, MAX(day) AS last_day,
+                   COUNT(DISTINCT CASE WHEN day > ? THEN day END) AS new_days
+            FROM xp_events
+            WHERE user_id = ? AND id > ?
+        ''', (last_active, user_id, row['snapshot_event_id']))
+        pending = cursor.fetchone()
+        
+        total_xp = row['xp'] + pending['xp']
+        last_active_date = row['last_active_date']
+        if pending['last_day'] and pending['last_day'] > last_active:
+            last_active_date = date.fromordinal(pending['last_day']).isoformat()
+        
+        user = User(
+            user_id=row['user_id'],
+            xp=total_xp,
+            streak=row['streak'] + pending['new_days'],
+            last_active_date=last_active_date,
+            created_at=datetime.fromisoformat(row['created_at']),
+            level=level_for(total_xp)
+        )
+        return user, pending['events'], pending['last_id'] or row['snapshot_event_id']
+    
+    def _save_xp_snapshot(self, cursor: sqlite3.Cursor, user: User, last_event_id: int):
+        """Make a user's current totals their snapshot up to `last_event_id` (in the caller's transaction)"""
+        cursor.execute('''
+            UPDATE users
+            SET xp = ?, streak = ?, last_active_date = ?, level = ?, snapshot_event_id = ?
+            WHERE user_id = ?
+        ''', (user.xp, user.streak, user.last_active_date, user.level, last_event_id, user.user_id))
+    
+    def update_user_progress(self, user_id: str, xp_earned: int, performance_id: Optional[int] = None,
+                             reason: int = PERFORMANCE) -> User:
+        """Award XP: append it to the XP ledger and return the user's new totals"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT 1 FROM users WHERE user_id = ?', (user_id,))
+        if not cursor.fetchone():
             # Create user if doesn't exist
             self.create_user(user_id)
-            cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
-            row = cursor.fetchone()
         
-        current_xp = row['xp'] + xp_earned
-        current_streak = row['streak']
-        current_date = datetime.now().strftime('%Y-%m-%d')
+        try:
+            cursor.execute('''
+                INSERT INTO xp_events (user_id, reason, performance_id, xp, day) VALUES (?, ?, ?, ?, ?)
+            ''', (user_id, reason, performance_id, xp_earned, date.today().toordinal()))
+            user, pending, last_event_id = self._ledger_user(cursor, user_id)
+            # The user's row is written once every SNAPSHOT_EVERY awards, not on each one
+            if pending >= SNAPSHOT_EVERY:
+                self._save_xp_snapshot(cursor, user, last_event_id)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
         
-        # Update streak if it's a new day
-        if streak_updated and row['last_active_date'] != current_date:
-            current_streak += 1
+        return user
+    
+    def snapshot_xp(self, batch_users: int = 1000) -> int:
+        """Move every user's XP snapshot up to their latest ledger event; returns how many moved"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
         
-        # Calculate new level (every 100 XP = 1 level)
-        new_level = (current_xp // 100) + 1
+        moved = 0
+        after_user_id = ''
+        while True:
+            cursor.execute('''
+                SELECT user_id FROM users
+                WHERE user_id > ? AND EXISTS (
+                    SELECT 1 FROM xp_events WHERE xp_events.user_id = users.user_id AND xp_events.id > users.snapshot_event_id
+                )
+                ORDER BY user_id LIMIT ?
+            ''', (after_user_id, batch_users))
+            user_ids = [row['user_id'] for row in cursor.fetchall()]
+            if not user_ids:
+                break
+            after_user_id = user_ids[-1]
+            
+            # Totals are read and saved under the write lock, so no award falls between
+            cursor.execute('BEGIN IMMEDIATE')
+            for user_id in user_ids:
+                user, pending, last_event_id = self._ledger_user(cursor, user_id)
+                if pending:
+                    self._save_xp_snapshot(cursor, user, last_event_id)
+                    moved += 1
+            conn.commit()
         
-        # Update user
-        cursor.execute('''
-            UPDATE users 
-            SET xp = ?, streak = ?, last_active_date = ?, level = ?
-            WHERE user_id = ?
-        ''', (current_xp, current_streak, current_date, new_level, user_id))
+        conn.close()
+        return moved
+    
+    def iter_xp_events(self, batch_size: int = 50000) -> Iterator[List[Tuple[str, int, int, Optional[int]]]]:
+        """
+        Yield the XP ledger in order, in batches of (user_id, reason, xp, score of the source performance)
         
+        Batches are read by id keyset, one connection per batch; the score
+        is None for events without a performance (or whose performance is gone).
+        """
+        last_id = 0
+        while True:
+            conn = self.get_connection()
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT x.id, x.user_id, x.reason, x.xp, p.score
+                FROM xp_events x
+                LEFT JOIN performances p ON p.id = x.performance_id
+                WHERE x.id > ?
+                ORDER BY x.id LIMIT ?
+            ''', (last_id, batch_size))
+            rows = cursor.fetchall()
+            conn.close()
+            
+            if not rows:
+                return
+            last_id = rows[-1]['id']
+            yield [(row['user_id'], row['reason'], row['xp'], row['score']) for row in rows]
+    
+    def append_xp_adjustments(self, adjustments: List[Tuple[str, int]]) -> int:
+        """Append an adjustment event for each (user_id, xp) in one transaction"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.executemany('INSERT INTO xp_events (user_id, reason, xp) VALUES (?, ?, ?)',
+                           ((user_id, ADJUSTMENT, xp_change) for user_id, xp_change in adjustments))
         conn.commit()
         conn.close()
-        
-        return User(
-            user_id=user_id,
-            xp=current_xp,
-            streak=current_streak,
-            last_active_date=current_date,
-            created_at=datetime.fromisoformat(row['created_at']),
-            level=new_level
-        )
+        for user_id, _ in adjustments:
+            data_versions.bump_user(user_id)
+        return len(adjustments)
     
     def get_exercises(self, limit: int = 10, difficulty: Optional[str] = None) -> List[Exercise]:
         """Get exercises with optional filtering"""
         conn = self.get_connection()
         cursor = conn.cursor()
         
-        query = 'SELECT * FROM exercises'
-        params = []
+        cursor.execute(*self._random_exercises_query('exercises.*', limit, difficulty))
+        rows = cursor.fetchall()
         
-        if difficulty:
-            query += ' WHERE difficulty = ?'
-            params.append(difficulty)
+        conn.close()
         
-        query += ' ORDER BY RANDOM() LIMIT ?'
-        params.append(limit)
+        return [self._row_to_exercise(row) for row in rows]
+    
+    def _random_exercises_query(self, columns: str, limit: int, difficulty: Optional[str]) -> Tuple[str, List[Any]]:
+        """
+        Query for `columns` of up to `limit` random exercises
         
-        cursor.execute(query, params)
-        rows = cursor.fetchall()
+        IDs are drawn first (from the difficulty index when filtering), so
+        only the chosen rows are read, decoded or serialized.
+        """
+        where = ' WHERE difficulty = ?' if difficulty else ''
+        params = [difficulty] if difficulty else []
+        return f'''
+            SELECT {columns} FROM (
+                SELECT id AS pick FROM exercises{where} ORDER BY RANDOM() LIMIT ?
+            ) JOIN exercises ON exercises.id = pick
+        ''', params + [limit]
+    
+    def get_exercises_json(self, limit: int = 10, difficulty: Optional[str] = None) -> List[str]:
+        """get_exercises, but each exercise comes back as serialized JSON text"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.row_factory = None
+        
+        cursor.execute(*self._random_exercises_query(EXERCISE_JSON_SQL, limit, difficulty))
+        objects = [row[0] for row in cursor.fetchall()]
         
         conn.close()
         
-        exercises = []
-        for row in rows:
-            exercise = Exercise(
-                id=row['id'],
-                measures=row['measures'],
-                difficulty=row['difficulty'],
-                title=row['title'],
-                key_signature=row['key_signature'],
-                time_signature=row['time_signature'],
-                notes=json.loads(row['notes']) if row['notes'] else None,
-                rhythm_pattern=json.loads(row['rhythm_pattern']) if row['rhythm_pattern'] else None,
-                xp_reward=row['xp_reward'],
-                created_at=datetime.fromisoformat(row['created_at'])
-            )
-            exercises.append(exercise)
+        return objects
+    
+    def _row_to_exercise(self, row: sqlite3.Row) -> Exercise:
+        return Exercise(
+            id=row['id'],
+            measures=row['measures'],
+            difficulty=row['difficulty'],
+            title=row['title'],
+            key_signature=row['key_signature'],
+            time_signature=row['time_signature'],
+            notes=json.loads(row['notes']) if row['notes'] else None,
+            rhythm_pattern=json.loads(row['rhythm_pattern']) if row['rhythm_pattern'] else None,
+            xp_reward=row['xp_reward'],
+            created_at=datetime.fromisoformat(row['created_at'])
+        )
+    
+    def get_max_exercise_id(self) -> int:
+        """Largest exercise ID (0 if there are none)"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT MAX(id) FROM exercises')
+        max_id = cursor.fetchone()[0]
+        conn.close()
+        return max_id or 0
+
+    def iter_exercises_after(self, after_id: int, batch_size: int = 5000) -> Iterator[List[Exercise]]:
+        """Yield batches of exercises with IDs above `after_id`, in ID order"""
+        while True:
+            conn = self.get_connection()
+            cursor = conn.cursor()
+            cursor.execute('SELECT * FROM exercises WHERE id > ? ORDER BY id LIMIT ?', (after_id, batch_size))
+            rows = cursor.fetchall()
+            conn.close()
+            if not rows:
+                return
+            after_id = rows[-1]['id']
+            yield [self._row_to_exercise(row) for row in rows]
+
+    def search_patterns(self, windows: List[Window], limit: int = 20) -> Tuple[List[Tuple[int, List[int], List[int]]], int]:
+        """
+        Exercises containing a melodic pattern, most matches first
+        
+        `windows` come from pattern_index.query_windows. Their posting lists
+        are intersected on (exercise, start note), rarest first; once few
+        exercises remain, the remaining lists are only probed for those.
+        Returns (exercise_id, start notes, start measures) per exercise and the
+        number of matching exercises.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        # Plain tuples: postings go straight into numpy
+        cursor.row_factory = None
+        
+        conditions = []
+        for window in windows:
+            if all(low == high for low, high in window.gram_ranges):
+                clause = f'gram IN ({",".join("?" * len(window.gram_ranges))})'
+                params = [low for low, _ in window.gram_ranges]
+            else:
+                clause = ' OR '.join('gram BETWEEN ? AND ?' for _ in window.gram_ranges)
+                params = [code for gram_range in window.gram_ranges for code in gram_range]
+            if window.rhythm_range is not None:
+                clause = f'({clause}) AND rhythm BETWEEN ? AND ?'
+                params += list(window.rhythm_range)
+            cursor.execute(f'SELECT COUNT(*) FROM pattern_postings WHERE {clause}', params)
+            conditions.append((cursor.fetchone()[0], window.offset, len(window.gram_ranges), clause, params))
+        conditions.sort(key=lambda condition: condition[0])
+        
+        keys = None
+        first_keys = first_measures = None
+        for postings, offset, ranges, clause, params in conditions:
+            if postings == 0:
+                keys = np.zeros(0, dtype=np.int64)
+                break
+            if keys is not None:
+                candidates = np.unique(keys // PATTERN_POSITION_SPAN).tolist()
+                # Probing each candidate per code beats reading the list only when they are fewer
+                if len(candidates) <= PATTERN_CANDIDATE_LIMIT and len(candidates) * ranges < postings:
+                    clause = f'({clause}) AND exercise_id IN ({",".join("?" * len(candidates))})'
+                    params = params + candidates
+            cursor.execute(f'SELECT exercise_id, position, measure FROM pattern_postings WHERE {clause}', params)
+            rows = np.array(cursor.fetchall(), dtype=np.int64).reshape(-1, 3)
+            rows = rows[rows[:, 1] >= offset]
+            window_keys = rows[:, 0] * PATTERN_POSITION_SPAN + rows[:, 1] - offset
+            if offset == 0:
+                order = np.argsort(window_keys)
+                first_keys, first_measures = window_keys[order], rows[order, 2]
+            keys = window_keys if keys is None else np.intersect1d(keys, window_keys)
+            if len(keys) == 0:
+                break
         
-        return exercises
+        conn.close()
+        
+        keys = np.unique(keys)
+        if len(keys) == 0:
+            return [], 0
+        measures = first_measures[np.searchsorted(first_keys, keys)]
+        exercise_ids, starts, counts = np.unique(keys // PATTERN_POSITION_SPAN, return_index=True, return_counts=True)
+        ranked = np.lexsort((exercise_ids, -counts))[:limit]
+        return [
+            (int(exercise_ids[i]),
+             (keys[starts[i]:starts[i] + counts[i]] % PATTERN_POSITION_SPAN).tolist(),
+             measures[starts[i]:starts[i] + counts[i]].tolist())
+            for i in ranked.tolist()
+        ], len(exercise_ids)
     
-    def save_performance(self, performance: Performance) -> int:
-        """Save performance record and return performance ID"""
+    def get_exercise(self, exercise_id: int) -> Optional[Exercise]:
+        """Get exercise by ID"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT * FROM exercises WHERE id = ?', (exercise_id,))
+        row = cursor.fetchone()
+        
+        conn.close()
+        
+        return self._row_to_exercise(row) if row else None
+    
+    def get_exercises_by_ids(self, exercise_ids: List[int]) -> List[Exercise]:
+        """Get exercises by ID, in the order given (unknown IDs are skipped)"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        rows_by_id = {}
+        for i in range(0, len(exercise_ids), EXERCISE_BATCH_SIZE):
+            batch = exercise_ids[i:i + EXERCISE_BATCH_SIZE]
+            placeholders = ','.join('?' * len(batch))
+            cursor.execute(f'SELECT * FROM exercises WHERE id IN ({placeholders})', batch)
+            rows_by_id.update((row['id'], row) for row in cursor.fetchall())
+        
+        conn.close()
+        
+        return [self._row_to_exercise(rows_by_id[i]) for i in exercise_ids if i in rows_by_id]
+    
+    def save_exercises(self, exercises: Iterable[Dict[str, Any]],
+                       links: Optional[List[Tuple[int, int, int, int, int, int, int]]] = None) -> Tuple[List[int], int]:
+        """
+        Store generated exercises in a single transaction
+        
+        Exercises are deduplicated by content fingerprint, so repeated sections
+        and re-uploads map to the existing row. Rows carrying `upload_id` and
+        `chunk_index` (plus optional `chunk_size`, `part`, `start_measure` and
+        `end_measure`) are linked to their source upload. Input is consumed in
+        batches, so it can be a generator of any length. `links` are extra
+        (upload_id, part, chunk_size, chunk_index, exercise_id, start_measure,
+        end_measure) rows written in the same transaction.
+        
+        Returns the exercise ID of every input row, in order, and how many
+        new exercises were inserted.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        exercise_ids = []
+        inserted = 0
+        created_at = datetime.now().isoformat()
+        iterator = iter(exercises)
+        
+        try:
+            while True:
+                batch = list(itertools.islice(iterator, EXERCISE_BATCH_SIZE))
+                if not batch:
+                    break
+                
+                fingerprints = [
+                    exercise_fingerprint(ex.get('notes'), ex.get('rhythm_pattern'),
+                                         ex.get('key_signature'), ex.get('time_signature'))
+                    for ex in batch
+                ]
+                
+                cursor.execute('SELECT MAX(id) FROM exercises')
+                previous_max_id = cursor.fetchone()[0] or 0
+                
+                cursor.executemany('''
+                    INSERT OR IGNORE INTO exercises (
+                        measures, difficulty, title, key_signature, time_signature,
+                        notes, rhythm_pattern, xp_reward, created_at, fingerprint, pattern_index_version
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', [
+                    (
+                        ex['measures'],
+                        ex['difficulty'],
+                        ex.get('title'),
+                        ex.get('key_signature'),
+                        ex.get('time_signature'),
+                        json.dumps(ex['notes']) if ex.get('notes') else None,
+                        json.dumps(ex['rhythm_pattern']) if ex.get('rhythm_pattern') else None,
+                        ex.get('xp_reward', 10),
+                        created_at,
+                        fingerprint,
+                        PATTERN_INDEX_VERSION
+                    )
+                    for ex, fingerprint in zip(batch, fingerprints)
+                ])
+                inserted += cursor.rowcount
+                
+                unique = list(set(fingerprints))
+                placeholders = ','.join('?' * len(unique))
+                cursor.execute(f'SELECT id, fingerprint FROM exercises WHERE fingerprint IN ({placeholders})', unique)
+                ids_by_fingerprint = {row['fingerprint']: row['id'] for row in cursor.fetchall()}
+                batch_ids = [ids_by_fingerprint[fingerprint] for fingerprint in fingerprints]
+                
+                # IDs only grow, so the new rows are the ones above the previous maximum
+                new_exercises = {exercise_id: ex for ex, exercise_id in zip(batch, batch_ids) if exercise_id > previous_max_id}
+                self._index_patterns(cursor, new_exercises.items())
+                
+                cursor.executemany('''
+                    INSERT OR REPLACE INTO upload_exercises (
+                        upload_id, part, chunk_size, chunk_index, exercise_id, start_measure, end_measure
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', [
+                    (ex['upload_id'], ex.get('part', 0), ex.get('chunk_size', 4), ex['chunk_index'], exercise_id,
+                     ex.get('start_measure'), ex.get('end_measure'))
+                    for ex, exercise_id in zip(batch, batch_ids)
+                    if ex.get('upload_id') is not None and ex.get('chunk_index') is not None
+                ])
+                
+                exercise_ids.extend(batch_ids)
+            
+            if links:
+                cursor.executemany('''
+                    INSERT OR REPLACE INTO upload_exercises (
+                        upload_id, part, chunk_size, chunk_index, exercise_id, start_measure, end_measure
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', links)
+            
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        
+        if inserted:
+            data_versions.bump(LIBRARY)
+        return exercise_ids, inserted
+    
+    def get_upload_exercise_links(self, upload_id: int) -> List[Tuple[int, int, int, int, int, Optional[int]]]:
+        """
+        (part, chunk_size, chunk_index, exercise_id, start_measure, end_measure) for every exercise linked to an upload
+        
+        end_measure is None for chunks stored before revisions could move
+        them; those end at the chunk size or the end of the score.
+        """
         conn = self.get_connection()
         cursor = conn.cursor()
         
         cursor.execute('''
-            INSERT INTO performances (
-                user_id, exercise_id, score, accuracy, rhythm_score, tempo_score,
-                practice_time_seconds, mistakes_count, notes_played, performance_data, submitted_at
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            SELECT part, chunk_size, chunk_index, exercise_id,
+                   COALESCE(start_measure, chunk_index * chunk_size), end_measure
+            FROM upload_exercises
+            WHERE upload_id = ? ORDER BY part, chunk_size, chunk_index
+        ''', (upload_id,))
+        links = [tuple(row) for row in cursor.fetchall()]
+        
+        conn.close()
+        
+        return links
+    
+    def save_performance(self, performance: Performance, events: Optional[bytes] = None) -> int:
+        """Save performance record (and its encoded note events) and return performance ID"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute('''
+                INSERT INTO performances (
+                    user_id, exercise_id, score, accuracy, rhythm_score, tempo_score,
+                    practice_time_seconds, mistakes_count, notes_played, performance_data,
+                    scoring_version, events, submitted_at
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                performance.user_id,
+                performance.exercise_id,
+                performance.score,
+                performance.accuracy,
+                performance.rhythm_score,
+                performance.tempo_score,
+                performance.practice_time_seconds,
+                performance.mistakes_count,
+                json.dumps(performance.notes_played) if performance.notes_played else None,
+                json.dumps(performance.performance_data) if performance.performance_data else None,
+                performance.scoring_version,
+                events,
+                performance.submitted_at.isoformat()
+            ))
+        
+            performance_id = cursor.lastrowid
+            self._remember_exercise(cursor, performance.user_id, performance.exercise_id)
+            self._review_exercise(cursor, performance)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        data_versions.bump_user(performance.user_id)
+        
+        return performance_id
+    
+    def _remember_exercise(self, cursor: sqlite3.Cursor, user_id: str, exercise_id: int):
+        """Add an exercise to the user's recent-history filter (in the caller's transaction)"""
+        cursor.execute('SELECT generation, bits FROM recent_exercises WHERE user_id = ?', (user_id,))
+        row = cursor.fetchone()
+        recent = RecentExercises.load(row['generation'] if row else None, row['bits'] if row else None, date.today())
+        recent.add(exercise_id)
+        cursor.execute('''
+            INSERT INTO recent_exercises (user_id, generation, bits) VALUES (?, ?, ?)
+            ON CONFLICT (user_id) DO UPDATE SET generation = excluded.generation, bits = excluded.bits
+        ''', (user_id, recent.generation, recent.to_blob()))
+
+    def _review_exercise(self, cursor: sqlite3.Cursor, performance: Performance):
+        """Apply a performance to its exercise's review schedule (in the caller's transaction)"""
+        cursor.execute('''
+            SELECT ease, interval_days, repetitions, lapses FROM review_state
+            WHERE user_id = ? AND exercise_id = ?
+        ''', (performance.user_id, performance.exercise_id))
+        row = cursor.fetchone()
+        ease, interval_days, repetitions, lapsed = schedule(
+            row['ease'] if row else DEFAULT_EASE,
+            row['interval_days'] if row else 0.0,
+            row['repetitions'] if row else 0,
+            grade_from_score(performance.score)
+        )
+        reviewed_at = performance.submitted_at.replace(microsecond=0)
+        due_at = reviewed_at + timedelta(days=float(interval_days))
+        cursor.execute('''
+            INSERT OR REPLACE INTO review_state (
+                user_id, exercise_id, ease, interval_days, repetitions, lapses, last_reviewed_at, due_at
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
         ''', (
-            performance.user_id,
-            performance.exercise_id,
-            performance.score,
-            performance.accuracy,
-            performance.rhythm_score,
-            performance.tempo_score,
-            performance.practice_time_seconds,
-            performance.mistakes_count,
-            json.dumps(performance.notes_played) if performance.notes_played else None,
-            json.dumps(performance.performance_data) if performance.performance_data else None,
-            performance.submitted_at.isoformat()
+            performance.user_id, performance.exercise_id, float(ease), float(interval_days), int(repetitions),
+            (row['lapses'] if row else 0) + int(lapsed), reviewed_at.isoformat(), due_at.isoformat()
         ))
-        
-        performance_id = cursor.lastrowid
+
+    def _due_review_ids(self, cursor: sqlite3.Cursor, user_id: str, limit: int,
+                        difficulty: Optional[str] = None, now: Optional[datetime] = None) -> List[int]:
+        """IDs of exercises due for review, most overdue first (a range scan of (user_id, due_at))"""
+        now = (now or datetime.now()).replace(microsecond=0).isoformat()
+        if difficulty:
+            cursor.execute('''
+                SELECT r.exercise_id FROM review_state r
+                JOIN exercises e ON e.id = r.exercise_id
+                WHERE r.user_id = ? AND r.due_at <= ? AND e.difficulty = ?
+                ORDER BY r.due_at
+                LIMIT ?
+            ''', (user_id, now, difficulty, limit))
+        else:
+            cursor.execute('''
+                SELECT exercise_id FROM review_state
+                WHERE user_id = ? AND due_at <= ?
+                ORDER BY due_at
+                LIMIT ?
+            ''', (user_id, now, limit))
+        return [row['exercise_id'] for row in cursor.fetchall()]
+
+    def get_due_reviews(self, user_id: str, limit: int = 20) -> Tuple[List[Exercise], int]:
+        """Get exercises due for review (most overdue first) and how many are due in total"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        exercise_ids = self._due_review_ids(cursor, user_id, limit)
+        cursor.execute('SELECT COUNT(*) FROM review_state WHERE user_id = ? AND due_at <= ?',
+                       (user_id, datetime.now().replace(microsecond=0).isoformat()))
+        total_due = cursor.fetchone()[0]
+        conn.close()
+        return self.get_exercises_by_ids(exercise_ids), total_due
+
+    def iter_review_histories(self, batch_users: int = 1000) -> Iterator[Tuple[List[str], List[sqlite3.Row]]]:
+        """
+        Yield (user_ids, performances) for batches of users, oldest first per exercise
+
+        Users are read by keyset on the user_id index, one connection per batch.
+        """
+        last_user = ''
+        while True:
+            conn = self.get_connection()
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT DISTINCT user_id FROM performances WHERE user_id > ? ORDER BY user_id LIMIT ?
+            ''', (last_user, batch_users))
+            user_ids = [row['user_id'] for row in cursor.fetchall()]
+            if not user_ids:
+                conn.close()
+                return
+            cursor.execute('''
+                SELECT user_id, exercise_id, score, submitted_at FROM performances
+                WHERE user_id BETWEEN ? AND ?
+                ORDER BY user_id, exercise_id, submitted_at, id
+            ''', (user_ids[0], user_ids[-1]))
+            rows = cursor.fetchall()
+            conn.close()
+            last_user = user_ids[-1]
+            yield user_ids, rows
+
+    def replace_review_state(self, user_ids: List[str], states: List[Tuple]) -> int:
+        """Replace the review state of these users in one transaction"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.executemany('DELETE FROM review_state WHERE user_id = ?', [(user_id,) for user_id in user_ids])
+        cursor.executemany('''
+            INSERT INTO review_state (
+                user_id, exercise_id, ease, interval_days, repetitions, lapses, last_reviewed_at, due_at
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', states)
         conn.commit()
         conn.close()
+        return len(states)
+
+    def get_struggled_exercise_ids(self, user_id: str, below_score: int = 60, limit: int = 10) -> List[int]:
+        """Exercises of the user's most recent performances scoring below `below_score`"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT DISTINCT exercise_id FROM (
+                SELECT exercise_id FROM performances
+                WHERE user_id = ? AND score < ?
+                ORDER BY submitted_at DESC
+                LIMIT ?
+            )
+        ''', (user_id, below_score, limit))
+        exercise_ids = [row['exercise_id'] for row in cursor.fetchall()]
+        conn.close()
+        return exercise_ids
+
+    def list_user_performances(self, user_id: str, limit: int = 20,
+                               offset: int = 0) -> Tuple[List[PerformanceSummary], int]:
+        """
+        List a user's performances newest first, with the total count
+
+        Columns are named explicitly so listings never read the events blob;
+        `has_events` is answered from the column's NULL-ness alone.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            SELECT id, exercise_id, score, accuracy, rhythm_score, tempo_score, mistakes_count,
+                   practice_time_seconds, scoring_version, events IS NOT NULL AS has_events, submitted_at
+            FROM performances
+            WHERE user_id = ?
+            ORDER BY submitted_at DESC, id DESC
+            LIMIT ? OFFSET ?
+        ''', (user_id, limit, offset))
+        rows = cursor.fetchall()
+        cursor.execute('SELECT COUNT(*) FROM performances WHERE user_id = ?', (user_id,))
+        total = cursor.fetchone()[0]
+
+        conn.close()
+
+        return [PerformanceSummary(**dict(row)) for row in rows], total
+
+    def get_performance_events(self, performance_id: int) -> Optional[Tuple[str, Optional[bytes]]]:
+        """Get (user_id, events blob) of one performance"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT user_id, events FROM performances WHERE id = ?', (performance_id,))
+        row = cursor.fetchone()
+        conn.close()
+        return (row['user_id'], row['events']) if row else None
+
+    def iter_performances_for_rescore(self, below_version: Optional[int] = None,
+                                      batch_size: int = 5000) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Yield batches of performances that have played notes, with their exercise's notes
         
-        return performance_id
+        With `below_version`, only rows scored by older rules (or by the
+        client) are returned. Batches are read by id keyset, one connection
+        per batch, so the caller can update rows between batches.
+        """
+        last_id = 0
+        while True:
+            conn = self.get_connection()
+            cursor = conn.cursor()
+            query = '''
+                SELECT p.id, p.notes_played, p.rhythm_score, p.tempo_score, p.events IS NOT NULL AS has_events,
+                       p.score, p.accuracy, p.mistakes_count, e.notes AS expected_notes
+                FROM performances p
+                JOIN exercises e ON e.id = p.exercise_id
+                WHERE p.id > ? AND p.notes_played IS NOT NULL
+            '''
+            params: List[Any] = [last_id]
+            if below_version is not None:
+                query += ' AND (p.scoring_version IS NULL OR p.scoring_version < ?)'
+                params.append(below_version)
+            query += ' ORDER BY p.id LIMIT ?'
+            params.append(batch_size)
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
+            conn.close()
+            
+            if not rows:
+                return
+            last_id = rows[-1]['id']
+            yield [{
+                'id': row['id'],
+                'notes_played': json.loads(row['notes_played']),
+                'expected_notes': json.loads(row['expected_notes']) if row['expected_notes'] else [],
+                'rhythm_score': row['rhythm_score'],
+                'tempo_score': row['tempo_score'],
+                'has_events': bool(row['has_events']),
+                'score': row['score'],
+                'accuracy': row['accuracy'],
+                'mistakes_count': row['mistakes_count'],
+            } for row in rows]
+    
+    def update_performance_scores(self, updates: List[Tuple[int, float, int, int, int]]) -> int:
+        """Apply (score, accuracy, mistakes_count, scoring_version, id) updates in one transaction"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.executemany('''
+            UPDATE performances
+            SET score = ?, accuracy = ?, mistakes_count = ?, scoring_version = ?
+            WHERE id = ?
+        ''', updates)
+        conn.commit()
+        conn.close()
+        return len(updates)
     
     def get_user_progress(self, user_id: str) -> Optional[UserProgress]:
         """Get comprehensive user progress"""
@@ -309,12 +1219,12 @@ class Database:
         cursor = conn.cursor()
         
         # Get user data
-        cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
-        user_row = cursor.fetchone()
+        found = self._ledger_user(cursor, user_id)
         
-        if not user_row:
+        if not found:
             conn.close()
             return None
+        user = found[0]
         
         # Get performance statistics
         cursor.execute('''
@@ -331,19 +1241,361 @@ class Database:
         
         return UserProgress(
             user_id=user_id,
-            current_xp=user_row['xp'],
-            current_level=user_row['level'],
-            current_streak=user_row['streak'],
-            last_active_date=user_row['last_active_date'],
+            current_xp=user.xp,
+            current_level=user.level,
+            current_streak=user.streak,
+            last_active_date=user.last_active_date,
             total_exercises_completed=perf_row['total_exercises'] if perf_row['total_exercises'] else 0,
             average_score=perf_row['average_score'] if perf_row['average_score'] else 0.0
         )
     
-    def get_daily_exercises_for_user(self, user_id: str, limit: int = 5) -> List[Exercise]:
-        """Get daily exercises for a specific user"""
-        # For now, return random exercises
-        # TODO: Implement AI-powered exercise selection based on user level and progress
-        return self.get_exercises(limit=limit)
+    def _row_to_upload(self, row: sqlite3.Row) -> UploadRecord:
+        return UploadRecord(
+            id=row['id'],
+            filename=row['filename'],
+            original_filename=row['original_filename'],
+            owner_id=row['owner_id'],
+            content_hash=row['content_hash'],
+            size_bytes=row['size_bytes'],
+            file_type=row['file_type'],
+            parse_status=row['parse_status'],
+            parent_upload_id=row['parent_upload_id'],
+            revision=row['revision'],
+            uploaded_at=datetime.fromisoformat(row['created_at'])
+        )
+    
+    def create_upload(self, filename: str, file_type: FileType, size_bytes: int,
+                      content_hash: Optional[str] = None, original_filename: Optional[str] = None,
+                      owner_id: Optional[str] = None,
+                      parse_status: ParseStatus = ParseStatus.PENDING,
+                      parent_upload_id: Optional[int] = None, revision: int = 1) -> UploadRecord:
+        """Add an uploaded file to the catalog"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        created_at = datetime.now().isoformat()
+        
+        cursor.execute('''
+            INSERT INTO uploads (
+                filename, original_filename, owner_id, content_hash, size_bytes, file_type,
+                parse_status, parent_upload_id, revision, created_at
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (filename, original_filename, owner_id, content_hash, size_bytes,
+              file_type.value, parse_status.value, parent_upload_id, revision, created_at))
+        
+        upload_id = cursor.lastrowid
+        conn.commit()
+        conn.close()
+        
+        return UploadRecord(
+            id=upload_id,
+            filename=filename,
+            original_filename=original_filename,
+            owner_id=owner_id,
+            content_hash=content_hash,
+            size_bytes=size_bytes,
+            file_type=file_type,
+            parse_status=parse_status,
+            parent_upload_id=parent_upload_id,
+            revision=revision,
+            uploaded_at=datetime.fromisoformat(created_at)
+        )
+    
+    def update_upload_status(self, filename: str, parse_status: ParseStatus):
+        """Record the parse status of an upload"""
+        conn = self.get_connection()
+        conn.execute('UPDATE uploads SET parse_status = ? WHERE filename = ?', (parse_status.value, filename))
+        conn.commit()
+        conn.close()
+    
+    def update_upload_statuses(self, filenames: Iterable[str], parse_status: ParseStatus):
+        """Record one parse status for many uploads in a single transaction"""
+        conn = self.get_connection()
+        conn.executemany('UPDATE uploads SET parse_status = ? WHERE filename = ?',
+                         [(parse_status.value, filename) for filename in filenames])
+        conn.commit()
+        conn.close()
+    
+    def get_upload(self, filename: str) -> Optional[UploadRecord]:
+        """Get a catalog entry by filename"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT * FROM uploads WHERE filename = ?', (filename,))
+        row = cursor.fetchone()
+        
+        conn.close()
+        
+        return self._row_to_upload(row) if row else None
+    
+    def count_uploads(self) -> int:
+        """Count catalog entries"""
+        conn = self.get_connection()
+        count = conn.execute('SELECT COUNT(*) FROM uploads').fetchone()[0]
+        conn.close()
+        return count
+    
+    def list_uploads(self, limit: int = 50, cursor: Optional[str] = None, owner_id: Optional[str] = None,
+                     file_type: Optional[FileType] = None,
+                     parse_status: Optional[ParseStatus] = None) -> Tuple[List[UploadRecord], Optional[str]]:
+        """List catalog entries newest first using keyset pagination"""
+        conn = self.get_connection()
+        db_cursor = conn.cursor()
+        
+        conditions = []
+        params = []
+        
+        if owner_id:
+            conditions.append('owner_id = ?')
+            params.append(owner_id)
+        if file_type:
+            conditions.append('file_type = ?')
+            params.append(file_type.value)
+        if parse_status:
+            conditions.append('parse_status = ?')
+            params.append(parse_status.value)
+        if cursor:
+            created_at, row_id = decode_cursor(cursor)
+            conditions.append('(created_at, id) < (?, ?)')
+            params.extend([created_at, row_id])
+        
+        query = 'SELECT * FROM uploads'
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        
+        # Fetch one extra row to know whether another page exists
+        query += ' ORDER BY created_at DESC, id DESC LIMIT ?'
+        params.append(limit + 1)
+        
+        db_cursor.execute(query, params)
+        rows = db_cursor.fetchall()
+        
+        conn.close()
+        
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1]['created_at'], rows[-1]['id'])
+        
+        return [self._row_to_upload(row) for row in rows], next_cursor
+    
+    def delete_upload(self, filename: str, file_path: str) -> bool:
+        """
+        Delete an upload from disk and catalog together
+        
+        The file is moved aside before the catalog row is committed and only
+        unlinked afterwards, so a failure on either side leaves both intact.
+        Returns False if neither the file nor a catalog entry exists.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        trash_path = file_path + '.deleting'
+        moved = False
+        
+        try:
+            # Exercises stay (they may have performances); only the links go
+            cursor.execute(
+                'DELETE FROM upload_exercises WHERE upload_id IN (SELECT id FROM uploads WHERE filename = ?)',
+                (filename,)
+            )
+            cursor.execute('DELETE FROM uploads WHERE filename = ?', (filename,))
+            in_catalog = cursor.rowcount > 0
+            
+            if os.path.exists(file_path):
+                os.replace(file_path, trash_path)
+                moved = True
+            elif not in_catalog:
+                conn.rollback()
+                return False
+            
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            if moved:
+                os.replace(trash_path, file_path)
+            raise
+        finally:
+            conn.close()
+        
+        if moved:
+            os.remove(trash_path)
+        return True
+    
+    def reconcile_uploads(self, uploads_dir: str, classify: Callable[[str], Tuple[FileType, ParseStatus]],
+                          dry_run: bool = False) -> Dict[str, List[str]]:
+        """
+        Fix drift between the uploads directory and the catalog
+        
+        Files missing from the catalog are added, entries whose file is gone
+        are removed, and entries whose size changed are re-hashed.
+        `classify(filename)` returns the (FileType, ParseStatus) to record
+        for each added file.
+        """
+        on_disk = {}
+        with os.scandir(uploads_dir) as entries:
+            for entry in entries:
+                if entry.is_file() and not entry.name.endswith(TEMPORARY_SUFFIXES) and not entry.name.startswith('.'):
+                    stat = entry.stat()
+                    on_disk[entry.name] = (entry.path, stat.st_size, stat.st_ctime)
+        
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT filename, size_bytes FROM uploads')
+        catalog = {row['filename']: row['size_bytes'] for row in cursor.fetchall()}
+        
+        added = sorted(set(on_disk) - set(catalog))
+        removed = sorted(set(catalog) - set(on_disk))
+        updated = sorted(name for name in set(on_disk) & set(catalog) if on_disk[name][1] != catalog[name])
+        
+        if not dry_run:
+            new_rows = []
+            for name in added:
+                path, size, ctime = on_disk[name]
+                file_type, status = classify(name)
+                new_rows.append((name, file_sha256(path), size, file_type.value, status.value,
+                                 datetime.fromtimestamp(ctime).isoformat()))
+            
+            cursor.executemany('''
+                INSERT INTO uploads (filename, content_hash, size_bytes, file_type, parse_status, created_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', new_rows)
+            cursor.executemany(
+                'DELETE FROM upload_exercises WHERE upload_id IN (SELECT id FROM uploads WHERE filename = ?)',
+                [(name,) for name in removed]
+            )
+            cursor.executemany('DELETE FROM uploads WHERE filename = ?', [(name,) for name in removed])
+            cursor.executemany(
+                'UPDATE uploads SET size_bytes = ?, content_hash = ? WHERE filename = ?',
+                [(on_disk[name][1], file_sha256(on_disk[name][0]), name) for name in updated]
+            )
+            conn.commit()
+        
+        conn.close()
+        
+        return {"added": added, "removed": removed, "updated": updated}
+    
+    def get_daily_exercises_for_user(self, user_id: str, limit: int = 5,
+                                     difficulty: Optional[str] = None) -> Tuple[List[Exercise], int]:
+        """
+        Get daily exercises for a specific user, and how many of them are reviews
+
+        The set is chosen once per user, day and difficulty filter and then
+        served from daily_sets, along with the limit it was chosen for, so
+        a set cut short by a small library or filter is not drawn again.
+        Exercises due for review come first (up to REVIEW_SHARE of the
+        set); new material is drawn per difficulty
+        straight from the (difficulty, id) index, around a target difficulty
+        for the user's level and recent scores, preferring exercises the
+        user has not practiced recently.
+        """
+        today = date.today().isoformat()
+        set_key = difficulty or ''
+
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT exercise_ids, review_count, set_limit FROM daily_sets WHERE user_id = ? AND date = ? AND difficulty = ?
+        ''', (user_id, today, set_key))
+        row = cursor.fetchone()
+        if row:
+            stored = json.loads(row['exercise_ids'])
+            if len(stored) >= limit or row['set_limit'] >= limit:
+                conn.close()
+                return self.get_exercises_by_ids(stored[:limit]), min(row['review_count'], limit)
+
+        reviews = self._due_review_ids(cursor, user_id, int(limit * REVIEW_SHARE), difficulty)
+        new_count = limit - len(reviews)
+
+        found = self._ledger_user(cursor, user_id)
+        cursor.execute('''
+            SELECT AVG(COALESCE(accuracy, score)) AS recent_score FROM (
+                SELECT accuracy, score FROM performances
+                WHERE user_id = ?
+                ORDER BY submitted_at DESC
+                LIMIT ?
+            )
+        ''', (user_id, RECENT_PERFORMANCES))
+        recent_score = cursor.fetchone()['recent_score']
+        cursor.execute('SELECT generation, bits FROM recent_exercises WHERE user_id = ?', (user_id,))
+        filter_row = cursor.fetchone()
+        recent = RecentExercises.load(filter_row['generation'] if filter_row else None,
+                                      filter_row['bits'] if filter_row else None, date.today())
+
+        if difficulty:
+            quotas = {difficulty: new_count}
+        else:
+            target = target_difficulty(found[0].level if found else 1, recent_score)
+            quotas = difficulty_quotas(target, new_count) if new_count else {}
+
+        rng = np.random.default_rng(daily_seed(user_id, f"{today}|{set_key}"))
+        chosen: List[int] = []
+        fallback: List[int] = []
+        scheduled = set(reviews)
+        for level_name, count in quotas.items():
+            candidates = self._sample_exercise_ids(cursor, level_name, count * CANDIDATE_OVERSAMPLE, rng)
+            candidates = [c for c in candidates if c not in scheduled]
+            fresh, practiced = prefer_fresh(candidates, recent, count)
+            chosen.extend(fresh)
+            fallback.extend(practiced)
+
+        # Top up from other difficulties, then with recently practiced exercises
+        if len(chosen) < new_count and not difficulty:
+            for level_name in DIFFICULTIES:
+                if level_name in quotas:
+                    continue
+                candidates = self._sample_exercise_ids(cursor, level_name, new_count * CANDIDATE_OVERSAMPLE, rng)
+                candidates = [c for c in candidates if c not in scheduled]
+                fresh, practiced = prefer_fresh(candidates, recent, new_count - len(chosen))
+                chosen.extend(fresh)
+                fallback.extend(practiced)
+        chosen = reviews + chosen + fallback[:max(new_count - len(chosen), 0)]
+
+        cursor.execute('DELETE FROM daily_sets WHERE user_id = ? AND date < ?', (user_id, today))
+        cursor.execute('''
+            INSERT OR REPLACE INTO daily_sets (user_id, date, difficulty, exercise_ids, review_count, set_limit)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (user_id, today, set_key, json.dumps(chosen), len(reviews), limit))
+        conn.commit()
+        conn.close()
+        data_versions.bump_user(user_id)
+
+        return self.get_exercises_by_ids(chosen), len(reviews)
+
+    def _sample_exercise_ids(self, cursor: sqlite3.Cursor, difficulty: str, count: int,
+                             rng: np.random.Generator) -> List[int]:
+        """
+        Up to `count` distinct random exercise IDs of one difficulty
+
+        Small difficulty ranges are read whole; large ones are sampled with
+        index seeks to random IDs, so the cost does not grow with the table.
+        """
+        cursor.execute('SELECT MIN(id) AS low, MAX(id) AS high FROM exercises WHERE difficulty = ?', (difficulty,))
+        bounds = cursor.fetchone()
+        if bounds['low'] is None or count <= 0:
+            return []
+
+        if bounds['high'] - bounds['low'] < count * 4:
+            cursor.execute('SELECT id FROM exercises WHERE difficulty = ?', (difficulty,))
+            ids = [row['id'] for row in cursor.fetchall()]
+            rng.shuffle(ids)
+            return ids[:count]
+
+        ids: List[int] = []
+        seen = set()
+        for probe in rng.integers(bounds['low'], bounds['high'] + 1, size=count * 2).tolist():
+            cursor.execute('SELECT id FROM exercises WHERE difficulty = ? AND id >= ? ORDER BY id LIMIT 1',
+                           (difficulty, probe))
+            found = cursor.fetchone()
+            if found and found['id'] not in seen:
+                seen.add(found['id'])
+                ids.append(found['id'])
+                if len(ids) == count:
+                    break
+        return ids
+
+# Time every Database method for /metrics
+time_methods(Database, DB_QUERY_SECONDS)
 
 # Global database instance
 db = Database()
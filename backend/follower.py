@@ -0,0 +1,234 @@
+"""
+Online score following for live practice
+
+Aligns notes as they arrive against an exercise's expected notes with an
+incremental edit-distance (DTW-style) recursion, restricted to a fixed-width
+band around the current position. Each session keeps only that band, a few
+counters and its tempo estimate, so its state is small and does not grow
+with the length of the exercise or of the session. Expected notes are
+shared read-only between all sessions on the same exercise.
+"""
+
+from collections import deque
+from functools import lru_cache
+from typing import List, Optional, Dict, Any, Tuple
+
+import numpy as np
+
+from analysis import FrameAnalyzer, midi_name, MIN_NOTE_SECONDS
+from score_store import quarter_lengths
+from scoring import SUBSTITUTION_COST, OCTAVE_ERROR_COST, GAP_COST
+from transpose import notes_to_arrays
+
+# Width of the alignment band (expected positions tracked per session)
+BAND = 24
+# Onsets within this fraction of a beat of the prediction count as on time
+TIMING_TOLERANCE_BEATS = 0.15
+# How quickly the tempo estimate follows the player (0..1)
+TEMPO_SMOOTHING = 0.3
+
+
+class ExpectedNotes:
+    """Read-only expected notes of one exercise, shared by all its sessions"""
+
+    __slots__ = ('exercise_id', 'midi', 'beats', 'names')
+
+    def __init__(self, exercise_id: int, notes: List[str], rhythm_pattern: Optional[List[str]]):
+        self.exercise_id = exercise_id
+        _, _, midi = notes_to_arrays(notes)
+        self.midi = midi.astype(np.int16)
+        self.beats = np.concatenate(([0.0], np.cumsum(quarter_lengths(rhythm_pattern, len(notes)))[:-1]))
+        self.names = tuple(notes)
+        self.midi.flags.writeable = False
+        self.beats.flags.writeable = False
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+
+@lru_cache(maxsize=1024)
+def expected_notes_for(exercise_id: int, notes: Tuple[str, ...], rhythm_pattern: Tuple[str, ...]) -> ExpectedNotes:
+    return ExpectedNotes(exercise_id, list(notes), list(rhythm_pattern))
+
+
+class ScoreFollower:
+    """Per-session alignment state; feed played notes with `play`"""
+
+    __slots__ = ('expected', 'row', 'low', 'position', 'correct', 'wrong', 'extra', 'missed',
+                 'last_index', 'last_result', 'last_time', 'last_beat', 'seconds_per_beat')
+
+    def __init__(self, expected: ExpectedNotes, tempo: float = 90.0):
+        self.expected = expected
+        # row[k] = cost of aligning everything played so far with expected[:low + k]
+        self.row = np.arange(BAND, dtype=np.float64) * GAP_COST
+        self.low = 0
+        self.position = 0
+        self.correct = 0
+        self.wrong = 0
+        self.extra = 0
+        self.missed = 0
+        self.last_index = -1
+        self.last_result: Optional[str] = None
+        self.last_time: Optional[float] = None
+        self.last_beat = 0.0
+        self.seconds_per_beat = 60.0 / tempo
+
+    def play(self, midi: int, time: float) -> Dict[str, Any]:
+        """Align one played note (MIDI number, seconds since start) and describe it"""
+        expected = self.expected
+        count = len(expected)
+        positions = self.low + np.arange(BAND)
+        valid = positions <= count
+
+        # Cost of playing this note as expected note j-1 (diagonal), or as an extra (up)
+        previous_notes = expected.midi[np.clip(positions - 1, 0, max(count - 1, 0))] if count else np.zeros(BAND)
+        interval = previous_notes.astype(np.int64) - midi
+        substitution = np.where(interval == 0, 0.0,
+                                np.where(interval % 12 == 0, OCTAVE_ERROR_COST, SUBSTITUTION_COST))
+        # (the band's first cell has no predecessor in the band)
+        diagonal = np.full(BAND, np.inf)
+        diagonal[1:] = self.row[:-1] + substitution[1:]
+        up = self.row + GAP_COST
+        arrival = np.minimum(diagonal, up)
+        arrival[~valid] = np.inf
+
+        # Skipping expected notes (left to right) as a running minimum
+        steps = np.arange(BAND) * GAP_COST
+        row = np.minimum.accumulate(arrival - steps) + steps
+        row[~valid] = np.inf
+
+        # Ties go to the furthest position (a wrong note rather than an extra
+        # one); the best cell is always one the note arrived at directly,
+        # since skips only ever add cost
+        best = BAND - 1 - int(np.argmin(row[::-1]))
+        target = self.low + best
+
+        event: Dict[str, Any] = {"played": midi_name(midi), "missed": []}
+        if diagonal[best] <= up[best]:
+            index = target - 1
+            start = self.position
+            if index > start:
+                event["missed"] = list(expected.names[start:index])
+                self.missed += index - start
+            elif index == self.last_index:
+                # A better alignment for the same expected note: the previous
+                # note becomes an extra one
+                self._count(self.last_result, -1)
+                self._count("extra", 1)
+                event["revises_previous"] = True
+            event["index"] = index
+            event["expected"] = expected.names[index]
+            event["result"] = "correct" if substitution[best] == 0.0 else "wrong"
+            self._count(event["result"], 1)
+            self.last_index, self.last_result = index, event["result"]
+            event.update(self._timing(float(expected.beats[index]), time))
+        else:
+            event["result"] = "extra"
+            self.extra += 1
+
+        self.position = max(target, 0)
+        self._recentre(row)
+        event["position"] = self.position
+        event["complete"] = self.position >= count
+        return event
+
+    def _count(self, result: str, change: int):
+        setattr(self, result, getattr(self, result) + change)
+
+    def _timing(self, beat: float, time: float) -> Dict[str, Any]:
+        """Drift of a matched note against the tempo the player has been keeping"""
+        if self.last_time is None or beat <= self.last_beat:
+            drift = 0.0
+        else:
+            beats = beat - self.last_beat
+            predicted = self.last_time + beats * self.seconds_per_beat
+            drift = float(time - predicted)
+            local = float(time - self.last_time) / beats
+            local = min(max(local, 0.5 * self.seconds_per_beat), 2.0 * self.seconds_per_beat)
+            self.seconds_per_beat += TEMPO_SMOOTHING * (local - self.seconds_per_beat)
+        self.last_time, self.last_beat = float(time), beat
+
+        tolerance = TIMING_TOLERANCE_BEATS * self.seconds_per_beat
+        timing = "on_time" if abs(drift) <= tolerance else ("late" if drift > 0 else "early")
+        return {
+            "timing": timing,
+            "drift_ms": round(drift * 1000.0, 1),
+            "tempo": round(60.0 / self.seconds_per_beat, 1),
+        }
+
+    def _recentre(self, row: np.ndarray):
+        """Keep the best position a quarter of the way into the band"""
+        low = max(self.position - BAND // 4, 0)
+        shift = low - self.low
+        if shift > 0:
+            row = np.concatenate((row[shift:], np.full(min(shift, BAND), np.inf)))[:BAND]
+        elif shift < 0:
+            row = np.concatenate((np.full(min(-shift, BAND), np.inf), row[:shift]))[:BAND]
+        self.row = row
+        self.low = low
+
+    def summary(self) -> Dict[str, Any]:
+        count = len(self.expected)
+        missed = self.missed + max(count - self.position, 0)
+        return {
+            "correct": self.correct,
+            "wrong": self.wrong,
+            "extra": self.extra,
+            "missed": missed,
+            "mistakes_count": self.wrong + self.extra + missed,
+            "accuracy": round(100.0 * self.correct / count, 1) if count else 0.0,
+            "tempo": round(60.0 / self.seconds_per_beat, 1),
+            "complete": self.position >= count,
+        }
+
+
+class LiveNoteDetector(FrameAnalyzer):
+    """
+    Turns short PCM chunks into note-on events as they arrive
+
+    Uses the same YIN and spectral-flux frame analysis as recordings, but
+    keeps only a handful of running values instead of per-frame history.
+    """
+
+    def __init__(self, sample_rate: int):
+        super().__init__(sample_rate)
+        self.min_frames = max(int(MIN_NOTE_SECONDS * sample_rate / self.hop), 1)
+        self.frame_index = 0
+        self.run_pitch = -1
+        self.run_length = 0
+        self.armed = False
+        self.flux_average = 0.0
+        self.recent_rms = deque([0.0] * 4, maxlen=4)
+        self.events: List[Tuple[int, float]] = []
+
+    def push(self, samples: np.ndarray) -> List[Tuple[int, float]]:
+        """Analyse a chunk and return (midi, onset seconds) for notes that started in it"""
+        super().push(samples)
+        events, self.events = self.events, []
+        return events
+
+    def _analyse(self, frames: np.ndarray):
+        frames = frames.astype(np.float64)
+        rms = np.sqrt(np.mean(frames ** 2, axis=1))
+        flux = self._spectral_flux(frames)
+        with np.errstate(invalid='ignore'):
+            f0 = self._yin(frames)
+            pitches = np.where(np.isnan(f0), -1, np.round(69 + 12 * np.log2(f0 / 440.0))).astype(np.int64)
+
+        offset = self.window / 2 / self.sample_rate
+        for pitch, level, strength in zip(pitches.tolist(), rms.tolist(), flux.tolist()):
+            attack = strength > 1.5 * self.flux_average + 1.0 and level > 1.1 * min(self.recent_rms)
+            self.flux_average += 0.1 * (strength - self.flux_average)
+            self.recent_rms.append(level)
+
+            if pitch != self.run_pitch:
+                self.run_pitch, self.run_length, self.armed = pitch, 0, True
+            elif attack:
+                self.run_length, self.armed = 0, True
+            self.run_length += 1
+
+            if self.armed and self.run_pitch >= 0 and self.run_length >= self.min_frames:
+                start = self.frame_index - self.run_length + 1
+                self.events.append((self.run_pitch, start * self.hop / self.sample_rate + offset))
+                self.armed = False
+            self.frame_index += 1
@@ -0,0 +1,160 @@
+"""
+HTTP caching and fast JSON responses for read endpoints
+
+Endpoints compute an ETag from what their response depends on (resource,
+parameters and data versions from versions.py) before doing any work, then
+ask the cache: a matching If-None-Match is answered 304 straight away, a
+cached body for the ETag is sent as is, and only otherwise is the response
+built, serialized once and stored.
+
+Since an ETag names exactly one body, bodies are cached by ETag: after a
+write the new ETag simply misses. Entries that depend on a version slot
+are also dropped when this process bumps it, and the cache evicts least
+recently used bodies to stay under its byte budget.
+
+List routes can also skip per-row models entirely: json_array_response
+wraps JSON objects that SQLite already serialized.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from fastapi import Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response
+
+from versions import data_versions
+from metrics import CACHE_LOOKUPS, RESPONSE_CACHE_BYTES
+
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+# Bump when response formats change, so clients don't revalidate against old bodies
+RESPONSE_FORMAT_VERSION = 1
+
+# Static or immutable content
+CACHE_STATIC = "public, max-age=3600"
+CACHE_IMMUTABLE = "public, max-age=86400, immutable"
+# Shared data that changes on writes: always revalidate (cheap, given ETags)
+CACHE_REVALIDATE = "public, no-cache"
+# Per-user data
+CACHE_PRIVATE = "private, no-cache"
+
+_LOOKUPS = {result: CACHE_LOOKUPS.labels("response", result) for result in ("hit", "miss", "not_modified")}
+_CACHED_BYTES = RESPONSE_CACHE_BYTES.labels()
+
+
+def etag_for(*parts: Any) -> str:
+    """Strong ETag for the values a response depends on"""
+    digest = hashlib.blake2b(repr((RESPONSE_FORMAT_VERSION,) + parts).encode(), digest_size=12).hexdigest()
+    return f'"{digest}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match comparison (weak, as RFC 9110 requires for this header)"""
+    if not if_none_match:
+        return False
+    candidates = [value.strip() for value in if_none_match.split(',')]
+    return '*' in candidates or any(value.removeprefix('W/') == etag for value in candidates)
+
+
+def json_array_response(objects: List[str]) -> Response:
+    """
+    Response for a list of already-serialized JSON objects
+
+    Routes opt into this fast path by returning it instead of models; FastAPI
+    then skips response_model validation and encoding.
+    """
+    return Response(content=('[' + ','.join(objects) + ']').encode('utf-8'), media_type="application/json")
+
+
+def _serialize(content: Any) -> bytes:
+    # Same output as FastAPI's JSONResponse
+    return json.dumps(jsonable_encoder(content), ensure_ascii=False, allow_nan=False,
+                      indent=None, separators=(",", ":")).encode("utf-8")
+
+
+class ResponseCache:
+    """Size-bounded in-process LRU of serialized JSON bodies, keyed by ETag"""
+
+    def __init__(self, max_bytes: int = RESPONSE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._by_slot: Dict[int, Set[str]] = {}
+        self._slots: Dict[str, Tuple[int, ...]] = {}
+        self._lock = threading.Lock()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def lookup(self, request: Request, etag: str, cache_control: str) -> Optional[Response]:
+        """A 304 or cached 200 response for this ETag, or None if it has to be built"""
+        headers = {"ETag": etag, "Cache-Control": cache_control}
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            self.not_modified += 1
+            _LOOKUPS["not_modified"].inc()
+            return Response(status_code=304, headers=headers)
+        with self._lock:
+            body = self._entries.get(etag)
+            if body is None:
+                self.misses += 1
+                _LOOKUPS["miss"].inc()
+                return None
+            self._entries.move_to_end(etag)
+            self.hits += 1
+            _LOOKUPS["hit"].inc()
+        return Response(content=body, media_type="application/json", headers=headers)
+
+    def store(self, etag: str, cache_control: str, content: Any, slots: Iterable[int] = ()) -> Response:
+        """Serialize a response body, cache it under its ETag and return the response"""
+        body = _serialize(content)
+        slots = tuple(slots)
+        # One oversized body shouldn't flush everything else
+        if len(body) <= self.max_bytes // 8:
+            with self._lock:
+                if etag not in self._entries:
+                    self._entries[etag] = body
+                    self.size += len(body)
+                    self._slots[etag] = slots
+                    for slot in slots:
+                        self._by_slot.setdefault(slot, set()).add(etag)
+                    while self.size > self.max_bytes:
+                        self._remove(next(iter(self._entries)))
+                    _CACHED_BYTES.set(self.size)
+        return Response(content=body, media_type="application/json",
+                        headers={"ETag": etag, "Cache-Control": cache_control})
+
+    def _remove(self, etag: str):
+        self.size -= len(self._entries.pop(etag))
+        for slot in self._slots.pop(etag, ()):
+            dependents = self._by_slot.get(slot)
+            if dependents is not None:
+                dependents.discard(etag)
+                if not dependents:
+                    del self._by_slot[slot]
+
+    def invalidate(self, slot: int):
+        """Drop every body that depends on a version slot"""
+        with self._lock:
+            for etag in list(self._by_slot.get(slot, ())):
+                self._remove(etag)
+            _CACHED_BYTES.set(self.size)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_slot.clear()
+            self._slots.clear()
+            self.size = 0
+            _CACHED_BYTES.set(0)
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self._entries), "bytes": self.size, "hits": self.hits,
+                "misses": self.misses, "not_modified": self.not_modified}
+
+
+response_cache = ResponseCache()
+data_versions.subscribe(response_cache.invalidate)
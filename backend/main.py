@@ -1,7 +1,8 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from datetime import datetime
+import asyncio
 import os
 
 # Import routers
@@ -9,6 +10,10 @@ from routers import upload, exercises, users
 
 # Import database
 from db import db
+from http_cache import response_cache, etag_for, CACHE_STATIC
+from admission import AdmissionMiddleware, admission
+import profiling
+import metrics
 
 # Create FastAPI app
 app = FastAPI(
@@ -19,7 +24,14 @@ app = FastAPI(
     redoc_url="/redoc"
 )
 
-# Add CORS middleware
+# Shed load per route class before expensive requests starve cheap reads
+app.add_middleware(AdmissionMiddleware)
+
+# Trace requests carrying X-Profile-Token (only installed when PROFILING_TOKEN is set)
+if profiling.enabled():
+    app.add_middleware(profiling.ProfilingMiddleware)
+
+# Add CORS middleware (outside admission, so 503s carry CORS headers)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # In production, restrict this to your app's domain
@@ -28,10 +40,14 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Request latency and in-flight metrics (outermost, so queueing time counts)
+app.add_middleware(metrics.MetricsMiddleware)
+
 # Include routers
 app.include_router(upload.router, prefix="/upload", tags=["upload"])
 app.include_router(exercises.router, prefix="/exercises", tags=["exercises"])
 app.include_router(users.router, prefix="/users", tags=["users"])
+app.include_router(profiling.router)
 
 # Root endpoint
 @app.get("/", tags=["root"])
@@ -90,11 +106,21 @@ async def health_check():
             }
         )
 
+# Prometheus metrics
+@app.get("/metrics", tags=["health"], include_in_schema=False)
+async def prometheus_metrics():
+    """Metrics in the Prometheus text format, for all workers"""
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 # API info endpoint
 @app.get("/api/info", tags=["info"])
-async def api_info():
+async def api_info(request: Request):
     """Get detailed API information"""
-    return {
+    etag = etag_for('api-info', app.version)
+    cached = response_cache.lookup(request, etag, CACHE_STATIC)
+    if cached:
+        return cached
+    return response_cache.store(etag, CACHE_STATIC, {
         "name": "SightReadPro API",
         "version": "1.0.0",
         "description": "A comprehensive API for music sight-reading practice",
@@ -126,7 +152,7 @@ async def api_info():
         },
         "database": {
             "type": "SQLite",
-            "tables": ["users", "exercises", "performances"],
+            "tables": ["users", "exercises", "performances", "uploads"],
             "features": ["automatic_user_creation", "sample_data", "indexes"]
         },
         "development_status": {
@@ -143,7 +169,13 @@ async def api_info():
             "redoc": "/redoc",
             "openapi_json": "/openapi.json"
         }
-    }
+    })
+
+# Admission control state
+@app.get("/api/admission", tags=["info"])
+async def admission_stats():
+    """Concurrency, queue depth and shed counts per route class (this worker)"""
+    return admission.stats()
 
 # Error handlers
 @app.exception_handler(404)
@@ -170,12 +202,13 @@ async def internal_error_handler(request, exc):
         }
     )
 
-# Startup event
-@app.on_event("startup")
-async def startup_event():
-    """Initialize application on startup"""
-    print("🎵 Starting SightReadPro API...")
+def prepare_shared_state():
+    """
+    One-time startup work on shared state (uploads directory, database)
     
+    serve.py runs this once in the parent before forking workers, so several
+    workers never migrate the same SQLite file at once.
+    """
     # Ensure uploads directory exists
     os.makedirs("uploads", exist_ok=True)
     
@@ -184,6 +217,25 @@ async def startup_event():
     db.init_database()
     print("✅ Database initialized successfully")
     
+    # Build the uploads catalog from disk on first run
+    if db.count_uploads() == 0:
+        result = upload.reconcile_upload_catalog()
+        print(f"📁 Cataloged {len(result['added'])} existing uploads")
+
+# Set by serve.py once prepare_shared_state has run in the parent
+app.state.preloaded = False
+
+# Startup event
+@app.on_event("startup")
+async def startup_event():
+    """Initialize application on startup"""
+    print("🎵 Starting SightReadPro API...")
+    
+    if not app.state.preloaded:
+        prepare_shared_state()
+    
+    app.state.loop_monitor = asyncio.create_task(metrics.monitor_event_loop())
+    
     print("🚀 SightReadPro API is ready!")
 
 # Shutdown event
@@ -191,6 +243,8 @@ async def startup_event():
 async def shutdown_event():
     """Cleanup on application shutdown"""
     print("🛑 Shutting down SightReadPro API...")
+    app.state.loop_monitor.cancel()
+    upload.shutdown_parse_pool()
 
 if __name__ == "__main__":
     import uvicorn
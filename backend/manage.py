@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Maintenance commands for the SightReadPro backend
+
+Usage:
+    python manage.py reconcile-uploads [--dry-run]
+    python manage.py rescore [--all] [--batch-size N] [--dry-run]
+    python manage.py schedule-reviews [--batch-users N] [--dry-run]
+    python manage.py build-similarity-index [--rebuild]
+    python manage.py build-pattern-index [--rebuild]
+    python manage.py snapshot-xp [--batch-users N]
+    python manage.py replay-xp [--batch-size N] [--dry-run]
+"""
+
+import argparse
+import sys
+import time
+from typing import Dict
+
+
+def reconcile_uploads(args) -> int:
+    """Fix drift between the uploads directory and the uploads catalog"""
+    from routers.upload import reconcile_upload_catalog, UPLOADS_DIR
+
+    print(f"🔍 Reconciling {UPLOADS_DIR}/ with the uploads catalog...")
+    result = reconcile_upload_catalog(dry_run=args.dry_run)
+
+    for action in ("added", "removed", "updated"):
+        for filename in result[action]:
+            print(f"   {action:<8} {filename}")
+
+    prefix = "Would fix" if args.dry_run else "Fixed"
+    print(f"✅ {prefix} {len(result['added'])} added, {len(result['removed'])} removed, "
+          f"{len(result['updated'])} updated")
+    return 0
+
+
+def rescore(args) -> int:
+    """Recompute performance scores from played notes with the current scoring rules"""
+    from db import db
+    from scoring import rescore_rows, SCORING_VERSION
+
+    db.init_database()
+    below_version = None if args.all else SCORING_VERSION
+    print(f"🎯 Rescoring performances with scoring version {SCORING_VERSION}...")
+
+    rescored = skipped = changed = 0
+    started = time.perf_counter()
+    for rows in db.iter_performances_for_rescore(below_version, args.batch_size):
+        updates, batch_skipped = rescore_rows(rows)
+        previous = {row['id']: (row['score'], row['accuracy'], row['mistakes_count']) for row in rows}
+        changed += sum(1 for score, accuracy, mistakes, _, row_id in updates
+                       if previous[row_id] != (score, accuracy, mistakes))
+        if not args.dry_run:
+            db.update_performance_scores(updates)
+        rescored += len(updates)
+        skipped += batch_skipped
+        print(f"   {rescored} rescored ({changed} changed, {skipped} skipped)")
+
+    prefix = "Would rescore" if args.dry_run else "Rescored"
+    print(f"✅ {prefix} {rescored} performances in {time.perf_counter() - started:.1f}s "
+          f"({changed} changed, {skipped} with unreadable notes)")
+    return 0
+
+
+def schedule_reviews(args) -> int:
+    """Rebuild spaced-repetition review state from every user's performance history"""
+    from db import db
+    from review import rebuild_states
+
+    db.init_database()
+    print("🗓️  Rebuilding review schedules...")
+
+    users = pairs = reviews = 0
+    started = time.perf_counter()
+    for user_ids, rows in db.iter_review_histories(args.batch_users):
+        states = rebuild_states(rows)
+        if not args.dry_run:
+            db.replace_review_state(user_ids, states)
+        users += len(user_ids)
+        pairs += len(states)
+        reviews += len(rows)
+        print(f"   {users} users, {pairs} exercises, {reviews} reviews")
+
+    prefix = "Would rebuild" if args.dry_run else "Rebuilt"
+    print(f"✅ {prefix} {pairs} review schedules for {users} users in {time.perf_counter() - started:.1f}s")
+    return 0
+
+
+def build_similarity_index(args) -> int:
+    """Index new exercises for similarity queries and save the index files"""
+    from db import db
+    from similarity import SimilarityIndex, SIMILARITY_INDEX_DIR
+
+    db.init_database()
+    index = SimilarityIndex(SIMILARITY_INDEX_DIR, load=not args.rebuild)
+    print(f"🧭 Indexing exercises above ID {index.max_id} ({len(index)} already indexed)...")
+
+    started = time.perf_counter()
+    added = 0
+    for exercises in db.iter_exercises_after(index.max_id, args.batch_size):
+        added += index.add_exercises(exercises)
+        print(f"   {added} indexed")
+    index.save()
+    print(f"✅ Indexed {added} exercises in {time.perf_counter() - started:.1f}s; "
+          f"{len(index)} in {SIMILARITY_INDEX_DIR}/")
+    return 0
+
+
+def build_pattern_index(args) -> int:
+    """Index exercise melodies for pattern search (everything, with --rebuild)"""
+    from db import db
+
+    started = time.perf_counter()
+    print("🎼 Rebuilding the melodic pattern index..." if args.rebuild else "🎼 Indexing unindexed exercise melodies...")
+    indexed = db.backfill_pattern_index(rebuild=args.rebuild)
+    print(f"✅ Indexed {indexed} exercises in {time.perf_counter() - started:.1f}s")
+    return 0
+
+
+def snapshot_xp(args) -> int:
+    """Fold every user's recent XP ledger events into their snapshot"""
+    from db import db
+
+    db.init_database()
+    print("📸 Snapshotting XP totals...")
+    started = time.perf_counter()
+    moved = db.snapshot_xp(args.batch_users)
+    print(f"✅ Snapshotted {moved} users in {time.perf_counter() - started:.1f}s")
+    return 0
+
+
+def replay_xp(args) -> int:
+    """Recompute every user's XP from the ledger with the current formula and append the differences"""
+    from db import db
+    from xp import replay_batch
+
+    db.init_database()
+    print("🧮 Replaying the XP ledger...")
+
+    recorded: Dict[str, int] = {}
+    replayed: Dict[str, int] = {}
+    events = 0
+    started = time.perf_counter()
+    for rows in db.iter_xp_events(args.batch_size):
+        users, batch_recorded, batch_replayed = replay_batch(rows)
+        for user_id, old_xp, new_xp in zip(users.tolist(), batch_recorded.tolist(), batch_replayed.tolist()):
+            recorded[user_id] = recorded.get(user_id, 0) + old_xp
+            replayed[user_id] = replayed.get(user_id, 0) + new_xp
+        events += len(rows)
+        print(f"   {events} events, {len(recorded)} users")
+
+    adjustments = [(user_id, replayed[user_id] - old_xp) for user_id, old_xp in recorded.items()
+                   if replayed[user_id] != old_xp]
+    if not args.dry_run:
+        db.append_xp_adjustments(adjustments)
+
+    prefix = "Would adjust" if args.dry_run else "Adjusted"
+    print(f"✅ {prefix} {len(adjustments)} users by {sum(change for _, change in adjustments):+d} XP in total "
+          f"({events} events replayed in {time.perf_counter() - started:.1f}s)")
+    return 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="SightReadPro maintenance commands")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    reconcile = subparsers.add_parser("reconcile-uploads", help=reconcile_uploads.__doc__)
+    reconcile.add_argument("--dry-run", action="store_true", help="Report drift without fixing it")
+    reconcile.set_defaults(handler=reconcile_uploads)
+
+    rescore_parser = subparsers.add_parser("rescore", help=rescore.__doc__)
+    rescore_parser.add_argument("--all", action="store_true",
+                                help="Rescore every performance, not just ones scored by older rules")
+    rescore_parser.add_argument("--batch-size", type=int, default=5000, help="Performances scored per pass")
+    rescore_parser.add_argument("--dry-run", action="store_true", help="Report changes without saving them")
+    rescore_parser.set_defaults(handler=rescore)
+
+    reviews_parser = subparsers.add_parser("schedule-reviews", help=schedule_reviews.__doc__)
+    reviews_parser.add_argument("--batch-users", type=int, default=1000, help="Users rebuilt per pass")
+    reviews_parser.add_argument("--dry-run", action="store_true", help="Compute schedules without saving them")
+    reviews_parser.set_defaults(handler=schedule_reviews)
+
+    similarity_parser = subparsers.add_parser("build-similarity-index", help=build_similarity_index.__doc__)
+    similarity_parser.add_argument("--rebuild", action="store_true", help="Index every exercise from scratch")
+    similarity_parser.add_argument("--batch-size", type=int, default=5000, help="Exercises read per pass")
+    similarity_parser.set_defaults(handler=build_similarity_index)
+
+    pattern_parser = subparsers.add_parser("build-pattern-index", help=build_pattern_index.__doc__)
+    pattern_parser.add_argument("--rebuild", action="store_true", help="Drop and re-index every exercise")
+    pattern_parser.set_defaults(handler=build_pattern_index)
+
+    snapshot_parser = subparsers.add_parser("snapshot-xp", help=snapshot_xp.__doc__)
+    snapshot_parser.add_argument("--batch-users", type=int, default=1000, help="Users snapshotted per transaction")
+    snapshot_parser.set_defaults(handler=snapshot_xp)
+
+    replay_parser = subparsers.add_parser("replay-xp", help=replay_xp.__doc__)
+    replay_parser.add_argument("--batch-size", type=int, default=50000, help="Ledger events read per pass")
+    replay_parser.add_argument("--dry-run", action="store_true", help="Report the differences without saving them")
+    replay_parser.set_defaults(handler=replay_xp)
+
+    args = parser.parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,468 @@
+"""
+Prometheus metrics
+
+Counters, gauges and histograms rendered in the Prometheus text format by
+GET /metrics. Values live in an anonymous shared memory mapping created at
+import (like versions.py), so a scrape answered by any worker forked from
+the importing process reports the whole server.
+
+Each process writes only its own row of the mapping and a scrape sums the
+rows, so recording takes no lock: it's a dictionary lookup for the label
+values and a float addition. Only the first use of a new label combination
+takes a (cross-process) lock, to give the series a place in the mapping.
+A row left by a dead worker is taken over by the next new process; its
+counters carry on from where they were and its gauges are reset.
+
+Threads of one process may very rarely lose an increment to each other;
+that's the price of not locking.
+"""
+
+import asyncio
+import bisect
+import hashlib
+import inspect
+import mmap
+import multiprocessing
+import os
+import struct
+import time
+from functools import wraps
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+MAX_PROCESSES = 64
+VALUES_PER_PROCESS = 64 * 1024
+MAX_SERIES = 8192
+KEY_ARENA_BYTES = 1024 * 1024
+
+# Seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+PARSE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+# Bytes
+SIZE_BUCKETS = tuple(float(1024 * 4 ** i) for i in range(10))  # 1KB .. 256MB
+MEASURE_BUCKETS = (4.0, 8.0, 16.0, 32.0, 64.0, 128.0, 256.0, 512.0, 1024.0)
+
+_COUNTER, _GAUGE, _HISTOGRAM = 1, 2, 3
+
+# Series table entry: key hash, first value, value count, key offset, key length, kind
+_ENTRY = struct.Struct("<QIIIHH")
+# Header: next free value, next free key byte, then one owner pid per row
+_HEADER = struct.Struct("<II")
+_PIDS = struct.Struct(f"<{MAX_PROCESSES}q")
+
+
+class SharedStore:
+    """Series table and per-process value rows in memory shared with forked workers"""
+
+    def __init__(self):
+        self._table_offset = _HEADER.size + _PIDS.size
+        self._arena_offset = self._table_offset + MAX_SERIES * _ENTRY.size
+        self._values_offset = self._arena_offset + KEY_ARENA_BYTES
+        size = self._values_offset + 8 * MAX_PROCESSES * VALUES_PER_PROCESS
+        # fileno -1 maps shared anonymous memory, which survives fork
+        self._buffer = mmap.mmap(-1, size)
+        self.values = memoryview(self._buffer)[self._values_offset:].cast('d')
+        self._lock = multiprocessing.Lock()
+        self._offsets: Dict[str, Tuple[int, int]] = {}
+        self.base = -1
+        os.register_at_fork(after_in_child=self._forked)
+
+    def _forked(self):
+        self.base = -1
+
+    def claim_row(self) -> int:
+        """Index of this process's first value, taking over a free or dead row"""
+        pid = os.getpid()
+        with self._lock:
+            pids = list(_PIDS.unpack_from(self._buffer, _HEADER.size))
+            for row, owner in enumerate(pids):
+                if owner == 0 or owner == pid or not _alive(owner):
+                    break
+            else:
+                raise RuntimeError("No free metrics rows")
+            if owner not in (0, pid):
+                self._reset_gauges(row * VALUES_PER_PROCESS)
+            pids[row] = pid
+            _PIDS.pack_into(self._buffer, _HEADER.size, *pids)
+        self.base = row * VALUES_PER_PROCESS
+        return self.base
+
+    def _reset_gauges(self, base: int):
+        for _, offset, count, kind in self._entries():
+            if kind == _GAUGE:
+                self.values[base + offset:base + offset + count] = memoryview(bytes(8 * count)).cast('d')
+
+    def offset(self, key: str, kind: int, count: int) -> Optional[int]:
+        """Offset of a series' values within a row, allocating them on first use"""
+        known = self._offsets.get(key)
+        if known is not None:
+            return known[0]
+        encoded = key.encode()
+        digest = int.from_bytes(hashlib.blake2b(encoded, digest_size=8).digest(), 'little') or 1
+        with self._lock:
+            slot = digest % MAX_SERIES
+            for _ in range(MAX_SERIES):
+                position = self._table_offset + slot * _ENTRY.size
+                found, value_offset, value_count, key_offset, key_length, _ = _ENTRY.unpack_from(self._buffer, position)
+                if found == 0:
+                    break
+                if found == digest and self._buffer[self._arena_offset + key_offset:
+                                                    self._arena_offset + key_offset + key_length] == encoded:
+                    self._offsets[key] = (value_offset, value_count)
+                    return value_offset
+                slot = (slot + 1) % MAX_SERIES
+            else:
+                return None
+            next_value, next_key = _HEADER.unpack_from(self._buffer, 0)
+            if next_value + count > VALUES_PER_PROCESS or next_key + len(encoded) > KEY_ARENA_BYTES:
+                return None
+            self._buffer[self._arena_offset + next_key:self._arena_offset + next_key + len(encoded)] = encoded
+            _ENTRY.pack_into(self._buffer, position, digest, next_value, count, next_key, len(encoded), kind)
+            _HEADER.pack_into(self._buffer, 0, next_value + count, next_key + len(encoded))
+        self._offsets[key] = (next_value, count)
+        return next_value
+
+    def _entries(self):
+        """(key, offset, count, kind) of every series"""
+        for slot in range(MAX_SERIES):
+            digest, value_offset, count, key_offset, key_length, kind = _ENTRY.unpack_from(
+                self._buffer, self._table_offset + slot * _ENTRY.size)
+            if digest:
+                start = self._arena_offset + key_offset
+                yield self._buffer[start:start + key_length].decode(), value_offset, count, kind
+
+    def snapshot(self) -> Dict[str, List[List[float]]]:
+        """Every series' values, one list per process row in use"""
+        pids = _PIDS.unpack_from(self._buffer, _HEADER.size)
+        rows = [row * VALUES_PER_PROCESS for row, pid in enumerate(pids) if pid]
+        return {key: [self.values[base + offset:base + offset + count].tolist() for base in rows]
+                for key, offset, count, _ in self._entries()}
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+store = SharedStore()
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class _Series:
+    """One label combination of a metric"""
+    __slots__ = ("offset",)
+
+    def __init__(self, offset: int):
+        self.offset = offset
+
+    def _index(self) -> int:
+        base = store.base
+        if base < 0:
+            base = store.claim_row()
+        return base + self.offset
+
+
+class CounterSeries(_Series):
+    __slots__ = ()
+
+    def inc(self, amount: float = 1.0):
+        store.values[self._index()] += amount
+
+
+class GaugeSeries(_Series):
+    __slots__ = ()
+
+    def inc(self, amount: float = 1.0):
+        store.values[self._index()] += amount
+
+    def dec(self, amount: float = 1.0):
+        store.values[self._index()] -= amount
+
+    def set(self, value: float):
+        store.values[self._index()] = value
+
+
+class HistogramSeries(_Series):
+    __slots__ = ("bounds",)
+
+    def __init__(self, offset: int, bounds: Tuple[float, ...]):
+        super().__init__(offset)
+        self.bounds = bounds
+
+    def observe(self, value: float):
+        index = self._index()
+        values = store.values
+        values[index + bisect.bisect_left(self.bounds, value)] += 1
+        values[index + len(self.bounds) + 1] += value
+
+
+class _Dropped:
+    """Stands in for a series when the shared mapping is full"""
+
+    def inc(self, amount: float = 1.0):
+        pass
+
+    dec = set = observe = inc
+
+
+class Metric:
+    kind = 0
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._series: Dict[Tuple[str, ...], _Series] = {}
+        REGISTRY.append(self)
+
+    def _value_count(self) -> int:
+        return 1
+
+    def _make(self, offset: int) -> _Series:
+        raise NotImplementedError
+
+    def labels(self, *values: str):
+        """The series for these label values (cache it for hot paths)"""
+        series = self._series.get(values)
+        if series is None:
+            labels = ','.join(f'{name}="{_escape(str(value))}"' for name, value in zip(self.labelnames, values))
+            offset = store.offset(f"{self.name}{{{labels}}}", self.kind, self._value_count())
+            series = self._series[values] = self._make(offset) if offset is not None else _Dropped()
+        return series
+
+    def render(self, series: Dict[str, List[List[float]]]) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        prefix = self.name + "{"
+        for key in sorted(k for k in series if k.startswith(prefix)):
+            lines.extend(self._render_series(key[len(self.name) + 1:-1], series[key]))
+        return lines
+
+    def _render_series(self, labels: str, rows: List[List[float]]) -> List[str]:
+        total = sum(row[0] for row in rows)
+        return [f"{self.name}{{{labels}}} {_number(total)}" if labels else f"{self.name} {_number(total)}"]
+
+
+class Counter(Metric):
+    kind = _COUNTER
+    type_name = "counter"
+
+    def _make(self, offset: int) -> CounterSeries:
+        return CounterSeries(offset)
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+
+class Gauge(Metric):
+    """Summed over processes, or the largest process value with aggregate="max\""""
+    kind = _GAUGE
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), aggregate: str = "sum"):
+        super().__init__(name, documentation, labelnames)
+        self.aggregate = aggregate
+
+    def _make(self, offset: int) -> GaugeSeries:
+        return GaugeSeries(offset)
+
+    def _render_series(self, labels: str, rows: List[List[float]]) -> List[str]:
+        values = [row[0] for row in rows] or [0.0]
+        value = max(values) if self.aggregate == "max" else sum(values)
+        return [f"{self.name}{{{labels}}} {_number(value)}" if labels else f"{self.name} {_number(value)}"]
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+
+class Histogram(Metric):
+    kind = _HISTOGRAM
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.bounds = tuple(sorted(buckets))
+
+    def _value_count(self) -> int:
+        # One count per bucket, +Inf, then the sum
+        return len(self.bounds) + 2
+
+    def _make(self, offset: int) -> HistogramSeries:
+        return HistogramSeries(offset, self.bounds)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def _render_series(self, labels: str, rows: List[List[float]]) -> List[str]:
+        totals = [sum(column) for column in zip(*rows)] if rows else [0.0] * self._value_count()
+        separator = "," if labels else ""
+        lines = []
+        cumulative = 0.0
+        for bound, count in zip(self.bounds + (float("inf"),), totals):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else _number(bound)
+            lines.append(f'{self.name}_bucket{{{labels}{separator}le="{le}"}} {_number(cumulative)}')
+        suffix = f"{{{labels}}}" if labels else ""
+        lines.append(f"{self.name}_sum{suffix} {_number(totals[-1])}")
+        lines.append(f"{self.name}_count{suffix} {_number(cumulative)}")
+        return lines
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if value == int(value) and abs(value) < 2 ** 53 else repr(value)
+
+
+REGISTRY: List[Metric] = []
+
+
+def render() -> str:
+    """Every metric in the Prometheus text exposition format"""
+    series = store.snapshot()
+    lines: List[str] = []
+    for metric in REGISTRY:
+        lines.extend(metric.render(series))
+    return "\n".join(lines) + "\n"
+
+
+def time_methods(cls, histogram: Histogram):
+    """Time every public method of `cls` into `histogram`, labelled by method name"""
+    for name, function in list(vars(cls).items()):
+        if name.startswith('_') or not inspect.isfunction(function):
+            continue
+        setattr(cls, name, _timed(function, histogram.labels(name)))
+    return cls
+
+
+def _timed(function: Callable, series: HistogramSeries) -> Callable:
+    if inspect.isgeneratorfunction(function):
+        @wraps(function)
+        def timed_generator(*args, **kwargs):
+            # Time spent producing items, not the time the consumer holds the generator
+            generator = function(*args, **kwargs)
+            elapsed = 0.0
+            try:
+                while True:
+                    began = time.perf_counter()
+                    try:
+                        item = next(generator)
+                    finally:
+                        elapsed += time.perf_counter() - began
+                    yield item
+            except StopIteration:
+                pass
+            finally:
+                generator.close()
+                series.observe(elapsed)
+        return timed_generator
+
+    @wraps(function)
+    def timed(*args, **kwargs):
+        began = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            series.observe(time.perf_counter() - began)
+    return timed
+
+
+# HTTP
+HTTP_REQUEST_SECONDS = Histogram(
+    "sightreadpro_http_request_duration_seconds", "HTTP request latency by route template and status",
+    ("method", "route", "status"))
+HTTP_IN_FLIGHT = Gauge("sightreadpro_http_requests_in_flight", "HTTP requests being handled")
+
+# Database
+DB_QUERY_SECONDS = Histogram(
+    "sightreadpro_db_query_duration_seconds", "Time spent in each Database method", ("method",))
+
+# Uploads and parsing
+UPLOAD_BYTES = Counter("sightreadpro_upload_bytes_total", "Bytes received in uploads", ("kind",))
+PARSE_SECONDS = Histogram(
+    "sightreadpro_music21_parse_duration_seconds", "music21 MusicXML parse and store time", buckets=PARSE_BUCKETS)
+SCORE_BYTES = Histogram("sightreadpro_score_size_bytes", "Size of parsed MusicXML files", buckets=SIZE_BUCKETS)
+SCORE_MEASURES = Histogram("sightreadpro_score_measures", "Measures per parsed score", buckets=MEASURE_BUCKETS)
+
+# Caches
+CACHE_LOOKUPS = Counter("sightreadpro_cache_lookups_total", "Cache lookups by cache and result", ("cache", "result"))
+RESPONSE_CACHE_BYTES = Gauge("sightreadpro_response_cache_bytes", "Bytes of cached response bodies")
+
+# Admission control
+ADMISSION_QUEUED = Gauge("sightreadpro_admission_queued", "Requests waiting for admission", ("route_class",))
+ADMISSION_SHED = Counter(
+    "sightreadpro_admission_shed_total", "Requests answered 503 by admission control", ("route_class", "reason"))
+
+# Event loop
+EVENT_LOOP_LAG_SECONDS = Histogram(
+    "sightreadpro_event_loop_lag_seconds", "How late the event loop runs a timer",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0))
+EVENT_LOOP_LAG_MAX = Gauge(
+    "sightreadpro_event_loop_lag_max_seconds", "Latest event loop lag of the most lagging worker", aggregate="max")
+
+EVENT_LOOP_PROBE_SECONDS = 0.5
+
+
+async def monitor_event_loop(interval: float = EVENT_LOOP_PROBE_SECONDS):
+    """Measure how late a sleep wakes up, for as long as the loop runs"""
+    loop = asyncio.get_running_loop()
+    lag_histogram, lag_gauge = EVENT_LOOP_LAG_SECONDS.labels(), EVENT_LOOP_LAG_MAX.labels()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        lag = max(loop.time() - expected, 0.0)
+        lag_histogram.observe(lag)
+        lag_gauge.set(lag)
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing HTTP requests by route template and status"""
+
+    def __init__(self, app):
+        self.app = app
+        self._routes: Dict[Callable, str] = {}
+        self._series: Dict[Tuple[str, str, int], HistogramSeries] = {}
+
+    def _route_template(self, scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        template = self._routes.get(endpoint)
+        if template is None:
+            router = scope.get("router")
+            self._routes = {route.endpoint: route.path for route in getattr(router, "routes", ())
+                            if hasattr(route, "endpoint")}
+            template = self._routes.get(endpoint, "unmatched")
+        return template
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        in_flight = HTTP_IN_FLIGHT.labels()
+        in_flight.inc()
+        began = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - began
+            in_flight.dec()
+            key = (scope["method"], self._route_template(scope), status)
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = HTTP_REQUEST_SECONDS.labels(*key)
+            series.observe(elapsed)
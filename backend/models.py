@@ -16,6 +16,12 @@ class FileType(str, Enum):
     MUSICXML = "musicxml"
     XML = "xml"
 
+class ParseStatus(str, Enum):
+    PENDING = "pending"
+    PARSED = "parsed"
+    FAILED = "failed"
+    NOT_APPLICABLE = "not_applicable"
+
 class User(BaseModel):
     user_id: str = Field(..., description="Unique user identifier")
     xp: int = Field(default=0, description="User's experience points")
@@ -36,6 +42,15 @@ class Exercise(BaseModel):
     xp_reward: int = Field(default=10, description="XP earned for completing this exercise")
     created_at: datetime = Field(default_factory=datetime.now)
 
+class SimilarExercise(Exercise):
+    similarity: float = Field(..., description="Cosine similarity of exercise features (1 = identical)")
+
+class TransposedExercise(Exercise):
+    semitones: int = Field(0, description="Semitones shifted from the original key")
+    octave_shift: int = Field(0, description="Extra octaves applied to fit the instrument range")
+    in_range: bool = Field(True, description="Whether every note fits the instrument range")
+    instrument: str = Field("piano", description="Instrument used for the range check")
+
 class Performance(BaseModel):
     user_id: str = Field(..., description="User who performed the exercise")
     exercise_id: int = Field(..., description="Exercise that was performed")
@@ -47,19 +62,79 @@ class Performance(BaseModel):
     mistakes_count: Optional[int] = Field(None, description="Number of mistakes made")
     notes_played: Optional[List[str]] = Field(None, description="Notes that were actually played")
     performance_data: Optional[Dict[str, Any]] = Field(None, description="Additional performance metrics")
+    scoring_version: Optional[int] = Field(None, description="Server scoring rules version (None if client-scored)")
     submitted_at: datetime = Field(default_factory=datetime.now)
 
+class PerformanceSummary(BaseModel):
+    id: int = Field(..., description="Performance ID")
+    exercise_id: int = Field(..., description="Exercise that was performed")
+    score: int = Field(..., description="Performance score (0-100)")
+    accuracy: Optional[float] = Field(None, description="Note accuracy percentage")
+    rhythm_score: Optional[float] = Field(None, description="Rhythm accuracy percentage")
+    tempo_score: Optional[float] = Field(None, description="Tempo consistency percentage")
+    mistakes_count: Optional[int] = Field(None, description="Number of mistakes made")
+    practice_time_seconds: Optional[int] = Field(None, description="Time spent practicing")
+    scoring_version: Optional[int] = Field(None, description="Server scoring rules version (None if client-scored)")
+    has_events: bool = Field(False, description="Whether timestamped note events are stored")
+    submitted_at: datetime = Field(..., description="Submission time")
+
 class UploadResponse(BaseModel):
     message: str = Field(..., description="Upload status message")
     filename: str = Field(..., description="Saved filename")
     file_type: FileType = Field(..., description="Type of uploaded file")
     exercises: Optional[List[Exercise]] = Field(None, description="Generated exercises (for MusicXML)")
 
+class UploadRecord(BaseModel):
+    id: int = Field(..., description="Catalog entry ID")
+    filename: str = Field(..., description="Saved filename")
+    original_filename: Optional[str] = Field(None, description="Filename as uploaded")
+    owner_id: Optional[str] = Field(None, description="User who uploaded the file")
+    content_hash: Optional[str] = Field(None, description="SHA-256 of the file contents")
+    size_bytes: int = Field(..., description="File size in bytes")
+    file_type: FileType = Field(..., description="Type of uploaded file")
+    parse_status: ParseStatus = Field(..., description="MusicXML parse status")
+    parent_upload_id: Optional[int] = Field(None, description="Catalog entry this file is a revision of")
+    revision: int = Field(default=1, description="Revision number of the score")
+    uploaded_at: datetime = Field(..., description="Upload time")
+
+class UploadListResponse(BaseModel):
+    files: List[UploadRecord] = Field(..., description="Uploaded files, newest first")
+    count: int = Field(..., description="Number of files in this page")
+    next_cursor: Optional[str] = Field(None, description="Cursor for the next page, if any")
+
+class RevisionResponse(BaseModel):
+    message: str = Field(..., description="Revision status message")
+    filename: str = Field(..., description="Saved filename of the new revision")
+    previous_filename: str = Field(..., description="Filename of the revised upload")
+    revision: int = Field(..., description="Revision number of the new upload")
+    changed_measures: List[int] = Field(..., description="Measures (1-based) whose content changed")
+    regenerated_chunks: int = Field(..., description="Exercises generated from changed measures")
+    reused_chunks: int = Field(..., description="Exercises kept from the previous revision")
+    exercises: List[Exercise] = Field(..., description="Exercises of the new revision")
+
 class DailyExercisesResponse(BaseModel):
     user_id: str = Field(..., description="User ID")
     date: str = Field(..., description="Date of exercises")
     exercises: List[Exercise] = Field(..., description="List of daily exercises")
     total_count: int = Field(..., description="Total number of exercises")
+    review_count: int = Field(0, description="Leading exercises that are due reviews")
+
+class DueReviewsResponse(BaseModel):
+    user_id: str = Field(..., description="User ID")
+    exercises: List[Exercise] = Field(..., description="Exercises due for review, most overdue first")
+    total_due: int = Field(..., description="Number of exercises due for review")
+
+class PatternMatch(BaseModel):
+    exercise_id: int = Field(..., description="Exercise ID")
+    match_count: int = Field(..., description="Times the pattern occurs in the exercise")
+    positions: List[int] = Field(..., description="Note index where each occurrence starts (0-based)")
+    measures: List[int] = Field(..., description="Measure where each occurrence starts")
+
+class PatternSearchResponse(BaseModel):
+    pattern: str = Field(..., description="Pattern searched for")
+    intervals: int = Field(..., description="Number of intervals in the pattern")
+    results: List[PatternMatch] = Field(..., description="Matching exercises, most occurrences first")
+    total: int = Field(..., description="Number of matching exercises")
 
 class PerformanceResponse(BaseModel):
     message: str = Field(..., description="Performance submission message")
@@ -72,6 +147,14 @@ class PerformanceResponse(BaseModel):
     streak_updated: bool = Field(..., description="Whether streak was updated")
     new_streak: int = Field(..., description="Updated streak count")
 
+class RecordingPerformanceResponse(PerformanceResponse):
+    accuracy: float = Field(..., description="Percentage of expected notes played correctly")
+    rhythm_score: Optional[float] = Field(None, description="Rhythm accuracy percentage")
+    tempo_score: Optional[float] = Field(None, description="Tempo consistency percentage")
+    mistakes_count: int = Field(..., description="Missed, extra and wrong notes")
+    notes_detected: List[str] = Field(default_factory=list, description="Notes detected in the recording")
+    detected_tempo: Optional[float] = Field(None, description="Tempo the exercise was played at (BPM)")
+
 class UserProgress(BaseModel):
     user_id: str = Field(..., description="User ID")
     current_xp: int = Field(..., description="Current XP")
@@ -89,6 +172,15 @@ class UserTable(BaseModel):
     last_active_date: str
     created_at: str
     level: int
+    snapshot_event_id: int  # xp, streak and level cover the XP ledger up to this event
+
+class XPEventTable(BaseModel):
+    id: int
+    user_id: str
+    reason: int  # xp.REASONS
+    performance_id: Optional[int]
+    xp: int
+    day: Optional[int]  # date ordinal; None for adjustments
 
 class ExerciseTable(BaseModel):
     id: int
@@ -102,6 +194,19 @@ class ExerciseTable(BaseModel):
     xp_reward: int
     created_at: str
 
+class UploadTable(BaseModel):
+    id: int
+    filename: str
+    original_filename: Optional[str]
+    owner_id: Optional[str]
+    content_hash: Optional[str]
+    size_bytes: int
+    file_type: str
+    parse_status: str
+    parent_upload_id: Optional[int]
+    revision: int
+    created_at: str
+
 class PerformanceTable(BaseModel):
     id: int
     user_id: str
@@ -114,6 +219,8 @@ class PerformanceTable(BaseModel):
     mistakes_count: Optional[int]
     notes_played: Optional[str]  # JSON string
     performance_data: Optional[str]  # JSON string
+    scoring_version: Optional[int]
+    events: Optional[bytes]  # perf_events blob
     submitted_at: str
 
 
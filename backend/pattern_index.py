@@ -0,0 +1,187 @@
+"""
+Transposition-invariant melodic pattern search
+
+Every exercise is indexed by the interval trigrams of its melody (three
+successive semitone steps), each posting carrying where it starts: the note
+position and its measure. Intervals are key-independent, so a figure matches
+in any transposition. A posting also carries the rhythm of the four notes it
+spans, so a query can optionally pin the rhythm too.
+
+Trigram codes put the first interval in the most significant digit, and a
+melody's last two postings are padded, so a pattern shorter than a trigram
+is a contiguous code range. A longer pattern is covered by a few trigram
+windows whose posting lists are intersected, rarest first, on
+(exercise, start position); the work follows the posting-list sizes, not
+the library size.
+
+Pattern syntax: comma- or space-separated signed semitone steps ("+8,-1,-2"),
+where "+s"/"-s" stand for a step up/down (1 or 2 semitones) and steps
+beyond an octave and a semitone match any leap that large; or note names
+("E4 C5 B4 A4"), which are turned into intervals.
+"""
+
+import itertools
+import re
+from dataclasses import dataclass
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from score_store import RHYTHM_NAMES, quarter_lengths
+from transpose import notes_to_arrays, TranspositionError
+
+INDEX_VERSION = 1
+GRAM_LENGTH = 3
+
+# Steps beyond this many semitones share the largest code
+MAX_INTERVAL = 13
+INTERVAL_PAD = 2 * MAX_INTERVAL + 1
+INTERVAL_BASE = INTERVAL_PAD + 1
+
+RHYTHM_VALUES = np.array(sorted(RHYTHM_NAMES))
+RHYTHM_PAD = len(RHYTHM_VALUES)
+RHYTHM_BASE = RHYTHM_PAD + 1
+
+# Alternatives for the step tokens
+_STEP_TOKENS = {'+s': (1, 2), '-s': (-1, -2), 's': (-2, -1, 1, 2)}
+_INTERVAL_TOKEN = re.compile(r'^[+-]?\d+$')
+# Longest pattern accepted, in intervals
+MAX_PATTERN_INTERVALS = 32
+# Largest number of trigram codes one window may expand to
+MAX_WINDOW_CODES = 64
+
+
+class PatternError(ValueError):
+    """Raised for a pattern that cannot be parsed or searched"""
+
+
+@dataclass
+class Window:
+    """One trigram-sized slice of a query: where it starts and the codes it matches"""
+    offset: int
+    gram_ranges: List[Tuple[int, int]]
+    rhythm_range: Optional[Tuple[int, int]] = None
+
+
+def _interval_code(steps) -> np.ndarray:
+    return np.clip(steps, -MAX_INTERVAL, MAX_INTERVAL) + MAX_INTERVAL
+
+
+def rhythm_codes(lengths: np.ndarray) -> np.ndarray:
+    """Rhythm class (nearest named note value) of each duration in quarter notes"""
+    return np.abs(np.log2(lengths[:, None] / RHYTHM_VALUES[None, :])).argmin(axis=1)
+
+
+def _measure_length(time_signature: Optional[str]) -> float:
+    """Length of a measure in quarter notes (4/4 when unknown)"""
+    numerator, _, denominator = (time_signature or '').partition('/')
+    if numerator.strip().isdigit() and denominator.strip().isdigit() and int(numerator) and int(denominator):
+        return int(numerator) * 4.0 / int(denominator)
+    return 4.0
+
+
+def _first_measure(measures: Optional[str]) -> int:
+    start = (measures or '').split('-')[0].strip()
+    return int(start) if start.isdigit() else 1
+
+
+def exercise_postings(notes: Optional[Sequence[str]], rhythm_pattern: Optional[Sequence[str]],
+                      time_signature: Optional[str], measures: Optional[str]) -> List[Tuple[int, int, int, int]]:
+    """
+    Postings of one exercise as (gram, rhythm, position, measure) tuples
+
+    There is one per note that has a next note; the last two are padded.
+    """
+    try:
+        midi = notes_to_arrays(notes or [])[2].astype(np.int64)
+    except TranspositionError:
+        return []
+    count = len(midi)
+    if count < 2:
+        return []
+
+    steps = np.concatenate((_interval_code(np.diff(midi)), [INTERVAL_PAD] * (GRAM_LENGTH - 1)))
+    grams = np.zeros(count - 1, dtype=np.int64)
+    for i in range(GRAM_LENGTH):
+        grams = grams * INTERVAL_BASE + steps[i:i + count - 1]
+
+    lengths = quarter_lengths(rhythm_pattern, count)
+    classes = np.concatenate((rhythm_codes(lengths), [RHYTHM_PAD] * GRAM_LENGTH))
+    rhythms = np.zeros(count - 1, dtype=np.int64)
+    for i in range(GRAM_LENGTH + 1):
+        rhythms = rhythms * RHYTHM_BASE + classes[i:i + count - 1]
+
+    onsets = np.cumsum(lengths) - lengths
+    bars = _first_measure(measures) + np.floor(onsets[:count - 1] / _measure_length(time_signature) + 1e-9)
+    return list(zip(grams.tolist(), rhythms.tolist(), range(count - 1), bars.astype(np.int64).tolist()))
+
+
+def parse_pattern(pattern: str) -> List[Tuple[int, ...]]:
+    """The allowed semitone steps for each interval of a pattern"""
+    tokens = [token for token in re.split(r'[\s,]+', pattern.strip()) if token]
+    if not tokens:
+        raise PatternError("Pattern is empty")
+
+    if all(token.lower() in _STEP_TOKENS or _INTERVAL_TOKEN.match(token) for token in tokens):
+        steps = [_STEP_TOKENS.get(token.lower()) or (int(token),) for token in tokens]
+    else:
+        try:
+            midi = notes_to_arrays(tokens)[2].astype(np.int64)
+        except TranspositionError as e:
+            raise PatternError(f"Pattern must be semitone steps or note names: {e}")
+        steps = [(int(step),) for step in np.diff(midi)]
+
+    if not steps:
+        raise PatternError("Pattern needs at least one interval (two notes)")
+    if len(steps) > MAX_PATTERN_INTERVALS:
+        raise PatternError(f"Pattern is limited to {MAX_PATTERN_INTERVALS} intervals")
+    return steps
+
+
+def parse_rhythm(rhythm: str, note_count: int) -> List[int]:
+    """Rhythm classes for a comma-separated list of rhythm names, one per pattern note"""
+    names = [name.strip().lower() for name in rhythm.split(',') if name.strip()]
+    if len(names) != note_count:
+        raise PatternError(f"Rhythm needs one value per pattern note ({note_count}), got {len(names)}")
+    lengths = {name: ql for ql, name in RHYTHM_NAMES.items()}
+    unknown = [name for name in names if name not in lengths]
+    if unknown:
+        raise PatternError(f"Unknown rhythm '{unknown[0]}'")
+    return rhythm_codes(np.array([lengths[name] for name in names])).tolist()
+
+
+def _code_range(digits: Sequence[int], base: int, length: int) -> Tuple[int, int]:
+    """Codes starting with `digits`, whatever the remaining digits are"""
+    prefix = 0
+    for digit in digits:
+        prefix = prefix * base + digit
+    span = base ** (length - len(digits))
+    return prefix * span, prefix * span + span - 1
+
+
+def query_windows(steps: List[Tuple[int, ...]], rhythm: Optional[List[int]] = None) -> List[Window]:
+    """
+    Trigram windows covering every interval of a parsed pattern
+
+    A pattern of fewer intervals than a trigram is a single prefix window.
+    """
+    count = len(steps)
+    if count < GRAM_LENGTH:
+        offsets = [0]
+    else:
+        offsets = sorted(set(range(0, count - GRAM_LENGTH + 1, GRAM_LENGTH)) | {count - GRAM_LENGTH})
+
+    windows = []
+    for offset in offsets:
+        span = steps[offset:offset + GRAM_LENGTH]
+        choices = [sorted(set(_interval_code(np.array(alternatives)).tolist())) for alternatives in span]
+        combinations = list(itertools.islice(itertools.product(*choices), MAX_WINDOW_CODES + 1))
+        if len(combinations) > MAX_WINDOW_CODES:
+            raise PatternError("Pattern has too many step alternatives in a row")
+        windows.append(Window(
+            offset=offset,
+            gram_ranges=[_code_range(digits, INTERVAL_BASE, GRAM_LENGTH) for digits in combinations],
+            rhythm_range=(_code_range(rhythm[offset:offset + len(span) + 1], RHYTHM_BASE, GRAM_LENGTH + 1)
+                          if rhythm is not None else None),
+        ))
+    return windows
@@ -0,0 +1,173 @@
+"""
+Compact binary format for timestamped performance events
+
+A performance's note events (onset, pitch, velocity, duration) are stored
+column by column after a small header:
+
+    magic 'SRPE' | version u8 | flags u8 | count u32
+    onset_ms u32[count]      (differences from the previous onset if DELTA)
+    pitch u8[count]
+    velocity u8[count]
+    duration_ms u16[count]
+
+With the ZLIB flag everything after the header is zlib-compressed. Delta
+onsets are small and repetitive, so they compress far better than absolute
+times; decoding is a few frombuffer calls and one cumsum.
+"""
+
+import base64
+import struct
+import zlib
+from typing import List, Optional, Any, Sequence, Union
+
+import numpy as np
+
+MAGIC = b'SRPE'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<4sBBI')
+
+FLAG_DELTA = 1
+FLAG_ZLIB = 2
+
+EVENT_DTYPE = np.dtype([
+    ('onset_ms', '<u4'),
+    ('pitch', 'u1'),
+    ('velocity', 'u1'),
+    ('duration_ms', '<u2'),
+])
+_COLUMNS = [(name, EVENT_DTYPE[name]) for name in EVENT_DTYPE.names]
+
+MAX_EVENTS = 100_000
+MAX_DURATION_MS = 0xFFFF
+
+
+class PerformanceEventError(ValueError):
+    """Raised for event lists or blobs that are not valid"""
+
+
+def events_from_records(records: Sequence[Any]) -> np.ndarray:
+    """
+    Build an event array from client records, sorted by onset
+
+    Records are [onset_ms, pitch, velocity, duration_ms] lists or dicts
+    with those keys; velocity defaults to 64 and duration to 0.
+    """
+    if len(records) > MAX_EVENTS:
+        raise PerformanceEventError(f"Too many events (maximum {MAX_EVENTS})")
+
+    rows = []
+    for record in records:
+        if isinstance(record, dict):
+            rows.append((record['onset_ms'], record['pitch'], record.get('velocity', 64), record.get('duration_ms', 0)))
+        else:
+            if not 2 <= len(record) <= 4:
+                raise PerformanceEventError("Event records need 2 to 4 values")
+            rows.append(tuple(record) + (64, 0)[len(record) - 2:])
+
+    table = np.array(rows, dtype=np.float64).reshape(-1, 4)
+    if table.size and (table[:, 0].min() < 0 or table[:, 0].max() > 0xFFFFFFFF):
+        raise PerformanceEventError("onset_ms must be between 0 and 4294967295")
+    if table.size and (table[:, 1:3].min() < 0 or table[:, 1:3].max() > 127):
+        raise PerformanceEventError("pitch and velocity must be between 0 and 127")
+    if table.size and table[:, 3].min() < 0:
+        raise PerformanceEventError("duration_ms must not be negative")
+
+    events = np.empty(len(table), dtype=EVENT_DTYPE)
+    events['onset_ms'] = table[:, 0]
+    events['pitch'] = table[:, 1]
+    events['velocity'] = table[:, 2]
+    events['duration_ms'] = np.minimum(table[:, 3], MAX_DURATION_MS)
+    return events[np.argsort(events['onset_ms'], kind='stable')]
+
+
+def encode_events(events: np.ndarray, delta: bool = True, compress: bool = True) -> bytes:
+    """Encode an EVENT_DTYPE array (sorted by onset when delta is used)"""
+    onsets = events['onset_ms'].astype('<u4')
+    flags = 0
+    if delta:
+        onsets = np.diff(onsets, prepend=np.uint32(0)).astype('<u4')
+        flags |= FLAG_DELTA
+
+    body = b''.join(
+        (onsets if name == 'onset_ms' else events[name].astype(dtype)).tobytes()
+        for name, dtype in _COLUMNS
+    )
+    if compress:
+        body = zlib.compress(body, 6)
+        flags |= FLAG_ZLIB
+    return HEADER.pack(MAGIC, FORMAT_VERSION, flags, len(events)) + body
+
+
+def decode_events(blob: bytes) -> np.ndarray:
+    """Decode a blob written by encode_events into an EVENT_DTYPE array"""
+    if len(blob) < HEADER.size:
+        raise PerformanceEventError("Event data is truncated")
+    magic, version, flags, count = HEADER.unpack_from(blob)
+    if magic != MAGIC:
+        raise PerformanceEventError("Not a performance event blob")
+    if version > FORMAT_VERSION:
+        raise PerformanceEventError(f"Unsupported event format version {version}")
+    if count > MAX_EVENTS:
+        raise PerformanceEventError(f"Too many events (maximum {MAX_EVENTS})")
+
+    body = memoryview(blob)[HEADER.size:]
+    expected = count * EVENT_DTYPE.itemsize
+    if flags & FLAG_ZLIB:
+        # Inflate at most one byte past what the header allows, so a small blob can't expand without bound
+        decompressor = zlib.decompressobj()
+        try:
+            inflated = decompressor.decompress(body, expected + 1)
+        except zlib.error as e:
+            raise PerformanceEventError(f"Corrupt event data: {e}")
+        if len(inflated) > expected or decompressor.unconsumed_tail or decompressor.unused_data:
+            raise PerformanceEventError("Event data length does not match its header")
+        if not decompressor.eof:
+            raise PerformanceEventError("Event data is truncated")
+        body = memoryview(inflated)
+    if len(body) != expected:
+        raise PerformanceEventError("Event data length does not match its header")
+
+    events = np.empty(count, dtype=EVENT_DTYPE)
+    offset = 0
+    for name, dtype in _COLUMNS:
+        size = count * dtype.itemsize
+        events[name] = np.frombuffer(body[offset:offset + size], dtype=dtype)
+        offset += size
+    if flags & FLAG_DELTA:
+        events['onset_ms'] = np.cumsum(events['onset_ms'], dtype=np.uint64)
+    return events
+
+
+def events_from_payload(payload: Union[str, List[Any]]) -> np.ndarray:
+    """Events from an API payload: a list of records, or a base64-encoded blob"""
+    if isinstance(payload, str):
+        try:
+            return decode_events(base64.b64decode(payload, validate=True))
+        except ValueError as e:
+            raise PerformanceEventError(f"Invalid events: {e}")
+    if isinstance(payload, list):
+        try:
+            return events_from_records(payload)
+        except (KeyError, TypeError, ValueError) as e:
+            raise PerformanceEventError(f"Invalid events: {e}")
+    raise PerformanceEventError("events must be a list of records or a base64 string")
+
+
+def events_to_records(events: np.ndarray) -> List[List[int]]:
+    """Events as compact [onset_ms, pitch, velocity, duration_ms] lists"""
+    return np.column_stack([events[name].astype(np.int64) for name in EVENT_DTYPE.names]).tolist()
+
+
+def onset_seconds(events: np.ndarray) -> np.ndarray:
+    return events['onset_ms'].astype(np.float64) / 1000.0
+
+
+def summarize_events(events: Optional[np.ndarray]) -> dict:
+    """Small per-performance facts worth keeping next to the blob"""
+    if events is None or not len(events):
+        return {'event_count': 0}
+    return {
+        'event_count': int(len(events)),
+        'duration_ms': int(events['onset_ms'][-1]) + int(events['duration_ms'][-1]),
+        'mean_velocity': round(float(events['velocity'].mean()), 1),
+    }
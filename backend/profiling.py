@@ -0,0 +1,291 @@
+"""
+On-demand profiling
+
+Disabled unless PROFILING_TOKEN is set; then two ways to see where time goes:
+
+- Single request: send any request with `X-Profile-Token: <token>`. The
+  request is traced deterministically (every Python and C call on the event
+  loop thread made on behalf of that request, including Database calls and
+  music21 parsing, which then runs in-process instead of in the parse pool)
+  and the response is replaced by the profile. `X-Profile-Format` picks
+  `speedscope` (default, JSON for https://www.speedscope.app) or `collapsed`
+  (one `frame;frame;frame microseconds` line per stack, for flamegraph.pl).
+  The original status is in `X-Profiled-Status`.
+
+- Window: `POST /admin/profile?seconds=10&interval_ms=5&format=...` with the
+  same header samples every thread of the worker that answers it for that
+  long (statistical: weights are samples times the interval) and returns
+  the profile. Other requests are served normally meanwhile.
+
+When disabled, the middleware isn't installed and nothing is traced.
+"""
+
+import asyncio
+import contextvars
+import hmac
+import json
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import Response
+
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN", "")
+MAX_WINDOW_SECONDS = 60
+
+FORMATS = ("speedscope", "collapsed")
+
+# Set while the current task's request is being traced
+_profiling: contextvars.ContextVar[bool] = contextvars.ContextVar("profiling", default=False)
+_busy = threading.Lock()
+
+_SITE_PACKAGES = "site-packages" + os.sep
+_BACKEND_DIR = os.path.dirname(os.path.abspath(__file__)) + os.sep
+
+Stack = Tuple[str, ...]
+
+
+def enabled() -> bool:
+    return bool(PROFILING_TOKEN)
+
+
+def authorized(token: Optional[str]) -> bool:
+    return enabled() and token is not None and hmac.compare_digest(token, PROFILING_TOKEN)
+
+
+def profiling_request() -> bool:
+    """Whether the current request is being traced (e.g. to keep work in-process)"""
+    return _profiling.get()
+
+
+def _short_path(path: str) -> str:
+    if path.startswith(_BACKEND_DIR):
+        return path[len(_BACKEND_DIR):]
+    index = path.rfind(_SITE_PACKAGES)
+    return path[index + len(_SITE_PACKAGES):] if index >= 0 else path
+
+
+_labels: Dict[object, str] = {}
+
+
+def _code_label(code) -> str:
+    label = _labels.get(code)
+    if label is None:
+        label = _labels[code] = f"{code.co_qualname} ({_short_path(code.co_filename)}:{code.co_firstlineno})"
+    return label
+
+
+def _builtin_label(function) -> str:
+    label = _labels.get(function)
+    if label is None:
+        owner = getattr(function, "__self__", None)
+        prefix = type(owner).__name__ + "." if owner is not None and not isinstance(owner, type(sys)) else ""
+        module = getattr(function, "__module__", None) or ""
+        label = _labels[function] = f"{prefix}{function.__name__} ({module or 'builtin'})"
+    return label
+
+
+def _frame_stack(frame) -> Stack:
+    labels = []
+    while frame is not None:
+        labels.append(_code_label(frame.f_code))
+        frame = frame.f_back
+    return tuple(reversed(labels))
+
+
+class Tracer:
+    """
+    Deterministic tracer for one request on the current thread
+
+    Wall time between profiler events goes to the stack that was running.
+    While the request awaits, the loop idles or runs other tasks; that time
+    is collected under one "[other tasks or idle]" frame.
+    """
+
+    OTHER = ("[other tasks or idle]",)
+
+    def __init__(self):
+        self.totals: Dict[Stack, int] = defaultdict(int)
+        self._stacks: Dict[object, Stack] = {}
+        self._current: Stack = ()
+        self._last = 0
+
+    def _stack_of(self, frame) -> Stack:
+        if frame is None:
+            return ()
+        stack = self._stacks.get(frame)
+        return stack if stack is not None else _frame_stack(frame)
+
+    def _event(self, frame, event, arg):
+        now = time.perf_counter_ns()
+        self.totals[self._current] += now - self._last
+        self._last = now
+        if not _profiling.get():
+            self._current = self.OTHER
+            return
+        if event == "call":
+            stack = self._stack_of(frame.f_back) + (_code_label(frame.f_code),)
+            self._stacks[frame] = self._current = stack
+        elif event == "return":
+            self._stacks.pop(frame, None)
+            self._current = self._stack_of(frame.f_back)
+        elif event == "c_call":
+            self._current = self._stack_of(frame) + (_builtin_label(arg),)
+        else:  # c_return, c_exception
+            self._current = self._stack_of(frame)
+
+    def start(self):
+        self._last = time.perf_counter_ns()
+        sys.setprofile(self._event)
+
+    def stop(self):
+        sys.setprofile(None)
+        self.totals[self._current] += time.perf_counter_ns() - self._last
+        self.totals.pop((), None)
+        self._stacks.clear()
+
+    def weights(self) -> Dict[Stack, float]:
+        """Microseconds per stack"""
+        return {stack: nanoseconds / 1000 for stack, nanoseconds in self.totals.items() if nanoseconds}
+
+
+def sample_threads(seconds: float, interval: float, stop: threading.Event) -> Dict[Stack, float]:
+    """Sample every other thread's stack each `interval` for `seconds`; microseconds per stack"""
+    own = threading.get_ident()
+    names = {thread.ident: thread.name for thread in threading.enumerate()}
+    counts: Dict[Stack, int] = defaultdict(int)
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline and not stop.is_set():
+        for ident, frame in sys._current_frames().items():
+            if ident != own:
+                counts[(f"[thread {names.get(ident, ident)}]",) + _frame_stack(frame)] += 1
+        time.sleep(interval)
+    return {stack: count * interval * 1_000_000 for stack, count in counts.items()}
+
+
+def collapsed(weights: Dict[Stack, float]) -> str:
+    """Brendan Gregg's collapsed stack format, integer microseconds"""
+    lines = [f"{';'.join(frame.replace(';', ':') for frame in stack)} {round(value)}"
+             for stack, value in sorted(weights.items()) if round(value) > 0]
+    return "\n".join(lines) + "\n"
+
+
+def speedscope(weights: Dict[Stack, float], name: str) -> str:
+    """A speedscope file with one sampled profile, weights in microseconds"""
+    frame_index: Dict[str, int] = {}
+    frames: List[Dict[str, str]] = []
+    samples: List[List[int]] = []
+    values: List[float] = []
+    for stack, value in sorted(weights.items()):
+        indexes = []
+        for label in stack:
+            index = frame_index.get(label)
+            if index is None:
+                index = frame_index[label] = len(frames)
+                frames.append({"name": label})
+            indexes.append(index)
+        samples.append(indexes)
+        values.append(round(value, 1))
+    total = sum(values)
+    return json.dumps({
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "shared": {"frames": frames},
+        "profiles": [{
+            "type": "sampled", "name": name, "unit": "microseconds",
+            "startValue": 0, "endValue": total, "samples": samples, "weights": values,
+        }],
+        "name": name,
+        "exporter": "sightreadpro",
+    })
+
+
+def profile_response(weights: Dict[Stack, float], output: str, name: str,
+                     headers: Optional[Dict[str, str]] = None) -> Response:
+    if output == "collapsed":
+        return Response(content=collapsed(weights), media_type="text/plain", headers=headers)
+    return Response(content=speedscope(weights, name), media_type="application/json", headers=headers)
+
+
+def _header(scope, name: bytes) -> Optional[str]:
+    for key, value in scope["headers"]:
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+
+class ProfilingMiddleware:
+    """ASGI middleware tracing requests that carry a valid X-Profile-Token"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not authorized(_header(scope, b"x-profile-token")):
+            return await self.app(scope, receive, send)
+        if scope["path"] == "/admin/profile":
+            return await self.app(scope, receive, send)
+
+        output = _header(scope, b"x-profile-format") or "speedscope"
+        if output not in FORMATS:
+            return await Response(status_code=400, content=f"X-Profile-Format must be one of {FORMATS}")(
+                scope, receive, send)
+        if not _busy.acquire(blocking=False):
+            return await Response(status_code=409, content="Another profile is running")(scope, receive, send)
+
+        status = 500
+
+        async def discard(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+
+        tracer = Tracer()
+        token = _profiling.set(True)
+        tracer.start()
+        try:
+            await self.app(scope, receive, discard)
+        finally:
+            tracer.stop()
+            _profiling.reset(token)
+            _busy.release()
+
+        name = f"{scope['method']} {scope['path']}"
+        await profile_response(tracer.weights(), output, name, {"X-Profiled-Status": str(status)})(
+            scope, receive, send)
+
+
+router = APIRouter(prefix="/admin", tags=["admin"])
+
+
+@router.post("/profile", include_in_schema=False)
+async def profile_window(
+    request: Request,
+    seconds: float = Query(10.0, gt=0, le=MAX_WINDOW_SECONDS),
+    interval_ms: float = Query(5.0, ge=1, le=1000),
+    format: str = Query("speedscope")
+):
+    """Sample this worker's threads for a while and return the profile"""
+    if not authorized(request.headers.get("x-profile-token")):
+        raise HTTPException(status_code=404, detail="Not Found")
+    if format not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {FORMATS}")
+    if not _busy.acquire(blocking=False):
+        raise HTTPException(status_code=409, detail="Another profile is running")
+
+    stop = threading.Event()
+    try:
+        sampling = asyncio.get_running_loop().run_in_executor(
+            None, sample_threads, seconds, interval_ms / 1000, stop)
+        try:
+            weights = await sampling
+        except asyncio.CancelledError:
+            stop.set()
+            raise
+    finally:
+        _busy.release()
+
+    return profile_response(weights, format, f"{seconds:g}s window, pid {os.getpid()}")
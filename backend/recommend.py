@@ -0,0 +1,138 @@
+"""
+Daily exercise recommendation
+
+Picks a user's daily exercises around a target difficulty derived from
+their level and recent scores, skipping exercises they practiced recently.
+Recent history is a per-user Bloom filter over exercise IDs with two weekly
+generations (so it forgets after one to two weeks); it is a fixed 1KB per
+user however much they practice, and checking a batch of candidates against
+it is one vectorized lookup.
+"""
+
+import hashlib
+from datetime import date
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+DIFFICULTIES = ['easy', 'medium', 'hard']
+
+# Bloom filter geometry: about 0.1% false positives at 200 exercises a week
+FILTER_BITS = 4096
+FILTER_HASHES = 4
+GENERATION_DAYS = 7
+
+# Level at which each difficulty becomes the default target
+DIFFICULTY_LEVELS = {'easy': 1, 'medium': 4, 'hard': 8}
+# Recent average score that moves the target up or down one step
+STEP_UP_SCORE = 85.0
+STEP_DOWN_SCORE = 60.0
+RECENT_PERFORMANCES = 10
+# Share of the daily set at the target difficulty (the rest goes to neighbours)
+TARGET_SHARE = 0.6
+# Candidates drawn per exercise wanted, to leave room for recently practiced ones
+CANDIDATE_OVERSAMPLE = 3
+
+_MASK64 = np.uint64(0xFFFFFFFFFFFFFFFF)
+
+
+def _mix64(values: np.ndarray) -> np.ndarray:
+    """splitmix64 finaliser, vectorized"""
+    with np.errstate(over='ignore'):
+        z = values.astype(np.uint64) + np.uint64(0x9E3779B97F4A7C15)
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return (z ^ (z >> np.uint64(31))) & _MASK64
+
+
+def _bit_positions(exercise_ids: np.ndarray) -> np.ndarray:
+    """(n, FILTER_HASHES) bit positions by double hashing"""
+    h1 = _mix64(exercise_ids)
+    h2 = _mix64(h1) | np.uint64(1)
+    steps = np.arange(FILTER_HASHES, dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        return ((h1[:, None] + steps[None, :] * h2[:, None]) % np.uint64(FILTER_BITS)).astype(np.int64)
+
+
+def generation_of(day: date) -> int:
+    return day.toordinal() // GENERATION_DAYS
+
+
+class RecentExercises:
+    """Two-generation Bloom filter of the exercises a user practiced recently"""
+
+    __slots__ = ('generation', 'current', 'previous')
+
+    SIZE = FILTER_BITS // 8
+
+    def __init__(self, generation: int, current: Optional[np.ndarray] = None,
+                 previous: Optional[np.ndarray] = None):
+        self.generation = generation
+        self.current = current if current is not None else np.zeros(self.SIZE, dtype=np.uint8)
+        self.previous = previous if previous is not None else np.zeros(self.SIZE, dtype=np.uint8)
+
+    @classmethod
+    def load(cls, stored_generation: Optional[int], blob: Optional[bytes], today: date) -> 'RecentExercises':
+        """Restore a stored filter, aged to today's generation"""
+        generation = generation_of(today)
+        if blob is None or stored_generation is None or len(blob) != 2 * cls.SIZE:
+            return cls(generation)
+        bits = np.frombuffer(blob, dtype=np.uint8)
+        current, previous = bits[:cls.SIZE].copy(), bits[cls.SIZE:].copy()
+        if stored_generation == generation:
+            return cls(generation, current, previous)
+        if stored_generation == generation - 1:
+            return cls(generation, None, current)
+        return cls(generation)
+
+    def to_blob(self) -> bytes:
+        return self.current.tobytes() + self.previous.tobytes()
+
+    def add(self, exercise_id: int):
+        positions = _bit_positions(np.array([exercise_id]))[0]
+        np.bitwise_or.at(self.current, positions >> 3, (1 << (positions & 7)).astype(np.uint8))
+
+    def contains(self, exercise_ids: List[int]) -> np.ndarray:
+        """Boolean mask: which IDs were (probably) practiced recently"""
+        if not exercise_ids:
+            return np.zeros(0, dtype=bool)
+        positions = _bit_positions(np.asarray(exercise_ids))
+        bits = self.current | self.previous
+        return ((bits[positions >> 3] >> (positions & 7)) & 1).astype(bool).all(axis=1)
+
+
+def target_difficulty(level: int, recent_score: Optional[float]) -> str:
+    """Difficulty for a user's level, nudged by how their recent performances went"""
+    index = max(i for i, name in enumerate(DIFFICULTIES) if level >= DIFFICULTY_LEVELS[name])
+    if recent_score is not None:
+        if recent_score >= STEP_UP_SCORE:
+            index += 1
+        elif recent_score < STEP_DOWN_SCORE:
+            index -= 1
+    return DIFFICULTIES[min(max(index, 0), len(DIFFICULTIES) - 1)]
+
+
+def difficulty_quotas(target: str, limit: int) -> Dict[str, int]:
+    """How many exercises to draw from each difficulty, target first"""
+    index = DIFFICULTIES.index(target)
+    neighbours = [DIFFICULTIES[i] for i in (index - 1, index + 1) if 0 <= i < len(DIFFICULTIES)]
+    quotas = {target: max(int(round(limit * TARGET_SHARE)), 1) if neighbours else limit}
+    remaining = limit - quotas[target]
+    for i, name in enumerate(neighbours):
+        share = remaining // (len(neighbours) - i)
+        quotas[name] = share
+        remaining -= share
+    return {name: count for name, count in quotas.items() if count > 0}
+
+
+def daily_seed(user_id: str, day: str) -> int:
+    """Stable seed so a user's set for a day is reproducible"""
+    return int.from_bytes(hashlib.blake2b(f"{user_id}|{day}".encode(), digest_size=8).digest(), 'little')
+
+
+def prefer_fresh(candidates: List[int], recent: RecentExercises, count: int) -> Tuple[List[int], List[int]]:
+    """Split candidates into (up to `count` not practiced recently, the practiced rest)"""
+    practiced = recent.contains(candidates)
+    fresh = [c for c, seen in zip(candidates, practiced.tolist()) if not seen]
+    stale = [c for c, seen in zip(candidates, practiced.tolist()) if seen]
+    return fresh[:count], stale
@@ -0,0 +1,121 @@
+"""
+Spaced-repetition scheduling of exercise reviews
+
+Each (user, exercise) pair keeps SM-2 memory state: ease factor, current
+interval, successful repetitions in a row and lapses. Every performance is a
+review graded from its score; a pass lengthens the interval (1 day, 6 days,
+then interval x ease), a fail resets it to a day and lowers the ease.
+
+`schedule` works element-wise on arrays, so the same rules serve a single
+submission and the nightly rebuild (`replay`), which applies them to every
+pair at once, one review step at a time.
+"""
+
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+DEFAULT_EASE = 2.5
+MIN_EASE = 1.3
+# Grades (0-5) from this up count as remembered
+PASSING_GRADE = 3
+FIRST_INTERVAL_DAYS = 1.0
+SECOND_INTERVAL_DAYS = 6.0
+# Longest interval; without a cap, a long run of passes overflows dates
+MAX_INTERVAL_DAYS = 36500.0
+# Share of a daily set given to due reviews
+REVIEW_SHARE = 0.4
+
+SECONDS_PER_DAY = 86400
+
+
+def grade_from_score(score) -> np.ndarray:
+    """SM-2 grade (0-5) from a 0-100 performance score"""
+    return np.clip(np.round(np.asarray(score, dtype=np.float64) / 20.0), 0, 5)
+
+
+def schedule(ease, interval_days, repetitions, grade):
+    """
+    Apply one review to SM-2 state (scalars or arrays of equal length)
+
+    Returns (ease, interval_days, repetitions, lapsed).
+    """
+    ease = np.asarray(ease, dtype=np.float64)
+    interval_days = np.asarray(interval_days, dtype=np.float64)
+    grade = np.asarray(grade, dtype=np.float64)
+
+    passed = grade >= PASSING_GRADE
+    repetitions = np.where(passed, np.asarray(repetitions) + 1, 0)
+    interval_days = np.where(
+        ~passed | (repetitions == 1), FIRST_INTERVAL_DAYS,
+        np.where(repetitions == 2, SECOND_INTERVAL_DAYS, np.minimum(np.round(interval_days * ease), MAX_INTERVAL_DAYS))
+    )
+    miss = 5.0 - grade
+    ease = np.maximum(ease + 0.1 - miss * (0.08 + miss * 0.02), MIN_EASE)
+    return ease, interval_days, repetitions, ~passed
+
+
+def replay(pair_index: np.ndarray, grades: np.ndarray, reviewed_at: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Rebuild review state from full histories
+
+    `pair_index` numbers the (user, exercise) pairs 0..P-1 and must be
+    sorted, with each pair's reviews in time order; `reviewed_at` is
+    datetime64. Returns per-pair arrays: ease, interval_days, repetitions,
+    lapses, last_reviewed_at and due_at.
+    """
+    count = int(pair_index[-1]) + 1 if len(pair_index) else 0
+    starts = np.searchsorted(pair_index, np.arange(count))
+    step = np.arange(len(pair_index)) - starts[pair_index]
+
+    ease = np.full(count, DEFAULT_EASE)
+    interval_days = np.zeros(count)
+    repetitions = np.zeros(count, dtype=np.int64)
+    lapses = np.zeros(count, dtype=np.int64)
+
+    # Review n of every pair is applied together
+    order = np.argsort(step, kind='stable')
+    boundaries = np.searchsorted(step[order], np.arange(1, step.max() + 1 if len(step) else 0))
+    for rows in np.split(order, boundaries):
+        pairs = pair_index[rows]
+        ease[pairs], interval_days[pairs], repetitions[pairs], lapsed = schedule(
+            ease[pairs], interval_days[pairs], repetitions[pairs], grades[rows]
+        )
+        lapses[pairs] += lapsed
+
+    last_reviewed_at = reviewed_at[np.r_[starts[1:], len(pair_index)] - 1] if count else reviewed_at[:0]
+    return {
+        'ease': ease,
+        'interval_days': interval_days,
+        'repetitions': repetitions,
+        'lapses': lapses,
+        'last_reviewed_at': last_reviewed_at,
+        'due_at': last_reviewed_at + (interval_days * SECONDS_PER_DAY).astype('timedelta64[s]'),
+    }
+
+
+def rebuild_states(rows) -> List[Tuple]:
+    """
+    Review state rows for performances sorted by user, exercise and time
+
+    Rows carry user_id, exercise_id, score and submitted_at; the result
+    matches the review_state columns.
+    """
+    if not rows:
+        return []
+    users = [row['user_id'] for row in rows]
+    exercises = np.array([row['exercise_id'] for row in rows], dtype=np.int64)
+    new_pair = np.ones(len(rows), dtype=bool)
+    new_pair[1:] = (exercises[1:] != exercises[:-1]) | (np.array(users[1:]) != np.array(users[:-1]))
+    pair_index = np.cumsum(new_pair) - 1
+    reviewed_at = np.array([row['submitted_at'] for row in rows], dtype='datetime64[s]')
+
+    state = replay(pair_index, grade_from_score([row['score'] for row in rows]), reviewed_at)
+    firsts = np.flatnonzero(new_pair)
+    last_reviewed = np.datetime_as_string(state['last_reviewed_at'], unit='s')
+    due = np.datetime_as_string(state['due_at'], unit='s')
+    return [
+        (users[first], int(exercises[first]), float(state['ease'][i]), float(state['interval_days'][i]),
+         int(state['repetitions'][i]), int(state['lapses'][i]), str(last_reviewed[i]), str(due[i]))
+        for i, first in enumerate(firsts.tolist())
+    ]
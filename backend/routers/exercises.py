@@ -1,47 +1,77 @@
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, HTTPException, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import FileResponse, Response
+from starlette.concurrency import run_in_threadpool
+import os
+import json
+import time
+import numpy as np
 from typing import List, Optional
 from datetime import datetime
-from models import Exercise, DailyExercisesResponse, DifficultyLevel
+from models import (
+    Exercise, DailyExercisesResponse, DueReviewsResponse, DifficultyLevel, TransposedExercise, SimilarExercise,
+    PatternMatch, PatternSearchResponse
+)
 from db import db
+from transpose import transpose_exercise, TranspositionError, ALL_KEYS
+from synth import audio_cache, parse_range, SynthesisError, INSTRUMENT_VOICES
+from follower import ScoreFollower, LiveNoteDetector, expected_notes_for
+from similarity import similarity_index
+from transpose import notes_to_arrays
+from pattern_index import parse_pattern, parse_rhythm, query_windows, PatternError
+from http_cache import (
+    response_cache, etag_for, json_array_response, CACHE_IMMUTABLE, CACHE_REVALIDATE, CACHE_PRIVATE
+)
+from versions import data_versions, LIBRARY
 
 router = APIRouter(prefix="/exercises", tags=["exercises"])
 
+# Live practice sessions held open at once by this worker
+MAX_PRACTICE_SESSIONS = int(os.getenv("MAX_PRACTICE_SESSIONS", "5000"))
+# Largest audio chunk accepted over a practice socket (about 1.5s of 22kHz PCM)
+MAX_AUDIO_CHUNK_BYTES = 64 * 1024
+active_practice_sessions = 0
+
 @router.get("/daily/{user_id}", response_model=DailyExercisesResponse)
 async def get_daily_exercises(
     user_id: str,
+    request: Request,
     limit: int = Query(default=5, ge=1, le=20, description="Number of exercises to return"),
     difficulty: Optional[DifficultyLevel] = Query(None, description="Filter by difficulty level")
 ):
     """
     Get daily exercises for a specific user
     
-    TODO: Implement AI-powered exercise selection:
-    - Analyze user's current level and progress
-    - Select exercises based on learning objectives
-    - Ensure appropriate difficulty progression
-    - Consider user's practice history and preferences
+    Exercises due for spaced-repetition review come first (`review_count`
+    of them); new ones are picked around a difficulty that follows the
+    user's level and recent scores (or only from `difficulty` when given),
+    skipping ones practiced in the last week or two. The set is fixed for
+    the day, and revalidated through its ETag.
     """
     
     try:
-        # Get exercises for the user
-        exercises = db.get_daily_exercises_for_user(user_id, limit=limit)
+        current_date = datetime.now().strftime('%Y-%m-%d')
+        slot = data_versions.user_slot(user_id)
         
-        # Filter by difficulty if specified
-        if difficulty:
-            exercises = [ex for ex in exercises if ex.difficulty == difficulty]
+        def daily_etag() -> str:
+            return etag_for('daily', data_versions.epoch, data_versions.version(slot), user_id, current_date,
+                            limit, difficulty.value if difficulty else None)
         
-        # If no exercises found, return sample exercises
-        if not exercises:
-            exercises = db.get_exercises(limit=limit, difficulty=difficulty.value if difficulty else None)
+        cached = response_cache.lookup(request, daily_etag(), CACHE_PRIVATE)
+        if cached:
+            return cached
         
-        current_date = datetime.now().strftime('%Y-%m-%d')
+        exercises, review_count = db.get_daily_exercises_for_user(
+            user_id, limit=limit, difficulty=difficulty.value if difficulty else None
+        )
         
-        return DailyExercisesResponse(
+        # Choosing the set stores it (a write), so the ETag is taken afterwards
+        return response_cache.store(daily_etag(), CACHE_PRIVATE, DailyExercisesResponse(
             user_id=user_id,
             date=current_date,
             exercises=exercises,
-            total_count=len(exercises)
-        )
+            total_count=len(exercises),
+            review_count=review_count
+        ), slots=[slot])
         
     except Exception as e:
         raise HTTPException(
@@ -49,6 +79,85 @@ async def get_daily_exercises(
             detail=f"Failed to get daily exercises: {str(e)}"
         )
 
+@router.get("/reviews/{user_id}", response_model=DueReviewsResponse)
+async def get_due_reviews(
+    user_id: str,
+    limit: int = Query(default=20, ge=1, le=100, description="Number of exercises to return")
+):
+    """Get exercises due for spaced-repetition review, most overdue first"""
+    
+    try:
+        exercises, total_due = db.get_due_reviews(user_id, limit=limit)
+        return DueReviewsResponse(user_id=user_id, exercises=exercises, total_due=total_due)
+        
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to get due reviews: {str(e)}"
+        )
+
+@router.get("/similar-to-mistakes/{user_id}", response_model=List[SimilarExercise])
+async def get_exercises_like_mistakes(
+    user_id: str,
+    k: int = Query(default=10, ge=1, le=100, description="Number of exercises to return"),
+    difficulty: Optional[DifficultyLevel] = Query(None, description="Only return this difficulty")
+):
+    """Get new exercises resembling the ones the user recently scored poorly on"""
+    
+    try:
+        struggled = db.get_struggled_exercise_ids(user_id)
+        if not struggled:
+            return []
+        await run_in_threadpool(similarity_index.sync, db)
+        vectors = [v for v in (similarity_index.vector_for(i) for i in struggled) if v is not None]
+        if not vectors:
+            return []
+        centroid = np.mean(vectors, axis=0)
+        centroid /= np.linalg.norm(centroid) or 1.0
+        return await run_in_threadpool(_similar_exercises, centroid.astype(np.float32), k, struggled, difficulty)
+        
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to find similar exercises: {str(e)}"
+        )
+
+@router.get("/pattern-search", response_model=PatternSearchResponse)
+async def search_melodic_pattern(
+    pattern: str = Query(..., description="Semitone steps such as '+8,-s,-s' ('+s'/'-s' = step up/down), or note names"),
+    rhythm: Optional[str] = Query(None, description="Comma-separated rhythm names, one per pattern note"),
+    limit: int = Query(default=20, ge=1, le=100, description="Number of exercises to return")
+):
+    """
+    Find exercises containing a melodic figure, in any key
+    
+    Matches interval sequences through the trigram index, so a figure is
+    found whatever note it starts on. Each result lists where the figure
+    starts, as note positions and measures.
+    """
+    
+    try:
+        steps = parse_pattern(pattern)
+        windows = query_windows(steps, parse_rhythm(rhythm, len(steps) + 1) if rhythm else None)
+        matches, total = await run_in_threadpool(db.search_patterns, windows, limit)
+        return PatternSearchResponse(
+            pattern=pattern,
+            intervals=len(steps),
+            results=[
+                PatternMatch(exercise_id=exercise_id, match_count=len(positions), positions=positions, measures=measures)
+                for exercise_id, positions, measures in matches
+            ],
+            total=total
+        )
+        
+    except PatternError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to search melodic pattern: {str(e)}"
+        )
+
 @router.get("/", response_model=List[Exercise])
 async def get_all_exercises(
     limit: int = Query(default=20, ge=1, le=100, description="Number of exercises to return"),
@@ -66,13 +175,14 @@ async def get_all_exercises(
     """
     
     try:
-        exercises = db.get_exercises(limit=limit, difficulty=difficulty.value if difficulty else None)
+        # Rows are serialized by SQLite (see db.EXERCISE_JSON_SQL)
+        exercises = db.get_exercises_json(limit=limit, difficulty=difficulty.value if difficulty else None)
         
         # Apply offset (simple pagination)
         if offset > 0:
             exercises = exercises[offset:offset + limit]
         
-        return exercises
+        return json_array_response(exercises)
         
     except Exception as e:
         raise HTTPException(
@@ -81,13 +191,17 @@ async def get_all_exercises(
         )
 
 @router.get("/{exercise_id}", response_model=Exercise)
-async def get_exercise_by_id(exercise_id: int):
-    """Get a specific exercise by ID"""
+async def get_exercise_by_id(exercise_id: int, request: Request):
+    """Get a specific exercise by ID (exercises never change once stored)"""
     
     try:
-        # Get all exercises and find the one with matching ID
-        exercises = db.get_exercises(limit=1000)  # Get all exercises
-        exercise = next((ex for ex in exercises if ex.id == exercise_id), None)
+        # IDs are only stable within one database, so the epoch is part of the tag
+        etag = etag_for('exercise', data_versions.epoch, exercise_id)
+        cached = response_cache.lookup(request, etag, CACHE_IMMUTABLE)
+        if cached:
+            return cached
+        
+        exercise = db.get_exercise(exercise_id)
         
         if not exercise:
             raise HTTPException(
@@ -95,7 +209,7 @@ async def get_exercise_by_id(exercise_id: int):
                 detail=f"Exercise with ID {exercise_id} not found"
             )
         
-        return exercise
+        return response_cache.store(etag, CACHE_IMMUTABLE, exercise)
         
     except HTTPException:
         raise
@@ -105,6 +219,268 @@ async def get_exercise_by_id(exercise_id: int):
             detail=f"Failed to get exercise: {str(e)}"
         )
 
+def _transposed(exercise: Exercise, keys: List[str], instrument: str) -> List[TransposedExercise]:
+    """Transpose an exercise's notes into each key, reusing cached variants"""
+    variants = transpose_exercise(exercise.id, exercise.notes or [], exercise.key_signature or 'C',
+                                  keys, instrument)
+    base = exercise.model_dump()
+    return [
+        TransposedExercise(**{
+            **base,
+            "key_signature": variant["key_signature"],
+            "notes": variant["notes"],
+            "semitones": variant["semitones"],
+            "octave_shift": variant["octave_shift"],
+            "in_range": variant["in_range"],
+            "instrument": instrument,
+        })
+        for variant in variants
+    ]
+
+def _similar_exercises(vector: np.ndarray, k: int, exclude: List[int],
+                       difficulty: Optional[DifficultyLevel]) -> List[SimilarExercise]:
+    """Top-k neighbours of a feature vector as exercises, most similar first"""
+    matches = similarity_index.query(vector, k, exclude=exclude, difficulty=difficulty.value if difficulty else None)
+    exercises = {exercise.id: exercise for exercise in db.get_exercises_by_ids([exercise_id for exercise_id, _ in matches])}
+    return [
+        SimilarExercise(**exercises[exercise_id].model_dump(), similarity=round(score, 4))
+        for exercise_id, score in matches if exercise_id in exercises
+    ]
+
+@router.get("/{exercise_id}/similar", response_model=List[SimilarExercise])
+async def get_similar_exercises(
+    exercise_id: int,
+    k: int = Query(default=10, ge=1, le=100, description="Number of exercises to return"),
+    difficulty: Optional[DifficultyLevel] = Query(None, description="Only return this difficulty")
+):
+    """
+    Get the exercises most like this one
+    
+    Compares interval histograms, rhythm profiles, range, key, meter and
+    difficulty through the in-memory similarity index.
+    """
+    
+    try:
+        await run_in_threadpool(similarity_index.sync, db)
+        vector = similarity_index.vector_for(exercise_id)
+        if vector is None:
+            raise HTTPException(status_code=404, detail=f"Exercise with ID {exercise_id} not found")
+        return await run_in_threadpool(_similar_exercises, vector, k, [exercise_id], difficulty)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to find similar exercises: {str(e)}"
+        )
+
+@router.get("/{exercise_id}/transpose/{key}", response_model=TransposedExercise)
+async def transpose_exercise_to_key(
+    exercise_id: int,
+    key: str,
+    instrument: str = Query(default="piano", description="Instrument whose range is checked")
+):
+    """Get an exercise transposed into another key (e.g. 'G', 'B-', 'Bb', 'F#')"""
+    
+    try:
+        exercise = db.get_exercise(exercise_id)
+        
+        if not exercise:
+            raise HTTPException(
+                status_code=404,
+                detail=f"Exercise with ID {exercise_id} not found"
+            )
+        
+        return _transposed(exercise, [key], instrument)[0]
+        
+    except HTTPException:
+        raise
+    except TranspositionError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to transpose exercise: {str(e)}"
+        )
+
+@router.get("/{exercise_id}/transpositions", response_model=List[TransposedExercise])
+async def get_exercise_in_all_keys(
+    exercise_id: int,
+    instrument: str = Query(default="piano", description="Instrument whose range is checked")
+):
+    """Get an exercise in all 12 major keys, computed in one batch"""
+    
+    try:
+        exercise = db.get_exercise(exercise_id)
+        
+        if not exercise:
+            raise HTTPException(
+                status_code=404,
+                detail=f"Exercise with ID {exercise_id} not found"
+            )
+        
+        return _transposed(exercise, ALL_KEYS, instrument)
+        
+    except HTTPException:
+        raise
+    except TranspositionError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to transpose exercise: {str(e)}"
+        )
+
+@router.get("/{exercise_id}/audio")
+async def get_exercise_audio(
+    exercise_id: int,
+    request: Request,
+    tempo: int = Query(default=90, ge=30, le=300, description="Tempo in quarter notes per minute"),
+    instrument: str = Query(default="piano", description=f"One of: {', '.join(INSTRUMENT_VOICES)}"),
+    format: str = Query(default="wav", description="Audio format (only 'wav' is available)")
+):
+    """
+    Get reference audio for an exercise
+    
+    Rendered on the server on first request and cached on disk, so clients
+    don't have to synthesize playback themselves. Supports HTTP Range
+    requests for seeking and progressive playback.
+    """
+    
+    try:
+        if format != "wav":
+            raise HTTPException(status_code=400, detail=f"Unsupported audio format '{format}', use 'wav'")
+        
+        exercise = db.get_exercise(exercise_id)
+        
+        if not exercise:
+            raise HTTPException(
+                status_code=404,
+                detail=f"Exercise with ID {exercise_id} not found"
+            )
+        
+        path = await run_in_threadpool(
+            audio_cache.get_or_render, exercise.id, exercise.notes or [], exercise.rhythm_pattern,
+            tempo, instrument
+        )
+        
+        size = os.path.getsize(path)
+        headers = {"Accept-Ranges": "bytes", "Cache-Control": "public, max-age=86400"}
+        range_header = request.headers.get("range")
+        if not range_header:
+            return FileResponse(path, media_type="audio/wav", headers=headers)
+        
+        byte_range = parse_range(range_header, size)
+        if byte_range is None:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+        
+        start, end = byte_range
+        with open(path, "rb") as f:
+            f.seek(start)
+            content = f.read(end - start + 1)
+        return Response(
+            content=content,
+            status_code=206,
+            media_type="audio/wav",
+            headers={**headers, "Content-Range": f"bytes {start}-{end}/{size}"}
+        )
+        
+    except HTTPException:
+        raise
+    except (SynthesisError, TranspositionError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to render exercise audio: {str(e)}"
+        )
+
+def _played_note(message: dict) -> int:
+    """MIDI number of a note message ({"midi": 60} or {"note": "C4"})"""
+    if "midi" in message:
+        midi = int(message["midi"])
+        if not 0 <= midi <= 127:
+            raise ValueError("midi must be between 0 and 127")
+        return midi
+    _, _, midi = notes_to_arrays([str(message["note"])])
+    return int(midi[0])
+
+@router.websocket("/{exercise_id}/practice")
+async def practice_session(
+    websocket: WebSocket,
+    exercise_id: int,
+    tempo: float = Query(default=90, ge=30, le=300),
+    sample_rate: int = Query(default=22050, ge=8000, le=48000)
+):
+    """
+    Live practice feedback over a WebSocket
+    
+    Send note events as JSON ({"type": "note", "midi": 60, "time": 1.25},
+    time in seconds since the start) or 16-bit mono PCM audio chunks as
+    binary messages. Each detected note is answered right away with a
+    "feedback" message (correct / wrong / extra, missed notes, timing drift).
+    Send {"type": "end"} to get a "summary" and close the session.
+    """
+    global active_practice_sessions
+    
+    await websocket.accept()
+    if active_practice_sessions >= MAX_PRACTICE_SESSIONS:
+        await websocket.close(code=1013, reason="Too many practice sessions, try again later")
+        return
+    
+    active_practice_sessions += 1
+    try:
+        exercise = await run_in_threadpool(db.get_exercise, exercise_id)
+        if not exercise or not exercise.notes:
+            await websocket.close(code=1008, reason=f"Exercise with ID {exercise_id} not found")
+            return
+        
+        expected = expected_notes_for(exercise.id, tuple(exercise.notes), tuple(exercise.rhythm_pattern or ()))
+        follower = ScoreFollower(expected, tempo)
+        detector = None
+        started = time.monotonic()
+        
+        await websocket.send_json({"type": "ready", "exercise_id": exercise.id, "notes": len(expected)})
+        
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            received = time.perf_counter()
+            
+            if message.get("bytes") is not None:
+                chunk = message["bytes"]
+                if len(chunk) > MAX_AUDIO_CHUNK_BYTES or len(chunk) % 2:
+                    await websocket.send_json({"type": "error", "detail": "Audio chunks must be 16-bit PCM, at most 64KB"})
+                    continue
+                if detector is None:
+                    detector = LiveNoteDetector(sample_rate)
+                samples = np.frombuffer(chunk, dtype="<i2").astype(np.float32) / 32768.0
+                played = detector.push(samples)
+            else:
+                try:
+                    data = json.loads(message.get("text") or "")
+                    if data.get("type") == "end":
+                        await websocket.send_json({"type": "summary", **follower.summary()})
+                        await websocket.close()
+                        break
+                    played = [(_played_note(data), float(data.get("time", time.monotonic() - started)))]
+                except (ValueError, KeyError, TypeError, AttributeError) as e:
+                    await websocket.send_json({"type": "error", "detail": f"Invalid message: {str(e)}"})
+                    continue
+            
+            for midi, onset in played:
+                feedback = follower.play(midi, onset)
+                feedback["type"] = "feedback"
+                feedback["latency_ms"] = round((time.perf_counter() - received) * 1000.0, 2)
+                await websocket.send_json(feedback)
+    
+    except WebSocketDisconnect:
+        pass
+    finally:
+        active_practice_sessions -= 1
+
 @router.get("/difficulty/{difficulty}", response_model=List[Exercise])
 async def get_exercises_by_difficulty(
     difficulty: DifficultyLevel,
@@ -113,8 +489,7 @@ async def get_exercises_by_difficulty(
     """Get exercises by difficulty level"""
     
     try:
-        exercises = db.get_exercises(limit=limit, difficulty=difficulty.value)
-        return exercises
+        return json_array_response(db.get_exercises_json(limit=limit, difficulty=difficulty.value))
         
     except Exception as e:
         raise HTTPException(
@@ -137,8 +512,9 @@ async def get_random_exercises(
     """
     
     try:
-        exercises = db.get_exercises(limit=count, difficulty=difficulty.value if difficulty else None)
-        return exercises
+        return json_array_response(
+            db.get_exercises_json(limit=count, difficulty=difficulty.value if difficulty else None)
+        )
         
     except Exception as e:
         raise HTTPException(
@@ -147,10 +523,15 @@ async def get_random_exercises(
         )
 
 @router.get("/stats/summary")
-async def get_exercise_stats():
+async def get_exercise_stats(request: Request):
     """Get summary statistics about available exercises"""
     
     try:
+        etag = etag_for('exercise-stats', data_versions.epoch, data_versions.version(LIBRARY))
+        cached = response_cache.lookup(request, etag, CACHE_REVALIDATE)
+        if cached:
+            return cached
+        
         all_exercises = db.get_exercises(limit=1000)  # Get all exercises
         
         # Count by difficulty
@@ -163,13 +544,13 @@ async def get_exercise_stats():
         total_xp = sum(ex.xp_reward for ex in all_exercises)
         avg_xp = total_xp / len(all_exercises) if all_exercises else 0
         
-        return {
+        return response_cache.store(etag, CACHE_REVALIDATE, {
             "total_exercises": len(all_exercises),
             "difficulty_distribution": difficulty_counts,
             "average_xp_reward": round(avg_xp, 2),
             "total_xp_available": total_xp,
             "last_updated": datetime.now().isoformat()
-        }
+        }, slots=[LIBRARY])
         
     except Exception as e:
         raise HTTPException(
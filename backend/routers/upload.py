@@ -1,12 +1,31 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Query
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 import os
+import json
+import shutil
+import asyncio
+import hashlib
+import tempfile
+import zipfile
+import multiprocessing
 import aiofiles
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime
 import uuid
-from typing import List
-import music21
-from models import UploadResponse, Exercise, FileType, DifficultyLevel
+from typing import List, Optional, Tuple, Dict, Any, BinaryIO, Iterator, Callable, Set
+from models import (
+    UploadResponse, Exercise, FileType, ParseStatus, UploadListResponse, RevisionResponse
+)
+from db import db
+from metrics import UPLOAD_BYTES, PARSE_SECONDS, SCORE_BYTES, SCORE_MEASURES
+from profiling import profiling_request
+from score_store import (
+    ParsedScore, parse_and_store, parsed_path_for, load_parsed_score, pitch_name, rhythm_name,
+    generate_exercises, parse_to_exercise_rows, parse_to_file, align_measures, changed_measures, plan_revision_chunks
+)
 
 router = APIRouter(prefix="/upload", tags=["upload"])
 
@@ -34,115 +53,145 @@ def is_musicxml_file(filename: str) -> bool:
     ext = os.path.splitext(filename.lower())[1]
     return ext in ['.musicxml', '.xml']
 
-async def save_uploaded_file(file: UploadFile, filename: str) -> str:
-    """Save uploaded file to disk"""
+# Read uploads in fixed-size chunks so large files are never held in memory
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Batch upload limits
+MAX_BATCH_FILES = 500
+MAX_BATCH_ENTRY_SIZE = 10 * 1024 * 1024  # 10MB per file, as for single uploads
+
+# MusicXML parsing runs in worker processes; at most MAX_PENDING_PARSES
+# files are queued at once so a large archive never piles up in memory
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", str(os.cpu_count() or 2)))
+MAX_PENDING_PARSES = PARSE_WORKERS * 2
+
+_parse_pool: Optional[ProcessPoolExecutor] = None
+
+def get_parse_pool() -> ProcessPoolExecutor:
+    """Get the shared MusicXML parsing pool, starting it on first use"""
+    global _parse_pool
+    if _parse_pool is None:
+        # Spawn rather than fork: the server process has threads running
+        _parse_pool = ProcessPoolExecutor(
+            max_workers=PARSE_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _parse_pool
+
+def shutdown_parse_pool():
+    """Stop the parsing pool if it was started"""
+    global _parse_pool
+    if _parse_pool is not None:
+        _parse_pool.shutdown(wait=False, cancel_futures=True)
+        _parse_pool = None
+
+def record_parse(file_path: str, seconds: float, measures: int):
+    """Record one music21 parse in the metrics"""
+    PARSE_SECONDS.observe(seconds)
+    SCORE_BYTES.observe(os.path.getsize(file_path))
+    SCORE_MEASURES.observe(measures)
+
+async def _recorded_parse(future: asyncio.Future, file_path: str) -> List[Dict[str, Any]]:
+    rows, seconds, measures = await future
+    record_parse(file_path, seconds, measures)
+    return rows
+
+def run_in_parse_pool(function: Callable[..., Any], *args) -> asyncio.Future:
+    """Run a parse function in the pool, off the event loop"""
+    loop = asyncio.get_running_loop()
+    if profiling_request():
+        # Parse in this process, so the request's profile includes music21
+        future = loop.create_future()
+        try:
+            future.set_result(function(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+    try:
+        return loop.run_in_executor(get_parse_pool(), function, *args)
+    except BrokenProcessPool:
+        # A worker died (e.g. out of memory); start a fresh pool
+        shutdown_parse_pool()
+        return loop.run_in_executor(get_parse_pool(), function, *args)
+
+def submit_parse(file_path: str, filename: str, chunk_size: int = 4) -> asyncio.Future:
+    """Parse a stored MusicXML upload in the pool, off the event loop; resolves to exercise rows"""
+    future = run_in_parse_pool(parse_to_exercise_rows, file_path, parsed_path_for(filename), chunk_size)
+    return asyncio.ensure_future(_recorded_parse(future, file_path))
+
+def new_upload_filename(original_filename: str) -> str:
+    """Generate a unique filename keeping the original extension"""
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    file_id = str(uuid.uuid4())[:8]
+    extension = os.path.splitext(original_filename)[1]
+    return f"{timestamp}_{file_id}{extension}"
+
+async def save_uploaded_file(file: UploadFile, filename: str) -> Tuple[str, int, str]:
+    """Save uploaded file to disk, returning its path, size and SHA-256"""
     file_path = os.path.join(UPLOADS_DIR, filename)
+    digest = hashlib.sha256()
+    size = 0
     
     async with aiofiles.open(file_path, 'wb') as f:
-        content = await file.read()
-        await f.write(content)
+        while True:
+            chunk = await file.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            size += len(chunk)
+            await f.write(chunk)
     
-    return file_path
+    UPLOAD_BYTES.labels("score").inc(size)
+    return file_path, size, digest.hexdigest()
+
+def classify_upload(filename: str) -> Tuple[FileType, ParseStatus]:
+    """File type and parse status of a file found on disk"""
+    if not is_musicxml_file(filename):
+        return get_file_type(filename), ParseStatus.NOT_APPLICABLE
+    if os.path.exists(parsed_path_for(filename)):
+        return get_file_type(filename), ParseStatus.PARSED
+    return get_file_type(filename), ParseStatus.PENDING
 
-def parse_musicxml_with_music21(file_path: str) -> List[Exercise]:
+def reconcile_upload_catalog(dry_run: bool = False) -> Dict[str, List[str]]:
+    """Bring the uploads catalog in line with the uploads directory"""
+    return db.reconcile_uploads(UPLOADS_DIR, classify_upload, dry_run=dry_run)
+
+def parse_musicxml_with_music21(file_path: str, chunk_size: int = 4) -> List[Dict[str, Any]]:
     """
-    Parse MusicXML file using music21 and generate exercises
+    Parse MusicXML file using music21 and generate exercise rows
+    
+    The parsed representation is persisted next to the upload (see score_store),
+    so later regeneration reads the memory-mapped file instead of the XML.
+    Rows are stored (and get their IDs) with db.save_exercises.
     
     TODO: Implement AI-powered exercise generation:
     - Analyze musical complexity
     - Identify challenging sections
     - Generate appropriate difficulty levels
-    - Create measure-based chunks
     """
-    try:
-        # Load the score
-        score = music21.converter.parse(file_path)
-        
-        # For now, create dummy exercises based on the score
-        # This is a placeholder for real AI analysis
-        exercises = []
-        
-        # Get basic score information
-        key_signature = score.keySignature.tonic.name if score.keySignature else "C"
-        time_signature = f"{score.timeSignature.numerator}/{score.timeSignature.denominator}" if score.timeSignature else "4/4"
-        
-        # Count measures
-        total_measures = len(score.parts[0].getElementsByClass('Measure'))
-        
-        # Create exercises in 2-4 bar chunks
-        chunk_size = 4
-        exercise_id = 1
-        
-        for i in range(0, total_measures, chunk_size):
-            end_measure = min(i + chunk_size, total_measures)
-            measures_range = f"{i + 1}-{end_measure}"
-            
-            # Determine difficulty based on measure position (simple heuristic)
-            if i < total_measures // 3:
-                difficulty = DifficultyLevel.EASY
-                xp_reward = 10
-            elif i < 2 * total_measures // 3:
-                difficulty = DifficultyLevel.MEDIUM
-                xp_reward = 15
-            else:
-                difficulty = DifficultyLevel.HARD
-                xp_reward = 20
-            
-            # Extract notes from this measure range (simplified)
-            notes = []
-            rhythm_pattern = []
-            
-            # TODO: Implement real note extraction and rhythm analysis
-            # For now, use dummy data
-            if difficulty == DifficultyLevel.EASY:
-                notes = ['C4', 'D4', 'E4', 'F4']
-                rhythm_pattern = ['quarter', 'quarter', 'quarter', 'quarter']
-            elif difficulty == DifficultyLevel.MEDIUM:
-                notes = ['G4', 'A4', 'B4', 'C5', 'D5']
-                rhythm_pattern = ['eighth', 'eighth', 'quarter', 'eighth', 'quarter']
-            else:
-                notes = ['F4', 'G4', 'A4', 'B4', 'C5', 'D5', 'E5', 'F5']
-                rhythm_pattern = ['eighth', 'eighth', 'eighth', 'eighth', 'eighth', 'eighth', 'eighth', 'eighth']
-            
-            exercise = Exercise(
-                id=exercise_id,
-                measures=measures_range,
-                difficulty=difficulty,
-                title=f"Measures {measures_range}",
-                key_signature=key_signature,
-                time_signature=time_signature,
-                notes=notes,
-                rhythm_pattern=rhythm_pattern,
-                xp_reward=xp_reward,
-                created_at=datetime.now()
-            )
-            
-            exercises.append(exercise)
-            exercise_id += 1
-        
-        return exercises
-        
-    except Exception as e:
-        print(f"Error parsing MusicXML: {e}")
-        # Return fallback exercises if parsing fails
-        return [
-            Exercise(
-                id=1,
-                measures="1-4",
-                difficulty=DifficultyLevel.EASY,
-                title="Fallback Exercise",
-                key_signature="C",
-                time_signature="4/4",
-                notes=['C4', 'D4', 'E4', 'F4'],
-                rhythm_pattern=['quarter', 'quarter', 'quarter', 'quarter'],
-                xp_reward=10,
-                created_at=datetime.now()
-            )
-        ]
+    parsed = parse_and_store(file_path, parsed_path_for(file_path))
+    return generate_exercises(parsed, chunk_size=chunk_size)
+
+def store_exercises(rows: List[Dict[str, Any]], upload_id: int) -> List[Exercise]:
+    """Persist generated rows linked to their upload and return the stored exercises"""
+    for row in rows:
+        row['upload_id'] = upload_id
+    exercise_ids, _ = db.save_exercises(rows)
+    
+    # Repeated sections share one exercise; list each once
+    return db.get_exercises_by_ids(list(dict.fromkeys(exercise_ids)))
+
+def load_parsed_upload(filename: str) -> ParsedScore:
+    """Load the parsed score of an uploaded file or raise 404"""
+    parsed_path = parsed_path_for(filename)
+    if not is_musicxml_file(filename) or not os.path.exists(parsed_path):
+        raise HTTPException(status_code=404, detail="Parsed score not found")
+    return load_parsed_score(parsed_path)
 
 @router.post("/score", response_model=UploadResponse)
 async def upload_score(
-    file: UploadFile = File(..., description="Upload PDF, JPG, or MusicXML file")
+    file: UploadFile = File(..., description="Upload PDF, JPG, or MusicXML file"),
+    owner_id: Optional[str] = Form(None, description="User uploading the file")
 ):
     """
     Upload a score file (PDF, JPG, or MusicXML)
@@ -158,23 +207,36 @@ async def upload_score(
     file_type = get_file_type(file.filename)
     
     # Generate unique filename
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    file_id = str(uuid.uuid4())[:8]
-    extension = os.path.splitext(file.filename)[1]
-    new_filename = f"{timestamp}_{file_id}{extension}"
+    new_filename = new_upload_filename(file.filename)
     
     try:
         # Save file
-        file_path = await save_uploaded_file(file, new_filename)
+        file_path, size_bytes, content_hash = await save_uploaded_file(file, new_filename)
         
         exercises = None
+        is_musicxml = is_musicxml_file(file.filename)
+        
+        # Record the upload in the catalog
+        upload_record = db.create_upload(
+            filename=new_filename,
+            file_type=file_type,
+            size_bytes=size_bytes,
+            content_hash=content_hash,
+            original_filename=file.filename,
+            owner_id=owner_id,
+            parse_status=ParseStatus.PENDING if is_musicxml else ParseStatus.NOT_APPLICABLE
+        )
         
         # Parse MusicXML files
-        if is_musicxml_file(file.filename):
+        if is_musicxml:
             try:
-                exercises = parse_musicxml_with_music21(file_path)
+                rows = await submit_parse(file_path, new_filename)
+                exercises = store_exercises(rows, upload_record.id)
+                db.update_upload_status(new_filename, ParseStatus.PARSED)
                 message = f"MusicXML file uploaded and parsed successfully. Generated {len(exercises)} exercises."
             except Exception as e:
+                print(f"Error parsing MusicXML: {e}")
+                db.update_upload_status(new_filename, ParseStatus.FAILED)
                 message = f"File uploaded but parsing failed: {str(e)}"
                 # Still return the file info even if parsing fails
         else:
@@ -188,35 +250,358 @@ async def upload_score(
         )
         
     except Exception as e:
-        # Clean up file if it was saved
+        # Clean up file and catalog entry if they were saved
         file_path = os.path.join(UPLOADS_DIR, new_filename)
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        db.delete_upload(new_filename, file_path)
         
         raise HTTPException(
             status_code=500,
             detail=f"Failed to upload file: {str(e)}"
         )
 
-@router.get("/files")
-async def list_uploaded_files():
-    """List all uploaded files"""
+def _iter_batch_entries(files: List[UploadFile]) -> Iterator[Tuple[str, BinaryIO]]:
+    """Yield (original filename, stream) for each uploaded file or zip archive entry"""
+    if len(files) == 1 and files[0].filename and files[0].filename.lower().endswith('.zip'):
+        with zipfile.ZipFile(files[0].file) as archive:
+            for info in archive.infolist():
+                name = os.path.basename(info.filename)
+                if info.is_dir() or not name or name.startswith('.') or info.filename.startswith('__MACOSX/'):
+                    continue
+                with archive.open(info) as stream:
+                    yield name, stream
+    else:
+        for file in files:
+            yield file.filename or "", file.file
+
+def _store_next_entry(entries: Iterator[Tuple[str, BinaryIO]], owner_id: Optional[str]) -> Optional[Dict[str, Any]]:
+    """
+    Stream the next batch entry to storage and catalog it
+    
+    Runs in a thread: zip decompression and file writes are blocking.
+    Returns None when the batch is exhausted.
+    """
+    entry = next(entries, None)
+    if entry is None:
+        return None
+    
+    original_filename, stream = entry
+    result = {"original_filename": original_filename}
+    
+    if os.path.splitext(original_filename.lower())[1] not in ALLOWED_EXTENSIONS:
+        result.update(status="rejected", error="Unsupported file type")
+        return result
+    
+    filename = new_upload_filename(original_filename)
+    file_path = os.path.join(UPLOADS_DIR, filename)
+    digest = hashlib.sha256()
+    size = 0
+    
+    with open(file_path, 'wb') as f:
+        for chunk in iter(lambda: stream.read(UPLOAD_CHUNK_SIZE), b''):
+            size += len(chunk)
+            if size > MAX_BATCH_ENTRY_SIZE:
+                break
+            digest.update(chunk)
+            f.write(chunk)
+    
+    UPLOAD_BYTES.labels("batch").inc(size)
+    if size > MAX_BATCH_ENTRY_SIZE:
+        os.remove(file_path)
+        result.update(status="rejected", error=f"File exceeds {MAX_BATCH_ENTRY_SIZE} bytes")
+        return result
+    
+    is_musicxml = is_musicxml_file(filename)
+    upload_record = db.create_upload(
+        filename=filename,
+        file_type=get_file_type(filename),
+        size_bytes=size,
+        content_hash=digest.hexdigest(),
+        original_filename=original_filename,
+        owner_id=owner_id,
+        parse_status=ParseStatus.PENDING if is_musicxml else ParseStatus.NOT_APPLICABLE
+    )
+    
+    result.update(
+        filename=filename,
+        upload_id=upload_record.id,
+        file_path=file_path,
+        size_bytes=size,
+        status="pending" if is_musicxml else "saved"
+    )
+    return result
+
+def _reject_next_entry(entries: Iterator[Tuple[str, BinaryIO]]) -> Optional[Dict[str, Any]]:
+    """Report the next batch entry past MAX_BATCH_FILES as rejected without storing it"""
+    entry = next(entries, None)
+    if entry is None:
+        return None
+    return {
+        "original_filename": entry[0],
+        "status": "rejected",
+        "error": f"Batch exceeds {MAX_BATCH_FILES} files"
+    }
+
+def _finish_parse(future: asyncio.Future, result: Dict[str, Any], spool) -> Dict[str, Any]:
+    """
+    Record the outcome of one parse and spool its exercises for the final insert
+    
+    Runs in a thread. A parsed upload stays PENDING until the final insert
+    commits its exercises; a failed one is marked FAILED here.
+    """
+    result.pop("file_path")
+    try:
+        rows = future.result()
+        for row in rows:
+            row['upload_id'] = result['upload_id']
+            spool.write(json.dumps(row) + "\n")
+        result.update(status="parsed", exercises=len(rows))
+    except Exception as e:
+        db.update_upload_status(result["filename"], ParseStatus.FAILED)
+        result.update(status="failed", error=str(e))
+    return result
+
+async def _run_batch(files: List[UploadFile], owner_id: Optional[str], chunk_size: int):
+    """Store, parse and report batch entries as NDJSON lines, then insert all exercises"""
+    entries = _iter_batch_entries(files)
+    pending: Dict[asyncio.Future, Dict[str, Any]] = {}
+    counts = {"files": 0, "parsed": 0, "failed": 0, "saved": 0, "rejected": 0, "truncated": 0}
+    # MusicXML uploads still PENDING, and those parsed but not yet inserted
+    unsettled: Set[str] = set()
+    parsed: List[str] = []
+    
+    # Generated exercises are spooled to disk so memory stays flat with archive size
+    spool = tempfile.TemporaryFile(mode='w+', encoding='utf-8')
+    
+    def report(result: Dict[str, Any]) -> str:
+        result.pop("file_path", None)
+        counts["files"] += 1
+        counts[result["status"]] += 1
+        if result["status"] == "parsed":
+            parsed.append(result["filename"])
+        elif result["status"] == "failed":
+            unsettled.discard(result["filename"])
+        return json.dumps(result) + "\n"
+    
+    try:
+        while True:
+            # Entries past the cap are still read (not stored) so each one is reported
+            truncated = counts["files"] + len(pending) >= MAX_BATCH_FILES
+            try:
+                if truncated:
+                    result = await run_in_threadpool(_reject_next_entry, entries)
+                else:
+                    result = await run_in_threadpool(_store_next_entry, entries, owner_id)
+            except zipfile.BadZipFile as e:
+                yield json.dumps({"error": f"Invalid zip archive: {str(e)}"}) + "\n"
+                break
+            if result is None:
+                break
+            if truncated:
+                counts["truncated"] += 1
+            
+            if result["status"] != "pending":
+                yield report(result)
+                continue
+            
+            # Wait for a slot before queueing another parse
+            while len(pending) >= MAX_PENDING_PARSES:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    yield report(await run_in_threadpool(_finish_parse, future, pending.pop(future), spool))
+            
+            unsettled.add(result["filename"])
+            future = submit_parse(result["file_path"], result["filename"], chunk_size)
+            pending[future] = result
+        
+        while pending:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                yield report(await run_in_threadpool(_finish_parse, future, pending.pop(future), spool))
+        
+        # Store every generated exercise in one transaction; uploads count as parsed once it commits
+        spool.seek(0)
+        try:
+            exercise_ids, inserted = await run_in_threadpool(db.save_exercises, (json.loads(line) for line in spool))
+        except Exception as e:
+            yield json.dumps({"error": f"Failed to store exercises: {str(e)}"}) + "\n"
+            return
+        await run_in_threadpool(db.update_upload_statuses, parsed, ParseStatus.PARSED)
+        unsettled.clear()
+        
+        yield json.dumps({
+            "summary": counts,
+            "exercises_linked": len(exercise_ids),
+            "exercises_inserted": inserted
+        }) + "\n"
+        
+    finally:
+        for future in pending:
+            future.cancel()
+        spool.close()
+        # On error or client disconnect nothing was inserted for these. This runs
+        # inline: a cancelled stream can't await the threadpool any more.
+        if unsettled:
+            db.update_upload_statuses(unsettled, ParseStatus.FAILED)
+
+@router.post("/batch")
+async def upload_batch(
+    files: List[UploadFile] = File(..., description="MusicXML/PDF/image files, or a single zip archive"),
+    owner_id: Optional[str] = Form(None, description="User uploading the files"),
+    chunk_size: int = Form(4, ge=1, le=32, description="Measures per generated exercise")
+):
+    """
+    Upload many scores at once (e.g. a whole book)
+    
+    Accepts several files or one zip archive. Entries are streamed to storage
+    and MusicXML parsing is fanned out across a worker pool. Results are
+    streamed back as newline-delimited JSON, one line per file as it finishes,
+    followed by a summary line once all generated exercises are inserted in
+    a single transaction (deduplicated by content, like single uploads).
+    Uploads are marked parsed only once that transaction commits; if it
+    fails or the client disconnects first, they are marked failed.
+    """
+    if not files:
+        raise HTTPException(status_code=400, detail="No files provided")
+    
+    return StreamingResponse(
+        _run_batch(files, owner_id, chunk_size),
+        media_type="application/x-ndjson"
+    )
+
+@router.post("/files/{filename}/revisions", response_model=RevisionResponse)
+async def upload_revision(
+    filename: str,
+    file: UploadFile = File(..., description="Revised MusicXML file"),
+    owner_id: Optional[str] = Form(None, description="User uploading the revision")
+):
+    """
+    Upload a revised version of a MusicXML score
+    
+    The new version is diffed against the previous parsed score by aligning
+    their per-measure hashes, so inserting or deleting a measure doesn't
+    shift everything after it. Chunks whose measures all survive keep their
+    exercise, and with it the performance history, wherever they now sit;
+    only measures around the edit are chunked and generated again. Kept
+    exercises keep the measure numbers in their title. An identical
+    re-upload skips parsing entirely.
+    """
+    previous = db.get_upload(filename)
+    if not previous or not is_musicxml_file(filename):
+        raise HTTPException(status_code=404, detail="MusicXML upload not found")
+    if not file.filename or not is_musicxml_file(file.filename):
+        raise HTTPException(status_code=400, detail="Revisions must be MusicXML files")
+    
+    previous_parsed_path = parsed_path_for(filename)
+    if not os.path.exists(previous_parsed_path):
+        raise HTTPException(status_code=409, detail="Previous revision has no parsed score")
+    
+    new_filename = new_upload_filename(file.filename)
+    
+    try:
+        file_path, size_bytes, content_hash = await save_uploaded_file(file, new_filename)
+        
+        upload_record = db.create_upload(
+            filename=new_filename,
+            file_type=get_file_type(new_filename),
+            size_bytes=size_bytes,
+            content_hash=content_hash,
+            original_filename=file.filename,
+            owner_id=owner_id or previous.owner_id,
+            parent_upload_id=previous.id,
+            revision=previous.revision + 1
+        )
+        
+        previous_parsed = load_parsed_score(previous_parsed_path)
+        new_parsed_path = parsed_path_for(new_filename)
+        unchanged_file = content_hash == previous.content_hash
+        
+        if unchanged_file:
+            shutil.copyfile(previous_parsed_path, new_parsed_path)
+            parsed = load_parsed_score(new_parsed_path)
+        else:
+            seconds, measures = await run_in_parse_pool(parse_to_file, file_path, new_parsed_path)
+            record_parse(file_path, seconds, measures)
+            parsed = load_parsed_score(new_parsed_path)
+        
+        # Regenerate every chunking the previous revision had (default: part 0, 4 measures)
+        previous_links = db.get_upload_exercise_links(previous.id)
+        chunkings = sorted({(part, chunk_size) for part, chunk_size, _, _, _, _ in previous_links}) or [(0, 4)]
+        
+        rows = []
+        reused_links = []
+        for part, chunk_size in chunkings:
+            if part >= parsed.part_count:
+                continue
+            
+            aligned = np.arange(parsed.measure_count) if unchanged_file else align_measures(previous_parsed, parsed, part)
+            previous_chunks = [
+                (start, end if end is not None else min(start + chunk_size, previous_parsed.measure_count), exercise_id)
+                for p, c, _, exercise_id, start, end in previous_links
+                if p == part and c == chunk_size
+            ]
+            
+            regenerate = []
+            for chunk_index, (start, end, exercise_id) in enumerate(
+                    plan_revision_chunks(aligned, previous_chunks, chunk_size)):
+                if exercise_id is not None:
+                    reused_links.append((upload_record.id, part, chunk_size, chunk_index, exercise_id, start, end))
+                else:
+                    regenerate.append((chunk_index, start, end))
+            
+            for row in generate_exercises(parsed, chunk_size=chunk_size, part=part, chunks=regenerate):
+                row['upload_id'] = upload_record.id
+                rows.append(row)
+        
+        db.save_exercises(rows, links=reused_links)
+        db.update_upload_status(new_filename, ParseStatus.PARSED)
+        
+        exercise_ids = [link[3] for link in db.get_upload_exercise_links(upload_record.id)]
+        exercises = db.get_exercises_by_ids(list(dict.fromkeys(exercise_ids)))
+        
+        changed_list = [] if unchanged_file else (changed_measures(previous_parsed, parsed, 0) + 1).tolist()
+        
+        return RevisionResponse(
+            message=f"Revision {upload_record.revision} saved. Regenerated {len(rows)} exercises, kept {len(reused_links)}.",
+            filename=new_filename,
+            previous_filename=filename,
+            revision=upload_record.revision,
+            changed_measures=changed_list,
+            regenerated_chunks=len(rows),
+            reused_chunks=len(reused_links),
+            exercises=exercises
+        )
+        
+    except Exception as e:
+        if db.get_upload(new_filename):
+            db.update_upload_status(new_filename, ParseStatus.FAILED)
+        
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to upload revision: {str(e)}"
+        )
+
+@router.get("/files", response_model=UploadListResponse)
+async def list_uploaded_files(
+    limit: int = Query(default=50, ge=1, le=500, description="Number of files to return"),
+    cursor: Optional[str] = Query(None, description="Cursor from the previous page"),
+    owner_id: Optional[str] = Query(None, description="Filter by uploader"),
+    file_type: Optional[FileType] = Query(None, description="Filter by file type"),
+    parse_status: Optional[ParseStatus] = Query(None, description="Filter by parse status")
+):
+    """List uploaded files from the catalog, newest first"""
     try:
-        files = []
-        for filename in os.listdir(UPLOADS_DIR):
-            file_path = os.path.join(UPLOADS_DIR, filename)
-            if os.path.isfile(file_path):
-                file_type = get_file_type(filename)
-                file_size = os.path.getsize(file_path)
-                files.append({
-                    "filename": filename,
-                    "file_type": file_type,
-                    "size_bytes": file_size,
-                    "uploaded_at": datetime.fromtimestamp(os.path.getctime(file_path)).isoformat()
-                })
-        
-        return {"files": files, "total_count": len(files)}
+        files, next_cursor = db.list_uploads(
+            limit=limit,
+            cursor=cursor,
+            owner_id=owner_id,
+            file_type=file_type,
+            parse_status=parse_status
+        )
         
+        return UploadListResponse(files=files, count=len(files), next_cursor=next_cursor)
+        
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -225,21 +610,103 @@ async def list_uploaded_files():
 
 @router.delete("/files/{filename}")
 async def delete_uploaded_file(filename: str):
-    """Delete an uploaded file"""
+    """Delete an uploaded file and its catalog entry"""
     try:
-        file_path = os.path.join(UPLOADS_DIR, filename)
+        file_path = os.path.join(UPLOADS_DIR, os.path.basename(filename))
         
-        if not os.path.exists(file_path):
+        if not db.delete_upload(filename, file_path):
             raise HTTPException(status_code=404, detail="File not found")
         
-        os.remove(file_path)
+        parsed_path = parsed_path_for(filename)
+        if is_musicxml_file(filename) and os.path.exists(parsed_path):
+            os.remove(parsed_path)
         
         return {"message": f"File {filename} deleted successfully"}
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"Failed to delete file: {str(e)}"
         )
 
+@router.get("/files/{filename}/measures")
+async def get_uploaded_measures(
+    filename: str,
+    start: int = Query(default=1, ge=1, description="First measure (1-based)"),
+    end: Optional[int] = Query(None, ge=1, description="Last measure (inclusive), defaults to start"),
+    part: int = Query(default=0, ge=0, description="Part index")
+):
+    """Get the notes of a measure range from a parsed score (for rendering)"""
+    try:
+        parsed = load_parsed_upload(filename)
+        
+        if part >= parsed.part_count:
+            raise HTTPException(status_code=404, detail=f"Part {part} not found")
+        
+        end = end or start
+        rows = parsed.measures(start - 1, end, part=part)
+        
+        measures = {}
+        for row in rows:
+            measure_index = int(row['measure'])
+            entry = measures.setdefault(measure_index, {
+                "measure": measure_index + 1,
+                "number": int(parsed.measure_numbers[measure_index]),
+                "notes": []
+            })
+            is_rest = row['midi'] < 0
+            entry["notes"].append({
+                "pitch": None if is_rest else pitch_name(int(row['step']), int(row['alter']), int(row['octave'])),
+                "midi": None if is_rest else int(row['midi']),
+                "offset": float(row['offset']),
+                "duration": float(row['duration']),
+                "rhythm": rhythm_name(row['duration'])
+            })
+        
+        return {
+            "filename": filename,
+            "part": part,
+            "part_name": parsed.part_names[part],
+            "key_signature": parsed.key_signature,
+            "time_signature": parsed.time_signature,
+            "total_measures": parsed.measure_count,
+            "measures": list(measures.values())
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to read measures: {str(e)}"
+        )
 
+@router.post("/files/{filename}/exercises", response_model=List[Exercise])
+async def regenerate_exercises(
+    filename: str,
+    chunk_size: int = Query(default=4, ge=1, le=32, description="Measures per exercise"),
+    part: int = Query(default=0, ge=0, description="Part index")
+):
+    """Re-chunk a parsed score into stored exercises without re-parsing the MusicXML"""
+    try:
+        parsed = load_parsed_upload(filename)
+        
+        if part >= parsed.part_count:
+            raise HTTPException(status_code=404, detail=f"Part {part} not found")
+        
+        upload_record = db.get_upload(filename)
+        if not upload_record:
+            raise HTTPException(status_code=404, detail="Upload not found in catalog")
+        
+        rows = generate_exercises(parsed, chunk_size=chunk_size, part=part)
+        return store_exercises(rows, upload_record.id)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to regenerate exercises: {str(e)}"
+        )
@@ -1,11 +1,33 @@
-from fastapi import APIRouter, HTTPException, Body
-from typing import Dict, Any
+from fastapi import APIRouter, HTTPException, Body, UploadFile, File, Form
+from fastapi.responses import Response
+from starlette.concurrency import run_in_threadpool
+from typing import Dict, Any, Tuple, Optional
 from datetime import datetime
-from models import Performance, PerformanceResponse, UserProgress, User
+import time
+from models import Performance, PerformanceResponse, RecordingPerformanceResponse, UserProgress, User
 from db import db
+from metrics import UPLOAD_BYTES
+from analysis import analyze_recording, AnalysisError, midi_name
+from perf_events import (
+    events_from_payload, encode_events, decode_events, events_to_records, onset_seconds,
+    summarize_events, PerformanceEventError
+)
+from scoring import score_performance, overall_score, SCORING_VERSION
+from transpose import notes_to_arrays, TranspositionError
+from xp import performance_xp, XP_PER_LEVEL
+
+# Largest accepted recording (about 10 minutes of 16-bit 44.1kHz stereo)
+MAX_RECORDING_SIZE = 100 * 1024 * 1024
 
 router = APIRouter(prefix="/users", tags=["users"])
 
+def _record_performance(performance: Performance, events: Optional[bytes] = None) -> Tuple[int, User]:
+    """Save a performance, award XP and return (xp_earned, updated user)"""
+    performance_id = db.save_performance(performance, events)
+    xp_earned = performance_xp(performance.score)
+    updated_user = db.update_user_progress(performance.user_id, xp_earned, performance_id)
+    return xp_earned, updated_user
+
 @router.post("/submit_performance", response_model=PerformanceResponse)
 async def submit_performance(
     performance_data: Dict[str, Any] = Body(..., description="Performance data")
@@ -13,12 +35,15 @@ async def submit_performance(
     """
     Submit user performance for an exercise
     
-    TODO: Implement advanced performance analysis:
-    - Audio recording analysis
-    - Note accuracy detection
-    - Rhythm pattern matching
-    - Tempo consistency measurement
-    - Real-time feedback generation
+    When `notes_played` is given, it is aligned with the exercise's notes
+    and score, accuracy and mistakes_count are computed on the server;
+    otherwise the client-supplied score is used.
+    
+    `events` ([onset_ms, pitch, velocity, duration_ms] records, or a
+    base64 perf_events blob) replaces `notes_played`; rhythm and tempo
+    scores are then also computed from the onsets, and the events are
+    stored compactly beside the performance. Live feedback while playing
+    comes from the exercise practice websocket instead.
     """
     
     try:
@@ -26,47 +51,78 @@ async def submit_performance(
         user_id = performance_data.get('user_id')
         exercise_id = performance_data.get('exercise_id')
         score = performance_data.get('score')
+        notes_played = performance_data.get('notes_played') or []
         
         # Validate required fields
         if not user_id:
             raise HTTPException(status_code=400, detail="user_id is required")
         if not exercise_id:
             raise HTTPException(status_code=400, detail="exercise_id is required")
-        if score is None or not isinstance(score, int) or score < 0 or score > 100:
-            raise HTTPException(status_code=400, detail="score must be an integer between 0 and 100")
+        if not isinstance(notes_played, list) or not all(isinstance(note, str) for note in notes_played):
+            raise HTTPException(status_code=400, detail="notes_played must be a list of note names")
+        
+        accuracy = performance_data.get('accuracy')
+        mistakes_count = performance_data.get('mistakes_count')
+        extra_data = performance_data.get('performance_data') or {}
+        # Client timing scores are only kept when the server can't score the notes itself
+        rhythm_score = performance_data.get('rhythm_score')
+        tempo_score = performance_data.get('tempo_score')
+        scoring_version = None
+        events = None
+        
+        if performance_data.get('events') is not None:
+            try:
+                events = events_from_payload(performance_data['events'])
+            except PerformanceEventError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            notes_played = [midi_name(pitch) for pitch in events['pitch'].tolist()]
+        
+        if notes_played:
+            exercise = db.get_exercise(exercise_id)
+            if not exercise:
+                raise HTTPException(status_code=404, detail=f"Exercise with ID {exercise_id} not found")
+            try:
+                _, _, played_midi = notes_to_arrays(notes_played)
+            except TranspositionError as e:
+                raise HTTPException(status_code=400, detail=f"Invalid notes_played: {str(e)}")
+            onsets = onset_seconds(events) if events is not None else None
+            metrics = score_performance(exercise.notes or [], exercise.rhythm_pattern, played_midi.tolist(), onsets)
+            accuracy = metrics['accuracy']
+            mistakes_count = metrics['mistakes_count']
+            rhythm_score = metrics['rhythm_score']
+            tempo_score = metrics['tempo_score']
+            if events is not None:
+                extra_data = {**extra_data, 'detected_tempo': metrics['detected_tempo'], **summarize_events(events)}
+            score = overall_score(accuracy, rhythm_score, tempo_score)
+            extra_data = {**extra_data, **{key: metrics[key] for key in ('missed_notes', 'extra_notes', 'wrong_notes')}}
+            scoring_version = SCORING_VERSION
+        else:
+            if score is None or not isinstance(score, int) or score < 0 or score > 100:
+                raise HTTPException(status_code=400, detail="score must be an integer between 0 and 100")
+            for name, value in (('rhythm_score', rhythm_score), ('tempo_score', tempo_score)):
+                if value is not None and (not isinstance(value, (int, float)) or not 0 <= value <= 100):
+                    raise HTTPException(status_code=400, detail=f"{name} must be a number between 0 and 100")
         
         # Create performance object
         performance = Performance(
             user_id=user_id,
             exercise_id=exercise_id,
             score=score,
-            accuracy=performance_data.get('accuracy'),
-            rhythm_score=performance_data.get('rhythm_score'),
-            tempo_score=performance_data.get('tempo_score'),
+            accuracy=accuracy,
+            rhythm_score=rhythm_score,
+            tempo_score=tempo_score,
             practice_time_seconds=performance_data.get('practice_time_seconds'),
-            mistakes_count=performance_data.get('mistakes_count'),
-            notes_played=performance_data.get('notes_played', []),
-            performance_data=performance_data.get('performance_data', {}),
+            mistakes_count=mistakes_count,
+            notes_played=notes_played,
+            performance_data=extra_data,
+            scoring_version=scoring_version,
             submitted_at=datetime.now()
         )
         
-        # Save performance to database
-        performance_id = db.save_performance(performance)
-        
-        # Calculate XP earned (simple formula for now)
-        # TODO: Implement sophisticated XP calculation based on:
-        # - Exercise difficulty
-        # - Performance accuracy
-        # - Practice time
-        # - Streak bonuses
-        # - Level-based multipliers
-        
-        base_xp = 10  # Base XP for completing exercise
-        accuracy_bonus = int((score / 100) * 10)  # Up to 10 bonus XP for accuracy
-        xp_earned = base_xp + accuracy_bonus
-        
-        # Update user progress
-        updated_user = db.update_user_progress(user_id, xp_earned, streak_updated=True)
+        # Save performance and update user progress
+        xp_earned, updated_user = _record_performance(
+            performance, encode_events(events) if events is not None else None
+        )
         
         return PerformanceResponse(
             message="Performance submitted successfully!",
@@ -88,6 +144,99 @@ async def submit_performance(
             detail=f"Failed to submit performance: {str(e)}"
         )
 
+@router.post("/submit_recording", response_model=RecordingPerformanceResponse)
+async def submit_recording(
+    file: UploadFile = File(..., description="Recorded take (PCM WAV)"),
+    user_id: str = Form(..., description="User who performed the exercise"),
+    exercise_id: int = Form(..., description="Exercise that was performed")
+):
+    """
+    Submit an audio recording of a performance
+    
+    The take is decoded and analysed on the server (pitch and onset
+    detection), aligned with the exercise's notes, and the resulting
+    metrics are saved as the performance instead of client-supplied scores.
+    """
+    
+    try:
+        exercise = db.get_exercise(exercise_id)
+        if not exercise:
+            raise HTTPException(status_code=404, detail=f"Exercise with ID {exercise_id} not found")
+        if not exercise.notes:
+            raise HTTPException(status_code=400, detail="Exercise has no notes to compare against")
+        
+        if file.size is not None and file.size > MAX_RECORDING_SIZE:
+            raise HTTPException(
+                status_code=413,
+                detail=f"Recording too large. Maximum size: {MAX_RECORDING_SIZE // (1024 * 1024)}MB"
+            )
+        
+        if file.size is not None:
+            UPLOAD_BYTES.labels("recording").inc(file.size)
+        
+        started = time.perf_counter()
+        analysis = await run_in_threadpool(analyze_recording, file.file)
+        detected = analysis['notes']
+        metrics = score_performance(
+            exercise.notes, exercise.rhythm_pattern,
+            [note['midi'] for note in detected], [note['onset'] for note in detected]
+        )
+        
+        performance = Performance(
+            user_id=user_id,
+            exercise_id=exercise_id,
+            score=metrics['score'],
+            accuracy=metrics['accuracy'],
+            rhythm_score=metrics['rhythm_score'],
+            tempo_score=metrics['tempo_score'],
+            practice_time_seconds=int(round(analysis['duration'])),
+            mistakes_count=metrics['mistakes_count'],
+            notes_played=[note['name'] for note in detected],
+            scoring_version=SCORING_VERSION,
+            performance_data={
+                'source': 'recording',
+                'missed_notes': metrics['missed_notes'],
+                'extra_notes': metrics['extra_notes'],
+                'wrong_notes': metrics['wrong_notes'],
+                'detected_tempo': metrics['detected_tempo'],
+                'analysis_seconds': round(time.perf_counter() - started, 3),
+            },
+            submitted_at=datetime.now()
+        )
+        
+        events = events_from_payload([
+            [round(note['onset'] * 1000), note['midi'], 64, round(note['duration'] * 1000)] for note in detected
+        ])
+        xp_earned, updated_user = _record_performance(performance, encode_events(events))
+        
+        return RecordingPerformanceResponse(
+            message="Recording analysed and performance submitted!",
+            user_id=user_id,
+            exercise_id=exercise_id,
+            score=performance.score,
+            xp_earned=xp_earned,
+            new_total_xp=updated_user.xp,
+            new_level=updated_user.level,
+            streak_updated=True,
+            new_streak=updated_user.streak,
+            accuracy=metrics['accuracy'],
+            rhythm_score=metrics['rhythm_score'],
+            tempo_score=metrics['tempo_score'],
+            mistakes_count=metrics['mistakes_count'],
+            notes_detected=performance.notes_played,
+            detected_tempo=metrics['detected_tempo']
+        )
+        
+    except HTTPException:
+        raise
+    except AnalysisError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to analyse recording: {str(e)}"
+        )
+
 @router.get("/{user_id}/progress", response_model=UserProgress)
 async def get_user_progress(user_id: str):
     """Get comprehensive user progress and statistics"""
@@ -134,7 +283,10 @@ async def get_user_performances(
     offset: int = 0
 ):
     """
-    Get user's performance history
+    Get user's performance history, newest first
+    
+    Listings never read the stored note events; fetch those per
+    performance from /{user_id}/performances/{performance_id}/events.
     
     TODO: Implement advanced performance analytics:
     - Performance trends over time
@@ -149,16 +301,14 @@ async def get_user_performances(
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
         
-        # TODO: Implement performance history retrieval from database
-        # For now, return a placeholder response
+        performances, total_count = db.list_user_performances(user_id, limit, offset)
         
         return {
             "user_id": user_id,
-            "performances": [],
-            "total_count": 0,
+            "performances": performances,
+            "total_count": total_count,
             "limit": limit,
-            "offset": offset,
-            "message": "Performance history retrieval not yet implemented"
+            "offset": offset
         }
         
     except HTTPException:
@@ -169,6 +319,45 @@ async def get_user_performances(
             detail=f"Failed to get user performances: {str(e)}"
         )
 
+@router.get("/{user_id}/performances/{performance_id}/events")
+async def get_performance_events(user_id: str, performance_id: int, encoding: str = "json"):
+    """
+    Get the timestamped note events of one performance
+    
+    `encoding=json` returns [onset_ms, pitch, velocity, duration_ms]
+    records; `encoding=binary` returns the stored perf_events blob as is.
+    """
+    
+    try:
+        if encoding not in ("json", "binary"):
+            raise HTTPException(status_code=400, detail="encoding must be 'json' or 'binary'")
+        
+        stored = db.get_performance_events(performance_id)
+        if not stored or stored[0] != user_id:
+            raise HTTPException(status_code=404, detail="Performance not found")
+        blob = stored[1]
+        if blob is None:
+            raise HTTPException(status_code=404, detail="No events stored for this performance")
+        
+        if encoding == "binary":
+            return Response(content=blob, media_type="application/octet-stream")
+        
+        events = decode_events(blob)
+        return {
+            "performance_id": performance_id,
+            "fields": ["onset_ms", "pitch", "velocity", "duration_ms"],
+            "events": events_to_records(events),
+            "count": len(events)
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to get performance events: {str(e)}"
+        )
+
 @router.get("/{user_id}/stats")
 async def get_user_stats(user_id: str):
     """
@@ -204,9 +393,9 @@ async def get_user_stats(user_id: str):
             days_since_practice = 0
         
         # Calculate level progress
-        xp_in_current_level = progress.current_xp % 100
-        xp_to_next_level = 100 - xp_in_current_level
-        level_progress_percentage = (xp_in_current_level / 100) * 100
+        xp_in_current_level = progress.current_xp % XP_PER_LEVEL
+        xp_to_next_level = XP_PER_LEVEL - xp_in_current_level
+        level_progress_percentage = (xp_in_current_level / XP_PER_LEVEL) * 100
         
         return {
             "user_id": user_id,
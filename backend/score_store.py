@@ -0,0 +1,470 @@
+"""
+Parsed score storage for SightReadPro
+
+A score is parsed with music21 once and written to a compact binary file:
+per-part note arrays plus a measure offset index. Files are memory-mapped
+on load, so any measure range can be read without loading the whole score.
+
+Version 2 adds a content hash per measure and part, used to diff revisions
+of a score at measure granularity.
+
+File layout (little endian):
+    magic (4 bytes) | version (uint16) | reserved (uint16) | header length (uint32)
+    JSON header (score metadata and array locations)
+    arrays, each aligned to ARRAY_ALIGNMENT bytes
+"""
+
+import difflib
+import hashlib
+import json
+import os
+import struct
+import time
+from typing import List, Optional, Dict, Any, Tuple, Iterable
+
+import numpy as np
+from numpy.lib import recfunctions
+import music21
+
+from models import DifficultyLevel
+
+# Directory for parsed score files
+PARSED_DIR = "parsed"
+PARSED_EXTENSION = ".srps"
+
+MAGIC = b"SRPS"
+FORMAT_VERSION = 2
+PREAMBLE = struct.Struct("<4sHHI")
+ARRAY_ALIGNMENT = 16
+
+# One row per sounding pitch (chord tones get a row each) or rest
+NOTE_DTYPE = np.dtype([
+    ('measure', '<u4'),   # measure index within the part (0-based)
+    ('offset', '<f4'),    # offset from the start of the measure, in quarter lengths
+    ('duration', '<f4'),  # duration in quarter lengths
+    ('midi', 'i1'),       # MIDI pitch, -1 for rests
+    ('step', 'i1'),       # diatonic step (0=C ... 6=B), -1 for rests
+    ('alter', 'i1'),      # accidental in semitones
+    ('octave', 'i1'),
+])
+
+INDEX_DTYPE = np.dtype('<u4')
+MEASURE_NUMBER_DTYPE = np.dtype('<i4')
+HASH_DTYPE = np.dtype('<u8')
+
+# Fields that make up a measure's content hash; the measure index is left out
+# so a measure hashes the same wherever it sits in the score
+HASHED_FIELDS = ['offset', 'duration', 'midi', 'step', 'alter', 'octave']
+
+STEP_NAMES = ['C', 'D', 'E', 'F', 'G', 'A', 'B']
+STEP_INDEX = {name: i for i, name in enumerate(STEP_NAMES)}
+
+# Quarter length -> rhythm name used in Exercise.rhythm_pattern
+RHYTHM_NAMES = {
+    6.0: 'dotted whole',
+    4.0: 'whole',
+    3.0: 'dotted half',
+    2.0: 'half',
+    1.5: 'dotted quarter',
+    1.0: 'quarter',
+    0.75: 'dotted eighth',
+    0.5: 'eighth',
+    0.375: 'dotted 16th',
+    0.25: '16th',
+    0.125: '32nd',
+}
+_BASE_RHYTHMS = [(4.0, 'whole'), (2.0, 'half'), (1.0, 'quarter'), (0.5, 'eighth'), (0.25, '16th'), (0.125, '32nd')]
+
+
+def pitch_name(step: int, alter: int, octave: int) -> str:
+    """Format a spelled pitch the way music21 does (e.g. 'F#4', 'B-3')"""
+    accidental = '#' * alter if alter > 0 else '-' * -alter
+    return f"{STEP_NAMES[step]}{accidental}{octave}"
+
+
+def rhythm_name(quarter_length: float) -> str:
+    """Map a quarter length to a rhythm name, snapping tuplets to the nearest base value"""
+    name = RHYTHM_NAMES.get(round(float(quarter_length), 3))
+    if name:
+        return name
+    if quarter_length <= 0:
+        return 'grace'
+    return min(_BASE_RHYTHMS, key=lambda item: abs(np.log2(item[0] / quarter_length)))[1]
+
+
+_QUARTER_LENGTHS = {name: ql for ql, name in RHYTHM_NAMES.items()}
+_QUARTER_LENGTHS['grace'] = 0.125
+
+
+def quarter_lengths(rhythm_pattern: Optional[Iterable[str]], count: int) -> np.ndarray:
+    """Durations in quarter notes for `count` notes; the pattern repeats if it is shorter"""
+    if not rhythm_pattern:
+        return np.ones(count)
+    lengths = np.array([_QUARTER_LENGTHS.get(name, 1.0) for name in rhythm_pattern])
+    return np.resize(lengths, count)
+
+
+def parsed_path_for(filename: str) -> str:
+    """Path of the parsed score file for an uploaded filename"""
+    base = os.path.splitext(os.path.basename(filename))[0]
+    return os.path.join(PARSED_DIR, base + PARSED_EXTENSION)
+
+
+class ParsedScore:
+    """Read access to a parsed score (in memory or memory-mapped)"""
+
+    def __init__(self, meta: Dict[str, Any], parts: List[np.ndarray], indexes: List[np.ndarray],
+                 measure_numbers: np.ndarray, path: Optional[str] = None,
+                 hashes: Optional[List[Optional[np.ndarray]]] = None):
+        self.meta = meta
+        self.parts = parts
+        self.indexes = indexes
+        self.measure_numbers = measure_numbers
+        self.path = path
+        self.hashes = hashes or [None] * len(parts)
+
+    @property
+    def title(self) -> Optional[str]:
+        return self.meta.get('title')
+
+    @property
+    def key_signature(self) -> str:
+        return self.meta.get('key_signature', 'C')
+
+    @property
+    def time_signature(self) -> str:
+        return self.meta.get('time_signature', '4/4')
+
+    @property
+    def part_names(self) -> List[Optional[str]]:
+        return self.meta.get('part_names', [])
+
+    @property
+    def part_count(self) -> int:
+        return len(self.parts)
+
+    @property
+    def measure_count(self) -> int:
+        return len(self.measure_numbers)
+
+    def measures(self, start: int, end: int, part: int = 0) -> np.ndarray:
+        """Note rows for measure indexes [start, end) of a part, without copying"""
+        index = self.indexes[part]
+        measure_total = len(index) - 1
+        start = max(0, min(start, measure_total))
+        end = max(start, min(end, measure_total))
+        return self.parts[part][index[start]:index[end]]
+
+    def measure_hashes(self, part: int = 0) -> np.ndarray:
+        """Content hash of every measure of a part (computed for version 1 files)"""
+        if self.hashes[part] is None:
+            self.hashes[part] = compute_measure_hashes(self.parts[part], self.indexes[part])
+        return self.hashes[part]
+
+    @staticmethod
+    def note_names(rows: np.ndarray) -> List[str]:
+        """Pitch names for the sounding rows (rests skipped)"""
+        sounding = rows[rows['midi'] >= 0]
+        return [pitch_name(int(s), int(a), int(o))
+                for s, a, o in zip(sounding['step'], sounding['alter'], sounding['octave'])]
+
+    @staticmethod
+    def rhythm_names(rows: np.ndarray) -> List[str]:
+        """Rhythm names for the sounding rows (rests skipped)"""
+        sounding = rows[rows['midi'] >= 0]
+        return [rhythm_name(d) for d in sounding['duration']]
+
+
+def compute_measure_hashes(rows: np.ndarray, index: np.ndarray) -> np.ndarray:
+    """Hash the note rows of each measure into a uint64"""
+    packed = recfunctions.repack_fields(rows[HASHED_FIELDS])
+    hashes = np.empty(len(index) - 1, dtype=HASH_DTYPE)
+    for measure in range(len(hashes)):
+        content = packed[index[measure]:index[measure + 1]].tobytes()
+        hashes[measure] = int.from_bytes(hashlib.blake2b(content, digest_size=8).digest(), 'little')
+    return hashes
+
+
+def align_measures(previous: ParsedScore, current: ParsedScore, part: int = 0) -> np.ndarray:
+    """
+    For each measure of `current`, the index of the equal measure of `previous` it aligns with, or -1
+
+    The two sequences of measure hashes are aligned with difflib, so an
+    inserted or deleted measure only affects itself: the measures after it
+    still align with their old selves. A key or time signature change aligns
+    nothing, since it changes every generated exercise.
+    """
+    current_hashes = current.measure_hashes(part)
+    aligned = np.full(len(current_hashes), -1, dtype=np.int64)
+    if (part >= previous.part_count
+            or previous.key_signature != current.key_signature
+            or previous.time_signature != current.time_signature):
+        return aligned
+
+    matcher = difflib.SequenceMatcher(None, previous.measure_hashes(part).tolist(), current_hashes.tolist(),
+                                      autojunk=False)
+    for previous_start, current_start, size in matcher.get_matching_blocks():
+        aligned[current_start:current_start + size] = np.arange(previous_start, previous_start + size)
+    return aligned
+
+
+def changed_measures(previous: ParsedScore, current: ParsedScore, part: int = 0) -> np.ndarray:
+    """Indexes of measures in `current` that don't align with an equal measure of `previous`"""
+    return np.flatnonzero(align_measures(previous, current, part) < 0)
+
+
+def plan_revision_chunks(aligned: np.ndarray, previous_chunks: Iterable[Tuple[int, int, int]],
+                         chunk_size: int) -> List[Tuple[int, int, Optional[int]]]:
+    """
+    Chunks of a revised score as (start, end, exercise ID to keep or None)
+
+    `aligned` is align_measures for the revision and `previous_chunks` the
+    previous revision's (start, end, exercise ID) chunks. A previous chunk
+    whose measures all align, in order and with nothing between them, is
+    kept where its measures now are. The measures left over (inserted,
+    replaced, or from a chunk an edit broke up) are chunked afresh,
+    `chunk_size` at a time, so the work scales with the size of the edit.
+    """
+    previous_chunks = [chunk for chunk in previous_chunks if chunk[1] > chunk[0]]
+    # Position in the revision of each previous measure, -1 if it didn't survive
+    moved_to = np.full(max((end for _, end, _ in previous_chunks), default=0), -1, dtype=np.int64)
+    survivors = np.flatnonzero((aligned >= 0) & (aligned < len(moved_to)))
+    moved_to[aligned[survivors]] = survivors
+
+    kept = []
+    for start, end, exercise_id in previous_chunks:
+        positions = moved_to[start:end]
+        if positions[0] >= 0 and np.array_equal(positions, np.arange(positions[0], positions[0] + end - start)):
+            kept.append((int(positions[0]), int(positions[0]) + end - start, exercise_id))
+    kept.sort()
+
+    chunks: List[Tuple[int, int, Optional[int]]] = []
+    position = 0
+    for start, end, exercise_id in kept + [(len(aligned), len(aligned), None)]:
+        chunks.extend((gap, min(gap + chunk_size, start), None) for gap in range(position, start, chunk_size))
+        if end > start:
+            chunks.append((start, end, exercise_id))
+        position = end
+    return chunks
+
+
+def _key_signature_name(score: music21.stream.Score) -> str:
+    signatures = score.flatten().getElementsByClass(music21.key.KeySignature)
+    if not signatures:
+        return "C"
+    signature = signatures[0]
+    if isinstance(signature, music21.key.Key):
+        return signature.tonic.name
+    return signature.asKey('major').tonic.name
+
+
+def _time_signature_name(score: music21.stream.Score) -> str:
+    signatures = score.flatten().getElementsByClass(music21.meter.TimeSignature)
+    return signatures[0].ratioString if signatures else "4/4"
+
+
+def _part_rows(part: music21.stream.Part) -> Tuple[np.ndarray, np.ndarray, List[int]]:
+    """Extract note rows, the measure offset index and measure numbers of one part"""
+    rows = []
+    index = [0]
+    numbers = []
+
+    for measure_index, measure in enumerate(part.getElementsByClass(music21.stream.Measure)):
+        numbers.append(measure.number)
+        for element in measure.flatten().notesAndRests:
+            offset = float(element.offset)
+            duration = float(element.quarterLength)
+            if element.isRest:
+                rows.append((measure_index, offset, duration, -1, -1, 0, 0))
+                continue
+            for pitch in element.pitches:
+                alter = int(pitch.accidental.alter) if pitch.accidental else 0
+                rows.append((measure_index, offset, duration, pitch.midi,
+                             STEP_INDEX[pitch.step], alter, pitch.octave))
+        index.append(len(rows))
+
+    return np.array(rows, dtype=NOTE_DTYPE), np.array(index, dtype=INDEX_DTYPE), numbers
+
+
+def build_parsed_score(score: music21.stream.Score) -> ParsedScore:
+    """Build an in-memory ParsedScore from a music21 score"""
+    parts = []
+    indexes = []
+    part_names = []
+    measure_numbers = []
+
+    for i, part in enumerate(score.parts):
+        rows, index, numbers = _part_rows(part)
+        parts.append(rows)
+        indexes.append(index)
+        part_names.append(part.partName)
+        if i == 0:
+            measure_numbers = numbers
+
+    meta = {
+        'title': score.metadata.title if score.metadata else None,
+        'key_signature': _key_signature_name(score),
+        'time_signature': _time_signature_name(score),
+        'part_names': part_names,
+    }
+    hashes = [compute_measure_hashes(rows, index) for rows, index in zip(parts, indexes)]
+    return ParsedScore(meta, parts, indexes, np.array(measure_numbers, dtype=MEASURE_NUMBER_DTYPE),
+                       hashes=hashes)
+
+
+def _aligned(position: int) -> int:
+    return (position + ARRAY_ALIGNMENT - 1) // ARRAY_ALIGNMENT * ARRAY_ALIGNMENT
+
+
+def save_parsed_score(parsed: ParsedScore, path: str) -> str:
+    """Write a parsed score to disk atomically and return its path"""
+    arrays = [('measure_numbers', parsed.measure_numbers)]
+    for i in range(parsed.part_count):
+        arrays.append((f'part{i}.notes', parsed.parts[i]))
+        arrays.append((f'part{i}.index', parsed.indexes[i]))
+        arrays.append((f'part{i}.hashes', parsed.measure_hashes(i)))
+
+    # Array offsets depend on the header size, so lay out relative to the data start first
+    layout = {}
+    position = 0
+    for name, array in arrays:
+        position = _aligned(position)
+        layout[name] = {'offset': position, 'count': int(len(array))}
+        position += array.nbytes
+
+    def encode_header(data_start: int) -> bytes:
+        header = dict(parsed.meta)
+        header['arrays'] = {name: {'offset': data_start + loc['offset'], 'count': loc['count']}
+                            for name, loc in layout.items()}
+        return json.dumps(header, separators=(',', ':')).encode('utf-8')
+
+    # The header holds absolute offsets, so grow the data start until the header fits
+    data_start = 0
+    while True:
+        header = encode_header(data_start)
+        needed = _aligned(PREAMBLE.size + len(header))
+        if needed <= data_start:
+            break
+        data_start = needed
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(PREAMBLE.pack(MAGIC, FORMAT_VERSION, 0, len(header)))
+        f.write(header)
+        for name, array in arrays:
+            f.seek(data_start + layout[name]['offset'])
+            f.write(np.ascontiguousarray(array).tobytes())
+    os.replace(tmp_path, path)
+
+    parsed.path = path
+    return path
+
+
+def load_parsed_score(path: str) -> ParsedScore:
+    """Memory-map a parsed score file"""
+    with open(path, 'rb') as f:
+        magic, version, _, header_length = PREAMBLE.unpack(f.read(PREAMBLE.size))
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a parsed score file")
+        if version > FORMAT_VERSION:
+            raise ValueError(f"Unsupported parsed score version {version}")
+        meta = json.loads(f.read(header_length).decode('utf-8'))
+
+    buffer = np.memmap(path, dtype=np.uint8, mode='r')
+    locations = meta.pop('arrays')
+
+    def view(name: str, dtype: np.dtype) -> np.ndarray:
+        loc = locations[name]
+        start = loc['offset']
+        return buffer[start:start + loc['count'] * dtype.itemsize].view(dtype)
+
+    part_count = len(meta.get('part_names', []))
+    parts = [view(f'part{i}.notes', NOTE_DTYPE) for i in range(part_count)]
+    indexes = [view(f'part{i}.index', INDEX_DTYPE) for i in range(part_count)]
+    measure_numbers = view('measure_numbers', MEASURE_NUMBER_DTYPE)
+    hashes = [view(f'part{i}.hashes', HASH_DTYPE) if f'part{i}.hashes' in locations else None
+              for i in range(part_count)]
+
+    return ParsedScore(meta, parts, indexes, measure_numbers, path=path, hashes=hashes)
+
+
+def parse_and_store(file_path: str, parsed_path: Optional[str] = None) -> ParsedScore:
+    """Parse a MusicXML file with music21 and persist the parsed representation"""
+    score = music21.converter.parse(file_path)
+    parsed = build_parsed_score(score)
+    save_parsed_score(parsed, parsed_path or parsed_path_for(file_path))
+    return parsed
+
+
+def generate_exercises(parsed: ParsedScore, chunk_size: int = 4, part: int = 0,
+                       chunks: Optional[Iterable[Tuple[int, int, int]]] = None) -> List[Dict[str, Any]]:
+    """
+    Generate measure-based exercise rows from a parsed score
+
+    Reads note rows straight from the parsed score, so re-chunking a stored
+    score never goes back to music21. Rows have no ID yet; they get one when
+    stored with Database.save_exercises. By default the score is cut every
+    `chunk_size` measures; pass (chunk_index, start, end) `chunks` to
+    generate others (e.g. the ones a revision changed).
+    """
+    exercises = []
+    total_measures = parsed.measure_count
+    if chunks is None:
+        chunks = ((chunk_index, i, min(i + chunk_size, total_measures))
+                  for chunk_index, i in enumerate(range(0, total_measures, chunk_size)))
+
+    for chunk_index, i, end_measure in chunks:
+        measures_range = f"{i + 1}-{end_measure}"
+
+        # Determine difficulty based on measure position (simple heuristic)
+        if i < total_measures // 3:
+            difficulty = DifficultyLevel.EASY
+            xp_reward = 10
+        elif i < 2 * total_measures // 3:
+            difficulty = DifficultyLevel.MEDIUM
+            xp_reward = 15
+        else:
+            difficulty = DifficultyLevel.HARD
+            xp_reward = 20
+
+        rows = parsed.measures(i, end_measure, part=part)
+
+        exercises.append({
+            'measures': measures_range,
+            'difficulty': difficulty.value,
+            'title': f"Measures {measures_range}",
+            'key_signature': parsed.key_signature,
+            'time_signature': parsed.time_signature,
+            'notes': ParsedScore.note_names(rows),
+            'rhythm_pattern': ParsedScore.rhythm_names(rows),
+            'xp_reward': xp_reward,
+            'part': part,
+            'chunk_size': chunk_size,
+            'chunk_index': chunk_index,
+            'start_measure': i,
+            'end_measure': end_measure,
+        })
+
+    return exercises
+
+
+def parse_to_file(file_path: str, parsed_path: str) -> Tuple[float, int]:
+    """Parse and persist one MusicXML file (runs in a worker process); returns the parse time and measure count"""
+    began = time.perf_counter()
+    parsed = parse_and_store(file_path, parsed_path)
+    return time.perf_counter() - began, parsed.measure_count
+
+
+def parse_to_exercise_rows(file_path: str, parsed_path: str,
+                           chunk_size: int = 4) -> Tuple[List[Dict[str, Any]], float, int]:
+    """
+    Parse, persist and chunk one MusicXML file (runs in a worker process)
+
+    Also returns the parse time in seconds and the measure count, which the
+    server records in its metrics.
+    """
+    began = time.perf_counter()
+    parsed = parse_and_store(file_path, parsed_path)
+    seconds = time.perf_counter() - began
+    return generate_exercises(parsed, chunk_size=chunk_size), seconds, parsed.measure_count
@@ -0,0 +1,289 @@
+"""
+Performance scoring for SightReadPro
+
+Aligns the notes a student played with the exercise's expected notes and
+derives the Performance metrics (accuracy, rhythm, tempo consistency,
+mistakes) on the server instead of trusting client-supplied values.
+"""
+
+from typing import List, Optional, Dict, Any, Sequence, Tuple
+
+import numpy as np
+
+from score_store import quarter_lengths
+from transpose import notes_to_arrays
+
+# Bump when the rules below change; `manage.py rescore` recomputes older rows
+SCORING_VERSION = 1
+
+# Edit costs for the alignment
+SUBSTITUTION_COST = 1.0
+OCTAVE_ERROR_COST = 0.5
+GAP_COST = 1.0
+# Matches are made slightly cheaper than free, so that among equally good
+# alignments the one with the most correct notes wins
+MATCH_BONUS = 1e-3
+
+# Onsets further than this from the fitted beat grid get no rhythm credit
+RHYTHM_TOLERANCE_BEATS = 0.5
+# Coefficient of variation of the local tempo at which tempo credit reaches zero
+TEMPO_CV_LIMIT = 0.3
+
+# Weights of the overall score
+SCORE_WEIGHTS = {'accuracy': 0.6, 'rhythm': 0.25, 'tempo': 0.15}
+
+# Submissions scored together in one vectorized pass
+BATCH_CHUNK_SIZE = 4096
+
+
+def _substitution(expected: np.ndarray, played: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Cost of playing `played` where `expected` was written, and whether it is correct"""
+    interval = expected - played
+    correct = interval == 0
+    cost = np.where(correct, -MATCH_BONUS,
+                    np.where(interval % 12 == 0, OCTAVE_ERROR_COST, SUBSTITUTION_COST))
+    return cost, correct
+
+
+def _running_min(values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Running minimum along the last axis and the (latest) index it came from"""
+    running = np.minimum.accumulate(values, axis=-1)
+    columns = np.broadcast_to(np.arange(values.shape[-1]), values.shape)
+    origin = np.maximum.accumulate(np.where(values <= running, columns, 0), axis=-1)
+    return running, origin
+
+
+def align_notes(expected: Sequence[int], played: Sequence[int]) -> List[Tuple[Optional[int], Optional[int]]]:
+    """
+    Align two MIDI sequences with a weighted edit distance
+
+    Returns (expected_index, played_index) pairs in order; None on one side
+    marks a missed (None played) or extra (None expected) note. Octave
+    errors cost less than other wrong notes. Each row of the cost matrix is
+    computed as a whole: the left-to-right dependency (extra notes) is a
+    running minimum.
+    """
+    expected = np.asarray(expected, dtype=np.int64)
+    played = np.asarray(played, dtype=np.int64)
+    n, m = expected.size, played.size
+    steps = np.arange(m + 1) * GAP_COST
+
+    row = steps.copy()
+    took_diagonal = np.zeros((n + 1, m + 1), dtype=bool)
+    origin = np.zeros((n + 1, m + 1), dtype=np.int64)
+    for i in range(1, n + 1):
+        substitution, _ = _substitution(expected[i - 1], played)
+        arrival = row + GAP_COST
+        diagonal = row[:-1] + substitution
+        took_diagonal[i, 1:] = diagonal <= arrival[1:]
+        arrival[1:] = np.where(took_diagonal[i, 1:], diagonal, arrival[1:])
+        running, origin[i] = _running_min(arrival - steps)
+        row = running + steps
+
+    # Walk back from the end: horizontal moves are extra notes
+    pairs = []
+    i, j = n, m
+    while i > 0 or j > 0:
+        if i == 0 or origin[i, j] < j:
+            pairs.append((None, j - 1))
+            j -= 1
+        elif j > 0 and took_diagonal[i, j]:
+            pairs.append((i - 1, j - 1))
+            i, j = i - 1, j - 1
+        else:
+            pairs.append((i - 1, None))
+            i -= 1
+    pairs.reverse()
+    return pairs
+
+
+def _pad(sequences: Sequence[Sequence[int]], fill: int) -> Tuple[np.ndarray, np.ndarray]:
+    lengths = np.array([len(seq) for seq in sequences], dtype=np.int64)
+    padded = np.full((len(sequences), max(int(lengths.max(initial=0)), 1)), fill, dtype=np.int64)
+    for row, seq in enumerate(sequences):
+        padded[row, :len(seq)] = seq
+    return padded, lengths
+
+
+# Path counts are packed into one int64 per cell, 16 bits each, so a
+# whole row of paths moves with a single gather
+_CORRECT, _WRONG, _MISSED, _EXTRA = 1, 1 << 16, 1 << 32, 1 << 48
+
+
+def _batch_counts(expected: Sequence[Sequence[int]], played: Sequence[Sequence[int]]) -> np.ndarray:
+    """(correct, wrong, missed, extra) of the best alignment of each pair, shape (B, 4)"""
+    # Padding values that never match a real note or each other
+    expected_notes, n = _pad(expected, -1000)
+    played_notes, m = _pad(played, -2001)
+    batch, width = played_notes.shape[0], played_notes.shape[1] + 1
+    rows = np.arange(batch)
+    columns = np.arange(width)
+    steps = columns * GAP_COST
+
+    cost = np.tile(steps, (batch, 1))
+    counts = np.tile(columns * _EXTRA, (batch, 1))
+    result = m * _EXTRA
+    for i in range(1, int(n.max(initial=0)) + 1):
+        substitution, correct = _substitution(expected_notes[:, i - 1:i], played_notes)
+        arrival = cost + GAP_COST
+        arrived = counts + _MISSED
+        diagonal = cost[:, :-1] + substitution
+        take = diagonal <= arrival[:, 1:]
+        arrival[:, 1:] = np.where(take, diagonal, arrival[:, 1:])
+        arrived[:, 1:] = np.where(take, counts[:, :-1] + np.where(correct, _CORRECT, _WRONG), arrived[:, 1:])
+
+        running, origin = _running_min(arrival - steps)
+        cost = running + steps
+        counts = np.take_along_axis(arrived, origin, axis=1) + (columns - origin) * _EXTRA
+
+        finished = n == i
+        result[finished] = counts[rows[finished], m[finished]]
+
+    return (result[:, None] >> np.array([0, 16, 32, 48])) & 0xFFFF
+
+
+def batch_score(expected: Sequence[Sequence[int]], played: Sequence[Sequence[int]]) -> Dict[str, np.ndarray]:
+    """
+    Note-level metrics for many (expected, played) MIDI sequence pairs at once
+
+    Submissions are grouped by length so each chunk is one vectorized pass
+    with little padding. Returns arrays of correct, wrong, missed and extra
+    counts, mistakes_count and accuracy, in input order.
+    """
+    total = len(expected)
+    counts = np.zeros((total, 4), dtype=np.int32)
+    order = np.argsort([max(len(e), len(p)) for e, p in zip(expected, played)], kind='stable')
+    for start in range(0, total, BATCH_CHUNK_SIZE):
+        chunk = order[start:start + BATCH_CHUNK_SIZE]
+        counts[chunk] = _batch_counts([expected[k] for k in chunk], [played[k] for k in chunk])
+
+    lengths = np.array([len(e) for e in expected], dtype=np.float64)
+    correct, wrong, missed, extra = counts.T
+    with np.errstate(divide='ignore', invalid='ignore'):
+        accuracy = np.where(lengths > 0, 100.0 * correct / lengths, 0.0)
+    return {
+        'correct': correct,
+        'wrong': wrong,
+        'missed': missed,
+        'extra': extra,
+        'mistakes_count': wrong + missed + extra,
+        'accuracy': np.round(accuracy, 1),
+    }
+
+
+def overall_score(accuracy: float, rhythm_score: Optional[float], tempo_score: Optional[float]) -> int:
+    """Weighted overall score; missing timing scores fall back to accuracy"""
+    overall = SCORE_WEIGHTS['accuracy'] * accuracy
+    overall += SCORE_WEIGHTS['rhythm'] * (rhythm_score if rhythm_score is not None else accuracy)
+    overall += SCORE_WEIGHTS['tempo'] * (tempo_score if tempo_score is not None else accuracy)
+    return int(round(overall))
+
+
+def timing_scores(expected_beats: np.ndarray, onsets: np.ndarray) -> Dict[str, Optional[float]]:
+    """
+    Rhythm and tempo-consistency scores for aligned onsets
+
+    Fits onset = intercept + seconds_per_beat * beat by least squares, so a
+    steady performance at any tempo scores well on rhythm. Rhythm credit
+    falls off with each onset's distance from that grid; tempo consistency
+    falls off with the spread of the local (note to note) tempo.
+    """
+    if onsets.size < 2:
+        return {'rhythm_score': None, 'tempo_score': None, 'detected_tempo': None}
+
+    slope, intercept = np.polyfit(expected_beats, onsets, 1)
+    if slope <= 0:
+        return {'rhythm_score': 0.0, 'tempo_score': 0.0, 'detected_tempo': None}
+
+    deviation_beats = np.abs(onsets - (intercept + slope * expected_beats)) / slope
+    rhythm = 100.0 * np.clip(1.0 - deviation_beats / RHYTHM_TOLERANCE_BEATS, 0.0, 1.0).mean()
+
+    beat_steps = np.diff(expected_beats)
+    valid = beat_steps > 0
+    tempo = None
+    if valid.sum() >= 2:
+        local = np.diff(onsets)[valid] / beat_steps[valid]
+        cv = local.std() / local.mean() if local.mean() > 0 else 1.0
+        tempo = 100.0 * float(np.clip(1.0 - cv / TEMPO_CV_LIMIT, 0.0, 1.0))
+
+    return {
+        'rhythm_score': round(float(rhythm), 1),
+        'tempo_score': round(tempo, 1) if tempo is not None else None,
+        'detected_tempo': round(60.0 / float(slope), 1),
+    }
+
+
+def score_performance(expected_notes: Sequence[str], rhythm_pattern: Optional[Sequence[str]],
+                      played_midi: Sequence[int], played_onsets: Optional[Sequence[float]] = None) -> Dict[str, Any]:
+    """
+    Score played notes (and optionally their onset times in seconds) against an exercise
+
+    Returns accuracy, rhythm_score, tempo_score, mistakes_count, missed,
+    extra and wrong note counts, detected_tempo and an overall score.
+    """
+    _, _, expected_midi = notes_to_arrays(expected_notes)
+    pairs = align_notes(expected_midi, played_midi)
+
+    correct = sum(1 for e, p in pairs if e is not None and p is not None and expected_midi[e] == played_midi[p])
+    matched = [(e, p) for e, p in pairs if e is not None and p is not None]
+    missed = sum(1 for _, p in pairs if p is None)
+    extra = sum(1 for e, _ in pairs if e is None)
+    wrong = len(matched) - correct
+
+    accuracy = 100.0 * correct / len(expected_midi) if len(expected_midi) else 0.0
+
+    timing = {'rhythm_score': None, 'tempo_score': None, 'detected_tempo': None}
+    if played_onsets is not None and matched:
+        beats = np.concatenate(([0.0], np.cumsum(quarter_lengths(rhythm_pattern, len(expected_midi)))))
+        timing = timing_scores(beats[[e for e, _ in matched]],
+                               np.asarray(played_onsets, dtype=np.float64)[[p for _, p in matched]])
+
+    return {
+        'score': overall_score(accuracy, timing['rhythm_score'], timing['tempo_score']),
+        'accuracy': round(accuracy, 1),
+        'rhythm_score': timing['rhythm_score'],
+        'tempo_score': timing['tempo_score'],
+        'detected_tempo': timing['detected_tempo'],
+        'mistakes_count': missed + extra + wrong,
+        'missed_notes': missed,
+        'extra_notes': extra,
+        'wrong_notes': wrong,
+    }
+
+
+def rescore_rows(rows: Sequence[Dict[str, Any]]) -> Tuple[List[Tuple[int, float, int, int, int]], int]:
+    """
+    Recompute note metrics for stored performances in one batch
+
+    `rows` carry id, notes_played, expected_notes, the stored
+    rhythm_score / tempo_score and has_events. Stored timing scores count
+    only when the server computed them from note events; a client's own
+    are ignored, as on submission. Returns (score, accuracy, mistakes_count,
+    scoring_version, id) updates and the number of rows skipped because
+    their notes could not be read.
+    """
+    ids, expected, played, timing = [], [], [], []
+    skipped = 0
+    for row in rows:
+        try:
+            expected_midi = notes_to_arrays(row['expected_notes'])[2] if row['expected_notes'] else []
+            played_midi = notes_to_arrays(row['notes_played'])[2] if row['notes_played'] else []
+        except ValueError:
+            skipped += 1
+            continue
+        ids.append(row['id'])
+        expected.append(list(expected_midi))
+        played.append(list(played_midi))
+        timing.append((row.get('rhythm_score'), row.get('tempo_score')) if row.get('has_events') else (None, None))
+
+    if not ids:
+        return [], skipped
+
+    metrics = batch_score(expected, played)
+    updates = []
+    for k, performance_id in enumerate(ids):
+        accuracy = float(metrics['accuracy'][k])
+        rhythm, tempo = timing[k]
+        updates.append((overall_score(accuracy, rhythm, tempo), accuracy,
+                        int(metrics['mistakes_count'][k]), SCORING_VERSION, performance_id))
+    return updates, skipped
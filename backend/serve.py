@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+Production server: a prefork master running uvicorn workers
+
+The master imports the app (music21, numpy, the memory-mapped similarity
+index), runs the one-time startup work on the database and uploads
+catalog, warms read-mostly caches, freezes the heap for the garbage
+collector and binds the listening socket. It then forks the workers, which
+inherit all of it and share those pages copy-on-write, and accept on the
+same socket.
+
+Workers are recycled after about MAX_REQUESTS requests (with jitter, so they
+don't all restart together) to bound memory growth, and replaced if they
+die. Signals to the master:
+    SIGHUP          rolling restart: replace workers one at a time
+    SIGTERM/SIGINT  graceful shutdown: workers finish in-flight requests
+
+Usage:
+    python serve.py [--workers N] [--host 0.0.0.0] [--port 8000]
+
+Code changes need a new master (e.g. a new container); SIGHUP restarts
+workers from the code the master preloaded.
+"""
+
+import argparse
+import gc
+import os
+import random
+import signal
+import socket
+import sys
+import time
+from typing import Dict
+
+import uvicorn
+
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", str(os.cpu_count() or 1)))
+MAX_REQUESTS = int(os.getenv("MAX_REQUESTS", "10000"))
+MAX_REQUESTS_JITTER = int(os.getenv("MAX_REQUESTS_JITTER", "1000"))
+GRACEFUL_TIMEOUT = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+# How long a new worker gets to start before the one it replaces is stopped
+WORKER_STARTUP_SECONDS = float(os.getenv("WORKER_STARTUP_SECONDS", "2"))
+BACKLOG = 2048
+
+# A one-note score, parsed once so music21's MusicXML reader is loaded before forking
+_WARMUP_MUSICXML = """<?xml version="1.0" encoding="UTF-8"?>
+<score-partwise version="3.1">
+  <part-list><score-part id="P1"><part-name>Warmup</part-name></score-part></part-list>
+  <part id="P1"><measure number="1">
+    <attributes><divisions>1</divisions><key><fifths>0</fifths></key>
+      <time><beats>4</beats><beat-type>4</beat-type></time></attributes>
+    <note><pitch><step>C</step><octave>4</octave></pitch><duration>4</duration><type>whole</type></note>
+  </measure></part>
+</score-partwise>"""
+
+
+def preload(app_module) -> None:
+    """Startup work and cache warming done once, before forking"""
+    import music21
+    from db import db
+    from similarity import similarity_index
+
+    app_module.prepare_shared_state()
+    app_module.app.state.preloaded = True
+
+    music21.converter.parse(_WARMUP_MUSICXML, format="musicxml")
+    added = similarity_index.sync(db)
+    print(f"🧭 Similarity index: {len(similarity_index)} exercises ({added} added at startup)")
+
+    # Objects that exist now are never collected, so the collector never
+    # writes to (and un-shares) their pages in the workers
+    gc.collect()
+    gc.freeze()
+
+
+def bind_socket(host: str, port: int) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(BACKLOG)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(app, sock: socket.socket, max_requests: int) -> None:
+    """Serve on the inherited socket until stopped or recycled (child process)"""
+    random.seed()
+    config = uvicorn.Config(
+        app,
+        limit_max_requests=max_requests + random.randint(0, MAX_REQUESTS_JITTER) if max_requests else None,
+        timeout_graceful_shutdown=GRACEFUL_TIMEOUT,
+        log_level=os.getenv("LOG_LEVEL", "info").lower(),
+    )
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+class Master:
+    """Keeps `workers` worker processes running"""
+
+    def __init__(self, app, sock: socket.socket, workers: int, max_requests: int):
+        self.app = app
+        self.sock = sock
+        self.workers = workers
+        self.max_requests = max_requests
+        self.children: Dict[int, float] = {}
+        self.stopping = False
+        self.restart_requested = False
+
+    def spawn(self) -> int:
+        pid = os.fork()
+        if pid == 0:
+            # uvicorn handles SIGTERM/SIGINT; a SIGHUP sent to the whole group is the master's
+            for signum in (signal.SIGTERM, signal.SIGINT):
+                signal.signal(signum, signal.SIG_DFL)
+            signal.signal(signal.SIGHUP, signal.SIG_IGN)
+            code = 0
+            try:
+                run_worker(self.app, self.sock, self.max_requests)
+            except BaseException:
+                code = 1
+                raise
+            finally:
+                os._exit(code)
+        self.children[pid] = time.monotonic()
+        return pid
+
+    def reap(self) -> int:
+        """Collect exited workers; returns how many"""
+        reaped = 0
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self.children.clear()
+                break
+            if pid == 0:
+                break
+            if self.children.pop(pid, None) is not None:
+                reaped += 1
+                if not self.stopping:
+                    print(f"♻️  Worker {pid} exited ({os.waitstatus_to_exitcode(status)}), replacing it")
+        return reaped
+
+    def stop_worker(self, pid: int, timeout: float = GRACEFUL_TIMEOUT + 5) -> None:
+        """SIGTERM one worker and wait for it, killing it after `timeout`"""
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+        deadline = time.monotonic() + timeout
+        while pid in self.children and time.monotonic() < deadline:
+            try:
+                if os.waitpid(pid, os.WNOHANG)[0] == pid:
+                    self.children.pop(pid, None)
+                    return
+            except ChildProcessError:
+                self.children.pop(pid, None)
+                return
+            time.sleep(0.1)
+        if pid in self.children:
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+            self.children.pop(pid, None)
+
+    def rolling_restart(self) -> None:
+        print(f"🔄 Rolling restart of {len(self.children)} workers")
+        for pid in list(self.children):
+            if self.stopping:
+                return
+            self.spawn()
+            time.sleep(WORKER_STARTUP_SECONDS)
+            self.stop_worker(pid)
+        print("✅ Rolling restart complete")
+
+    def shutdown(self) -> None:
+        print(f"🛑 Stopping {len(self.children)} workers...")
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + GRACEFUL_TIMEOUT + 5
+        while self.children and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.1)
+        for pid in list(self.children):
+            os.kill(pid, signal.SIGKILL)
+        while self.children:
+            self.reap()
+            time.sleep(0.05)
+
+    def run(self) -> int:
+        def request_stop(signum, frame):
+            self.stopping = True
+
+        def request_restart(signum, frame):
+            self.restart_requested = True
+
+        signal.signal(signal.SIGTERM, request_stop)
+        signal.signal(signal.SIGINT, request_stop)
+        signal.signal(signal.SIGHUP, request_restart)
+
+        for _ in range(self.workers):
+            self.spawn()
+        print(f"🚀 {self.workers} workers serving (master pid {os.getpid()})")
+
+        while not self.stopping:
+            self.reap()
+            while len(self.children) < self.workers and not self.stopping:
+                self.spawn()
+            if self.restart_requested:
+                self.restart_requested = False
+                self.rolling_restart()
+            time.sleep(0.2)
+
+        self.shutdown()
+        return 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--workers", type=int, default=WEB_CONCURRENCY, help="Worker processes (WEB_CONCURRENCY)")
+    parser.add_argument("--host", default=os.getenv("API_HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("API_PORT", "8000")))
+    parser.add_argument("--max-requests", type=int, default=MAX_REQUESTS,
+                        help="Recycle a worker after about this many requests (0 = never)")
+    args = parser.parse_args(argv)
+
+    print("🎵 Preloading SightReadPro API...")
+    import main as app_module
+    preload(app_module)
+
+    sock = bind_socket(args.host, args.port)
+    print(f"🌐 Listening on {args.host}:{args.port}")
+    return Master(app_module.app, sock, max(args.workers, 1), args.max_requests).run()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,252 @@
+"""
+Exercise similarity index for "more like this" queries
+
+Every exercise is described by a short feature vector: its melodic interval
+histogram, rhythm profile, pitch range, key, meter, length and difficulty.
+Vectors are L2-normalised, so cosine similarity is a dot product, and kept
+in one contiguous float32 matrix stored feature-major (features x
+exercises), which makes the query's matrix-vector product stream through
+memory once; an argpartition then picks the top k.
+
+The index is persisted as .npy files and memory-mapped on startup. Exercises
+are only ever appended, so new ones are added incrementally (any exercise ID
+above the largest indexed one) into an in-memory tail that is folded into
+the files on the next save.
+"""
+
+import json
+import os
+import threading
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from score_store import quarter_lengths
+from transpose import notes_to_arrays, parse_key, TranspositionError
+
+SIMILARITY_INDEX_DIR = os.getenv("SIMILARITY_INDEX_DIR", "similarity_index")
+FEATURE_VERSION = 1
+# Fold the in-memory tail into the files once it holds this many exercises
+SAVE_EVERY = 10_000
+
+DIFFICULTY_CODES = {'easy': 0, 'medium': 1, 'hard': 2}
+
+# Melodic intervals -7..+7 semitones, plus larger leaps down and up
+_INTERVAL_BINS = 17
+# Note lengths in quarter notes (anything else is binned to the nearest)
+_RHYTHM_BINS = np.array([0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 4.0])
+# Relative weight of each feature group in the similarity
+_WEIGHTS = {
+    'intervals': 1.0,
+    'rhythm': 1.0,
+    'range': 0.6,
+    'key': 0.4,
+    'meter': 0.5,
+    'shape': 0.5,
+}
+FEATURE_DIMENSIONS = _INTERVAL_BINS + len(_RHYTHM_BINS) + 3 + 3 + 2 + 2
+_EXCLUDED_SHIFT = 4.0
+
+
+def exercise_features(notes: Optional[Sequence[str]], rhythm_pattern: Optional[Sequence[str]],
+                      key_signature: Optional[str], time_signature: Optional[str],
+                      difficulty: Optional[str]) -> np.ndarray:
+    """Unit-length float32 feature vector of one exercise"""
+    try:
+        midi = notes_to_arrays(notes or [])[2].astype(np.int64)
+    except TranspositionError:
+        midi = np.zeros(0, dtype=np.int64)
+    count = len(midi)
+
+    intervals = np.zeros(_INTERVAL_BINS)
+    if count > 1:
+        steps = np.diff(midi)
+        bins = np.where(steps < -7, 15, np.where(steps > 7, 16, steps + 7))
+        intervals = np.bincount(bins, minlength=_INTERVAL_BINS) / len(steps)
+
+    rhythm = np.zeros(len(_RHYTHM_BINS))
+    if count:
+        lengths = quarter_lengths(rhythm_pattern, count)
+        nearest = np.abs(lengths[:, None] - _RHYTHM_BINS[None, :]).argmin(axis=1)
+        rhythm = np.bincount(nearest, minlength=len(_RHYTHM_BINS)) / count
+
+    # Lowest and highest note (around middle C) and the span, in octaves
+    pitch_range = np.zeros(3)
+    if count:
+        pitch_range = np.array([(midi.min() - 60) / 24, (midi.max() - 60) / 24, (midi.max() - midi.min()) / 24])
+
+    # Tonic on the circle of fifths, and mode
+    key = np.zeros(3)
+    if key_signature:
+        try:
+            step, alter = parse_key(key_signature)
+            pitch_class = ((0, 2, 4, 5, 7, 9, 11)[step] + alter) % 12
+            angle = 2 * np.pi * ((pitch_class * 7) % 12) / 12
+            key = np.array([np.cos(angle), np.sin(angle), 1.0 if 'minor' in key_signature.lower() else 0.0])
+        except TranspositionError:
+            pass
+
+    meter = np.zeros(2)
+    if time_signature and '/' in time_signature:
+        numerator, _, denominator = time_signature.partition('/')
+        if numerator.strip().isdigit() and denominator.strip().isdigit():
+            beats, unit = int(numerator), int(denominator)
+            compound = beats % 3 == 0 and beats > 3 and unit >= 8
+            meter = np.array([min(beats, 12) / 12, 1.0 if compound else 0.0])
+
+    shape = np.array([np.log1p(count) / np.log1p(64), DIFFICULTY_CODES.get(difficulty, 1) / 2])
+
+    groups = {'intervals': intervals, 'rhythm': rhythm, 'range': pitch_range, 'key': key, 'meter': meter,
+              'shape': shape}
+    vector = np.concatenate([_WEIGHTS[name] * values for name, values in groups.items()]).astype(np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def _features_of(exercise) -> np.ndarray:
+    return exercise_features(exercise.notes, exercise.rhythm_pattern, exercise.key_signature,
+                             exercise.time_signature, exercise.difficulty.value if exercise.difficulty else None)
+
+
+class SimilarityIndex:
+    """Feature matrix of all exercises with top-k cosine queries"""
+
+    def __init__(self, directory: str = SIMILARITY_INDEX_DIR, load: bool = True):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.base_ids = np.zeros(0, dtype=np.int64)
+        # Feature-major: base_features[:, row] is one exercise
+        self.base_features = np.zeros((FEATURE_DIMENSIONS, 0), dtype=np.float32)
+        self.base_difficulty = np.zeros(0, dtype=np.int8)
+        self._reset_tail()
+        if load:
+            self.load()
+
+    def _reset_tail(self):
+        self.tail_ids = np.zeros(0, dtype=np.int64)
+        self.tail_vectors = np.zeros((1024, FEATURE_DIMENSIONS), dtype=np.float32)
+        self.tail_difficulty = np.zeros(1024, dtype=np.int8)
+
+    def _paths(self) -> Dict[str, str]:
+        return {name: os.path.join(self.directory, f"{name}.npy") for name in ('ids', 'features', 'difficulty')}
+
+    def load(self) -> bool:
+        """Memory-map the saved index; returns False if there is none (or it is stale)"""
+        meta_path = os.path.join(self.directory, 'meta.json')
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if meta.get('version') != FEATURE_VERSION or meta.get('dimensions') != FEATURE_DIMENSIONS:
+                return False
+            paths = self._paths()
+            ids = np.load(paths['ids'], mmap_mode='r')
+            features = np.load(paths['features'], mmap_mode='r')
+            difficulty = np.load(paths['difficulty'], mmap_mode='r')
+        except (OSError, ValueError):
+            return False
+        if not (len(ids) == features.shape[1] == len(difficulty) == meta.get('count')):
+            return False
+        self.base_ids, self.base_features, self.base_difficulty = ids, features, difficulty
+        self._reset_tail()
+        return True
+
+    def save(self):
+        """Write base and tail to the index files and map them back in"""
+        os.makedirs(self.directory, exist_ok=True)
+        count = len(self)
+        arrays = {
+            'ids': np.concatenate((self.base_ids, self.tail_ids)),
+            'features': np.concatenate((self.base_features, self.tail_vectors[:len(self.tail_ids)].T), axis=1),
+            'difficulty': np.concatenate((self.base_difficulty, self.tail_difficulty[:len(self.tail_ids)])),
+        }
+        for name, path in self._paths().items():
+            with open(path + '.tmp', 'wb') as f:
+                np.save(f, arrays[name])
+            os.replace(path + '.tmp', path)
+        meta_path = os.path.join(self.directory, 'meta.json')
+        with open(meta_path + '.tmp', 'w') as f:
+            json.dump({'version': FEATURE_VERSION, 'dimensions': FEATURE_DIMENSIONS, 'count': count}, f)
+        os.replace(meta_path + '.tmp', meta_path)
+        self.load()
+
+    def __len__(self) -> int:
+        return len(self.base_ids) + len(self.tail_ids)
+
+    @property
+    def max_id(self) -> int:
+        last = [int(ids[-1]) for ids in (self.base_ids, self.tail_ids) if len(ids)]
+        return max(last) if last else 0
+
+    def add(self, ids: Sequence[int], vectors: np.ndarray, difficulty: Sequence[int]):
+        """Append exercises (IDs above max_id) to the in-memory tail"""
+        start, end = len(self.tail_ids), len(self.tail_ids) + len(ids)
+        if end > len(self.tail_vectors):
+            capacity = max(end, 2 * len(self.tail_vectors))
+            vectors_buffer = np.zeros((capacity, FEATURE_DIMENSIONS), dtype=np.float32)
+            difficulty_buffer = np.zeros(capacity, dtype=np.int8)
+            vectors_buffer[:start] = self.tail_vectors[:start]
+            difficulty_buffer[:start] = self.tail_difficulty[:start]
+            self.tail_vectors, self.tail_difficulty = vectors_buffer, difficulty_buffer
+        self.tail_vectors[start:end] = vectors
+        self.tail_difficulty[start:end] = difficulty
+        self.tail_ids = np.concatenate((self.tail_ids, np.asarray(ids, dtype=np.int64)))
+
+    def add_exercises(self, exercises: Iterable) -> int:
+        exercises = list(exercises)
+        if exercises:
+            self.add([e.id for e in exercises], np.stack([_features_of(e) for e in exercises]),
+                     [DIFFICULTY_CODES.get(e.difficulty.value, 1) for e in exercises])
+        return len(exercises)
+
+    def sync(self, database, batch_size: int = 5000) -> int:
+        """Index exercises added to the database since the last sync"""
+        with self.lock:
+            if database.get_max_exercise_id() <= self.max_id:
+                return 0
+            added = 0
+            for exercises in database.iter_exercises_after(self.max_id, batch_size):
+                added += self.add_exercises(exercises)
+            if len(self.tail_ids) >= SAVE_EVERY:
+                self.save()
+            return added
+
+    def vector_for(self, exercise_id: int) -> Optional[np.ndarray]:
+        row = int(np.searchsorted(self.base_ids, exercise_id))
+        if row < len(self.base_ids) and self.base_ids[row] == exercise_id:
+            return np.array(self.base_features[:, row])
+        row = int(np.searchsorted(self.tail_ids, exercise_id))
+        if row < len(self.tail_ids) and self.tail_ids[row] == exercise_id:
+            return self.tail_vectors[row].copy()
+        return None
+
+    def query(self, vector: np.ndarray, k: int = 10, exclude: Sequence[int] = (),
+              difficulty: Optional[str] = None) -> List[Tuple[int, float]]:
+        """Top-k (exercise_id, cosine similarity), most similar first"""
+        tail = len(self.tail_ids)
+        ids = np.concatenate((self.base_ids, self.tail_ids)) if tail else self.base_ids
+        scores = vector @ np.asarray(self.base_features)
+        if tail:
+            scores = np.concatenate((scores, self.tail_vectors[:tail] @ vector))
+        # Ruled-out rows are shifted below any cosine rather than set to one
+        # value, since argpartition slows down badly on many equal values
+        if difficulty is not None:
+            code = DIFFICULTY_CODES[difficulty]
+            codes = np.asarray(self.base_difficulty)
+            if tail:
+                codes = np.concatenate((codes, self.tail_difficulty[:tail]))
+            scores -= (codes != code) * np.float32(_EXCLUDED_SHIFT)
+        if len(exclude):
+            # IDs are sorted: base and tail each are, and the tail's come after
+            exclude = np.asarray(exclude, dtype=np.int64)
+            rows = np.minimum(np.searchsorted(ids, exclude), max(len(ids) - 1, 0))
+            scores[rows[ids[rows] == exclude]] -= _EXCLUDED_SHIFT
+
+        k = min(k, len(scores))
+        if k <= 0:
+            return []
+        top = np.argpartition(scores, len(scores) - k)[len(scores) - k:]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [(int(ids[i]), float(scores[i])) for i in top if scores[i] >= -1.0]
+
+
+similarity_index = SimilarityIndex()
@@ -0,0 +1,207 @@
+"""
+Reference-audio synthesis for SightReadPro
+
+Renders an exercise's notes and rhythm to 16-bit mono WAV with NumPy
+additive synthesis: every sample of the take is computed in one vectorized
+pass per harmonic, with no per-note Python loop over samples. Rendered
+files are kept in a size-bounded on-disk LRU cache so that only the first
+play of a cold (exercise, tempo, instrument) costs CPU.
+"""
+
+import os
+import struct
+import hashlib
+import threading
+from typing import List, Optional, Dict, Tuple, Sequence
+
+import numpy as np
+
+from score_store import quarter_lengths
+from transpose import notes_to_arrays
+from metrics import CACHE_LOOKUPS
+
+SAMPLE_RATE = 22050
+AUDIO_CACHE_DIR = "audio_cache"
+AUDIO_CACHE_MAX_BYTES = int(os.getenv("AUDIO_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+MIN_TEMPO = 30
+MAX_TEMPO = 300
+
+# Harmonic amplitudes and envelope (attack, decay time constant, release) per voice
+INSTRUMENT_VOICES = {
+    'piano': {'harmonics': [1.0, 0.45, 0.25, 0.12, 0.06], 'attack': 0.005, 'decay': 0.6, 'release': 0.04},
+    'organ': {'harmonics': [1.0, 0.6, 0.0, 0.35, 0.0, 0.2], 'attack': 0.02, 'decay': None, 'release': 0.03},
+    'strings': {'harmonics': [1.0, 0.5, 0.33, 0.25, 0.2, 0.16], 'attack': 0.08, 'decay': None, 'release': 0.08},
+    'flute': {'harmonics': [1.0, 0.2, 0.05], 'attack': 0.04, 'decay': None, 'release': 0.05},
+    'sine': {'harmonics': [1.0], 'attack': 0.01, 'decay': None, 'release': 0.02},
+}
+
+
+class SynthesisError(ValueError):
+    """Raised for exercises or options that cannot be rendered"""
+
+
+def render_samples(notes: Sequence[str], rhythm_pattern: Optional[Sequence[str]],
+                   tempo: int = 90, instrument: str = 'piano',
+                   sample_rate: int = SAMPLE_RATE) -> np.ndarray:
+    """Render notes to float32 samples in [-1, 1]"""
+    if instrument not in INSTRUMENT_VOICES:
+        raise SynthesisError(f"Unknown instrument '{instrument}'")
+    if not MIN_TEMPO <= tempo <= MAX_TEMPO:
+        raise SynthesisError(f"Tempo must be between {MIN_TEMPO} and {MAX_TEMPO} BPM")
+    if not notes:
+        return np.zeros(0, dtype=np.float32)
+
+    voice = INSTRUMENT_VOICES[instrument]
+    _, _, midi = notes_to_arrays(notes)
+    frequencies = 440.0 * 2.0 ** ((midi - 69) / 12.0)
+
+    # Sample boundaries of each note
+    seconds = quarter_lengths(rhythm_pattern, len(notes)) * 60.0 / tempo
+    lengths = np.maximum(np.round(seconds * sample_rate).astype(np.int64), 1)
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+
+    # Per-sample note index and time since that note started
+    note_index = np.repeat(np.arange(len(notes)), lengths)
+    local = (np.arange(note_index.size) - starts[note_index]) / sample_rate
+    remaining = (lengths[note_index] / sample_rate) - local
+
+    phase = 2.0 * np.pi * frequencies[note_index] * local
+    nyquist = sample_rate / 2.0
+    samples = np.zeros(note_index.size)
+    for h, amplitude in enumerate(voice['harmonics'], start=1):
+        if amplitude:
+            audible = frequencies[note_index] * h < nyquist
+            samples += np.where(audible, amplitude * np.sin(h * phase), 0.0)
+
+    envelope = np.minimum(local / voice['attack'], 1.0)
+    if voice['decay']:
+        envelope *= np.exp(-local / voice['decay'])
+    envelope *= np.minimum(remaining / voice['release'], 1.0)
+
+    samples *= envelope
+    peak = np.abs(samples).max()
+    if peak > 0:
+        samples *= 0.8 / peak
+    return samples.astype(np.float32)
+
+
+def wav_bytes(samples: np.ndarray, sample_rate: int = SAMPLE_RATE) -> bytes:
+    """Encode float samples as a 16-bit mono PCM WAV file"""
+    pcm = (np.clip(samples, -1.0, 1.0) * 32767).astype('<i2').tobytes()
+    header = struct.pack(
+        '<4sI4s4sIHHIIHH4sI',
+        b'RIFF', 36 + len(pcm), b'WAVE',
+        b'fmt ', 16, 1, 1, sample_rate, sample_rate * 2, 2, 16,
+        b'data', len(pcm),
+    )
+    return header + pcm
+
+
+_AUDIO_HITS = CACHE_LOOKUPS.labels("audio", "hit")
+_AUDIO_MISSES = CACHE_LOOKUPS.labels("audio", "miss")
+
+
+class AudioCache:
+    """
+    Size-bounded on-disk LRU cache of rendered audio
+
+    Recency is the file's mtime, touched on every hit, so the cache survives
+    restarts and is shared by every worker using the same directory.
+    """
+
+    def __init__(self, directory: str = AUDIO_CACHE_DIR, max_bytes: int = AUDIO_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def path_for(self, exercise_id: int, tempo: int, instrument: str,
+                 notes: Sequence[str], rhythm_pattern: Optional[Sequence[str]]) -> str:
+        # The content digest keeps a stale render from being served if an exercise changes
+        digest = hashlib.blake2b(repr((list(notes), list(rhythm_pattern or []))).encode(),
+                                 digest_size=6).hexdigest()
+        return os.path.join(self.directory, f"{exercise_id}_{tempo}_{instrument}_{digest}.wav")
+
+    def get_or_render(self, exercise_id: int, notes: Sequence[str], rhythm_pattern: Optional[Sequence[str]],
+                      tempo: int, instrument: str) -> str:
+        """Path of the rendered WAV, rendering and caching it on a miss"""
+        path = self.path_for(exercise_id, tempo, instrument, notes, rhythm_pattern)
+        try:
+            os.utime(path)
+            self.hits += 1
+            _AUDIO_HITS.inc()
+            return path
+        except FileNotFoundError:
+            pass
+
+        self.misses += 1
+        _AUDIO_MISSES.inc()
+        data = wav_bytes(render_samples(notes, rhythm_pattern, tempo, instrument))
+        os.makedirs(self.directory, exist_ok=True)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+        self.evict()
+        return path
+
+    def evict(self) -> int:
+        """Remove least recently used files until the cache fits; returns bytes freed"""
+        with self._lock:
+            entries: List[Tuple[float, int, str]] = []
+            total = 0
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if not entry.name.endswith('.wav'):
+                        continue
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+
+            freed = 0
+            entries.sort()
+            for _, size, path in entries:
+                if total - freed <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    freed += size
+                except FileNotFoundError:
+                    pass
+            return freed
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "max_bytes": self.max_bytes}
+
+
+audio_cache = AudioCache()
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single-range 'bytes=' header into inclusive (start, end)
+
+    Returns None when the range cannot be satisfied. Multi-range requests
+    are answered with the first range only.
+    """
+    if not header.startswith('bytes=') or size == 0:
+        return None
+    first = header[len('bytes='):].split(',')[0].strip()
+    start_text, _, end_text = first.partition('-')
+    try:
+        if start_text:
+            start = int(start_text)
+            end = int(end_text) if end_text else size - 1
+        else:
+            suffix = int(end_text)
+            if suffix == 0:
+                return None
+            start, end = max(size - suffix, 0), size - 1
+    except ValueError:
+        return None
+    end = min(end, size - 1)
+    if start > end or start >= size:
+        return None
+    return start, end
@@ -0,0 +1,84 @@
+"""
+Parity tests for the SQLite-serialized exercise lists
+
+The fast path must produce exactly the bytes FastAPI would for the same
+exercises as List[Exercise] models.
+"""
+
+import json
+from typing import List
+
+import pytest
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+EDGE_ROWS = [
+    # measures, difficulty, title, key, time signature, notes, rhythm, xp, created_at
+    ('1-4', 'easy', 'Für Elise — 練習 🎵', 'A minor', '3/8', '["E5", "D#5", "E5"]', '["16th"]', 10,
+     '2024-03-01T09:15:30.123456'),
+    ('5-8', 'medium', 'Quotes " and \\ backslash', None, None, None, None, 15, '2024-03-01T09:15:30'),
+    ('9', 'hard', 'Line\nbreak\ttab\x01ctl', 'B-', '6/8', '[]', '[]', 20, '2024-03-01T09:15:30.120000'),
+    ('10-12', 'easy', None, 'C', '4/4', '["C4"]', '["whole", "half"]', 0, '2024-03-01 09:15:30.000001'),
+    ('13-16', 'medium', '', 'F#', '5/4', '["C4","D4"]', '["quarter"]', 12, '2024-03-01T23:59:59.999999'),
+]
+
+
+@pytest.fixture
+def database(make_database):
+    # Hand-written rows first, for what generated exercises never contain
+    database = make_database()
+    conn = database.get_connection()
+    conn.executemany('''
+        INSERT INTO exercises (measures, difficulty, title, key_signature, time_signature, notes,
+                               rhythm_pattern, xp_reward, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', EDGE_ROWS)
+    conn.commit()
+    conn.close()
+    database.save_exercises(
+        {'measures': f'{i}-{i + 3}', 'difficulty': ('easy', 'medium', 'hard')[i % 3], 'title': f'Generated {i}',
+         'key_signature': 'G', 'time_signature': '2/4', 'notes': ['G4', 'A4', 'B4', f'C{4 + i % 3}'],
+         'rhythm_pattern': ['eighth', 'dotted quarter']}
+        for i in range(150)
+    )
+    return database
+
+
+def model_bytes(database, exercise_ids: List[int]) -> bytes:
+    """What FastAPI renders for these exercises through response_model=List[Exercise]"""
+    return JSONResponse(content=jsonable_encoder(database.get_exercises_by_ids(exercise_ids))).body
+
+
+def test_each_row_matches_model_serialization(database):
+    objects = database.get_exercises_json(limit=1000)
+    assert len(objects) == database.get_max_exercise_id()
+    for text in objects:
+        exercise_id = json.loads(text)['id']
+        assert ('[' + text + ']').encode('utf-8') == model_bytes(database, [exercise_id])
+
+
+def test_difficulty_filter_matches(database):
+    objects = database.get_exercises_json(limit=1000, difficulty='hard')
+    ids = [json.loads(text)['id'] for text in objects]
+    assert ids and len(ids) == len(database.get_exercises(limit=1000, difficulty='hard'))
+    assert ('[' + ','.join(objects) + ']').encode('utf-8') == model_bytes(database, ids)
+
+
+@pytest.mark.parametrize("path", [
+    "/exercises/exercises/?limit=100",
+    "/exercises/exercises/?limit=100&difficulty=medium",
+    "/exercises/exercises/difficulty/easy?limit=50",
+    "/exercises/exercises/random/60",
+])
+def test_routes_match_model_path(database, path, monkeypatch):
+    from fastapi.testclient import TestClient
+    import db as db_module
+    import main
+
+    monkeypatch.setattr(db_module.db, "db_path", database.db_path)
+    response = TestClient(main.app).get(path)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/json"
+    ids = [exercise["id"] for exercise in response.json()]
+    assert ids
+    assert response.content == model_bytes(database, ids)
@@ -0,0 +1,140 @@
+"""
+Tests for ETag revalidation and the response cache
+
+A conditional GET is answered 304 while the data a response depends on is
+unchanged, and gets a fresh body and ETag as soon as a write bumps its
+data version.
+"""
+
+import pytest
+
+from http_cache import ResponseCache, etag_for, etag_matches
+from versions import DataVersions, LIBRARY
+
+
+@pytest.fixture
+def database(make_database):
+    return make_database(
+        {'measures': f'{i}-{i + 3}', 'difficulty': ('easy', 'medium', 'hard')[i % 3], 'title': f'Generated {i}',
+         'key_signature': 'C', 'time_signature': '4/4', 'notes': ['C4', 'D4', f'E{3 + i % 4}'],
+         'rhythm_pattern': ['quarter']}
+        for i in range(12)
+    )
+
+
+@pytest.fixture
+def client(database, monkeypatch):
+    from fastapi.testclient import TestClient
+    import db as db_module
+    import main
+    from http_cache import response_cache
+
+    monkeypatch.setattr(db_module.db, "db_path", database.db_path)
+    # Bodies cached by other tests' databases would match the same ETags
+    response_cache.clear()
+    return TestClient(main.app)
+
+
+def revalidate(client, path: str, etag: str):
+    return client.get(path, headers={"If-None-Match": etag})
+
+
+@pytest.mark.parametrize('header, matches', [
+    (None, False), ('"abc"', True), ('W/"abc"', True), ('"x", "abc"', True), ('*', True), ('"abcd"', False),
+])
+def test_etag_matches(header, matches):
+    assert etag_matches(header, '"abc"') is matches
+
+
+def test_etag_depends_on_every_part():
+    assert etag_for('daily', 1, 'alice') == etag_for('daily', 1, 'alice')
+    assert len({etag_for('daily', 1, 'alice'), etag_for('daily', 2, 'alice'), etag_for('daily', 1, 'bob')}) == 3
+
+
+def test_bump_counts_and_notifies():
+    versions = DataVersions(user_slots=16)
+    bumped = []
+    versions.subscribe(bumped.append)
+    slot = versions.user_slot('alice')
+    assert 1 <= slot <= 16 and slot == versions.user_slot('alice')
+
+    versions.bump_user('alice')
+    versions.bump_user('alice')
+    versions.bump(LIBRARY)
+    assert (versions.version(slot), versions.version(LIBRARY)) == (2, 1)
+    assert bumped == [slot, slot, LIBRARY]
+
+
+def test_bump_drops_dependent_bodies():
+    cache = ResponseCache()
+    cache.store('"a"', 'private', {'n': 1}, slots=[3])
+    cache.store('"b"', 'private', {'n': 2}, slots=[4])
+    cache.invalidate(3)
+    assert cache.stats()['entries'] == 1
+    assert cache.size == len(b'{"n":2}')
+
+
+def test_cache_stays_under_its_budget():
+    cache = ResponseCache(max_bytes=800)
+    for i in range(20):
+        cache.store(f'"{i}"', 'public', {'value': 'x' * 80, 'i': i})
+    assert cache.size <= 800
+    # Least recently used bodies go first
+    assert cache.stats()['entries'] < 20
+
+
+def test_library_stats_revalidate_until_a_write(client, database):
+    path = '/exercises/exercises/stats/summary'
+    first = client.get(path)
+    assert first.status_code == 200
+    etag = first.headers['etag']
+    assert revalidate(client, path, etag).status_code == 304
+    assert client.get(path).content == first.content
+
+    database.save_exercises([{'measures': '1-1', 'difficulty': 'hard', 'title': 'New', 'key_signature': 'C',
+                              'time_signature': '4/4', 'notes': ['B5'], 'rhythm_pattern': ['half']}])
+    after = revalidate(client, path, etag)
+    assert after.status_code == 200
+    assert after.headers['etag'] != etag
+    assert after.json()['total_exercises'] == first.json()['total_exercises'] + 1
+
+
+def test_daily_set_revalidates_until_the_user_practices(client, database):
+    from datetime import datetime
+    from models import Performance
+
+    path = '/exercises/exercises/daily/alice?limit=3'
+    first = client.get(path)
+    assert first.status_code == 200
+    etag = first.headers['etag']
+    assert first.headers['cache-control'].startswith('private')
+    assert revalidate(client, path, etag).status_code == 304
+
+    # Another user's writes don't touch alice's version slot (unless the two share a slot)
+    database.save_performance(Performance(user_id='bob', exercise_id=1, score=90, submitted_at=datetime.now()))
+    import versions
+    if versions.data_versions.user_slot('bob') != versions.data_versions.user_slot('alice'):
+        assert revalidate(client, path, etag).status_code == 304
+
+    exercise_id = first.json()['exercises'][0]['id']
+    database.save_performance(Performance(user_id='alice', exercise_id=exercise_id, score=90,
+                                          submitted_at=datetime.now()))
+    after = revalidate(client, path, etag)
+    assert after.status_code == 200
+    assert after.headers['etag'] != etag
+
+
+def test_exercise_etag_changes_with_the_epoch(client, monkeypatch):
+    import versions
+
+    path = '/exercises/exercises/1'
+    first = client.get(path)
+    assert first.status_code == 200
+    assert 'immutable' in first.headers['cache-control']
+    assert revalidate(client, path, first.headers['etag']).status_code == 304
+
+    # A new epoch (e.g. a replaced database after a restart) must not revalidate old bodies
+    monkeypatch.setattr(versions.data_versions, 'epoch', 'replaced')
+    again = revalidate(client, path, first.headers['etag'])
+    assert again.status_code == 200
+    assert again.headers['etag'] != first.headers['etag']
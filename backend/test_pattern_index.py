@@ -0,0 +1,121 @@
+"""
+Tests for melodic pattern search
+
+Every search through the trigram index must find exactly what a scan of
+every exercise's intervals finds: the same exercises, start notes and
+start measures, whether the pattern is shorter or longer than a trigram,
+uses step alternatives or large leaps, or pins the rhythm.
+"""
+
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pytest
+
+from pattern_index import (
+    parse_pattern, parse_rhythm, query_windows, exercise_postings, rhythm_codes, PatternError, MAX_INTERVAL
+)
+from score_store import quarter_lengths
+from transpose import notes_to_arrays
+
+PITCHES = ['C4', 'D4', 'E4', 'F4', 'G4', 'A4', 'C5', 'E5', 'C6']
+RHYTHMS = ['quarter', 'eighth', 'half']
+
+
+def random_exercises(rng: np.random.Generator, count: int):
+    exercises = []
+    for i in range(count):
+        length = int(rng.integers(1, 24))
+        exercises.append({
+            'measures': f'{i + 1}-{i + 4}', 'difficulty': 'easy', 'title': f'Random {i}',
+            'key_signature': 'C', 'time_signature': ('4/4', '3/4', '6/8')[i % 3],
+            'notes': [PITCHES[p] for p in rng.integers(0, len(PITCHES), length)],
+            'rhythm_pattern': [RHYTHMS[r] for r in rng.integers(0, len(RHYTHMS), length)],
+        })
+    return exercises
+
+
+@pytest.fixture
+def library(make_database):
+    database = make_database(random_exercises(np.random.default_rng(11), 300))
+    # Everything stored, including the sample exercises a new database starts with
+    stored = database.get_exercises_by_ids(list(range(1, database.get_max_exercise_id() + 1)))
+    return database, {exercise.id: exercise for exercise in stored}
+
+
+def brute_force(exercises, steps: List[Tuple[int, ...]], rhythm: Optional[List[int]]):
+    """Matches found by checking every start position of every exercise"""
+    allowed = [set(np.clip(alternatives, -MAX_INTERVAL, MAX_INTERVAL).tolist()) for alternatives in steps]
+    matches = {}
+    for exercise_id, exercise in exercises.items():
+        midi = notes_to_arrays(exercise.notes or [])[2].astype(np.int64)
+        intervals = np.clip(np.diff(midi), -MAX_INTERVAL, MAX_INTERVAL).tolist()
+        classes = rhythm_codes(quarter_lengths(exercise.rhythm_pattern, len(midi))).tolist()
+        bars = {position: bar for _, _, position, bar in exercise_postings(
+            exercise.notes, exercise.rhythm_pattern, exercise.time_signature, exercise.measures)}
+        starts = [
+            start for start in range(len(intervals) - len(steps) + 1)
+            if all(intervals[start + i] in allowed[i] for i in range(len(steps)))
+            and (rhythm is None or classes[start:start + len(rhythm)] == rhythm)
+        ]
+        if starts:
+            matches[exercise_id] = (starts, [bars[start] for start in starts])
+    return matches
+
+
+def indexed(database, steps, rhythm):
+    results, total = database.search_patterns(query_windows(steps, rhythm), limit=10_000)
+    assert total == len(results)
+    return {exercise_id: (starts, measures) for exercise_id, starts, measures in results}
+
+
+@pytest.mark.parametrize('pattern', [
+    '+2', '-s', '+2,+2', '+2 +1 +2', '+2,+2,+1,+2', '+s,+s,+s,+s,+s', 's s', '+3,+5', '+12 -12',
+    '+20', 'C4 E4 G4', 'E4 D4 C4 D4 E4 E4', '+2,+2,+1,+2,+2,+2,+1',
+])
+def test_search_matches_brute_force(library, pattern):
+    database, exercises = library
+    steps = parse_pattern(pattern)
+    expected = brute_force(exercises, steps, None)
+    assert indexed(database, steps, None) == expected
+
+
+@pytest.mark.parametrize('pattern, rhythm', [
+    ('+2', 'quarter, quarter'),
+    ('+2,+2', 'eighth,eighth,quarter'),
+    ('s,s,s,s', 'quarter,eighth,quarter,eighth,half'),
+])
+def test_rhythm_search_matches_brute_force(library, pattern, rhythm):
+    database, exercises = library
+    steps = parse_pattern(pattern)
+    classes = parse_rhythm(rhythm, len(steps) + 1)
+    assert indexed(database, steps, classes) == brute_force(exercises, steps, classes)
+
+
+def test_patterns_taken_from_exercises_find_them(library):
+    database, exercises = library
+    rng = np.random.default_rng(5)
+    for exercise_id in rng.choice(sorted(exercises), 25).tolist():
+        midi = notes_to_arrays(exercises[exercise_id].notes or [])[2].astype(np.int64)
+        if len(midi) < 2:
+            continue
+        start = int(rng.integers(0, len(midi) - 1))
+        end = int(rng.integers(start + 1, min(start + 9, len(midi) - 1) + 1))
+        steps = [(int(step),) for step in np.diff(midi[start:end + 1])]
+        found = indexed(database, steps, None)
+        assert start in found[exercise_id][0]
+        assert found == brute_force(exercises, steps, None)
+
+
+def test_ranking_puts_most_matches_first(library):
+    database, _ = library
+    results, total = database.search_patterns(query_windows(parse_pattern('+2')), limit=5)
+    assert len(results) == 5 < total
+    counts = [len(starts) for _, starts, _ in results]
+    assert counts == sorted(counts, reverse=True)
+
+
+@pytest.mark.parametrize('pattern', ['', 'C4', 'H4 C4', ','.join(['+1'] * 33)])
+def test_unsearchable_patterns(pattern):
+    with pytest.raises(PatternError):
+        query_windows(parse_pattern(pattern))
@@ -0,0 +1,63 @@
+"""
+Tests for the performance event blob format
+
+Blobs come from clients, so decoding must reject anything that is cut
+short or that inflates past the size its header promises.
+"""
+
+import base64
+import zlib
+
+import numpy as np
+import pytest
+
+from perf_events import (
+    encode_events, decode_events, events_from_records, events_from_payload, PerformanceEventError,
+    HEADER, MAGIC, FORMAT_VERSION, FLAG_ZLIB, EVENT_DTYPE
+)
+
+RECORDS = [[1500, 64, 80, 250], [0, 60, 90, 240], [500, 62, 70, 260], [1000, 64], [2000, 67, 100, 70000]]
+
+
+@pytest.mark.parametrize('delta', [True, False])
+@pytest.mark.parametrize('compress', [True, False])
+def test_round_trip(delta, compress):
+    events = events_from_records(RECORDS)
+    decoded = decode_events(encode_events(events, delta=delta, compress=compress))
+    assert decoded.dtype == EVENT_DTYPE
+    assert np.array_equal(decoded, events)
+    assert decoded['onset_ms'].tolist() == [0, 500, 1000, 1500, 2000]
+    # Missing velocity and duration default; long durations are clipped
+    assert decoded[2].tolist() == (1000, 64, 64, 0)
+    assert decoded['duration_ms'][-1] == 0xFFFF
+
+
+def test_payload_round_trip():
+    events = events_from_records(RECORDS)
+    payload = base64.b64encode(encode_events(events)).decode('ascii')
+    assert np.array_equal(events_from_payload(payload), events)
+
+
+@pytest.mark.parametrize('compress', [True, False])
+def test_truncated_blob_is_rejected(compress):
+    blob = encode_events(events_from_records(RECORDS), compress=compress)
+    for cut in (3, HEADER.size + 1, len(blob) - 1):
+        with pytest.raises(PerformanceEventError):
+            decode_events(blob[:cut])
+
+
+def test_oversized_blob_is_rejected():
+    # A header promising two events in front of a body that inflates to 1 MB
+    bomb = HEADER.pack(MAGIC, FORMAT_VERSION, FLAG_ZLIB, 2) + zlib.compress(bytes(1 << 20), 9)
+    with pytest.raises(PerformanceEventError, match="does not match"):
+        decode_events(bomb)
+
+    blob = encode_events(events_from_records(RECORDS), compress=False)
+    with pytest.raises(PerformanceEventError, match="does not match"):
+        decode_events(blob + b'\0')
+
+
+def test_trailing_data_after_stream_is_rejected():
+    events = events_from_records(RECORDS)
+    with pytest.raises(PerformanceEventError):
+        decode_events(encode_events(events) + b'extra')
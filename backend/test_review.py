@@ -0,0 +1,129 @@
+"""
+Tests for spaced-repetition review scheduling
+
+Covers the SM-2 update, the due queue, and that the state kept up to date
+on each performance is exactly what `manage.py schedule-reviews` rebuilds
+from the full history.
+"""
+
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from review import (
+    schedule, grade_from_score, DEFAULT_EASE, MIN_EASE, MAX_INTERVAL_DAYS, FIRST_INTERVAL_DAYS, SECOND_INTERVAL_DAYS
+)
+
+NOW = datetime(2024, 3, 1, 9, 0, 0)
+
+
+@pytest.fixture
+def database(make_database):
+    return make_database(
+        {'measures': f'{i}-{i + 3}', 'difficulty': ('easy', 'medium', 'hard')[i % 3], 'title': f'Generated {i}',
+         'key_signature': 'C', 'time_signature': '4/4', 'notes': ['C4', 'D4', f'E{3 + i}'],
+         'rhythm_pattern': ['quarter']}
+        for i in range(6)
+    )
+
+
+def perform(database, user_id: str, exercise_id: int, score: int, submitted_at: datetime) -> int:
+    from models import Performance
+    return database.save_performance(Performance(user_id=user_id, exercise_id=exercise_id, score=score,
+                                                 submitted_at=submitted_at))
+
+
+def review_states(database):
+    conn = database.get_connection()
+    rows = conn.execute('SELECT * FROM review_state ORDER BY user_id, exercise_id').fetchall()
+    conn.close()
+    return [tuple(row) for row in rows]
+
+
+@pytest.mark.parametrize('score, grade', [(0, 0), (9, 0), (10, 0), (11, 1), (59, 3), (60, 3), (89, 4), (100, 5)])
+def test_grade_from_score(score, grade):
+    assert grade_from_score(score) == grade
+
+
+def test_passes_lengthen_interval():
+    ease, interval_days, repetitions = DEFAULT_EASE, 0.0, 0
+    intervals = []
+    for _ in range(4):
+        ease, interval_days, repetitions, lapsed = schedule(ease, interval_days, repetitions, 5)
+        assert not lapsed
+        intervals.append(float(interval_days))
+    assert intervals[:2] == [FIRST_INTERVAL_DAYS, SECOND_INTERVAL_DAYS]
+    assert intervals[2] == round(SECOND_INTERVAL_DAYS * (DEFAULT_EASE + 0.2))
+    assert intervals[3] == round(intervals[2] * (DEFAULT_EASE + 0.3))
+    assert repetitions == 4
+    assert ease == pytest.approx(DEFAULT_EASE + 0.4)
+
+
+def test_fail_resets_interval_and_lowers_ease():
+    ease, interval_days, repetitions, lapsed = schedule(DEFAULT_EASE, 16.0, 3, 2)
+    assert lapsed
+    assert (float(interval_days), int(repetitions)) == (FIRST_INTERVAL_DAYS, 0)
+    assert ease == pytest.approx(DEFAULT_EASE - 0.32)
+
+    ease, *_ = schedule(MIN_EASE, 1.0, 0, 0)
+    assert ease == MIN_EASE
+
+
+def test_interval_is_capped():
+    _, interval_days, _, _ = schedule(DEFAULT_EASE, MAX_INTERVAL_DAYS, 10, 5)
+    assert interval_days == MAX_INTERVAL_DAYS
+
+
+def test_arrays_match_scalars():
+    ease = np.array([2.5, 1.3, 2.1, 2.8])
+    interval_days = np.array([0.0, 1.0, 6.0, 30.0])
+    repetitions = np.array([0, 0, 2, 5])
+    grades = np.array([5, 1, 3, 4])
+    batched = schedule(ease, interval_days, repetitions, grades)
+    for i in range(len(ease)):
+        single = schedule(ease[i], interval_days[i], repetitions[i], grades[i])
+        assert [float(value[i]) for value in batched] == [float(value) for value in single]
+
+
+def test_due_queue_is_most_overdue_first(database):
+    # Failed reviews are due a day later, so earlier ones are more overdue
+    for exercise_id, days_ago in ((1, 5), (2, 9), (3, 3), (4, 7)):
+        perform(database, 'alice', exercise_id, 20, NOW - timedelta(days=days_ago))
+    # A pass on 5 six days after its first review is not due for another six
+    perform(database, 'alice', 5, 100, NOW - timedelta(days=8))
+    perform(database, 'alice', 5, 100, NOW - timedelta(days=2))
+    perform(database, 'bob', 6, 20, NOW - timedelta(days=20))
+
+    conn = database.get_connection()
+    cursor = conn.cursor()
+    assert database._due_review_ids(cursor, 'alice', 10, now=NOW) == [2, 4, 1, 3]
+    assert database._due_review_ids(cursor, 'alice', 2, now=NOW) == [2, 4]
+    # Exercises 1 and 4 are easy (see the fixture)
+    assert database._due_review_ids(cursor, 'alice', 10, difficulty='easy', now=NOW) == [4, 1]
+    assert database._due_review_ids(cursor, 'alice', 10, now=NOW - timedelta(days=6)) == [2, 4]
+    assert database._due_review_ids(cursor, 'carol', 10, now=NOW) == []
+    conn.close()
+
+
+def test_incremental_schedule_matches_rebuild(database, monkeypatch):
+    import db as db_module
+    import manage
+
+    rng = np.random.default_rng(7)
+    for user_id in ('alice', 'bob', 'carol'):
+        submitted_at = NOW
+        for _ in range(40):
+            submitted_at += timedelta(hours=int(rng.integers(1, 200)), microseconds=int(rng.integers(0, 10 ** 6)))
+            perform(database, user_id, int(rng.integers(1, 7)), int(rng.integers(0, 101)), submitted_at)
+    incremental = review_states(database)
+    assert len(incremental) > 10
+
+    monkeypatch.setattr(db_module, 'db', database)
+    assert manage.main(['schedule-reviews', '--batch-users', '2']) == 0
+    rebuilt = review_states(database)
+
+    assert [row[:2] for row in rebuilt] == [row[:2] for row in incremental]
+    for mine, theirs in zip(incremental, rebuilt):
+        assert mine[2] == pytest.approx(theirs[2])
+        assert mine[3:] == theirs[3:]
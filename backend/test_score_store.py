@@ -0,0 +1,116 @@
+"""
+Tests for revision diffing in the parsed-score store
+
+Measures are aligned by content hash, so an inserted or deleted measure
+only disturbs the chunk it lands in: every other chunk keeps its exercise
+and only the measures around the edit are chunked again.
+"""
+
+from typing import List
+
+import numpy as np
+import pytest
+
+from score_store import (
+    NOTE_DTYPE, ParsedScore, align_measures, changed_measures, plan_revision_chunks, generate_exercises,
+    save_parsed_score, load_parsed_score
+)
+
+NATURALS = [0, 2, 4, 5, 7, 9, 11]
+
+
+def score(pitches: List[int], key: str = 'C') -> ParsedScore:
+    """A one-part score with one whole note per measure; each pitch is a diatonic step from C4"""
+    rows = np.zeros(len(pitches), dtype=NOTE_DTYPE)
+    rows['measure'] = np.arange(len(pitches))
+    rows['duration'] = 4.0
+    rows['step'] = [pitch % 7 for pitch in pitches]
+    rows['octave'] = [4 + pitch // 7 for pitch in pitches]
+    rows['midi'] = [12 * (5 + pitch // 7) + NATURALS[pitch % 7] for pitch in pitches]
+    index = np.arange(len(pitches) + 1, dtype=np.uint32)
+    meta = {'key_signature': key, 'time_signature': '4/4', 'part_names': [None]}
+    return ParsedScore(meta, [rows], [index], np.arange(1, len(pitches) + 1, dtype=np.int32))
+
+
+ORIGINAL = list(range(16))
+GRID = [(start, start + 4, 100 + start // 4) for start in range(0, 16, 4)]
+
+
+def test_identical_revision_aligns_everything():
+    aligned = align_measures(score(ORIGINAL), score(ORIGINAL))
+    assert aligned.tolist() == ORIGINAL
+    assert changed_measures(score(ORIGINAL), score(ORIGINAL)).size == 0
+    assert plan_revision_chunks(aligned, GRID, 4) == GRID
+
+
+def test_insert_only_regenerates_around_it():
+    revised = ORIGINAL[:5] + [20] + ORIGINAL[5:]
+    aligned = align_measures(score(ORIGINAL), score(revised))
+    assert changed_measures(score(ORIGINAL), score(revised)).tolist() == [5]
+    # Measures after the insertion still align with their old selves
+    assert aligned[6:].tolist() == ORIGINAL[5:]
+
+    assert plan_revision_chunks(aligned, GRID, 4) == [
+        (0, 4, 100), (4, 8, None), (8, 9, None), (9, 13, 102), (13, 17, 103),
+    ]
+
+
+def test_delete_only_regenerates_the_broken_chunk():
+    revised = ORIGINAL[:5] + ORIGINAL[6:]
+    aligned = align_measures(score(ORIGINAL), score(revised))
+    assert changed_measures(score(ORIGINAL), score(revised)).size == 0
+    assert plan_revision_chunks(aligned, GRID, 4) == [(0, 4, 100), (4, 7, None), (7, 11, 102), (11, 15, 103)]
+
+
+def test_replace_regenerates_one_chunk():
+    revised = list(ORIGINAL)
+    revised[10] = 20
+    aligned = align_measures(score(ORIGINAL), score(revised))
+    assert changed_measures(score(ORIGINAL), score(revised)).tolist() == [10]
+    assert plan_revision_chunks(aligned, GRID, 4) == [(0, 4, 100), (4, 8, 101), (8, 12, None), (12, 16, 103)]
+
+
+def test_key_change_aligns_nothing():
+    aligned = align_measures(score(ORIGINAL), score(ORIGINAL, key='G'))
+    assert (aligned == -1).all()
+    assert plan_revision_chunks(aligned, GRID, 4) == [(start, end, None) for start, end, _ in GRID]
+
+
+def test_hashes_survive_storage(tmp_path):
+    path = save_parsed_score(score(ORIGINAL), str(tmp_path / 'a.srps'))
+    assert align_measures(load_parsed_score(path), score(ORIGINAL)).tolist() == ORIGINAL
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_plan_covers_the_revision_and_keeps_only_equal_chunks(seed):
+    rng = np.random.default_rng(seed)
+    previous = [int(p) for p in rng.integers(0, 20, 30)]
+    revised = list(previous)
+    for _ in range(3):
+        at = int(rng.integers(0, len(revised)))
+        edit = rng.integers(0, 3)
+        if edit == 0:
+            revised.insert(at, int(rng.integers(0, 20)))
+        elif edit == 1:
+            del revised[at]
+        else:
+            revised[at] = int(rng.integers(0, 20))
+
+    chunks = [(start, min(start + 4, len(previous)), start) for start in range(0, len(previous), 4)]
+    plan = plan_revision_chunks(align_measures(score(previous), score(revised)), chunks, 4)
+
+    # Contiguous, non-overlapping and covering every measure of the revision
+    assert [start for start, _, _ in plan] == [0] + [end for _, end, _ in plan[:-1]]
+    assert plan[-1][1] == len(revised)
+    for start, end, kept in plan:
+        assert 0 < end - start <= 4
+        if kept is not None:
+            assert revised[start:end] == previous[kept:kept + end - start]
+
+
+def test_generate_exercises_for_planned_chunks():
+    parsed = score(ORIGINAL[:5] + [20] + ORIGINAL[5:])
+    rows = generate_exercises(parsed, chunk_size=4, chunks=[(1, 4, 8), (2, 8, 9)])
+    assert [(row['chunk_index'], row['start_measure'], row['end_measure']) for row in rows] == [(1, 4, 8), (2, 8, 9)]
+    assert [row['measures'] for row in rows] == ['5-8', '9-9']
+    assert rows[0]['notes'] == ['G4', 'B6', 'A4', 'B4']
@@ -0,0 +1,80 @@
+"""
+Tests for server-side performance scoring
+
+When the server scores the played notes, the overall score must come from
+its own metrics only: rhythm and tempo scores sent by the client are
+ignored, on submission and when stored performances are rescored.
+"""
+
+import pytest
+
+from scoring import overall_score, rescore_rows, score_performance
+
+EXPECTED = ['C4', 'D4', 'E4', 'F4', 'G4']
+# One wrong note out of five
+PLAYED = ['C4', 'D4', 'E4', 'F#4', 'G4']
+SCALE = {'measures': '1-2', 'difficulty': 'easy', 'title': 'Scale', 'key_signature': 'C', 'time_signature': '4/4',
+         'notes': EXPECTED, 'rhythm_pattern': ['quarter'] * len(EXPECTED)}
+
+
+@pytest.fixture
+def database(make_database):
+    return make_database([SCALE])
+
+
+@pytest.fixture
+def exercise_id(database):
+    # Saving it again returns the stored row's ID
+    return database.save_exercises([SCALE])[0][0]
+
+
+@pytest.fixture
+def client(database, monkeypatch):
+    from fastapi.testclient import TestClient
+    import db as db_module
+    import main
+
+    monkeypatch.setattr(db_module.db, "db_path", database.db_path)
+    return TestClient(main.app)
+
+
+def stored_performance(database):
+    conn = database.get_connection()
+    row = conn.execute('SELECT score, rhythm_score, tempo_score FROM performances ORDER BY id DESC').fetchone()
+    conn.close()
+    return row
+
+
+def test_client_timing_scores_are_ignored(client, database, exercise_id):
+    accuracy = score_performance(EXPECTED, None, [60, 62, 64, 66, 67])['accuracy']
+    assert accuracy < 100
+
+    response = client.post('/users/users/submit_performance', json={
+        'user_id': 'alice', 'exercise_id': exercise_id, 'notes_played': PLAYED,
+        'score': 100, 'rhythm_score': 100, 'tempo_score': 100,
+    })
+    assert response.status_code == 200
+    assert response.json()['score'] == overall_score(accuracy, None, None)
+
+    row = stored_performance(database)
+    assert row['score'] == overall_score(accuracy, None, None)
+    assert (row['rhythm_score'], row['tempo_score']) == (None, None)
+
+
+@pytest.mark.parametrize('timing', [{'rhythm_score': 'fast'}, {'tempo_score': 150}, {'rhythm_score': -1}])
+def test_client_scored_timing_is_validated(client, timing):
+    response = client.post('/users/users/submit_performance', json={
+        'user_id': 'alice', 'exercise_id': 1, 'score': 80, **timing,
+    })
+    assert response.status_code == 400
+
+
+def test_rescore_ignores_client_timing():
+    row = {'id': 1, 'expected_notes': EXPECTED, 'notes_played': PLAYED,
+           'rhythm_score': 100.0, 'tempo_score': 100.0}
+    (client_scored, accuracy, _, _, _), = rescore_rows([{**row, 'has_events': False}])[0]
+    assert client_scored == overall_score(accuracy, None, None)
+
+    # Timing computed by the server from note events is kept
+    (event_scored, _, _, _, _), = rescore_rows([{**row, 'has_events': True}])[0]
+    assert event_scored == overall_score(accuracy, 100.0, 100.0)
@@ -0,0 +1,56 @@
+"""
+Tests for the transposition engine
+
+Targets take the nearest shift (a fourth up to a tritone down), keep
+diatonic spelling, and move an octave when that brings the notes back
+into the instrument's range.
+"""
+
+import pytest
+
+from transpose import transpose_notes, TranspositionError
+
+
+@pytest.mark.parametrize('from_key, notes, to_key, semitones, expected', [
+    ('C', ['C4', 'E4', 'G4'], 'F', 5, ['F4', 'A4', 'C5']),
+    ('C', ['C4', 'E4', 'G4'], 'G', -5, ['G3', 'B3', 'D4']),
+    ('C', ['C4', 'E4', 'G4'], 'F#', -6, ['F#3', 'A#3', 'C#4']),
+    ('C', ['C4', 'E4', 'G4'], 'G-', -6, ['G-3', 'B-3', 'D-4']),
+    ('E-', ['E-4', 'G4', 'B-4'], 'A', -6, ['A3', 'C#4', 'E4']),
+    ('B-', ['B-3', 'D4'], 'B', 1, ['B3', 'D#4']),
+    ('F#', ['F#4', 'E#4'], 'G-', 0, ['G-4', 'F4']),
+])
+def test_nearest_shift_and_spelling(from_key, notes, to_key, semitones, expected):
+    result, = transpose_notes(notes, from_key, [to_key])
+    assert result['semitones'] == semitones
+    assert result['notes'] == expected
+    assert (result['in_range'], result['octave_shift']) == (True, 0)
+
+
+def test_octave_shift_brings_notes_into_range():
+    # Violin's lowest note is G3, so F#3 has to move up an octave
+    result, = transpose_notes(['C4', 'E4'], 'C', ['F#'], instrument='violin')
+    assert result['notes'] == ['F#4', 'A#4']
+    assert result['midi'] == [66, 70]
+    assert (result['semitones'], result['octave_shift'], result['in_range']) == (6, 1, True)
+
+
+def test_out_of_range_without_a_fitting_octave():
+    # Three octaves is the flute's whole range; a whole step up can't fit either way
+    result, = transpose_notes(['C4', 'C7'], 'C', ['D'], instrument='flute')
+    assert result['notes'] == ['D4', 'D7']
+    assert (result['octave_shift'], result['in_range']) == (0, False)
+
+
+def test_many_keys_at_once_match_one_at_a_time():
+    notes = ['D4', 'F#4', 'A4', 'C#5']
+    keys = ['C', 'D-', 'E', 'F', 'A-', 'B']
+    together = transpose_notes(notes, 'D', keys)
+    assert together == [transpose_notes(notes, 'D', [key])[0] for key in keys]
+
+
+@pytest.mark.parametrize('notes, key, instrument', [(['H4'], 'C', 'piano'), (['C4'], 'X', 'piano'),
+                                                   (['C4'], 'C', 'kazoo')])
+def test_unreadable_input(notes, key, instrument):
+    with pytest.raises(TranspositionError):
+        transpose_notes(notes, 'C', [key], instrument=instrument)
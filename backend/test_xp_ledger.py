@@ -0,0 +1,121 @@
+"""
+Tests for the append-only XP ledger
+
+A user's totals are their snapshot plus the events after it, so moving
+the snapshot must never change what they read, and replaying the ledger
+must append only the difference the current formula makes.
+"""
+
+from datetime import date, timedelta
+
+
+def snapshot_row(database, user_id: str):
+    conn = database.get_connection()
+    row = conn.execute('SELECT xp, streak, snapshot_event_id FROM users WHERE user_id = ?', (user_id,)).fetchone()
+    conn.close()
+    return row
+
+
+def ledger_events(database, user_id: str):
+    conn = database.get_connection()
+    rows = conn.execute('SELECT reason, xp FROM xp_events WHERE user_id = ? ORDER BY id', (user_id,)).fetchall()
+    conn.close()
+    return [(row['reason'], row['xp']) for row in rows]
+
+
+def award_on(database, monkeypatch, user_id: str, xp_earned: int, day: date, performance_id=None):
+    """Award XP as if it were `day`"""
+    import db as db_module
+
+    class Today(date):
+        @classmethod
+        def today(cls):
+            return day
+
+    monkeypatch.setattr(db_module, 'date', Today)
+    user = database.update_user_progress(user_id, xp_earned, performance_id)
+    monkeypatch.setattr(db_module, 'date', date)
+    return user
+
+
+def test_totals_unchanged_by_snapshot(database):
+    for user_id, awards in (('alice', [10, 15, 20]), ('bob', [12]), ('carol', [])):
+        database.create_user(user_id)
+        for xp_earned in awards:
+            database.update_user_progress(user_id, xp_earned)
+    before = {user_id: database.get_user(user_id) for user_id in ('alice', 'bob', 'carol')}
+
+    assert database.snapshot_xp(batch_users=1) == 2
+    after = {user_id: database.get_user(user_id) for user_id in ('alice', 'bob', 'carol')}
+
+    assert after == before
+    assert after['alice'].xp == 45 and after['alice'].level == 1
+    assert snapshot_row(database, 'alice')['xp'] == 45
+    # Nothing left to fold in
+    assert database.snapshot_xp() == 0
+
+
+def test_snapshot_written_every_snapshot_every_events(database):
+    from xp import SNAPSHOT_EVERY
+
+    database.create_user('alice')
+    for _ in range(SNAPSHOT_EVERY - 1):
+        database.update_user_progress('alice', 10)
+    assert snapshot_row(database, 'alice')['xp'] == 0
+
+    user = database.update_user_progress('alice', 10)
+    row = snapshot_row(database, 'alice')
+    assert row['xp'] == user.xp == SNAPSHOT_EVERY * 10
+    assert row['snapshot_event_id'] == len(ledger_events(database, 'alice'))
+    assert database.get_user('alice') == user
+
+
+def test_streak_counts_each_new_day_once(database, monkeypatch):
+    database.create_user('alice')
+    start = date.fromisoformat(database.get_user('alice').last_active_date)
+
+    # Awards on the day the user was created do not extend the streak
+    assert award_on(database, monkeypatch, 'alice', 10, start).streak == 0
+    assert award_on(database, monkeypatch, 'alice', 10, start + timedelta(days=1)).streak == 1
+    assert award_on(database, monkeypatch, 'alice', 10, start + timedelta(days=1)).streak == 1
+    user = award_on(database, monkeypatch, 'alice', 10, start + timedelta(days=2))
+    assert user.streak == 2
+    assert user.last_active_date == (start + timedelta(days=2)).isoformat()
+
+    # Days already folded into the snapshot are not counted again
+    database.snapshot_xp()
+    assert database.get_user('alice') == user
+    assert award_on(database, monkeypatch, 'alice', 10, start + timedelta(days=2)).streak == 2
+    assert award_on(database, monkeypatch, 'alice', 10, start + timedelta(days=3)).streak == 3
+
+
+def test_replay_xp_appends_only_the_difference(database, monkeypatch):
+    import db as db_module
+    import manage
+    from models import Performance
+    from xp import performance_xp, ADJUSTMENT, PERFORMANCE
+
+    monkeypatch.setattr(db_module, 'db', database)
+    database.create_user('alice')
+    database.create_user('bob')
+    scores = {'alice': [80, 100], 'bob': [50]}
+    for user_id, user_scores in scores.items():
+        for score in user_scores:
+            performance_id = database.save_performance(Performance(user_id=user_id, exercise_id=1, score=score))
+            # Awarded under an older formula
+            database.update_user_progress(user_id, 5, performance_id)
+    database.update_user_progress('bob', 7)  # no source performance: kept as recorded
+
+    assert manage.main(['replay-xp']) == 0
+    for user_id, user_scores in scores.items():
+        expected = sum(performance_xp(score) for score in user_scores)
+        events = ledger_events(database, user_id)
+        assert events[-1] == (ADJUSTMENT, expected - 5 * len(user_scores))
+        assert database.get_user(user_id).xp == expected + (7 if user_id == 'bob' else 0)
+        assert [reason for reason, _ in events[:-1]] == [PERFORMANCE] * len(events[:-1])
+
+    totals = {user_id: database.get_user(user_id).xp for user_id in scores}
+    event_counts = {user_id: len(ledger_events(database, user_id)) for user_id in scores}
+    assert manage.main(['replay-xp']) == 0
+    assert {user_id: database.get_user(user_id).xp for user_id in scores} == totals
+    assert {user_id: len(ledger_events(database, user_id)) for user_id in scores} == event_counts
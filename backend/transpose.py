@@ -0,0 +1,211 @@
+"""
+Transposition engine for SightReadPro
+
+Works on MIDI pitch arrays rather than music21 objects: one exercise is
+shifted into any number of keys with a single vectorized operation, then
+re-spelled diatonically for each target key and checked against the
+instrument's range. Results are produced lazily and kept in a bounded
+in-process LRU cache.
+"""
+
+import re
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Dict, Any, Tuple, Sequence
+
+import numpy as np
+
+from score_store import STEP_NAMES, STEP_INDEX, pitch_name
+
+# Pitch class of each natural step (C D E F G A B)
+NATURAL_PITCH_CLASSES = np.array([0, 2, 4, 5, 7, 9, 11])
+
+# One conventional major-key spelling per pitch class
+ALL_KEYS = ['C', 'D-', 'D', 'E-', 'E', 'F', 'F#', 'G', 'A-', 'A', 'B-', 'B']
+
+# Written MIDI ranges (inclusive)
+INSTRUMENT_RANGES = {
+    'piano': (21, 108),
+    'violin': (55, 103),
+    'viola': (48, 91),
+    'cello': (36, 76),
+    'flute': (60, 96),
+    'clarinet': (50, 94),
+    'alto_sax': (58, 90),
+    'trumpet': (54, 82),
+    'trombone': (40, 72),
+    'guitar': (40, 88),
+    'voice': (48, 79),
+}
+
+_NOTE_PATTERN = re.compile(r'^([A-Ga-g])(#{1,2}|-{1,2}|b{1,2})?(\d)$')
+_KEY_PATTERN = re.compile(r'^([A-Ga-g])(#|-|b|sharp|flat)?(?:\s*(?:major|minor|m))?$')
+
+
+class TranspositionError(ValueError):
+    """Raised for notes or keys the engine cannot read"""
+
+
+def _alter_from(accidental: Optional[str]) -> int:
+    """Semitone alteration of '#', '##', '-', 'b', 'bb', 'sharp' or 'flat'"""
+    if not accidental:
+        return 0
+    if accidental == 'sharp':
+        return 1
+    if accidental == 'flat':
+        return -1
+    return len(accidental) if accidental[0] == '#' else -len(accidental)
+
+
+def parse_key(key: str) -> Tuple[int, int]:
+    """Parse a key name ('G', 'B-', 'Bb', 'F#', 'Eb major') into (step, alter)"""
+    match = _KEY_PATTERN.match(key.strip())
+    if not match:
+        raise TranspositionError(f"Unknown key '{key}'")
+    letter, accidental = match.groups()
+    return STEP_INDEX[letter.upper()], _alter_from(accidental)
+
+
+def key_name(step: int, alter: int) -> str:
+    """Format a key the way music21 names tonics ('B-', 'F#')"""
+    return STEP_NAMES[step] + ('#' * alter if alter > 0 else '-' * -alter)
+
+
+def notes_to_arrays(notes: Sequence[str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Parse note names into (step, alter, midi) arrays"""
+    count = len(notes)
+    steps = np.empty(count, dtype=np.int16)
+    alters = np.empty(count, dtype=np.int16)
+    octaves = np.empty(count, dtype=np.int16)
+
+    for i, name in enumerate(notes):
+        match = _NOTE_PATTERN.match(name)
+        if not match:
+            raise TranspositionError(f"Unknown note '{name}'")
+        letter, accidental, octave = match.groups()
+        steps[i] = STEP_INDEX[letter.upper()]
+        alters[i] = _alter_from(accidental)
+        octaves[i] = int(octave)
+
+    midi = 12 * (octaves + 1) + NATURAL_PITCH_CLASSES[steps] + alters
+    return steps, alters, midi
+
+
+def transpose_notes(notes: Sequence[str], from_key: str, to_keys: Sequence[str],
+                    instrument: str = 'piano') -> List[Dict[str, Any]]:
+    """
+    Transpose a note sequence into several keys at once
+
+    Each target gets the nearest transposition (at most a fourth up or a
+    tritone down), spelled diatonically: the letter names move by the same
+    number of steps as the tonic. If the result leaves the instrument's
+    range, an octave shift is applied when that brings it back in.
+    """
+    if instrument not in INSTRUMENT_RANGES:
+        raise TranspositionError(f"Unknown instrument '{instrument}'")
+    low, high = INSTRUMENT_RANGES[instrument]
+
+    source_step, source_alter = parse_key(from_key)
+    targets = [parse_key(key) for key in to_keys]
+    target_steps = np.array([step for step, _ in targets], dtype=np.int16)
+    target_alters = np.array([alter for _, alter in targets], dtype=np.int16)
+
+    # Semitone and letter shift per target key, shape (K, 1)
+    source_pc = NATURAL_PITCH_CLASSES[source_step] + source_alter
+    target_pcs = NATURAL_PITCH_CLASSES[target_steps] + target_alters
+    semitones = (target_pcs - source_pc + 6) % 12 - 6
+    letter_shift = (target_steps - source_step) % 7
+    letter_shift = np.where((semitones < 0) & (letter_shift > 0), letter_shift - 7, letter_shift)
+
+    steps, _, midi = notes_to_arrays(notes)
+
+    # Every key at once, shape (K, N)
+    new_midi = midi[None, :] + semitones[:, None]
+    absolute_steps = steps[None, :].astype(np.int32) + letter_shift[:, None]
+    new_steps = absolute_steps % 7
+    written_octaves = (new_midi - NATURAL_PITCH_CLASSES[new_steps] + 6) // 12 - 1
+    new_alters = new_midi - (12 * (written_octaves + 1) + NATURAL_PITCH_CLASSES[new_steps])
+
+    # Octave-shift whole rows that leave the range when that fits them back in
+    if len(notes):
+        lowest = new_midi.min(axis=1)
+        highest = new_midi.max(axis=1)
+    else:
+        lowest = np.full(len(targets), low)
+        highest = np.full(len(targets), high)
+    in_range = (lowest >= low) & (highest <= high)
+    octave_shift = np.zeros(len(targets), dtype=np.int16)
+    octave_shift[~in_range & (lowest + 12 >= low) & (highest + 12 <= high)] = 1
+    octave_shift[~in_range & (lowest - 12 >= low) & (highest - 12 <= high)] = -1
+    written_octaves = written_octaves + octave_shift[:, None]
+    new_midi = new_midi + 12 * octave_shift[:, None]
+    in_range = in_range | (octave_shift != 0)
+
+    results = []
+    for k, (step, alter) in enumerate(targets):
+        results.append({
+            'key_signature': key_name(step, alter),
+            'semitones': int(semitones[k] + 12 * octave_shift[k]),
+            'notes': [pitch_name(int(s), int(a), int(o))
+                      for s, a, o in zip(new_steps[k], new_alters[k], written_octaves[k])],
+            'midi': new_midi[k].tolist(),
+            'in_range': bool(in_range[k]),
+            'octave_shift': int(octave_shift[k]),
+        })
+    return results
+
+
+class TranspositionCache:
+    """Bounded LRU cache of transposed exercises, filled on first request"""
+
+    def __init__(self, max_entries: int = 4096):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[int, str, str], Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Tuple[int, str, str]) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: Tuple[int, str, str], value: Dict[str, Any]):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+transposition_cache = TranspositionCache()
+
+
+def transpose_exercise(exercise_id: int, notes: Sequence[str], from_key: str, to_keys: Sequence[str],
+                       instrument: str = 'piano') -> List[Dict[str, Any]]:
+    """Transpose an exercise into several keys, computing only the keys not cached yet"""
+    canonical = [key_name(*parse_key(key)) for key in to_keys]
+    results: Dict[str, Dict[str, Any]] = {}
+    missing = []
+
+    for key in canonical:
+        cached = transposition_cache.get((exercise_id, key, instrument))
+        if cached is None:
+            missing.append(key)
+        else:
+            results[key] = cached
+
+    if missing:
+        for result in transpose_notes(notes, from_key, missing, instrument):
+            transposition_cache.put((exercise_id, result['key_signature'], instrument), result)
+            results[result['key_signature']] = result
+
+    return [results[key] for key in canonical]
@@ -0,0 +1,63 @@
+"""
+Data version counters for cache validation
+
+Every write that changes what a cached response would contain bumps a
+counter: one for the exercise library, and one per user slot (user IDs
+hashed into a fixed number of slots, so two users may share one and
+invalidate each other now and then). Responses derive their ETags from
+these counters, so a conditional request can be answered without reading
+the database.
+
+The counters live in an anonymous shared memory mapping created at import,
+so workers forked from the process that imported this module see each
+other's bumps. `epoch` changes whenever the counters start over.
+"""
+
+import hashlib
+import mmap
+import multiprocessing
+import secrets
+from typing import Callable, List
+
+import numpy as np
+
+USER_SLOTS = 4096
+
+LIBRARY = 0
+
+
+class DataVersions:
+    """Write counters in memory shared with forked workers"""
+
+    def __init__(self, user_slots: int = USER_SLOTS):
+        self.user_slots = user_slots
+        # fileno -1 maps shared anonymous memory, which survives fork
+        self._buffer = mmap.mmap(-1, 8 * (1 + user_slots))
+        self._counters = np.frombuffer(self._buffer, dtype=np.uint64)
+        self._lock = multiprocessing.Lock()
+        self._listeners: List[Callable[[int], None]] = []
+        self.epoch = secrets.token_hex(4)
+
+    def user_slot(self, user_id: str) -> int:
+        digest = hashlib.blake2b(user_id.encode(), digest_size=8).digest()
+        return 1 + int.from_bytes(digest, 'little') % self.user_slots
+
+    def version(self, slot: int) -> int:
+        return int(self._counters[slot])
+
+    def bump(self, slot: int):
+        """Record a write affecting `slot`"""
+        with self._lock:
+            self._counters[slot] += np.uint64(1)
+        for listener in self._listeners:
+            listener(slot)
+
+    def bump_user(self, user_id: str):
+        self.bump(self.user_slot(user_id))
+
+    def subscribe(self, listener: Callable[[int], None]):
+        """Call `listener(slot)` after every bump made in this process"""
+        self._listeners.append(listener)
+
+
+data_versions = DataVersions()